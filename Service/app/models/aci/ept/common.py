@@ -2,11 +2,23 @@
 common ept functions
 """
 from . ept_msg import MSG_TYPE
+from . ept_msg import WORK_TYPE
 from . ept_msg import eptMsg
+from pymongo import UpdateMany
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from six import string_types
 
+from array import array
+import binascii
+import bisect
+import hashlib
+import heapq
 import logging
 import os
 import re
+import socket
+import struct
 import threading
 import time
 import traceback
@@ -28,9 +40,19 @@ MINIMUM_SUPPORTED_VERSION           = "2.2.1n"
 HELLO_INTERVAL                      = 5.0
 HELLO_TIMEOUT                       = 60.0
 WATCH_INTERVAL                      = 1.0
+WATCH_BATCH_SIZE                    = 512
 NOTIFY_INTERVAL                     = 1.0
 NOTIFY_QUEUE_MAX_SIZE               = 4096
 CACHE_STATS_INTERVAL                = 300.0
+# worker caches publish statistics and adapt their capacity (if cache_adaptive is enabled within the
+# fabric settings) at CACHE_ADAPT_INTERVAL. A cache that dropped entries with a hit ratio below
+# CACHE_ADAPT_HIT_RATIO over the interval is doubled and a cache using less than
+# CACHE_ADAPT_MIN_USAGE of its capacity is halved. Published statistics expire after
+# CACHE_STATS_TIMEOUT
+CACHE_ADAPT_INTERVAL                = 60.0
+CACHE_ADAPT_HIT_RATIO               = 0.9
+CACHE_ADAPT_MIN_USAGE               = 0.25
+CACHE_STATS_TIMEOUT                 = 3600.0
 SEQUENCE_TIMEOUT                    = 100.0
 MANAGER_CTRL_CHANNEL                = "mctrl"
 MANAGER_CTRL_RESPONSE_CHANNEL       = "r_mctrl"
@@ -38,16 +60,104 @@ MANAGER_WORK_QUEUE                  = "mq"
 SUBSCRIBER_CTRL_CHANNEL             = "sctrl"
 WORKER_CTRL_CHANNEL                 = "wctrl"
 WORKER_UPDATE_INTERVAL              = 15.0
-RAPID_CALCULATE_INTERVAL            = 15.0
+# rapid endpoint rates (events per minute) are refreshed by the worker at most once per 
+# RAPID_TICK_INTERVAL from the count of events within a sliding window of RAPID_RATE_WINDOW seconds
+# (tracked in per-tick buckets). Updated rapid counters are saved to eptEndpoint in bulk at 
+# RAPID_FLUSH_INTERVAL. The counters are kept in arrays of UINT64_TYPECODE.
+RAPID_TICK_INTERVAL                 = 1.0
+RAPID_RATE_WINDOW                   = 15.0
+RAPID_FLUSH_INTERVAL                = 15.0
 MAX_SEND_MSG_LENGTH                 = 10240
+HASH_RING_VNODES                    = 256
 BG_EVENT_HANDLER_INTERVAL           = 0.01
 BG_EVENT_HANDLER_ENABLED            = True
 
+# std mo events are held by the subscriber for up to STD_MO_BATCH_WINDOW seconds so a burst of 
+# events (i.e., tenant change) is sent to the watcher as a single bulk msg. When batching is 
+# enabled, the watcher coalesces the events within a bulk msg per dn and resolves dependencies for 
+# all of them at once with a single flush per updated ept object.
+STD_MO_BATCH_ENABLED                = True
+STD_MO_BATCH_WINDOW                 = 0.5
+
+# watcher auto-clear of stale/offsubnet endpoints is executed in-process by eptRemediator. Clears
+# are grouped per fabric node and each node is served by a single thread at a time using a pooled
+# ssh connection, with up to REMEDIATE_MAX_WORKERS nodes served in parallel. A thread executes up
+# to REMEDIATE_BATCH_SIZE clears on a node before the next node with pending clears is served and
+# clears across all nodes are limited to REMEDIATE_RATE_LIMIT per second. The ip clears of a batch
+# are combined into vsh commands of up to REMEDIATE_MAX_CMD_LENGTH characters (kept below the 4096
+# character line limit of the terminal). Connections are shared with api clears through the 
+# ConnectionPool (see tools/connection_pool.py)
+REMEDIATE_MAX_WORKERS               = 8
+REMEDIATE_BATCH_SIZE                = 64
+REMEDIATE_RATE_LIMIT                = 50.0
+REMEDIATE_MAX_CMD_LENGTH            = 2048
+
+# when the subscriber completes the build of the subnet db, all workers are requested to preload
+# their fabric caches (node, tunnel, pc, vpc, vnid, epg, and subnet) before endpoint events from the
+# initial endpoint build are received
+CACHE_PRELOAD_ENABLED               = True
+
 # when API requests msg queue length, manager can read the full data off each queue and accurate
 # msgs within bulk messages for accurate count. There is a performance hit to this so the
 # alternative is counting the number of messages in each queue where a bulk message counts as one.
 ACCURATE_QUEUE_LENGTH               = False
 
+# when enabled (and compact wire format is supported), subscribers send work to the manager as 
+# routed frames with the worker placement hash, role, and qnum precomputed for each record. The 
+# manager forwards the encoded records to worker queues without decoding them.
+MANAGER_ROUTED_WORK                 = True
+
+# optional mode where subscribers push unicast and broadcast work directly to worker queues using
+# the worker set published by the manager at WORKER_SET_KEY. Each push is accepted only if the 
+# epoch at WORKER_EPOCH_KEY is unchanged. The manager invalidates the epoch (sets to 0) before 
+# migrating worker queues and publishes the new worker set with a new epoch once complete. If no
+# valid epoch is available within DIRECT_WORK_EPOCH_TIMEOUT then work is sent via the manager.
+SUBSCRIBER_DIRECT_WORK              = False
+WORKER_EPOCH_KEY                    = "wepoch"
+WORKER_SET_KEY                      = "wset"
+DIRECT_WORK_EPOCH_TIMEOUT           = 30.0
+DIRECT_WORK_RETRY_INTERVAL          = 0.1
+
+# when enabled, workers atomically move each msg from a work queue onto the corresponding pending
+# list (see get_pending_queue) and remove it once processed. Unacknowledged work is replayed onto
+# the work queue when the worker restarts or migrated to the new owner when the worker is removed.
+# Redis has no blocking move from multiple lists so each push of work also pushes a token onto the
+# notify list of the queue (see add_work) and the worker blocks on its notify lists while all work
+# queues are empty.
+WORKER_PENDING_QUEUES               = True
+
+# worker queues are partitioned per fabric (see get_work_queue). For each priority, workers dequeue
+# from the fabric partitions using deficit round robin where each fabric can dequeue up to 
+# WORK_QUEUE_QUANTUM msgs before the next fabric with pending work is served. Workers discover 
+# fabric partitions on fabric start and by scanning redis every WORK_QUEUE_REFRESH_INTERVAL.
+WORK_QUEUE_QUANTUM                  = MAX_SEND_MSG_LENGTH
+WORK_QUEUE_REFRESH_INTERVAL         = 5.0
+
+# subscriber build_endpoint_db fetches each epm class concurrently and parses/sends the results in
+# a pipeline. Each stage is connected by a queue of up to BUILD_ENDPOINT_DB_QUEUE_SIZE batches of
+# MAX_SEND_MSG_LENGTH objects. When BUILD_ENDPOINT_DB_ALL_APICS is enabled, the class queries are 
+# spread across a session to each controller in the cluster.
+BUILD_ENDPOINT_DB_QUEUE_SIZE        = 8
+BUILD_ENDPOINT_DB_ALL_APICS         = False
+
+# ept collections (epg, subnet, vnid, etc) are built by streaming objects from the local mo db or
+# class query and upserting them in chunks of BUILD_CHUNK_SIZE objects tagged with the generation
+# of the build. Objects from previous generations are removed once the build completes so readers
+# never see an empty collection during a rebuild.
+BUILD_CHUNK_SIZE                    = 1024
+
+# once the initial build has been processed by all workers, the subscriber saves a sync record for
+# the fabric (see get_sync_key) with the modTs watermark of each mo class, the current time of each
+# node at the start of the build, and a fingerprint of each ept collection. When enabled and the
+# subscriber is restarted within DELTA_RESYNC_MAX_AGE of the last sync (for example, after a 
+# subscription drop), only the objects modified since the previous build are queried and unchanged
+# ept collections are not rebuilt. A full endpoint build is performed if more than 
+# DELTA_RESYNC_MAX_NEW_NODES nodes were added since the previous build. A hard restart or API stop
+# clears the record forcing a full build.
+DELTA_RESYNC_ENABLED                = True
+DELTA_RESYNC_MAX_AGE                = 86400.0
+DELTA_RESYNC_MAX_NEW_NODES          = 16
+
 # transitory timers:
 #   max_epm_build   maximum amount of time to wait for ACK from all worker processes to indiciate
 #                   that all initial epm messages (from build created/delete) have been processed.
@@ -67,7 +177,7 @@ ACCURATE_QUEUE_LENGTH               = False
 #                   note, watcher execute time is delayed for rapid_holdtime + transitory_rapid
 #                   timer to wait and see if endpoint is flagged as rapid a second time before 
 #                   restore_rapid action is applied.  This time should be greater than
-#                   RAPID_CALCULATE_INTERVAL
+#                   RAPID_FLUSH_INTERVAL
 #   
 # suppress timers
 #   watch_offsubnet amount of time to suppress new watch_offsubnet events for single node/ep
@@ -207,12 +317,16 @@ def db_alive(db):
         logger.debug("failed to connect to mongo db: %s", e)
         return False
 
-def get_queue_length(rdb, queue, accurate=True):
+def get_queue_length(rdb, queue, accurate=True, fabrics=None):
     """ get number of pending messages in queue. Requires an active connection to redis and the name
         of the queue to collect message length. Set accurate to true to inspect each message 
         individually and include sub-messages from eptBulk.  Note, ACCURATE_QUEUE_LENGTH must be 
-        enabled as well.
+        enabled as well. If a list of fabrics is provided then the length of each fabric partition
+        of the queue (see get_work_queue) is included.
     """
+    if fabrics is not None and len(fabrics) > 0:
+        return sum([get_queue_length(rdb, q, accurate=accurate) for q in 
+                    [queue] + [get_work_queue(queue, f) for f in fabrics]])
     if accurate and ACCURATE_QUEUE_LENGTH:
         # to support accurate message count for eptMsgBulk, we need to inspect each message
         # we may revisit this at a later time but for now, we will use lrange to pull all messages 
@@ -229,6 +343,117 @@ def get_queue_length(rdb, queue, accurate=True):
     else:
         return rdb.llen(queue) 
 
+def get_pending_queue(queue):
+    """ return name of pending list holding unacknowledged msgs popped from provided work queue. 
+        Note, '#' is not allowed in fabric names so this never overlaps with a fabric partition.
+    """
+    return "%s#pending" % queue
+
+def get_notify_queue(queue):
+    """ return name of the notify list for provided worker queue or fabric partition. A single 
+        notify list is used for the worker queue and all of its fabric partitions.
+    """
+    return "%s#notify" % queue.split("|", 1)[0]
+
+def add_work(pl, queue, *data):
+    """ add push of one or more encoded msgs onto worker queue (or fabric partition) to provided 
+        pipeline. If WORKER_PENDING_QUEUES is enabled, a token is also pushed onto the notify list 
+        of the queue to wake the worker blocked waiting for work.
+    """
+    pl.rpush(queue, *data)
+    if WORKER_PENDING_QUEUES:
+        pl.rpush(get_notify_queue(queue), 1)
+
+def get_work_queue(queue, fabric=None):
+    """ return name of the partition of a worker queue for the provided fabric. Work for each fabric
+        is placed on a separate list so that a fabric flush is a single delete. Msgs without a 
+        fabric (i.e., worker control msgs) are placed on the base queue.
+        Note, '|' is not allowed in fabric names so the fabric can always be derived from the name.
+    """
+    if fabric is None:
+        return queue
+    return "%s|%s" % (queue, fabric)
+
+def get_sync_key(fabric):
+    """ return redis key for the sync record of the fabric used for delta resync """
+    return "sync|%s" % fabric
+
+def get_cache_stats_key(fabric, worker_id):
+    """ return redis key for cache statistics published by a worker for the fabric """
+    return "cstats|%s|%s" % (fabric, worker_id)
+
+def get_shard_id(worker_id, shard):
+    """ return id of a shard process within a worker pool. Shards are not registered with the 
+        manager, the pool registers as a single worker and splits its work across the shards.
+    """
+    return "%s.%s" % (worker_id, shard)
+
+def get_shard(_hash, shards):
+    """ return shard index within a worker pool for provided address hash """
+    return _hash % shards
+
+def get_fabric_work_queues(rdb, queue):
+    """ return list of tuples (fabric, queue) for each fabric partition of the provided worker queue
+        currently present in redis. Redis deletes a list once empty, so a partition is also present
+        if only its pending list exists (i.e., worker exited while processing the last msg of the
+        partition).
+    """
+    ret = []
+    suffix = get_pending_queue("")
+    for key in rdb.scan_iter(match="%s|*" % queue):
+        if key.endswith(suffix):
+            key = key[:-len(suffix)]
+        elif "#" in key:
+            continue
+        fq = (key.split("|", 1)[1], key)
+        if fq not in ret:
+            ret.append(fq)
+    return ret
+
+def get_msg_fabric(msg):
+    """ return fabric for eptMsgWork (or eptMsgBulk of eptMsgWork) used for work queue placement or
+        None for all other msgs. All msgs within a bulk are always for the same fabric.
+    """
+    if msg.msg_type == MSG_TYPE.BULK:
+        if len(msg.msgs) == 0:
+            return None
+        msg = msg.msgs[0]
+    if msg.msg_type == MSG_TYPE.WORK and isinstance(msg.fabric, string_types):
+        return msg.fabric
+    return None
+
+# pop msg from the first non-empty work queue (KEYS[1..n], in dequeue order with n in ARGV[1]) and 
+# push it onto the corresponding pending list (KEYS[n+1..2n]). Returns {index, msg} with 1-based
+# queue index or nil if all work queues are empty. The notify lists (KEYS[2n+1..]) are cleared as
+# the tokens pushed before this point are for msgs that are now visible to the caller.
+WORK_DEQUEUE_SCRIPT = """
+local n = tonumber(ARGV[1])
+if #KEYS > 2 * n then
+    redis.call("DEL", unpack(KEYS, 2 * n + 1))
+end
+for i = 1, n do
+    local data = redis.call("LPOP", KEYS[i])
+    if data then
+        redis.call("RPUSH", KEYS[n+i], data)
+        return {i, data}
+    end
+end
+return false
+"""
+
+# move all msgs from each pending list (KEYS[n+1..2n]) back to the head of the corresponding work
+# queue (KEYS[1..n]) preserving the original order. Returns the number of msgs replayed.
+WORK_REPLAY_SCRIPT = """
+local n = #KEYS / 2
+local count = 0
+for i = 1, n do
+    while redis.call("RPOPLPUSH", KEYS[n+i], KEYS[i]) do
+        count = count + 1
+    end
+end
+return count
+"""
+
 ###############################################################################
 #
 # ept specific functions
@@ -258,16 +483,21 @@ def split_vpc_domain_id(n):
     """
     return [(n & 0xffff0000)>>16, n & 0x0000ffff]
 
-def push_event(collection, key, event, rotate=None, increment=True):
-    """ push an event into the events list of a collection. If increment is true, then increment
-        the 'count' attribute of the object.
-        return bool success
-    """
+def get_push_event_update(event, rotate=None, increment=True):
+    """ return update document used by push_event to push an event to the front of events list """
     update = {"$push": {"events": {"$each": [event], "$position": 0 } } } 
     if rotate is not None:
         update["$push"]["events"]["$slice"] = rotate
     if increment:
         update["$inc"] = {"count": 1}
+    return update
+
+def push_event(collection, key, event, rotate=None, increment=True):
+    """ push an event into the events list of a collection. If increment is true, then increment
+        the 'count' attribute of the object.
+        return bool success
+    """
+    update = get_push_event_update(event, rotate=rotate, increment=increment)
     # logger.debug("push event key: %s, event:%s", key, event)
     r = collection.update_one(key, update, upsert=True)
     # to support disabling write concern, we can only check for a successfull push if ack is enabled
@@ -508,6 +738,405 @@ def get_random_sequence():
     # using os.urandom return a pseudo random sequeunce number
     return sum(ord(c)<<4*i for i, c in enumerate(os.urandom(8))) & 0xffffffff
 
+def get_address_hash(addr):
+    """ return 32-bit hash for provided address string used for worker placement. The manager and 
+        workers must use the same function so both agree on which worker owns an address. This 
+        uses md5 over the utf-8 encoded address so the result is well distributed for sequential
+        addresses and stable across processes and python versions (unlike builtin hash).
+    """
+    return int(hashlib.md5(("%s" % addr).encode("utf-8")).hexdigest()[0:8], 16)
+
+def get_msg_hash(msg):
+    """ return address hash for eptMsgWork used for worker placement. Need to ensure that we hash 
+        on ip for EPM_RS_IP_EVENT so it goes to the correct worker
+    """
+    if msg.wt == WORK_TYPE.EPM_RS_IP_EVENT:
+        return get_address_hash(msg.ip)
+    return get_address_hash(msg.addr)
+
+
+###############################################################################
+#
+# Consistent hash ring for address to worker placement
+#
+###############################################################################
+
+class HashRing(object):
+    """ consistent hash ring mapping a 32-bit key (address hash) to a node (worker_id). Each node
+        is added to the ring at HASH_RING_VNODES positions so that when a node is added or removed
+        only the key ranges adjacent to that node's positions move, all other keys keep their 
+        current owner.  The ring is deterministic for the same set of nodes so independent 
+        processes (manager and workers) build identical rings from a list of worker ids.
+    """
+    def __init__(self, nodes=None, vnodes=HASH_RING_VNODES):
+        self.vnodes = vnodes
+        self.nodes = []             # sorted list of node ids on the ring
+        self.points = []            # sorted list of ring positions
+        self.owners = {}            # ring position to node id
+        if nodes is not None:
+            for n in nodes: self.add_node(n)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __repr__(self):
+        return "ring[%s]" % ",".join(self.nodes)
+
+    def add_node(self, node):
+        """ add a node to the ring if not already present """
+        node = "%s" % node
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        self.nodes.sort()
+        for i in range(0, self.vnodes):
+            point = get_address_hash("%s-%s" % (node, i))
+            # in the unlikely event of a collision, the lowest node id always wins
+            if point in self.owners:
+                if node < self.owners[point]:
+                    self.owners[point] = node
+                continue
+            self.owners[point] = node
+            bisect.insort(self.points, point)
+
+    def remove_node(self, node):
+        """ remove a node and all of its virtual positions from the ring """
+        node = "%s" % node
+        if node not in self.nodes:
+            return
+        # rebuild from remaining nodes to correctly restore any collided positions
+        nodes = [n for n in self.nodes if n != node]
+        self.nodes = []
+        self.points = []
+        self.owners = {}
+        for n in nodes: self.add_node(n)
+
+    def get_node(self, _hash):
+        """ return node id owning the provided 32-bit hash or None if the ring is empty. The hash
+            is used directly as the ring position so it must be well distributed (see 
+            get_address_hash)
+        """
+        if len(self.points) == 0:
+            return None
+        index = bisect.bisect(self.points, _hash & 0xffffffff)
+        if index >= len(self.points):
+            index = 0
+        return self.owners[self.points[index]]
+
+
+###############################################################################
+#
+# Compact endpoint presence set
+#
+###############################################################################
+
+def get_uint64_typecode():
+    """ return array typecode for unsigned 64-bit integers. Array 'Q' is not available in python2 
+        so 'L' is used when it is 64-bit (i.e., 64-bit linux). Raise an exception if no typecode is
+        available on this platform.
+    """
+    for typecode in ("L", "Q"):
+        try:
+            if array(typecode).itemsize >= 8:
+                return typecode
+        except ValueError as e:
+            continue
+    raise Exception("no array typecode for unsigned 64-bit integers available on this platform")
+
+# array typecode for unsigned 64-bit integers used by presence set and rapid counters
+UINT64_TYPECODE = get_uint64_typecode()
+
+class EndpointPresenceSet(object):
+    """ compact set of endpoints (node, vnid, addr) returned from epm class queries used to find 
+        endpoints in the db that no longer exist in the fabric. Each mac and ipv4 address is packed
+        into a 64-bit integer and appended to an array per node and vnid. The array is sorted on 
+        the first lookup after an add and each lookup is a binary search. ipv6 addresses (and any
+        address that cannot be parsed) are kept in a set per node and vnid.
+    """
+    IPV4_FLAG = 1 << 48
+
+    def __init__(self):
+        self.packed = {}        # array of packed mac/ipv4 values indexed by group (node, vnid)
+        self.unsorted = set()   # groups with values added since the last sort
+        self.other = {}         # set of ipv6 values or addr strings indexed by group
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def get_group(node, vnid):
+        """ return single integer for node (32-bit) and vnid """
+        return (node << 32) | vnid
+
+    @staticmethod
+    def get_value(addr_type, addr):
+        """ return tuple (packed, value) where value is a 64-bit integer if packed is True, else an
+            ipv6 integer value or the original addr if it cannot be parsed. The value is the same
+            as get_mac_value and get_ip_prefix. The common formats (XX:XX:XX:XX:XX:XX mac and 
+            ipv4/ipv6 without mask) are converted directly and any other format is converted with
+            get_mac_value/get_ip_prefix.
+        """
+        try:
+            if addr_type == "mac":
+                if len(addr) == 17:
+                    return (True, int(addr.replace(":", ""), 16))
+            elif ":" not in addr:
+                value = struct.unpack(">I", socket.inet_pton(socket.AF_INET, addr))[0]
+                return (True, value | EndpointPresenceSet.IPV4_FLAG)
+            else:
+                return (False, int(binascii.hexlify(socket.inet_pton(socket.AF_INET6, addr)), 16))
+        except (ValueError, socket.error) as e:
+            pass
+        if addr_type == "mac":
+            value = get_mac_value(addr)
+            if value > 0:
+                return (True, value)
+        else:
+            (value, mask) = get_ip_prefix(addr)
+            if value is not None:
+                if ":" in addr:
+                    return (False, value)
+                return (True, value | EndpointPresenceSet.IPV4_FLAG)
+        return (False, addr)
+
+    def add(self, node, vnid, addr_type, addr):
+        """ add endpoint to presence set """
+        group = EndpointPresenceSet.get_group(node, vnid)
+        (packed, value) = EndpointPresenceSet.get_value(addr_type, addr)
+        if packed:
+            if group not in self.packed:
+                self.packed[group] = array(UINT64_TYPECODE)
+            self.packed[group].append(value)
+            self.unsorted.add(group)
+        else:
+            if group not in self.other:
+                self.other[group] = set()
+            self.other[group].add(value)
+        self.count+= 1
+
+    def contains(self, node, vnid, addr_type, addr):
+        """ return True if endpoint is present in set """
+        group = EndpointPresenceSet.get_group(node, vnid)
+        (packed, value) = EndpointPresenceSet.get_value(addr_type, addr)
+        if not packed:
+            return group in self.other and value in self.other[group]
+        if group not in self.packed:
+            return False
+        if group in self.unsorted:
+            self.packed[group] = array(UINT64_TYPECODE, sorted(self.packed[group]))
+            self.unsorted.discard(group)
+        values = self.packed[group]
+        index = bisect.bisect_left(values, value)
+        return index < len(values) and values[index] == value
+
+
+###############################################################################
+#
+# Watch events ordered by execute timestamp
+#
+###############################################################################
+
+class WatchHeap(object):
+    """ watch events indexed by key and ordered by execute timestamp (msg.xts). Each key has at 
+        most one event, setting an existing key overwrites the previous event. Events are kept in a
+        min-heap with lazy deletion: an overwritten or removed event remains in the heap and is 
+        discarded when it reaches the top. The heap is rebuilt from the current events when it has
+        more than twice the number of current events, limiting the memory of discarded events.
+        pop_ready is proportional to the number of ready events instead of all events. 
+        Note, this is not thread safe, caller must hold corresponding lock.
+    """
+    COMPACT_MIN_SIZE = 1024
+
+    def __init__(self):
+        self.events = {}        # tuple (seq, msg) of current event indexed by key
+        self.heap = []          # tuple (xts, seq, key) where seq is unique per set
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def __contains__(self, key):
+        return key in self.events
+
+    def __getitem__(self, key):
+        return self.events[key][1]
+
+    def __setitem__(self, key, msg):
+        self.seq+= 1
+        self.events[key] = (self.seq, msg)
+        heapq.heappush(self.heap, (msg.xts, self.seq, key))
+        if len(self.heap) > WatchHeap.COMPACT_MIN_SIZE and len(self.heap) > 2*len(self.events):
+            self.compact()
+
+    def get(self, key, default=None):
+        if key in self.events:
+            return self.events[key][1]
+        return default
+
+    def pop(self, key, default=None):
+        """ remove key and return its msg, the heap entry is discarded when it reaches the top """
+        if key in self.events:
+            return self.events.pop(key)[1]
+        return default
+
+    def items(self):
+        return [(k, e[1]) for k, e in self.events.items()]
+
+    def keys(self):
+        return self.events.keys()
+
+    def compact(self):
+        """ rebuild heap from current events """
+        self.heap = [(e[1].xts, e[0], k) for k, e in self.events.iteritems()]
+        heapq.heapify(self.heap)
+
+    def pop_ready(self, ts):
+        """ remove and return list of (key, msg) for events with xts less than or equal to ts, 
+            ordered by xts
+        """
+        ret = []
+        heap = self.heap
+        while len(heap) > 0 and heap[0][0] <= ts:
+            (xts, seq, key) = heapq.heappop(heap)
+            event = self.events.get(key, None)
+            if event is not None and event[0] == seq:
+                del self.events[key]
+                ret.append((key, event[1]))
+        return ret
+
+###############################################################################
+#
+# Unit of work for batching db writes
+#
+###############################################################################
+
+class BulkWriter(object):
+    """ unit of work for db writes. When enabled, write operations are queued per collection and 
+        executed as a single ordered bulk_write per collection on flush. Operations for the same
+        collection are always executed in the order they were queued so ordering per endpoint 
+        (vnid, addr, node) is maintained. Each queued operation records the (vnid, addr) it 
+        updates so a reader can flush only when it is about to read a collection with pending 
+        writes for that endpoint. When not enabled, each operation is written immediately.
+
+        error_callback(vnid, addr) is executed for each endpoint that had pending operations in a
+        flush where one or more operations failed.
+    """
+    def __init__(self, db, error_callback=None):
+        self.db = db
+        self.error_callback = error_callback
+        self.enabled = False
+        self.ops = {}               # indexed by collection name, list of pending operations
+        self.collections = []       # collection names in order of first queued operation
+        self.keys = {}              # indexed by collection name, set of pending (vnid, addr)
+        self.count = 0              # number of pending operations
+
+    def __repr__(self):
+        return "bulk[enabled:%r, ops:%s, collections:%s]" % (self.enabled, self.count, 
+                                                                len(self.collections))
+
+    def start(self):
+        """ queue all subsequent write operations until stop or flush """
+        self.enabled = True
+
+    def stop(self):
+        """ flush pending operations and return to immediate writes. return bool success """
+        success = self.flush()
+        self.enabled = False
+        return success
+
+    def is_pending(self, collection, vnid, addr):
+        """ return True if there are queued operations for collection name, vnid, and addr """
+        return collection in self.keys and (vnid, addr) in self.keys[collection]
+
+    def write(self, collection, op, vnid=None, addr=None):
+        """ queue pymongo write operation (InsertOne, UpdateOne, UpdateMany) for collection name.
+            return bool success (always True when queued)
+        """
+        if not self.enabled:
+            return self.execute(collection, [op])
+        if collection not in self.ops:
+            self.ops[collection] = []
+            self.keys[collection] = set()
+            self.collections.append(collection)
+        self.ops[collection].append(op)
+        self.keys[collection].add((vnid, addr))
+        self.count+= 1
+        return True
+
+    def update_one(self, collection, flt, update, upsert=False):
+        """ queue update_one for collection name, flt must contain vnid and addr. Note, a copy of
+            flt is queued as callers commonly reuse/modify the same filter for the next write
+        """
+        return self.write(collection, UpdateOne(dict(flt), update, upsert=upsert), 
+                            vnid=flt.get("vnid", None), addr=flt.get("addr", None))
+
+    def update_many(self, collection, flt, update):
+        """ queue update_many for collection name, flt must contain vnid and addr """
+        return self.write(collection, UpdateMany(dict(flt), update),
+                            vnid=flt.get("vnid", None), addr=flt.get("addr", None))
+
+    def save(self, obj):
+        """ queue create/update of Rest object. If not enabled then perform normal save """
+        if not self.enabled:
+            return obj.save(refresh=False)
+        op = obj._save(bulk_prep=True)
+        if op is None:
+            return False
+        return self.write(obj._classname, op, vnid=getattr(obj, "vnid", None), 
+                            addr=getattr(obj, "addr", None))
+
+    def flush(self, collection=None, vnid=None, addr=None):
+        """ execute all queued operations. If collection, vnid, and addr are provided then the 
+            flush is only performed if there are queued operations for that collection and 
+            endpoint. return bool success
+        """
+        if self.count == 0:
+            return True
+        if collection is not None and not self.is_pending(collection, vnid, addr):
+            return True
+        ts = time.time()
+        (ops, keys, collections, count) = (self.ops, self.keys, self.collections, self.count)
+        self.ops = {}
+        self.keys = {}
+        self.collections = []
+        self.count = 0
+        success = True
+        for c in collections:
+            if not self.execute(c, ops[c]):
+                success = False
+        logger.debug("bulk write %s operations for %s collections, time: %0.3f", count, 
+                        len(collections), time.time() - ts)
+        if not success and callable(self.error_callback):
+            failed = set()
+            for c in keys:
+                failed.update(keys[c])
+            for (vnid, addr) in failed:
+                self.error_callback(vnid, addr)
+        return success
+
+    def execute(self, collection, ops):
+        """ perform ordered bulk_write for list of operations.  An error on one operation stops an
+            ordered bulk write, therefore continue with remaining operations after the failed one
+            return bool success
+        """
+        success = True
+        while len(ops) > 0:
+            try:
+                self.db[collection].bulk_write(ops, ordered=True)
+                break
+            except BulkWriteError as e:
+                success = False
+                errors = e.details.get("writeErrors", [])
+                if len(errors) == 0:
+                    logger.warn("%s bulk write error: %s", collection, e.details)
+                    break
+                index = errors[0].get("index", len(ops))
+                logger.warn("%s bulk write failed for operation %s: %s", collection, 
+                            ops[index] if index < len(ops) else None, errors[0].get("errmsg",""))
+                ops = ops[index+1:]
+        return success
+
 
 ###############################################################################
 #
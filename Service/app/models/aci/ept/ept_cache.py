@@ -1,8 +1,16 @@
 
 from ... utils import get_db
+from . common import CACHE_ADAPT_HIT_RATIO
+from . common import CACHE_ADAPT_MIN_USAGE
+from . common import RAPID_FLUSH_INTERVAL
+from . common import RAPID_RATE_WINDOW
+from . common import RAPID_TICK_INTERVAL
+from . common import UINT64_TYPECODE
+from . common import BulkWriter
 from . common import get_ip_prefix
 from . ept_endpoint import eptEndpoint
 from . ept_epg import eptEpg
+from . ept_history import eptHistory
 from . ept_node import eptNode
 from . ept_pc import eptPc
 from . ept_tunnel import eptTunnel
@@ -10,7 +18,12 @@ from . ept_subnet import eptSubnet
 from . ept_vnid import eptVnid
 from . ept_vpc import eptVpc
 
+from array import array
+
+import bisect
 import logging
+import sys
+import time
 import traceback
 
 # module level logging
@@ -35,23 +48,69 @@ class eptCache(object):
 
             get_subnets         return [eptSubnet] for provided bd
 
-            get_rapid_endpoint  return rapidEndpointCachedObject from cache or new object
+            get_subnet_index    return subnetIndex built from [eptSubnet] for provided bd
+
+            preload             bulk load node, tunnel, pc, vpc, vnid, epg, and subnet caches
+
+            rapid               rapidRateEngine with rapid counters of tracked endpoints
+
+            get_history_state   return cached per node eptHistory events for vnid, addr
+
+            get_endpoint_state  return cached eptEndpoint projection for vnid, addr
 
             ip_is_offsubnet     return bool if ip is outside of subnets for bd corresponding to 
                                 vrf, pctag
 
             offsubnet check:
-            vnid,pctag-> eptEpg.bd_vnid -> list(eptSubnets)
-                                                  |
-                                                  + ip ------> offsubnetCachedObject
+            vnid,pctag-> eptEpg.bd_vnid -> list(eptSubnets) -> subnetIndex
+                                                                    |
+                                                                    + ip ---> offsubnetCachedObject
     """
     MAX_CACHE_SIZE = 512
     MAX_OFFSUBNET_CACHE_SIZE = 1024
     MAX_ENDPOINT_CACHE_SIZE = 1024
+    MAX_STATE_CACHE_SIZE = 4096
     KEY_DELIM = "`"             # majority of keys are integers, this should be sufficient delimiter
-    def __init__(self, fabric):
+    # name of each cache and eptSettings attribute for its configured capacity
+    CACHES = [
+        ("tunnel_cache", "cache_size"),
+        ("node_cache", "cache_size"),
+        ("vpc_cache", "cache_size"),
+        ("pc_cache", "cache_size"),
+        ("vnid_cache", "cache_size"),
+        ("epg_cache", "cache_size"),
+        ("subnet_cache", "cache_size"),
+        ("subnet_index_cache", "cache_size"),
+        ("offsubnet_cache", "offsubnet_cache_size"),
+        ("rapid_cache", "rapid_cache_size"),
+        ("history_cache", "state_cache_size"),
+        ("endpoint_cache", "state_cache_size"),
+    ]
+    # objects loaded by preload with corresponding cache and key attributes
+    PRELOAD = [
+        (eptNode, "node_cache", ["node"]),
+        (eptTunnel, "tunnel_cache", ["node", "intf"]),
+        (eptPc, "pc_cache", ["node", "intf"]),
+        (eptVpc, "vpc_cache", ["node", "intf"]),
+        (eptVnid, "vnid_cache", ["vnid"]),
+        (eptEpg, "epg_cache", ["vrf", "pctag"]),
+    ]
+    def __init__(self, fabric, settings=None):
         self.fabric = fabric
         self.flush_requests = 0
+        # number of entries and duration of most recent preload
+        self.preload_count = 0
+        self.preload_time = 0.0
+        # adaptive sizing enabled via eptSettings within a memory budget (bytes) that applies to the
+        # caches of this worker for this fabric only, see adapt
+        self.adaptive = False
+        self.worker_memory_budget = 0
+        # configured capacity of each cache indexed by cache name (minimum size when adaptive)
+        self.min_size = {}
+        # hit, miss, and drop counters of each cache at previous adapt
+        self.adapt_counters = {}
+        # optional BulkWriter used for rapid counter saves, set by eptWorkerFabric
+        self.writer = None
         self.key_delim = eptCache.KEY_DELIM
         self.tunnel_cache = hitCache(eptCache.MAX_CACHE_SIZE)   # eptTunnel(node, intf) = eptTunnel
         self.node_cache = hitCache(eptCache.MAX_CACHE_SIZE)         # eptNode(node) = eptNode
@@ -60,10 +119,37 @@ class eptCache(object):
         self.vnid_cache = hitCache(eptCache.MAX_CACHE_SIZE)         # eptVnid(vnid) = eptVnid
         self.epg_cache = hitCache(eptCache.MAX_CACHE_SIZE)          # eptEpg(vrf,pctag) = eptEpg
         self.subnet_cache = hitCache(eptCache.MAX_CACHE_SIZE)       # eptSubnet(bd) = list(eptSubnet)
+        self.subnet_index_cache = hitCache(eptCache.MAX_CACHE_SIZE) # eptSubnet(bd) = subnetIndex
         # (vrf,pctag,ip) = eptOffSubnet
-        self.offsubnet_cache = hitCache(eptCache.MAX_OFFSUBNET_CACHE_SIZE) 
-        # (vnid,addr) = rapidEndpointCachedObject
-        self.rapid_cache = hitCache(eptCache.MAX_ENDPOINT_CACHE_SIZE, callback=self.evict_rapid) 
+        self.offsubnet_cache = hitCache(eptCache.MAX_OFFSUBNET_CACHE_SIZE, tags={
+                                    "bd": lambda val: val.bd})
+        # (vnid,addr) = slot within rapidRateEngine columns
+        self.rapid = rapidRateEngine(self)
+        self.rapid_cache = hitCache(eptCache.MAX_ENDPOINT_CACHE_SIZE, callback=self.rapid.evict)
+        # write-through endpoint state owned by this worker (address hash pins each vnid,addr to a
+        # single worker so the worker is the only writer of this state)
+        # (vnid,addr) = dict indexed by node with list containing most recent eptHistoryEvent
+        self.history_cache = hitCache(eptCache.MAX_STATE_CACHE_SIZE)
+        # (vnid,addr) = dict of eptEndpoint attributes used by worker (see get_endpoint_state)
+        self.endpoint_cache = hitCache(eptCache.MAX_STATE_CACHE_SIZE)
+        for (cache_name, attr) in eptCache.CACHES:
+            self.min_size[cache_name] = getattr(self, cache_name).max_size
+        if settings is not None:
+            self.apply_settings(settings)
+
+    def apply_settings(self, settings):
+        """ set capacity of each cache from eptSettings. If adaptive sizing is enabled, a cache that
+            has already grown beyond its configured capacity keeps its current capacity
+        """
+        self.adaptive = settings.cache_adaptive
+        self.worker_memory_budget = settings.cache_worker_memory_budget * 1024 * 1024
+        for (cache_name, attr) in eptCache.CACHES:
+            size = getattr(settings, attr)
+            c = getattr(self, cache_name)
+            grown = c.max_size > self.min_size[cache_name]
+            self.min_size[cache_name] = size
+            if not self.adaptive or not grown or c.max_size < size:
+                c.set_max_size(size)
 
     def handle_flush(self, collection_name, name=None):
         """ flush one or more entries in collection name """
@@ -124,11 +210,22 @@ class eptCache(object):
                 logger.debug("flushing subnet_cache and offsubnet_cache for bd 0x%x", flush_bd)
                 keystr = self.get_key_str(bd=flush_bd)
                 self.subnet_cache.remove(keystr)
+                self.subnet_index_cache.remove(keystr)
                 self.offsubnet_flush(flush_bd)
             else:
                 logger.debug("flushing full subnet_cache and offsubnet_cache")
                 self.subnet_cache.flush()
+                self.subnet_index_cache.flush()
                 self.offsubnet_cache.flush()
+        elif collection_name == eptEndpoint._classname or collection_name == eptHistory._classname:
+            # endpoint state for eptEndpoint and eptHistory is always flushed together. The name is
+            # the key string for vnid and addr
+            if name is not None: 
+                self.history_cache.remove(name, preserve_none=True)
+                self.endpoint_cache.remove(name, preserve_none=True)
+            else:
+                self.history_cache.flush()
+                self.endpoint_cache.flush()
         else:
             logger.debug("flush for unsupported collection name: %s", collection_name)
 
@@ -175,6 +272,43 @@ class eptCache(object):
             cache.push(keystr, val)
             return val
   
+    def preload(self):
+        """ bulk load node, tunnel, pc, vpc, vnid, epg, and subnet objects for the fabric into the
+            corresponding caches with a single cursor scan per collection. Each cache is loaded up
+            to its capacity. Subnets are grouped by bd as a subnet_cache entry requires all subnets
+            of the bd.  Return tuple (number of cached entries, duration in seconds)
+        """
+        ts = time.time()
+        db = get_db()
+        count = 0
+        for (eptObject, cache_name, keys) in eptCache.PRELOAD:
+            cache = getattr(self, cache_name)
+            cursor = db[eptObject._classname].find({"fabric": self.fabric}).limit(cache.max_size)
+            for o in cursor:
+                if any(k not in o for k in keys):
+                    continue
+                obj = eptObject(**o)
+                obj._exists = True
+                cache.push(self.get_key_str(**dict([(k, o[k]) for k in keys])), obj)
+                count+= 1
+        subnets = {}
+        for o in db[eptSubnet._classname].find({"fabric": self.fabric}):
+            if "bd" not in o:
+                continue
+            obj = eptSubnet(**o)
+            obj._exists = True
+            if obj.bd not in subnets:
+                subnets[obj.bd] = []
+            subnets[obj.bd].append(obj)
+        for bd in subnets.keys()[0:self.subnet_cache.max_size]:
+            self.subnet_cache.push(self.get_key_str(bd=bd), subnets[bd])
+            count+= 1
+        self.preload_count = count
+        self.preload_time = time.time() - ts
+        logger.debug("(cache) preloaded %s entries for fabric %s in %.3f seconds", count, 
+                self.fabric, self.preload_time)
+        return (count, self.preload_time)
+
     def get_pod_id(self, node):
         """ get node's pod_id.  If not found or an error occurs, return 0 """
         ret = self.generic_cache_lookup(self.node_cache, eptNode, node=node)
@@ -225,24 +359,69 @@ class eptCache(object):
         if ret is None: return ""
         return ret.name
 
-    def get_rapid_endpoint(self, vnid, addr, addr_type):
-        """ return rapidEndpointCachedObject from cache or new object """
-        ret = self.generic_cache_lookup(self.rapid_cache, rapidEndpointCachedObject, db_lookup=False,
-                                        vnid=vnid, addr=addr)
-        if ret is None:
-            # create a new rapidEndpointCachedObject and add to cache
-            ret = rapidEndpointCachedObject(self.fabric, vnid, addr, addr_type)
-            # add result to cache for next lookup
-            keystr = self.get_key_str(vnid=vnid, addr=addr)
-            self.rapid_cache.push(keystr, ret)
+    def get_history_state(self, vnid, addr):
+        """ return cached dict of per node eptHistory events for provided vnid and addr or None if 
+            not currently cached. The dict is indexed by node-id with list of eptHistoryEvent where
+            the first event has watch_stale_ts, watch_stale_event, and watch_offsubnet_ts embedded
+        """
+        ret = self.history_cache.search(self.get_key_str(vnid=vnid, addr=addr))
+        if isinstance(ret, hitCacheNotFound):
+            return None
+        return ret
+
+    def set_history_state(self, vnid, addr, per_node_history_events):
+        """ add per node eptHistory events to cache. Only the most recent event per node is kept """
+        for node in per_node_history_events:
+            if len(per_node_history_events[node]) > 1:
+                per_node_history_events[node] = per_node_history_events[node][0:1]
+        self.history_cache.push(self.get_key_str(vnid=vnid, addr=addr), per_node_history_events)
+
+    def get_endpoint_state(self, vnid, addr):
+        """ return cached dict of eptEndpoint attributes for provided vnid and addr or None if not 
+            currently cached. The dict contains the same attributes as the worker projection: 
+            learn_type, is_stale, is_offsubnet, events (most recent 2 events), and rapid counters.
+        """
+        ret = self.endpoint_cache.search(self.get_key_str(vnid=vnid, addr=addr))
+        if isinstance(ret, hitCacheNotFound):
+            return None
         return ret
 
-    def evict_rapid(self, cached_rapid):
-        """ triggered when rapidEndpointCachedObject is evicted from cache
-            here we need to save result to eptEndpoint as this and recalculations are the only 
-            time when rapid counters are saved to db
+    def set_endpoint_state(self, vnid, addr, endpoint):
+        """ add eptEndpoint attribute dict to cache. Caller must update the same dict on each write 
+            to eptEndpoint for this endpoint
         """
-        cached_rapid.save()
+        self.endpoint_cache.push(self.get_key_str(vnid=vnid, addr=addr), endpoint)
+
+    def update_endpoint_state(self, vnid, addr, **attributes):
+        """ update one or more attributes of cached eptEndpoint state if present in cache """
+        keystr = self.get_key_str(vnid=vnid, addr=addr)
+        node = self.endpoint_cache.key_hash.get(keystr, None)
+        if node is not None and node.val is not None:
+            node.val.update(attributes)
+
+    def remove_endpoint_state(self, vnid, addr):
+        """ remove cached eptHistory and eptEndpoint state for provided vnid and addr """
+        keystr = self.get_key_str(vnid=vnid, addr=addr)
+        self.history_cache.remove(keystr, preserve_none=True)
+        self.endpoint_cache.remove(keystr, preserve_none=True)
+
+    def release_endpoints(self, owned):
+        """ release cached endpoint state for each address where owned(addr) is False. Used on
+            worker handoff when the address is now owned by another worker. Rapid counters are 
+            saved to db and endpoint state is removed (new owner will read it from db)
+            return number of released rapid entries
+        """
+        released = [(k, n.val) for k, n in self.rapid_cache.key_hash.items() 
+                        if n.val is not None and not owned(self.rapid.keys[n.val][1])]
+        for (keystr, slot) in released:
+            self.rapid_cache.remove(keystr, preserve_none=True)
+            self.rapid.release(slot)
+        for cache in [self.history_cache, self.endpoint_cache]:
+            for keystr in cache.key_hash.keys():
+                (addr, vnid) = keystr.split(self.key_delim)
+                if not owned(addr):
+                    cache.remove(keystr, preserve_none=True)
+        return len(released)
 
     def get_subnets(self, bd):
         """ return list of subnet objects for provided bd.  Return an empty list of subnets not
@@ -252,6 +431,17 @@ class eptCache(object):
         if subnets is None: return []
         return subnets
 
+    def get_subnet_index(self, bd):
+        """ return subnetIndex for provided bd. The index is built once from the bd subnets and 
+            cached until the subnets for the bd are flushed
+        """
+        keystr = self.get_key_str(bd=bd)
+        index = self.subnet_index_cache.search(keystr)
+        if isinstance(index, hitCacheNotFound) or index is None:
+            index = subnetIndex(self.get_subnets(bd))
+            self.subnet_index_cache.push(keystr, index)
+        return index
+
     def ip_is_offsubnet(self, vrf, pctag, ip):
         """ return bool if ip is offsubnet
             if unable to determine bd then cannot execute offsubnet check and return False.  If 
@@ -273,22 +463,15 @@ class eptCache(object):
             logger.warn("failed to parse ip address: %s", ip)
             return False
         else:
-            # get list of subnets and check each for a match against the addr (assume offsubnet 
-            # until matched against one of the bd subnets)
-            offsubnet = True
-            subnets = self.get_subnets(epg.bd)
-            for s in subnets:
-                (saddr, smask) = get_ip_prefix(s.ip)
-                if saddr is None or smask is None:
-                    logger.warn("failed to parse ip address for subnet(%s): %s", s.name, s.ip)
-                    continue
-                if addr & smask == saddr:
-                    logger.debug("addr %s matched subnet: %s", ip, s.name)
-                    offsubnet = False
-                    break
+            # check addr against prefix index of bd subnets (offsubnet if not within any subnet)
+            index = self.get_subnet_index(epg.bd)
+            name = index.search(addr, ipv6=":" in ip)
+            offsubnet = name is None
             if offsubnet:
                 logger.debug("addr %s not matched against any of the %s subnets in bd %s", ip, 
-                    len(subnets), epg.bd)
+                    index.count, epg.bd)
+            else:
+                logger.debug("addr %s matched subnet: %s", ip, name)
 
         # add result to cache for next lookup
         keystr = self.get_key_str(vrf=vrf, pctag=pctag, ip=ip)
@@ -297,68 +480,352 @@ class eptCache(object):
 
     def offsubnet_flush(self, bd):
         """ offsubnet_cache contains offsubnetCachedObjects with key of vrf,pctag,ip. Flush occurs
-            based on bd so need to walk through all nodes in list and remove nodes with provided bd.
+            based on bd so remove all nodes with corresponding bd tag.
         """
-        remove_nodes = []
-        for n in self.offsubnet_cache.get_node_list():
-            if n.val is not None and hasattr(n.val, "bd") and n.val.bd == bd:
-                remove_nodes.append(n)
-        for n in remove_nodes:
-            self.offsubnet_cache._remove_node(n)
+        self.offsubnet_cache.remove_tag("bd", bd)
 
     def log_stats(self):
         """ log statistics for each cache """
-        caches = [
-            "tunnel_cache",
-            "node_cache", 
-            "vpc_cache", 
-            "epg_cache", 
-            "subnet_cache", 
-            "offsubnet_cache",
-            "rapid_cache",
-        ]
         logger.debug("cache stats for fabric %s, flush_request: 0x%08x", self.fabric, 
                 self.flush_requests)
-        for cache_name in caches:
+        for (cache_name, attr) in eptCache.CACHES:
             c = getattr(self, cache_name)
             logger.debug("[hit: 0x%08x, miss: 0x%08x, evict: 0x%08x, flush: 0x%08x] %s", 
                 c.hit_count, c.miss_count, c.evict_count, c.flush_count, cache_name)
 
-class rapidEndpointCachedObject(object):
-    """ rapid statistics for eptEndpoint """
-    _classname = "rapid_endpoint_cache"
-    def __init__(self, fabric, vnid, addr, addr_type):
-        self.fabric = fabric
-        self.addr = addr
-        self.vnid = vnid
-        self.type = addr_type
-        self.is_rapid = False
-        self.is_rapid_ts = 0.0
-        self.rapid_lts = 0.0
-        self.rapid_count = 0
-        self.rapid_lcount = 0
-        self.rapid_icount = 0
+    def get_stats(self):
+        """ return dict with statistics for each cache indexed by cache name along with the total
+            approximate bytes of all caches
+        """
+        caches = {}
+        total = 0
+        for (cache_name, attr) in eptCache.CACHES:
+            caches[cache_name] = getattr(self, cache_name).get_stats()
+            total+= caches[cache_name]["bytes"]
+        return {
+            "fabric": self.fabric,
+            "ts": time.time(),
+            "flush_requests": self.flush_requests,
+            "preload_count": self.preload_count,
+            "preload_time": self.preload_time,
+            "adaptive": self.adaptive,
+            "worker_memory_budget": self.worker_memory_budget,
+            "bytes": total,
+            "caches": caches,
+        }
+
+    def adapt(self, stats=None):
+        """ adjust the capacity of each cache based on the hit ratio and usage since the previous
+            adapt. A cache that dropped entries to maintain its capacity with a hit ratio below
+            CACHE_ADAPT_HIT_RATIO is doubled if the projected bytes of all caches remain within the
+            worker memory budget, lowest hit ratio first. A cache using less than
+            CACHE_ADAPT_MIN_USAGE of its capacity is halved. If the budget is exceeded then caches
+            above their configured capacity are halved, lowest hit ratio first, until within budget.
+            A cache is never reduced below its configured capacity. The budget only covers the
+            caches of this fabric on this worker. Provide stats from get_stats to prevent a second
+            collection of cache statistics. Return list of (cache_name, old_size, new_size)
+        """
+        if stats is None:
+            stats = self.get_stats()
+        ratios = {}
+        drops = {}
+        for (cache_name, attr) in eptCache.CACHES:
+            c = getattr(self, cache_name)
+            (hit, miss, drop) = self.adapt_counters.get(cache_name, (0, 0, 0))
+            self.adapt_counters[cache_name] = (c.hit_count, c.miss_count, c.drop_count)
+            lookups = (c.hit_count - hit) + (c.miss_count - miss)
+            ratios[cache_name] = float(c.hit_count - hit)/lookups if lookups > 0 else 1.0
+            drops[cache_name] = c.drop_count - drop
+        if not self.adaptive:
+            return []
+
+        ret = []
+        total = stats["bytes"]
+        def resize(cache_name, size):
+            c = getattr(self, cache_name)
+            ret.append((cache_name, c.max_size, size))
+            c.set_max_size(size)
+
+        by_ratio = sorted(ratios, key=lambda cache_name: ratios[cache_name])
+        for cache_name in by_ratio:
+            c = getattr(self, cache_name)
+            cstats = stats["caches"][cache_name]
+            size = c.max_size
+            if size > self.min_size[cache_name] and cstats["size"] < size*CACHE_ADAPT_MIN_USAGE:
+                size = max(self.min_size[cache_name], size/2)
+                resize(cache_name, size)
+            elif drops[cache_name] > 0 and ratios[cache_name] < CACHE_ADAPT_HIT_RATIO and \
+                cstats["size"] > 0:
+                # grow by projected bytes of additional entries based on current entry size
+                grow_bytes = (cstats["bytes"] / cstats["size"]) * size
+                if total + grow_bytes <= self.worker_memory_budget:
+                    total+= grow_bytes
+                    resize(cache_name, size*2)
+        for cache_name in by_ratio:
+            if total <= self.worker_memory_budget:
+                break
+            c = getattr(self, cache_name)
+            cstats = stats["caches"][cache_name]
+            if c.max_size > self.min_size[cache_name]:
+                size = max(self.min_size[cache_name], c.max_size/2)
+                if cstats["size"] > size:
+                    total-= (cstats["bytes"] / cstats["size"]) * (cstats["size"] - size)
+                resize(cache_name, size)
+        for (cache_name, old_size, new_size) in ret:
+            logger.debug("(cache) %s resized from %s to %s (hit ratio %.3f)", cache_name, 
+                    old_size, new_size, ratios[cache_name])
+        return ret
+
+class rapidRateEngine(object):
+    """ rapid statistics for all eptEndpoints tracked by a worker fabric cache. The counters of each
+        endpoint are stored in a slot within array-backed columns and the (vnid,addr) of each slot
+        is kept in the rapid_cache (hitCache) of the eptCache for LRU eviction.
+
+        events are recorded per slot with increment and the rate of all updated endpoints is
+        refreshed in a single pass at most once per tick interval. The rate is the number of events
+        within a sliding window scaled to events per minute. The window of each slot is a ring of
+        per-tick buckets (window/tick buckets) where a bucket is reused once it falls out of the
+        window. The ring is not saved to eptEndpoint, a slot loaded from eptEndpoint starts with an
+        empty window.
+
+        endpoints with a rate above the threshold are marked as rapid until the holdtime expires.
+        Updated counters are saved to eptEndpoint in bulk at flush interval and when the slot is
+        evicted or released.
+    """
+    FLAG_RAPID = 0x1
+    FLAG_LOADED = 0x2
+    def __init__(self, cache, window=RAPID_RATE_WINDOW, tick=RAPID_TICK_INTERVAL,
+            flush_interval=RAPID_FLUSH_INTERVAL):
+        self.cache = cache
+        self.buckets = max(1, int(round(float(window) / tick)))
+        self.window = float(self.buckets * tick)
+        self.tick_interval = tick
+        self.flush_interval = flush_interval
+        self.next_tick = 0.0
+        self.last_flush = 0.0
+        self.tick_count = 0
+        self.flush_count = 0
+        # columns indexed by slot
+        self.count = array(UINT64_TYPECODE)              # rapid_count
+        self.lcount = array(UINT64_TYPECODE)             # rapid_lcount (count at last refresh)
+        self.icount = array(UINT64_TYPECODE)             # rapid_icount (events while rapid)
+        self.pending = array(UINT64_TYPECODE)            # events since last refresh
+        self.wcount = array(UINT64_TYPECODE)             # events within window
+        self.wtick = array(UINT64_TYPECODE)              # tick of last refresh
+        self.ring = array("I")                           # events per tick, buckets per slot
+        self.rate = array("d")                           # rapid_rate (events per minute)
+        self.lts = array("d")                            # rapid_lts (timestamp of last refresh)
+        self.rapid_ts = array("d")                       # is_rapid_ts
+        self.flags = array("B")
+        # (vnid, addr, type) of each slot or None if slot is free
+        self.keys = []
+        self.free = []
+        # slots with events since last refresh, currently rapid, and not yet saved
+        self.updated = set()
+        self.rapid = set()
+        self.dirty = set()
 
     def __repr__(self):
-        return "is_rapid:%r, ts:%.3f, lts:%.3f [c:0x%08x, l:0x%08x, i:0x%08x]" % (
-            self.is_rapid, self.is_rapid_ts, self.rapid_lts,
-            self.rapid_count, self.rapid_lcount, self.rapid_icount
-        )
+        return "slots:%s, free:%s, updated:%s, rapid:%s, dirty:%s" % (len(self.keys),
+                len(self.free), len(self.updated), len(self.rapid), len(self.dirty))
 
-    def save(self):
-        """ save rapid counters to eptEndpoint entry, this is update for subset of attributes """
-        get_db()[eptEndpoint._classname].update_one({
-            "fabric": self.fabric,
-            "addr": self.addr,
-            "vnid": self.vnid
-        }, {"$set":{
-            "is_rapid": self.is_rapid,
-            "is_rapid_ts": self.is_rapid_ts,
-            "rapid_lts": self.rapid_lts,
-            "rapid_count": self.rapid_count,
-            "rapid_lcount": self.rapid_lcount,
-            "rapid_icount": self.rapid_icount,
-        }})
+    def get_slot(self, vnid, addr, addr_type):
+        """ return slot for provided vnid and addr, allocating a new slot if not currently tracked.
+            A new slot is not loaded (see is_loaded) until load is called with eptEndpoint state
+        """
+        keystr = self.cache.get_key_str(vnid=vnid, addr=addr)
+        slot = self.cache.rapid_cache.search(keystr)
+        if not isinstance(slot, hitCacheNotFound):
+            return slot
+        if len(self.free) > 0:
+            slot = self.free.pop()
+            for c in (self.count, self.lcount, self.icount, self.pending, self.wcount, self.wtick):
+                c[slot] = 0
+            base = slot * self.buckets
+            self.ring[base:base + self.buckets] = array("I", [0] * self.buckets)
+            for c in (self.rate, self.lts, self.rapid_ts):
+                c[slot] = 0.0
+            self.flags[slot] = 0
+            self.keys[slot] = (vnid, addr, addr_type)
+        else:
+            slot = len(self.keys)
+            for c in (self.count, self.lcount, self.icount, self.pending, self.wcount, self.wtick):
+                c.append(0)
+            self.ring.extend([0] * self.buckets)
+            for c in (self.rate, self.lts, self.rapid_ts):
+                c.append(0.0)
+            self.flags.append(0)
+            self.keys.append((vnid, addr, addr_type))
+        # push may drop the least recently used slot which is freed by evict
+        self.cache.rapid_cache.push(keystr, slot)
+        return slot
+
+    def is_loaded(self, slot):
+        """ return True if slot counters have been loaded from eptEndpoint state """
+        return self.flags[slot] & rapidRateEngine.FLAG_LOADED > 0
+
+    def is_rapid(self, slot):
+        """ return True if slot is currently marked as rapid """
+        return self.flags[slot] & rapidRateEngine.FLAG_RAPID > 0
+
+    def load(self, slot, endpoint=None):
+        """ load slot counters from eptEndpoint state dict (or initialize if endpoint is None) """
+        flags = rapidRateEngine.FLAG_LOADED
+        if endpoint is not None:
+            self.count[slot] = max(0, endpoint.get("rapid_count", 0))
+            self.lcount[slot] = max(0, endpoint.get("rapid_lcount", 0))
+            self.icount[slot] = max(0, endpoint.get("rapid_icount", 0))
+            self.rate[slot] = endpoint.get("rapid_rate", 0.0)
+            self.lts[slot] = endpoint.get("rapid_lts", 0.0)
+            if endpoint.get("is_rapid", False):
+                flags|= rapidRateEngine.FLAG_RAPID
+                self.rapid_ts[slot] = endpoint.get("is_rapid_ts", 0.0) or self.lts[slot]
+                self.rapid.add(slot)
+        self.flags[slot] = flags
+
+    def increment(self, slot):
+        """ record an event for slot, the rate is refreshed on the next tick """
+        self.count[slot]+= 1
+        self.pending[slot]+= 1
+        if self.flags[slot] & rapidRateEngine.FLAG_RAPID:
+            self.icount[slot]+= 1
+        self.updated.add(slot)
+
+    def tick(self, now, threshold, holdtime):
+        """ if tick interval has elapsed, refresh the rate of all slots with events since the last
+            refresh or currently marked as rapid. The rapid flag is cleared when holdtime has 
+            expired and set when the rate (events per minute) exceeds the threshold.
+            return list of slots newly marked as rapid
+        """
+        ret = []
+        if now < self.next_tick:
+            return ret
+        self.next_tick = now + self.tick_interval
+        self.tick_count+= 1
+        slots = self.updated | self.rapid
+        self.updated = set()
+        (count, lcount, pending, rate, lts, rapid_ts, flags) = (self.count, self.lcount,
+            self.pending, self.rate, self.lts, self.rapid_ts, self.flags)
+        (ring, wcount, wtick, buckets) = (self.ring, self.wcount, self.wtick, self.buckets)
+        scale = 60.0 / self.window
+        zero = array("I", [0] * buckets)
+        t = int(now // self.tick_interval)
+        for slot in slots:
+            f = flags[slot]
+            if f & rapidRateEngine.FLAG_RAPID and now - rapid_ts[slot] > holdtime:
+                f&= ~rapidRateEngine.FLAG_RAPID
+                self.rapid.discard(slot)
+            # clear buckets for ticks that are no longer within the window
+            base = slot * buckets
+            w = wtick[slot]
+            c = wcount[slot]
+            if t - w >= buckets:
+                ring[base:base + buckets] = zero
+                c = 0
+            else:
+                while w < t:
+                    w+= 1
+                    b = base + w % buckets
+                    c-= ring[b]
+                    ring[b] = 0
+            p = pending[slot]
+            ring[base + t % buckets]+= p
+            c+= p
+            wcount[slot] = c
+            wtick[slot] = t
+            r = c * scale
+            rate[slot] = r
+            lts[slot] = now
+            lcount[slot] = count[slot]
+            pending[slot] = 0
+            if not f & rapidRateEngine.FLAG_RAPID and r > threshold:
+                f|= rapidRateEngine.FLAG_RAPID
+                rapid_ts[slot] = now
+                self.rapid.add(slot)
+                ret.append(slot)
+            flags[slot] = f
+        self.dirty.update(slots)
+        if now - self.last_flush >= self.flush_interval:
+            self.last_flush = now
+            self.flush()
+        return ret
+
+    def get_update(self, slot):
+        """ return eptEndpoint filter and update for slot counters """
+        (vnid, addr, addr_type) = self.keys[slot]
+        flt = {
+            "fabric": self.cache.fabric,
+            "addr": addr,
+            "vnid": vnid,
+        }
+        update = {"$set":{
+            "is_rapid": self.is_rapid(slot),
+            "is_rapid_ts": self.rapid_ts[slot],
+            "rapid_lts": self.lts[slot],
+            "rapid_rate": self.rate[slot],
+            "rapid_count": self.count[slot],
+            "rapid_lcount": self.lcount[slot],
+            "rapid_icount": self.icount[slot],
+        }}
+        return (flt, update)
+
+    def flush(self):
+        """ save counters of all updated slots to eptEndpoint. The updates are queued on the cache
+            writer if enabled, else executed with a single bulk write
+            return number of saved slots
+        """
+        if len(self.dirty) == 0:
+            return 0
+        (dirty, self.dirty) = (self.dirty, set())
+        writer = self.cache.writer
+        bulk = writer is None or not writer.enabled
+        if bulk:
+            writer = BulkWriter(get_db())
+            writer.start()
+        for slot in dirty:
+            if self.keys[slot] is not None:
+                (flt, update) = self.get_update(slot)
+                writer.update_one(eptEndpoint._classname, flt, update)
+        if bulk:
+            writer.stop()
+        self.flush_count+= 1
+        return len(dirty)
+
+    def evict(self, slot):
+        """ triggered when slot is evicted from rapid_cache, save counters and free the slot """
+        self.release(slot, save=True)
+
+    def release(self, slot, save=True):
+        """ free the slot, saving the counters to eptEndpoint if loaded and save is set """
+        if self.keys[slot] is None:
+            return
+        (vnid, addr, addr_type) = self.keys[slot]
+        if save and self.is_loaded(slot):
+            (flt, update) = self.get_update(slot)
+            if self.cache.writer is not None:
+                self.cache.writer.update_one(eptEndpoint._classname, flt, update)
+            else:
+                get_db()[eptEndpoint._classname].update_one(flt, update)
+        # cached endpoint state has rapid counters from when the entry was first read, they are
+        # only used when rapid entry is rebuilt so the endpoint state must be refreshed from db
+        self.cache.endpoint_cache.remove(self.cache.get_key_str(vnid=vnid, addr=addr),
+                                            preserve_none=True)
+        self.keys[slot] = None
+        self.flags[slot] = 0
+        self.updated.discard(slot)
+        self.rapid.discard(slot)
+        self.dirty.discard(slot)
+        self.free.append(slot)
+
+    def remove(self, vnid, addr, save=True):
+        """ stop tracking vnid and addr, return True if found """
+        keystr = self.cache.get_key_str(vnid=vnid, addr=addr)
+        slot = self.cache.rapid_cache.search(keystr)
+        if isinstance(slot, hitCacheNotFound):
+            return False
+        self.cache.rapid_cache.remove(keystr, preserve_none=True)
+        self.release(slot, save=save)
+        return True
 
 class offsubnetCachedObject(object):
     """ cache objects support a key and val where val can contain an optionally name used mainly for
@@ -374,6 +841,71 @@ class offsubnetCachedObject(object):
         self.bd = bd
         self.offsubnet = offsubnet
 
+def get_object_size(obj, depth=4):
+    """ return approximate bytes of obj including the contents of dicts, lists, tuples, sets, and
+        object attributes up to the provided depth.  Note, objects referenced more than once are 
+        counted for each reference.
+    """
+    size = sys.getsizeof(obj)
+    if depth <= 0 or obj is None or isinstance(obj, (basestring, int, long, float)):
+        return size
+    depth-= 1
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            size+= get_object_size(k, depth) + get_object_size(v, depth)
+    elif isinstance(obj, (list, tuple, set)):
+        for v in obj:
+            size+= get_object_size(v, depth)
+    elif hasattr(obj, "__dict__"):
+        size+= get_object_size(obj.__dict__, depth)
+    return size
+
+class subnetIndex(object):
+    """ prefix index of the subnets for a single bd. Each subnet is parsed once and converted to an
+        integer range [first address, last address]. Since prefixes are either nested or disjoint,
+        overlapping ranges are merged into the enclosing range resulting in a sorted list of 
+        disjoint ranges per address family. An address is within a bd subnet if it falls within
+        one of the ranges which is a single binary search.
+    """
+    def __init__(self, subnets):
+        self.count = len(subnets)
+        # sorted list of range start, range end, and subnet name for ipv4 and ipv6 
+        self.starts = {False: [], True: []}
+        self.ends = {False: [], True: []}
+        self.names = {False: [], True: []}
+        ranges = {False: [], True: []}
+        for s in subnets:
+            (saddr, smask) = get_ip_prefix(s.ip)
+            if saddr is None or smask is None:
+                logger.warn("failed to parse ip address for subnet(%s): %s", s.name, s.ip)
+                continue
+            ipv6 = ":" in s.ip
+            if ipv6:
+                ranges[ipv6].append((saddr, saddr | (~smask & 0xffffffffffffffffffffffffffffffff), 
+                                    s.name))
+            else:
+                ranges[ipv6].append((saddr, saddr | (~smask & 0xffffffff), s.name))
+        for ipv6 in ranges:
+            starts = self.starts[ipv6]
+            ends = self.ends[ipv6]
+            names = self.names[ipv6]
+            for (start, end, name) in sorted(ranges[ipv6]):
+                if len(ends) > 0 and start <= ends[-1]:
+                    if end > ends[-1]:
+                        ends[-1] = end
+                        names[-1] = name
+                else:
+                    starts.append(start)
+                    ends.append(end)
+                    names.append(name)
+
+    def search(self, addr, ipv6=False):
+        """ return name of subnet containing integer address or None if not within any subnet """
+        i = bisect.bisect_right(self.starts[ipv6], addr) - 1
+        if i >= 0 and addr <= self.ends[ipv6][i]:
+            return self.names[ipv6][i]
+        return None
+
 class hitCacheNotFound(object):
     """ when searching for an object within hitCache and the corresponding name or key is not found,
         and instance of hitCacheNotFound object is returned.  This is to distinguish between None
@@ -395,23 +927,42 @@ class hitCache(object):
 
         provide a callback function that receives val of evicted object to get perform additional
         logic on cache eviction (i.e., cache write back logic). callback must accept single argument
-        which is value of object evicted
+        which is value of object evicted. The callback is only triggered when the least recently 
+        used node is dropped to maintain the max cache size, it is not triggered on remove or flush.
+
+        provide a tags dict indexed by tag name with a function that receives val and returns the 
+        tag value (or None if not tagged) to maintain a secondary index for each tag. All nodes 
+        with a tag value can be removed via remove_tag which is proportional to the number of 
+        matching nodes. For example, tags={"bd": lambda val: val.bd}
+
+        the max size can be changed at runtime via set_max_size and get_stats returns the counters
+        along with the approximate bytes of the cache calculated from a sample of nodes.
     """
-    def __init__(self, max_size, callback=None):
+    STATS_SAMPLE_SIZE = 32
+    def __init__(self, max_size, callback=None, tags=None):
         self.head = None
         self.tail = None
         self.max_size = max_size
         self.key_hash = {}
         self.name_hash = {}
         self.none_hash = {}     # objects with no name set (cached 'not found' objects)
+        self.tags = {}          # function to get tag value from val indexed by tag name
+        self.tag_hash = {}      # dict of nodes indexed by key for each tag name and tag value
         self.hit_count = 0
         self.miss_count = 0
         self.evict_count = 0
+        self.drop_count = 0     # nodes dropped to maintain max size (subset of evict_count)
         self.flush_count = 0
         if callback is not None and callable(callback):
             self.evict_callback = callback
         else:
             self.evict_callback = None
+        if tags is not None:
+            for tag in tags:
+                if not callable(tags[tag]):
+                    raise Exception("tag function not callable: %s" % tag)
+                self.tags[tag] = tags[tag]
+                self.tag_hash[tag] = {}
 
     def __repr__(self):
         s = ["len:%s [head-key:%s, tail-key:%s], list: " % (
@@ -437,6 +988,8 @@ class hitCache(object):
         self.key_hash = {}
         self.name_hash = {}
         self.none_hash = {}
+        for tag in self.tag_hash:
+            self.tag_hash[tag] = {}
         self.head = None
         self.tail = None
         self.flush_count+= 1
@@ -445,10 +998,54 @@ class hitCache(object):
         """ get number of nodes currently in cached linked list """
         return len(self.key_hash)
 
+    def set_max_size(self, max_size):
+        """ set max size of the cache, dropping least recently used nodes if the current size 
+            exceeds the new max size
+        """
+        self.max_size = max_size
+        while len(self.key_hash) > self.max_size and self.tail is not None:
+            self._drop_tail()
+
+    def get_bytes(self, sample=None):
+        """ return approximate bytes used by the cache. The average size of a sample of the most
+            recently used nodes including key and val is multiplied by the number of nodes. The
+            size of the key and name hashes is also included.
+        """
+        if sample is None:
+            sample = hitCache.STATS_SAMPLE_SIZE
+        size = sys.getsizeof(self.key_hash) + sys.getsizeof(self.name_hash)
+        count = 0
+        sample_size = 0
+        node = self.head
+        while node is not None and count < sample:
+            sample_size+= sys.getsizeof(node) + get_object_size(node.key) + \
+                            get_object_size(node.val)
+            count+= 1
+            node = node.child
+        if count > 0:
+            size+= (sample_size * len(self.key_hash)) / count
+        return size
+
+    def get_stats(self):
+        """ return dict of cache counters, hit ratio, and approximate bytes """
+        lookups = self.hit_count + self.miss_count
+        return {
+            "size": len(self.key_hash),
+            "max_size": self.max_size,
+            "hit": self.hit_count,
+            "miss": self.miss_count,
+            "evict": self.evict_count,
+            "drop": self.drop_count,
+            "flush": self.flush_count,
+            "hit_ratio": float(self.hit_count)/lookups if lookups > 0 else 0.0,
+            "bytes": self.get_bytes(),
+        }
+
     def search(self, key, name=False):
-        """ search for key within cache.  If found then trigger a push(hit) for that key and return
-            corresponding value. Set name to true to perform lookup against name_hash instead of 
-            key_hash.  Note, a match in name_hash does NOT trigger push/hit against object
+        """ search for key within cache.  If found then trigger a hit for that key moving it to the
+            head of the list and return corresponding value. Set name to true to perform lookup 
+            against name_hash instead of key_hash.  Note, a match in name_hash does NOT trigger 
+            hit against object
 
             return hitCacheNotFound object if not found
         """
@@ -459,29 +1056,36 @@ class hitCache(object):
         elif key in self.key_hash:
             self.hit_count+= 1
             node = self.key_hash[key]
-            self.push(node.key, node.val) 
+            self._move_to_head(node)
             return node.val
         self.miss_count+= 1
         return hitCacheNotFound()
 
     def push(self, key, val):
         """ push a new or existing node to the top of the list. If the node already exists, then it
-            is simply moved to the top of the list.
+            is removed and added back to the top of the list with the new value.
             if val contains 'name' attribute, then a parallel entry is added to the name_hash as 
             well as the key_hash dicts
         """
-        node = None
-        if key not in self.key_hash:
-            node = hitCacheNode(key, val)
-        else:
-            node = self.key_hash[key]
-            self._remove_node(node)
-        # unconditionally add back to key_hash and name hash
+        if key in self.key_hash:
+            self._remove_node(self.key_hash[key])
+        node = hitCacheNode(key, val)
         self.key_hash[key] = node
         for name in node.name:
             self.name_hash[name] = node
-        if node.val is None:
+        if val is None:
             self.none_hash[key] = node
+        elif len(self.tags) > 0:
+            node.tags = []
+            for tag in self.tags:
+                value = self.tags[tag](val)
+                if value is not None:
+                    node.tags.append((tag, value))
+                    nodes = self.tag_hash[tag].get(value, None)
+                    if nodes is None:
+                        nodes = {}
+                        self.tag_hash[tag][value] = nodes
+                    nodes[key] = node
 
         # update head/tail pointers
         if self.head is None:
@@ -491,14 +1095,7 @@ class hitCache(object):
             self._set_node_child(node, self.head)
             self.head = node
             if len(self.key_hash) > self.max_size:
-                self.evict_count+=1
-                if self.evict_callback is not None and self.tail is not None:
-                    try:
-                        self.evict_callback(self.tail.val)
-                    except Exception as e:
-                        logger.debug("Traceback:\n%s", traceback.format_exc())
-                        logger.warn("failed to execute cache evict callback: %s", e)
-                self._remove_node(self.tail)
+                self._drop_tail()
 
     def remove(self, key, name=False, preserve_none=False):
         """ remove a key from linked list if found.  If name is set to True, then use name_hash as
@@ -514,12 +1111,37 @@ class hitCache(object):
             self._remove_node(node)
             self.evict_count+=1
         if not preserve_none:
-            none_keys = self.none_hash.keys()
-            for k in none_keys:
-                node = self.none_hash.get(k, None)
-                if node is not None:
-                    self._remove_node(node)
-                    self.evict_count+=1
+            self.remove_none()
+
+    def remove_none(self):
+        """ remove all nodes in none_hash """
+        for node in self.none_hash.values():
+            self._remove_node(node)
+            self.evict_count+=1
+
+    def remove_tag(self, tag, value, preserve_none=True):
+        """ remove all nodes with provided tag value. if preserve_none is set to false then all 
+            nodes in none_hash are also removed. Return number of removed nodes
+        """
+        nodes = self.tag_hash[tag].pop(value, {})
+        for node in nodes.values():
+            self._remove_node(node)
+            self.evict_count+=1
+        if not preserve_none:
+            self.remove_none()
+        return len(nodes)
+
+    def _drop_tail(self):
+        # drop least recently used node to maintain max size, triggering evict callback
+        self.evict_count+=1
+        self.drop_count+=1
+        if self.evict_callback is not None:
+            try:
+                self.evict_callback(self.tail.val)
+            except Exception as e:
+                logger.debug("Traceback:\n%s", traceback.format_exc())
+                logger.warn("failed to execute cache evict callback: %s", e)
+        self._remove_node(self.tail)
 
     def _set_node_child(self, node, child):
         # add a child to a specific node, updatoing tail pointer if needed
@@ -529,15 +1151,39 @@ class hitCache(object):
             if self.tail == node:
                 self.tail = child
 
+    def _move_to_head(self, node):
+        # move existing node to head of linked list
+        if self.head is node:
+            return
+        # unlink node (node is not head so parent is always set)
+        node.parent.child = node.child
+        if node.child is not None:
+            node.child.parent = node.parent
+        else:
+            self.tail = node.parent
+        node.parent = None
+        node.child = self.head
+        self.head.parent = node
+        self.head = node
+
     def _remove_node(self, node):
-        # remove a node from linked list while maintaining head/tail pointers
-        self.key_hash.pop(node.key, None)
+        # remove a node from linked list and all indexes while maintaining head/tail pointers
+        if self.key_hash.get(node.key, None) is node:
+            self.key_hash.pop(node.key, None)
         self.none_hash.pop(node.key, None)
         for name in node.name:
-            self.name_hash.pop(name, None)
-        if self.head == node:
+            if self.name_hash.get(name, None) is node:
+                self.name_hash.pop(name, None)
+        if node.tags is not None:
+            for (tag, value) in node.tags:
+                nodes = self.tag_hash[tag].get(value, None)
+                if nodes is not None:
+                    nodes.pop(node.key, None)
+                    if len(nodes) == 0:
+                        self.tag_hash[tag].pop(value, None)
+        if self.head is node:
             self.head = node.child
-        if self.tail == node:
+        if self.tail is node:
             self.tail = node.parent
 
         if node.parent is not None:
@@ -549,11 +1195,13 @@ class hitCache(object):
 
 class hitCacheNode(object):
     """ individual hit node within hit node linked list """
+    __slots__ = ["key", "val", "parent", "child", "name", "tags"]
     def __init__(self, key, val):
         self.key = key
         self.val = val
         self.parent = None
         self.child = None
+        self.tags = None    # list of (tag name, tag value) tuples indexed for this node
         self.name = []      # one or more names representing this node (many-to-one relation)
         # val is a single object or list of objects. Each object may have a name attribute which 
         # needs to be added to name list
@@ -150,6 +150,12 @@ class eptEndpoint(Rest):
             "type": int,
             "description": "epm events ignored while endpoint was marked as rapid",
         },
+        "rapid_rate": {
+            "type": float,
+            "description": """ epm events per minute within the sliding rapid rate window when 
+            last rate calculation was performed (rapid_lts)
+            """,
+        },
         "first_learn": {
             "type": dict,
             "description": """
@@ -328,8 +334,9 @@ class eptEndpoint(Rest):
 
         # execute clear endpoint in parallel across each node
         def per_node_clear_endpoint(switch):
-            switch["ret"] = clear_endpoint(self.fabric, switch["pod"], switch["node"], self.vnid, 
-                                self.addr, addr_type, vrf_name)
+            # ssh connection to the node is acquired from the shared connection pool
+            switch["ret"] = clear_endpoint(f, switch["pod"], switch["node"], self.vnid, self.addr,
+                                addr_type, vrf_name)
             if switch["ret"]:
                 # add event to eptRemediate and send notification
                 switch["worker_fabric"].push_event(eptRemediate._classname, {
@@ -7,27 +7,51 @@ from .. utils import register_signal_handlers
 from .. utils import terminate_process
 from . common import HELLO_INTERVAL
 from . common import HELLO_TIMEOUT
+from . common import MAX_SEND_MSG_LENGTH
 from . common import MANAGER_CTRL_CHANNEL
 from . common import MANAGER_CTRL_RESPONSE_CHANNEL
+from . common import MANAGER_ROUTED_WORK
 from . common import MANAGER_WORK_QUEUE
 from . common import SEQUENCE_TIMEOUT
+from . common import SUBSCRIBER_DIRECT_WORK
 from . common import SUPPRESS_FABRIC_RESTART
 from . common import WORKER_CTRL_CHANNEL
+from . common import WORKER_EPOCH_KEY
+from . common import WORKER_PENDING_QUEUES
+from . common import WORKER_SET_KEY
 from . common import WORKER_UPDATE_INTERVAL
+from . common import WORK_REPLAY_SCRIPT
 from . common import BackgroundThread
+from . common import HashRing
+from . common import add_work
 from . common import db_alive
+from . common import get_address_hash
+from . common import get_fabric_work_queues
+from . common import get_msg_fabric
+from . common import get_msg_hash
+from . common import get_notify_queue
+from . common import get_pending_queue
 from . common import get_queue_length
+from . common import get_work_queue
 from . common import wait_for_db
 from . common import wait_for_redis
 from . ept_msg import MSG_TYPE
-from . ept_msg import WORK_TYPE
+from . ept_msg import WIRE_FORMAT_COMPACT
+from . ept_msg import WIRE_FORMAT_JSON
+from . ept_msg import WIRE_FORMATS
 from . ept_msg import eptMsg
 from . ept_msg import eptMsgBulk
 from . ept_msg import eptMsgHello
+from . ept_msg import compact_bulk_encode
+from . ept_msg import compact_decode_record
+from . ept_msg import get_wire_format
+from . ept_msg import is_routed
+from . ept_msg import routed_decode
 from . ept_queue_stats import eptQueueStats
 from . ept_subscriber import eptSubscriber
 from multiprocessing import Process
 
+import json
 import logging
 import re
 import signal
@@ -57,6 +81,7 @@ class eptManager(object):
         self.worker_tracker = None
 
         self.queue_stats_lock = threading.Lock()
+        self.queue_stats_last_tx = {}   # total_tx_msg per worker queue at last stats collection
         self.queue_stats = {
             WORKER_CTRL_CHANNEL: eptQueueStats.load(proc=self.worker_id, queue=WORKER_CTRL_CHANNEL),
             MANAGER_CTRL_CHANNEL: eptQueueStats.load(proc=self.worker_id, queue=MANAGER_CTRL_CHANNEL),
@@ -141,6 +166,13 @@ class eptManager(object):
             # to support msg type BULK, assume an array of messages received
             msg_list = []
             try:
+                if is_routed(data):
+                    # routing header precomputed by subscriber, forward without decoding the msgs
+                    (fabric, routes) = routed_decode(data)
+                    self.increment_stats(MANAGER_WORK_QUEUE, tx=False, count=len(routes))
+                    if not self.worker_tracker.send_routed(routes, fabric=fabric):
+                        logger.warn("[%s] failed to enqueue one or more messages", self)
+                    continue
                 omsg = eptMsg.parse(data) 
                 #logger.debug("[%s] msg on q(%s): %s", self, q, omsg)
                 if omsg.msg_type == MSG_TYPE.BULK:
@@ -162,13 +194,7 @@ class eptManager(object):
                             self.worker_tracker.broadcast(msg, qnum=msg.qnum, role=msg.role)
                         else:
                             # create hash based on address and send to specific worker
-                            # need to ensure that we hash on ip for EPM_RS_IP_EVENT so it goes to the 
-                            # correct worker...
-                            if msg.wt == WORK_TYPE.EPM_RS_IP_EVENT:
-                                _hash = sum(ord(i) for i in msg.ip)
-                            else:
-                                _hash = sum(ord(i) for i in msg.addr)
-                            bulk.append((_hash, msg))
+                            bulk.append((get_msg_hash(msg), msg))
                 if len(bulk) > 0:
                     if not self.worker_tracker.send_bulk(bulk):
                         logger.warn("[%s] failed to enqueue one or more messages", self)
@@ -232,10 +258,10 @@ class eptManager(object):
         elif msg.msg_type == MSG_TYPE.GET_WORKER_HASH:
             # requires addr field only and returns hash, index, and selected worker
             if "addr" in msg.data:
-                if "worker" in self.worker_tracker.active_workers:
-                    _hash = sum(ord(i) for i in msg.data["addr"])
-                    index = _hash % len(self.worker_tracker.active_workers["worker"])
-                    worker = self.worker_tracker.active_workers["worker"][index]
+                _hash = get_address_hash(msg.data["addr"])
+                worker = self.worker_tracker.get_worker("worker", _hash)
+                if worker is not None:
+                    index = self.worker_tracker.active_workers["worker"].index(worker)
                     data = {
                         "addr": msg.data["addr"],
                         "hash": _hash,
@@ -347,7 +373,13 @@ class eptManager(object):
                     return False
 
                 f.add_fabric_event("starting", reason)
-                sub = eptSubscriber(f, active_workers=self.worker_tracker.active_workers)
+                # subscriber is started from this process and can use any wire format supported by
+                # the manager for work sent to the manager
+                wire_format = get_wire_format(WIRE_FORMATS)
+                sub = eptSubscriber(f, active_workers=self.worker_tracker.active_workers,
+                                    wire_format=wire_format, routed=MANAGER_ROUTED_WORK and \
+                                    wire_format >= WIRE_FORMAT_COMPACT, 
+                                    direct=SUBSCRIBER_DIRECT_WORK)
                 self.fabrics[fabric]["subscriber"] = sub
                 self.fabrics[fabric]["process"] = Process(target=sub.run)
                 self.fabrics[fabric]["process"].daemon = True
@@ -466,10 +498,37 @@ class eptManager(object):
             raise_interrupt()
             return
         # update stats at regular interval for all queues
+        skew = self.get_queue_skew()
         for k, q in self.queue_stats.items():
             with self.queue_stats_lock:
-                q.collect(qlen = self.redis.llen(k))
-        
+                q.collect(qlen = get_queue_length(self.redis, k, accurate=False, 
+                            fabrics=self.fabrics.keys()), skew=skew.get(k, None))
+
+    def get_queue_skew(self):
+        """ return dict indexed by worker queue name with ratio of messages transmitted to the queue
+            since the last collection relative to the average of all active workers with the same
+            role and queue number.
+        """
+        groups = {}     # indexed by tuple (role, qnum) with list of (queue, tx_msg)
+        with self.queue_stats_lock:
+            for role, workers in self.worker_tracker.active_workers.items():
+                for w in list(workers):
+                    for qnum, q in enumerate(w.queues):
+                        if q not in self.queue_stats:
+                            continue
+                        total_tx = self.queue_stats[q].total_tx_msg
+                        tx_msg = total_tx - self.queue_stats_last_tx.get(q, 0)
+                        self.queue_stats_last_tx[q] = total_tx
+                        groups.setdefault((role, qnum), []).append((q, tx_msg))
+        skew = {}
+        for (role, qnum), queues in groups.items():
+            avg = float(sum([tx_msg for (q, tx_msg) in queues])) / len(queues)
+            for (q, tx_msg) in queues:
+                skew[q] = tx_msg / avg if avg > 0 else 1.0
+            logger.debug("worker load skew role %s, qnum %s: [%s]", role, qnum, 
+                    ", ".join(["%s:%.3f" % (q, skew[q]) for (q, tx_msg) in queues]))
+        return skew
+
 class WorkerTracker(object):
     # track list of active workers 
     def __init__(self, manager=None):
@@ -478,6 +537,13 @@ class WorkerTracker(object):
         self.known_subscribers = {} # indexed by fabric-id
         self.known_workers = {}     # indexed by worker_id
         self.active_workers = {}    # list of active workers indexed by role
+        self.rings = {}             # HashRing of active worker_ids indexed by role
+        self.epoch = 0              # incremented each time the active worker set is published
+        self.replay_script = self.redis.register_script(WORK_REPLAY_SCRIPT)
+        # ring_lock is held while placing and enqueuing work and while rebalancing queues after a
+        # ring change.  This guarantees all work placed with the old ring is on a queue before 
+        # the queues are migrated and no work is placed with the new ring until migration is done.
+        self.ring_lock = threading.Lock()
         self.update_interval = WORKER_UPDATE_INTERVAL # interval to check for new/expired workers
         self.update_thread = BackgroundThread(func=self.update_active_workers, count=0, 
                                             name="mgr-tracker", interval=self.update_interval)
@@ -513,6 +579,7 @@ class WorkerTracker(object):
             self.known_workers[hello.worker_id].queues = hello.queues
             self.known_workers[hello.worker_id].last_hello = time.time()
             self.known_workers[hello.worker_id].hello_seq = hello.seq
+            self.known_workers[hello.worker_id].wire_format = get_wire_format(hello.encodings)
             for q in hello.queues:
                 self.known_workers[hello.worker_id].last_seq.append(0)
                 self.known_workers[hello.worker_id].last_head.append(0)
@@ -540,17 +607,7 @@ class WorkerTracker(object):
                 logger.warn("worker timeout (last hello: %.3f) %s",ts-w.last_hello, w)
                 remove_workers.append(w)
             elif not w.active:
-                # new worker that needs to be added to active list
-                if w.role not in self.active_workers: 
-                    self.active_workers[w.role] = []
-                self.active_workers[w.role].append(w)
-                w.active = True
                 new_workers.append(w)
-                # sort active workers by worker_id for deterministic ordering
-                self.active_workers[w.role] = sorted(self.active_workers[w.role], 
-                                                key=lambda w: int(re.sub("[^0-9]","",w.worker_id)))
-                logger.info("new worker: %s, active_workers: [%s]", w, 
-                                    ",".join([sw.worker_id for sw in self.active_workers[w.role]]))
 
             #elif w.last_head_check + SEQUENCE_TIMEOUT < ts:
             #    # check if seq is stuck on any queue which indicates a problem with the worker
@@ -566,33 +623,10 @@ class WorkerTracker(object):
             #            w.last_head[i] = head
             #    self.last_head_check = ts
 
-        # inactive remove workers from known_workers and active_workers
-        for w in remove_workers:
-            logger.debug("removing worker from known_workers: %s", w)
-            self.known_workers.pop(w.worker_id, None)
-            if w.role in self.active_workers and w in self.active_workers[w.role]:
-                logger.debug("removing worker from active_workers[%s]: %s", w.role, w)
-                self.active_workers[w.role].remove(w)
-
-            # TODO, rebalance work for this worker to a new worker - for now flush and restart
-            for i, q in enumerate(w.queues):
-                logger.debug("deleting work from queue: %s", q)
-                with w.queue_locks[i]:
-                    self.redis.delete(q)
-
-        # if a worker has died or new worker comes online, then trigger monitor restart
-        stop_message = None
-        if len(new_workers)>0: 
-            stop_message = "[%s]" % ", ".join([w.worker_id for w in new_workers])
-            stop_message = "new worker detected %s" % stop_message
-        elif len(remove_workers)>0:
-            stop_message = "[%s]" % ", ".join([w.worker_id for w in remove_workers])
-            stop_message = "worker heartbeat timeout %s" % stop_message
-        if stop_message is not None:
+        if len(new_workers) > 0 or len(remove_workers) > 0:
+            with self.ring_lock:
+                self.update_rings(new_workers, remove_workers)
             logger.info("total workers: %s", len(self.known_workers))
-            # stop fabric (manager will restart when ready)
-            for f in self.manager.fabrics.keys():
-                self.manager.stop_fabric(f, reason=stop_message)
 
         # check hello from each subscriber. If any have timedout, set to inactive (manager func 
         # will restart any subscribers that are inactive)
@@ -605,31 +639,204 @@ class WorkerTracker(object):
         # trigger manager fabric processes check
         self.manager.check_fabric_processes()
 
+    def update_rings(self, new_workers, remove_workers):
+        """ add new workers and remove inactive workers from active_workers and corresponding hash
+            ring. For each role with a changed ring, work already queued for keys that are now 
+            owned by a different worker is migrated to the new owner and a handoff is broadcast to
+            all workers of that role. Only the key ranges adjacent to the added/removed workers
+            move, there is no need to restart the running fabrics.
+            The worker epoch is invalidated before any queue is migrated so subscribers sending 
+            work directly to worker queues stop until the new worker set is published.
+            this must be called with ring_lock held
+        """
+        self.redis.set(WORKER_EPOCH_KEY, 0)
+        changed_roles = {}      # indexed by role with list of workers whose queues need migration
+        for w in new_workers:
+            if w.role not in self.active_workers: 
+                self.active_workers[w.role] = []
+                self.rings[w.role] = HashRing()
+            # all existing workers of this role may lose a key range to the new worker
+            if w.role not in changed_roles:
+                changed_roles[w.role] = [aw for aw in self.active_workers[w.role]]
+            self.active_workers[w.role].append(w)
+            self.rings[w.role].add_node(w.worker_id)
+            w.active = True
+            # sort active workers by worker_id for deterministic ordering
+            self.active_workers[w.role] = sorted(self.active_workers[w.role], 
+                                            key=lambda w: int(re.sub("[^0-9]","",w.worker_id)))
+            logger.info("new worker: %s, active_workers: [%s]", w, 
+                                ",".join([sw.worker_id for sw in self.active_workers[w.role]]))
+
+        # inactive remove workers from known_workers and active_workers
+        for w in remove_workers:
+            logger.debug("removing worker from known_workers: %s", w)
+            self.known_workers.pop(w.worker_id, None)
+            w.active = False
+            if w.role in self.active_workers and w in self.active_workers[w.role]:
+                logger.debug("removing worker from active_workers[%s]: %s", w.role, w)
+                self.active_workers[w.role].remove(w)
+                self.rings[w.role].remove_node(w.worker_id)
+                # only the keys owned by the removed worker move
+                if w.role not in changed_roles:
+                    changed_roles[w.role] = []
+                if w not in changed_roles[w.role]:
+                    changed_roles[w.role].append(w)
+
+        for role in changed_roles:
+            logger.info("rebalancing role %s with %s", role, self.rings[role])
+            for w in changed_roles[role]:
+                self.migrate_worker_queues(w, drop_broadcast=(w in remove_workers))
+            handoff = eptMsg(MSG_TYPE.WORKER_HANDOFF, data={
+                "role": role,
+                "workers": [w.worker_id for w in self.active_workers[role]],
+            })
+            self.broadcast(handoff, role=role)
+
+        # new workers need a fabric start for each running fabric to init their fabric settings
+        # (required for watchers to establish the apic session used for remediation)
+        running = [f for f, fab in self.manager.fabrics.items() if fab["process"] is not None]
+        for w in new_workers:
+            for f in running:
+                self.send_msg(w, eptMsg(MSG_TYPE.FABRIC_START, data={"fabric": f}))
+
+        # deleted workers no longer need their queues, any remaining work has been migrated
+        for w in remove_workers:
+            for i, q in enumerate(w.queues):
+                queues = [q] + [fq for (f, fq) in get_fabric_work_queues(self.redis, q)]
+                with w.queue_locks[i]:
+                    self.redis.delete(*(queues + [get_pending_queue(fq) for fq in queues] + 
+                                        [get_notify_queue(q)]))
+
+        self.publish_worker_set()
+
+    def publish_worker_set(self):
+        """ increment worker epoch and publish the active workers for each role along with the new
+            epoch for subscribers sending work directly to worker queues. 
+            this must be called with ring_lock held
+        """
+        self.epoch+= 1
+        worker_set = {}
+        for role in self.active_workers:
+            worker_set[role] = [{
+                "worker_id": w.worker_id,
+                "queues": w.queues,
+                "wire_format": w.wire_format,
+            } for w in self.active_workers[role]]
+        pl = self.redis.pipeline()
+        pl.set(WORKER_SET_KEY, json.dumps(worker_set))
+        pl.set(WORKER_EPOCH_KEY, self.epoch)
+        pl.execute()
+        logger.debug("published worker set epoch %s", self.epoch)
+
+    def migrate_worker_queues(self, worker, drop_broadcast=False):
+        """ pull all pending messages from each queue of the provided worker and move any work 
+            whose key is now owned by a different worker to the new owner's queue, preserving the 
+            order of messages per key. Work still owned by this worker is pushed back onto the 
+            queue. Set drop_broadcast to discard non-keyed messages (i.e., the worker has been 
+            removed and the broadcast was delivered to all other workers as well).
+            this must be called with ring_lock held
+        """
+        queues = []     # list of tuples (qnum, queue) for each queue and fabric partition
+        for qnum, q in enumerate(worker.queues):
+            queues.append((qnum, q))
+            queues.extend([(qnum, fq) for (f, fq) in get_fabric_work_queues(self.redis, q)])
+        if WORKER_PENDING_QUEUES and not worker.active:
+            # worker has been removed, any work it popped but did not process is replayed onto its
+            # queues so it is migrated to the new owner along with the remaining work
+            keys = [q for (qnum, q) in queues]
+            count = self.replay_script(keys=keys + [get_pending_queue(q) for q in keys])
+            if count > 0:
+                logger.info("replayed %s unacknowledged msgs from worker %s", count, worker)
+        for (qnum, q) in queues:
+            pl = self.redis.pipeline()
+            pl.lrange(q, 0, -1)
+            pl.delete(q)
+            with worker.queue_locks[qnum]:
+                ret = pl.execute()
+            if len(ret) == 0 or type(ret[0]) is not list or len(ret[0]) == 0:
+                continue
+            repush = []
+            moved = {}      # indexed by worker_id with tuple (worker, list of eptMsgWork)
+            moved_count = 0
+            for data in ret[0]:
+                omsg = eptMsg.parse(data)
+                if omsg.msg_type == MSG_TYPE.BULK:
+                    msg_list = omsg.msgs
+                else:
+                    msg_list = [omsg]
+                keep = []
+                for msg in msg_list:
+                    if msg.msg_type != MSG_TYPE.WORK or msg.addr == 0:
+                        if not drop_broadcast:
+                            keep.append(msg)
+                        continue
+                    owner = self.get_worker(msg.role, get_msg_hash(msg))
+                    if owner is None or owner is worker:
+                        keep.append(msg)
+                    else:
+                        if owner.worker_id not in moved:
+                            moved[owner.worker_id] = (owner, [])
+                        moved[owner.worker_id][1].append(msg)
+                        moved_count+= 1
+                if len(keep) == len(msg_list):
+                    repush.append(data)
+                else:
+                    repush.extend([eptMsg.encode(m, worker.wire_format) for m in keep])
+            if worker.active and len(repush) > 0:
+                with worker.queue_locks[qnum]:
+                    self.push_work(q, *repush)
+            logger.debug("migrated %s msgs from queue %s to workers [%s]", moved_count, q, 
+                    ",".join(moved.keys()))
+            for wid, (owner, msgs) in moved.items():
+                if qnum >= len(owner.queues):
+                    logger.warn("unable to migrate work to worker %s, queue %s does not exist", 
+                            owner.worker_id, qnum)
+                    continue
+                for i in range(0, len(msgs), MAX_SEND_MSG_LENGTH):
+                    bulk = eptMsgBulk()
+                    bulk.msgs = msgs[i:i+MAX_SEND_MSG_LENGTH]
+                    self.send_msg(owner, bulk, qnum=qnum)
+
+    def get_worker(self, role, _hash):
+        """ return TrackedWorker owning the provided hash for role or None if no workers active """
+        if role not in self.rings:
+            return None
+        worker_id = self.rings[role].get_node(_hash)
+        if worker_id is None:
+            return None
+        return self.known_workers.get(worker_id, None)
+
     def send_bulk(self, msgs):
         """ receive list of tuples (_hash, msg) and enqueue to an available worker. 
             Each msg in bulk list must be of type eptMsgWork.  This will create sub bulk messages to
             reduce the blocking IO for redis calls.
             return boolean success
         """
+        with self.ring_lock:
+            return self._send_bulk(msgs)
+
+    def _send_bulk(self, msgs):
+        # send_bulk with ring_lock already held
         all_success = True
-        work = {}   # dict indexed by worker_id and qnum with a tuple (worker, eptMsgBulk)
+        # dict indexed by worker_id and (qnum, fabric) with a tuple (worker, eptMsgBulk)
+        work = {}
         for (_hash, msg) in msgs:
-            if msg.role not in self.active_workers or len(self.active_workers[msg.role]) == 0:
+            worker = self.get_worker(msg.role, _hash)
+            if worker is None:
                 logger.warn("no available workers for role '%s'", msg.role)
                 all_success = False
             else:
-                index = _hash % len(self.active_workers[msg.role])
-                worker = self.active_workers[msg.role][index]
                 if msg.qnum >= len(worker.queues):
                     logger.warn("unable to enqueue work on worker %s, queue %s does not exist", 
                         worker.worker_id, msg.qnum)
                     all_success = False
                 else:
+                    key = (msg.qnum, get_msg_fabric(msg))
                     if worker.worker_id not in work:
                         work[worker.worker_id] = {}
-                    if msg.qnum not in work[worker.worker_id]:
-                        work[worker.worker_id][msg.qnum] = (worker, eptMsgBulk())
-                    work[worker.worker_id][msg.qnum][1].msgs.append(msg)
+                    if key not in work[worker.worker_id]:
+                        work[worker.worker_id][key] = (worker, eptMsgBulk())
+                    work[worker.worker_id][key][1].msgs.append(msg)
                     with worker.queue_locks[msg.qnum]:
                         worker.last_seq[msg.qnum]+= 1
                         msg.seq = worker.last_seq[msg.qnum]
@@ -637,23 +844,107 @@ class WorkerTracker(object):
 
         # send each message
         for worker_id in work:
-            for qnum in work[worker_id]:
-                (worker, tx_msg) = work[worker_id][qnum]
+            for (qnum, fabric) in work[worker_id]:
+                (worker, tx_msg) = work[worker_id][(qnum, fabric)]
                 # if there's only one message, then send that single message instead of bulk format
                 if len(tx_msg.msgs) == 1:
                     tx_msg = tx_msg.msgs[0]
                 else:
                     tx_msg.seq = tx_msg.msgs[-1].seq
+                q = get_work_queue(worker.queues[qnum], fabric)
                 with worker.queue_locks[qnum]:
                     try:
-                        #logger.debug("enqueue %s: %s", worker.queues[qnum], tx_msg)
-                        self.redis.rpush(worker.queues[qnum], tx_msg.jsonify())
+                        #logger.debug("enqueue %s: %s", q, tx_msg)
+                        self.push_work(q, eptMsg.encode(tx_msg, worker.wire_format))
                     except Exception as e:
-                        logger.error("failed to enqueue msg on queue %s: %s", worker.queues[qnum], 
-                                        tx_msg)
+                        logger.error("failed to enqueue msg on queue %s: %s", q, tx_msg)
                         all_success = False
         return all_success
 
+    def send_routed(self, routes, fabric=None):
+        """ receive list of tuples (hash, role, qnum, record) from a routed frame for provided 
+            fabric and forward each encoded record to the worker owning the hash without decoding 
+            it. Broadcast records (hash of None) are decoded and sent to all workers of the role.
+            return boolean success
+        """
+        unicast = []
+        for route in routes:
+            (_hash, role, qnum, record) = route
+            if _hash is None:
+                # broadcast sent now, not within a batch (same as non-routed broadcast)
+                self.broadcast(compact_decode_record(record), qnum=qnum, role=role)
+            else:
+                unicast.append(route)
+        if len(unicast) > 0:
+            with self.ring_lock:
+                return self._send_routed(unicast, fabric=fabric)
+        return True
+
+    def _send_routed(self, routes, fabric=None):
+        # send_routed with ring_lock already held. Records are combined into a single compact bulk
+        # per worker queue.  Note, the seq within each forwarded record is the seq set by the 
+        # sender, only the seq of the bulk is updated.
+        all_success = True
+        work = {}       # dict indexed by worker_id and qnum with a tuple (worker, list of records)
+        decoded = []    # list of (hash, msg) for workers that do not support compact wire format
+        for (_hash, role, qnum, record) in routes:
+            worker = self.get_worker(role, _hash)
+            if worker is None:
+                logger.warn("no available workers for role '%s'", role)
+                all_success = False
+            elif qnum >= len(worker.queues):
+                logger.warn("unable to enqueue work on worker %s, queue %s does not exist", 
+                    worker.worker_id, qnum)
+                all_success = False
+            elif worker.wire_format < WIRE_FORMAT_COMPACT:
+                decoded.append((_hash, compact_decode_record(record)))
+            else:
+                if worker.worker_id not in work:
+                    work[worker.worker_id] = {}
+                if qnum not in work[worker.worker_id]:
+                    work[worker.worker_id][qnum] = (worker, [])
+                work[worker.worker_id][qnum][1].append(record)
+
+        for worker_id in work:
+            for qnum in work[worker_id]:
+                (worker, records) = work[worker_id][qnum]
+                with worker.queue_locks[qnum]:
+                    worker.last_seq[qnum]+= len(records)
+                    try:
+                        self.push_work(get_work_queue(worker.queues[qnum], fabric),
+                                        compact_bulk_encode(worker.last_seq[qnum], records))
+                    except Exception as e:
+                        logger.error("failed to enqueue %s records on queue %s", len(records), 
+                                        worker.queues[qnum])
+                        all_success = False
+                self.manager.increment_stats(worker.queues[qnum], tx=True, count=len(records))
+        if len(decoded) > 0 and not self._send_bulk(decoded):
+            all_success = False
+        return all_success
+
+    def send_msg(self, worker, msg, qnum=0):
+        """ send single msg (or eptMsgBulk) to specific worker queue """
+        with worker.queue_locks[qnum]:
+            if msg.msg_type == MSG_TYPE.BULK:
+                for m in msg.msgs:
+                    worker.last_seq[qnum]+= 1
+                    m.seq = worker.last_seq[qnum]
+                msg.seq = worker.last_seq[qnum]
+                count = len(msg.msgs)
+            else:
+                worker.last_seq[qnum]+= 1
+                msg.seq = worker.last_seq[qnum]
+                count = 1
+            self.push_work(get_work_queue(worker.queues[qnum], get_msg_fabric(msg)), 
+                                eptMsg.encode(msg, worker.wire_format))
+        self.manager.increment_stats(worker.queues[qnum], tx=True, count=count)
+
+    def push_work(self, q, *data):
+        """ push encoded msgs onto worker queue and notify the worker (see add_work) """
+        pl = self.redis.pipeline()
+        add_work(pl, q, *data)
+        pl.execute()
+
     def broadcast(self, msg, qnum=0, role=None):
         # broadcast message to active workers on particular queue index.  Set role to limit the 
         # broadcast to only workers of particular role
@@ -661,15 +952,11 @@ class WorkerTracker(object):
         for r in self.active_workers:
             if role is None or r == role:
                 for i, worker in enumerate(self.active_workers[r]):
-                    if qnum > len(worker.queues):
+                    if qnum >= len(worker.queues):
                         logger.warn("unable to broadcast msg on worker %s, qnum %s does not exist",
                             worker.worker_id, qnum)
                     else:
-                        with worker.queue_locks[qnum]:
-                            worker.last_seq[qnum]+= 1
-                            msg.seq = worker.last_seq[qnum]
-                            self.redis.rpush(worker.queues[qnum], msg.jsonify())
-                        self.manager.increment_stats(worker.queues[qnum], tx=True)
+                        self.send_msg(worker, msg, qnum=qnum)
 
     def flush_queue(self, fabric, q, lock=None):
         """ flush messages for provided fabric and redis queue """
@@ -709,8 +996,9 @@ class WorkerTracker(object):
                 logger.debug("repush completed")
 
     def flush_fabric(self, fabric, qnum=-1, role=None):
-        # walk through all active workers and remove any work objects from queue for this fabric
-        # note, this is a costly operation if the queue is significantly backed up...
+        # walk through all active workers and remove any work objects from queue for this fabric.
+        # Worker queues are partitioned per fabric so this is a delete of the fabric partition and
+        # its pending list. The manager work queue is shared and still requires a full inspection.
         logger.debug("flush fabric '%s'", fabric)
 
         # flush work from this fabric for manager work queue if no specific role set
@@ -725,7 +1013,9 @@ class WorkerTracker(object):
                         logger.warn("unable to flush fabric for worker %s, qnum %s does not exist",
                                 worker.worker_id, qnum)
                     else:
-                        self.flush_queue(fabric, worker.queues[qnum], lock=worker.queue_locks[qnum])
+                        q = get_work_queue(worker.queues[qnum], fabric)
+                        with worker.queue_locks[qnum]:
+                            self.redis.delete(q, get_pending_queue(q))
 
     def get_worker_status(self, brief=False):
         # return list of dict representation of TrackedWorker objects along with queue_len list 
@@ -733,7 +1023,8 @@ class WorkerTracker(object):
         status = []
         for wid, w in self.known_workers.items():
             js = w.to_json()
-            js["queue_len"] = [get_queue_length(self.redis, q, accurate=not brief) for q in w.queues]
+            js["queue_len"] = [get_queue_length(self.redis, q, accurate=not brief, 
+                                fabrics=self.manager.fabrics.keys()) for q in w.queues]
             status.append(js)
         return status
             
@@ -752,6 +1043,7 @@ class TrackedWorker(object):
         self.last_seq = []              # last seq enqueued on worker per queue
         self.last_head = []             # at time of last worker check, seq at head of queue
         self.last_head_check = 0        # timestamp of last head seq check
+        self.wire_format = WIRE_FORMAT_JSON # wire format negotiated from worker hello
 
     def __repr__(self):
         return "%s, role:%s, q:%s" % (self.worker_id,self.role,self.queues)
@@ -765,6 +1057,7 @@ class TrackedWorker(object):
             "start_time": self.start_time,
             "hello_seq": self.hello_seq,
             "last_hello": self.last_hello,
-            "last_seq": self.last_seq
+            "last_seq": self.last_seq,
+            "wire_format": self.wire_format,
         }
 
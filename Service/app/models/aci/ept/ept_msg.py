@@ -1,10 +1,12 @@
 
 from enum import Enum
 from enum import unique as enum_unique
+from six import text_type
 
 import json
 import logging
 import re
+import struct
 import time
 
 # module level logging
@@ -36,6 +38,9 @@ class MSG_TYPE(Enum):
     FABRIC_EPM_EOF_ACK  = "epm_eof_ack"     # sent from worker to subscriber on subscriber channel 
                                             # to indiciate reception/processing of work type
                                             # FABRIC_EPM_EOF.
+    WORKER_HANDOFF      = "worker_handoff"  # broadcast from manager to workers of a role with the
+                                            # current list of active workers when the hash ring
+                                            # changes so workers can release state for moved keys
 
 # static work types sent with MSG_TYPE.WORK
 @enum_unique
@@ -61,6 +66,24 @@ class WORK_TYPE(Enum):
                                             # EPM event. In response workers send back 
     FABRIC_WATCH_PAUSE  = "watch_pause"     # sent from subscriber to watcher to pause watch execute
     FABRIC_WATCH_RESUME = "watch_resume"    # sent from subscriber to watcher to resume execute
+    CACHE_PRELOAD       = "cache_preload"   # broadcast from subscriber to all workers to bulk load
+                                            # fabric caches after initial build
+
+# wire formats used for messages on redis queues. Each process advertises the formats it can decode
+# within eptMsgHello and a sender only uses a format supported by the receiver. json is always 
+# supported and is used as fallback for any message that cannot be compact encoded.
+WIRE_FORMAT_JSON                = 0     # json encoded eptMsg
+WIRE_FORMAT_COMPACT             = 1     # compact binary encoding, version 1 (see compact_encode)
+WIRE_FORMATS                    = [WIRE_FORMAT_JSON, WIRE_FORMAT_COMPACT]
+
+def get_wire_format(encodings):
+    """ return the best wire format supported by this process and the provided list of encodings 
+        advertised by the receiver
+    """
+    shared = [e for e in encodings if e in WIRE_FORMATS]
+    if len(shared) == 0:
+        return WIRE_FORMAT_JSON
+    return max(shared)
 
 class eptMsg(object):
     """ generic ept job for messaging between workers 
@@ -82,10 +105,19 @@ class eptMsg(object):
     def __repr__(self):
         return "%s.0x%08x" % (self.msg_type.value, self.seq)
 
+    @staticmethod
+    def encode(msg, wire_format=WIRE_FORMAT_JSON):
+        # return msg encoded for transport across messaging queue with provided wire format
+        if wire_format == WIRE_FORMAT_COMPACT:
+            return compact_encode(msg)
+        return msg.jsonify()
+
     @staticmethod
     def parse(data, brief=False):
         # parse data received on message queue and return corresponding eptMsg
         # allow exception to raise on invalid data
+        if data[0:1] == COMPACT_MAGIC:
+            return compact_decode(data, brief=brief)
         js = json.loads(data)
         if js["msg_type"] == MSG_TYPE.WORK.value:
             return eptMsgWork.from_msg_json(js)
@@ -179,13 +211,15 @@ class eptMsgSubOp(eptMsg):
 class eptMsgHello(object):
     """ hello message sent from worker to manager """
 
-    def __init__(self, worker_id, role, queues, start_time, seq=1):
+    def __init__(self, worker_id, role, queues, start_time, seq=1, encodings=None):
         self.msg_type = MSG_TYPE.HELLO
         self.worker_id = worker_id
         self.role = role
         self.queues = queues            # list of queue names sorted by priority        
         self.start_time = start_time
         self.seq = seq
+        # list of wire formats this process can decode, defaults to all supported formats
+        self.encodings = encodings if encodings is not None else list(WIRE_FORMATS)
 
     def __repr__(self):
         return "[%s] %s.0x%08x %s" % (self.worker_id, self.msg_type.value, self.seq, self.role)
@@ -200,6 +234,7 @@ class eptMsgHello(object):
                 "role": self.role,
                 "queues": self.queues, 
                 "start_time": self.start_time,
+                "encodings": self.encodings,
             },
         })
 
@@ -213,6 +248,8 @@ class eptMsgHello(object):
             hello_data["queues"],
             hello_data["start_time"],
             seq = js["seq"],
+            # hello without encodings is from a process that only supports json
+            encodings = hello_data.get("encodings", [WIRE_FORMAT_JSON]),
         )
 
 class eptMsgWork(object):
@@ -675,3 +712,265 @@ class eptMsgWorkEpmEvent(eptMsgWork):
             "[force]" if self.force else "",
         )
 
+
+###############################################################################
+#
+# compact wire format (WIRE_FORMAT_COMPACT)
+#
+# frame:    magic(1) version(1) record
+# record:   record_type(1) payload
+#   RECORD_JSON     payload is json encoded eptMsg
+#   RECORD_EPM      payload is fixed struct for eptMsgWorkEpmEvent followed by length prefixed 
+#                   strings and interned flags
+#   RECORD_BULK     payload is seq, count, and count length prefixed records
+#   RECORD_ROUTED   payload is fabric, count, and count routed records. Each routed record is a 
+#                   routing header (hash, flags, qnum, length, role) and the encoded record. This
+#                   allows the manager to place and forward the record without decoding it.
+#
+# the interned tables below are part of the wire format, values may only be appended. Any value 
+# not within a table (or any message other than epm event/bulk) is encoded as RECORD_JSON.
+#
+###############################################################################
+
+COMPACT_MAGIC = b"\xe5"         # never the first byte of a json message
+
+COMPACT_RECORD_JSON = 1
+COMPACT_RECORD_EPM = 2
+COMPACT_RECORD_BULK = 3
+COMPACT_RECORD_ROUTED = 4
+
+COMPACT_ROUTE_BROADCAST = 0x01  # routed record is a broadcast to all workers of role
+
+COMPACT_EPM_WORK_TYPE = [
+    WORK_TYPE.EPM_IP_EVENT,
+    WORK_TYPE.EPM_MAC_EVENT,
+    WORK_TYPE.EPM_RS_IP_EVENT,
+]
+COMPACT_EPM_CLASSNAME = ["", "epmIpEp", "epmMacEp", "epmRsMacEpToIpEpAtt"]
+COMPACT_EPM_STATUS = ["", "created", "modified", "deleted"]
+COMPACT_EPM_TYPE = ["", "ip", "mac"]
+COMPACT_EPM_FLAGS = [
+    "bounce", "bounce-to-proxy", "cached", "dp-lrn-dis", "ip", "local", "loopback", "mac",
+    "peer-aged", "peer-attached", "peer-attached-rl", "psvi", "sclass", "span", "static", "svi",
+    "vip", "vpc-attached", "vtep", 
+]
+COMPACT_EPM_FLAG_LITERAL = 0xff     # flag not in COMPACT_EPM_FLAGS, followed by length+string
+
+_compact_header = struct.Struct(">cB")          # magic, version
+_compact_record_type = struct.Struct(">B")
+_compact_len = struct.Struct(">I")
+_compact_str_len = struct.Struct(">H")
+_compact_bulk = struct.Struct(">QI")            # seq, count
+_compact_routed = struct.Struct(">I")           # count
+_compact_route = struct.Struct(">IBBI")         # hash, flags, qnum, record length
+# wt, classname, status, type, qnum, force, seq, ts, node, pcTag, vnid, vrf, bd, flag count
+_compact_epm = struct.Struct(">BBBBB?QdIIIIIB")
+_compact_routed_type = _compact_record_type.pack(COMPACT_RECORD_ROUTED)
+
+_compact_work_type_index = dict([(v, i) for i, v in enumerate(COMPACT_EPM_WORK_TYPE)])
+_compact_classname_index = dict([(v, i) for i, v in enumerate(COMPACT_EPM_CLASSNAME)])
+_compact_status_index = dict([(v, i) for i, v in enumerate(COMPACT_EPM_STATUS)])
+_compact_type_index = dict([(v, i) for i, v in enumerate(COMPACT_EPM_TYPE)])
+_compact_flag_index = dict([(v, i) for i, v in enumerate(COMPACT_EPM_FLAGS)])
+
+def _compact_str(s):
+    # return length prefixed utf-8 string. raise ValueError for non-string values (i.e., fabric 
+    # int default) so the msg falls back to json and the value type is preserved
+    if isinstance(s, text_type):
+        s = s.encode("utf-8")
+    elif not isinstance(s, bytes):
+        raise ValueError("unsupported compact string type %s" % type(s))
+    return _compact_str_len.pack(len(s)) + s
+
+def _compact_read_str(data, offset):
+    # return tuple (unicode string, next offset)
+    (length,) = _compact_str_len.unpack_from(data, offset)
+    offset+= _compact_str_len.size
+    return (data[offset:offset+length].decode("utf-8"), offset+length)
+
+def _compact_encode_record(msg):
+    # return encoded record for msg, falling back to json record if msg cannot be compact encoded
+    try:
+        if isinstance(msg, eptMsgWorkEpmEvent) and msg.wt in _compact_work_type_index:
+            parts = [
+                _compact_record_type.pack(COMPACT_RECORD_EPM),
+                _compact_epm.pack(
+                    _compact_work_type_index[msg.wt],
+                    _compact_classname_index[msg.classname],
+                    _compact_status_index[msg.status],
+                    _compact_type_index[msg.type],
+                    msg.qnum, msg.force, msg.seq, msg.ts, msg.node, msg.pcTag, msg.vnid, msg.vrf,
+                    msg.bd, len(msg.flags)
+                ),
+            ]
+            for f in msg.flags:
+                if f in _compact_flag_index:
+                    parts.append(_compact_record_type.pack(_compact_flag_index[f]))
+                else:
+                    parts.append(_compact_record_type.pack(COMPACT_EPM_FLAG_LITERAL))
+                    parts.append(_compact_str(f))
+            for attr in (msg.fabric, msg.addr, msg.ip, msg.ifId, msg.encap):
+                parts.append(_compact_str(attr))
+            return b"".join(parts)
+        elif isinstance(msg, eptMsgBulk):
+            parts = [
+                _compact_record_type.pack(COMPACT_RECORD_BULK),
+                _compact_bulk.pack(msg.seq, len(msg.msgs)),
+            ]
+            for m in msg.msgs:
+                record = _compact_encode_record(m)
+                parts.append(_compact_len.pack(len(record)))
+                parts.append(record)
+            return b"".join(parts)
+    except (KeyError, ValueError, TypeError, struct.error) as e:
+        logger.debug("compact encode fallback to json for %s: %s", msg, e)
+    js = msg.jsonify()
+    if isinstance(js, text_type):
+        js = js.encode("utf-8")
+    return _compact_record_type.pack(COMPACT_RECORD_JSON) + js
+
+def _compact_decode_record(data, offset, end, brief=False):
+    # decode a single record from data[offset:end] and return corresponding eptMsg
+    (record_type,) = _compact_record_type.unpack_from(data, offset)
+    offset+= _compact_record_type.size
+    if record_type == COMPACT_RECORD_EPM:
+        (wt, classname, status, _type, qnum, force, seq, ts, node, pcTag, vnid, vrf, bd, 
+            flag_count) = _compact_epm.unpack_from(data, offset)
+        offset+= _compact_epm.size
+        flags = []
+        for i in range(0, flag_count):
+            (f,) = _compact_record_type.unpack_from(data, offset)
+            offset+= _compact_record_type.size
+            if f == COMPACT_EPM_FLAG_LITERAL:
+                (f, offset) = _compact_read_str(data, offset)
+                flags.append(f)
+            else:
+                flags.append(text_type(COMPACT_EPM_FLAGS[f]))
+        (fabric, offset) = _compact_read_str(data, offset)
+        (addr, offset) = _compact_read_str(data, offset)
+        (ip, offset) = _compact_read_str(data, offset)
+        (ifId, offset) = _compact_read_str(data, offset)
+        (encap, offset) = _compact_read_str(data, offset)
+        msg = eptMsgWorkEpmEvent(addr, "worker", {}, COMPACT_EPM_WORK_TYPE[wt], qnum=qnum, 
+                seq=seq, fabric=fabric)
+        msg.classname = text_type(COMPACT_EPM_CLASSNAME[classname])
+        msg.status = text_type(COMPACT_EPM_STATUS[status])
+        msg.type = text_type(COMPACT_EPM_TYPE[_type])
+        msg.force = force
+        msg.ts = ts
+        msg.node = node
+        msg.pcTag = pcTag
+        msg.vnid = vnid
+        msg.vrf = vrf
+        msg.bd = bd
+        msg.flags = flags
+        msg.ip = ip
+        msg.ifId = ifId
+        msg.encap = encap
+        return msg
+    elif record_type == COMPACT_RECORD_BULK:
+        (seq, count) = _compact_bulk.unpack_from(data, offset)
+        offset+= _compact_bulk.size
+        bulk = eptMsgBulk(seq=seq)
+        bulk.msg_count = count
+        if not brief:
+            for i in range(0, count):
+                (length,) = _compact_len.unpack_from(data, offset)
+                offset+= _compact_len.size
+                bulk.msgs.append(_compact_decode_record(data, offset, offset+length))
+                offset+= length
+        return bulk
+    elif record_type == COMPACT_RECORD_ROUTED:
+        (fabric, routes) = _compact_read_routes(data, offset)
+        bulk = eptMsgBulk()
+        bulk.msg_count = len(routes)
+        if not brief:
+            for (_hash, role, qnum, record) in routes:
+                bulk.msgs.append(compact_decode_record(record))
+        return bulk
+    elif record_type == COMPACT_RECORD_JSON:
+        return eptMsg.parse(data[offset:end], brief=brief)
+    raise ValueError("unsupported compact record type %s" % record_type)
+
+def compact_encode(msg):
+    """ return msg encoded with WIRE_FORMAT_COMPACT. eptMsgWorkEpmEvent and eptMsgBulk are encoded
+        as fixed structs, all other messages are returned in json format
+    """
+    if not isinstance(msg, (eptMsgWorkEpmEvent, eptMsgBulk)):
+        return msg.jsonify()
+    return _compact_header.pack(COMPACT_MAGIC, WIRE_FORMAT_COMPACT) + _compact_encode_record(msg)
+
+def compact_decode(data, brief=False):
+    """ return eptMsg for data encoded with WIRE_FORMAT_COMPACT """
+    (magic, version) = _compact_header.unpack_from(data, 0)
+    if version != WIRE_FORMAT_COMPACT:
+        raise ValueError("unsupported compact wire format version %s" % version)
+    return _compact_decode_record(data, _compact_header.size, len(data), brief=brief)
+
+def compact_decode_record(record):
+    """ return eptMsg for a single encoded record (i.e., record from routed_decode) """
+    return _compact_decode_record(record, 0, len(record))
+
+def compact_bulk_encode(seq, records):
+    """ return WIRE_FORMAT_COMPACT eptMsgBulk frame built from list of already encoded records """
+    parts = [
+        _compact_header.pack(COMPACT_MAGIC, WIRE_FORMAT_COMPACT),
+        _compact_record_type.pack(COMPACT_RECORD_BULK),
+        _compact_bulk.pack(seq, len(records)),
+    ]
+    for record in records:
+        parts.append(_compact_len.pack(len(record)))
+        parts.append(record)
+    return b"".join(parts)
+
+def routed_encode(routes, fabric=None):
+    """ return WIRE_FORMAT_COMPACT routed frame for list of tuples (hash, eptMsgWork) all belonging
+        to the provided fabric. Each msg is encoded as a record prefixed with a routing header 
+        containing the hash, role, and qnum so the receiver can place the record without decoding
+        it. A hash of None is a broadcast.
+    """
+    parts = [
+        _compact_header.pack(COMPACT_MAGIC, WIRE_FORMAT_COMPACT),
+        _compact_record_type.pack(COMPACT_RECORD_ROUTED),
+        _compact_str(fabric or ""),
+        _compact_routed.pack(len(routes)),
+    ]
+    for (_hash, msg) in routes:
+        record = _compact_encode_record(msg)
+        flags = COMPACT_ROUTE_BROADCAST if _hash is None else 0
+        parts.append(_compact_route.pack(_hash or 0, flags, msg.qnum, len(record)))
+        # role of None (broadcast to all roles) is encoded as empty string
+        parts.append(_compact_str(msg.role or ""))
+        parts.append(record)
+    return b"".join(parts)
+
+def is_routed(data):
+    """ return true if data is a WIRE_FORMAT_COMPACT routed frame """
+    return data[0:1] == COMPACT_MAGIC and \
+        data[_compact_header.size:_compact_header.size+1] == _compact_routed_type
+
+def routed_decode(data):
+    """ return tuple (fabric, list of tuples (hash, role, qnum, record)) from routed frame. The 
+        records are not decoded, use compact_decode_record if the full msg is required. Hash is 
+        None for broadcast.
+    """
+    (magic, version) = _compact_header.unpack_from(data, 0)
+    if version != WIRE_FORMAT_COMPACT or not is_routed(data):
+        raise ValueError("unsupported routed frame (version %s)" % version)
+    return _compact_read_routes(data, _compact_header.size + _compact_record_type.size)
+
+def _compact_read_routes(data, offset):
+    # return tuple (fabric, list of tuples (hash, role, qnum, record)) for routed frame payload
+    (fabric, offset) = _compact_read_str(data, offset)
+    (count,) = _compact_routed.unpack_from(data, offset)
+    offset+= _compact_routed.size
+    routes = []
+    for i in range(0, count):
+        (_hash, flags, qnum, length) = _compact_route.unpack_from(data, offset)
+        offset+= _compact_route.size
+        (role, offset) = _compact_read_str(data, offset)
+        if flags & COMPACT_ROUTE_BROADCAST:
+            _hash = None
+        routes.append((_hash, role or None, qnum, data[offset:offset+length]))
+        offset+= length
+    return (fabric or None, routes)
@@ -48,6 +48,14 @@ stats_queue_meta_with_qlen["qlen"] = {
     "type": int,
     "description": "number of messages in queue at time of collection",
 }
+stats_queue_meta_with_qlen["skew"] = {
+    "type": float,
+    "description": """
+    ratio of messages transmitted to this worker queue within the interval relative to the average
+    of all active worker queues with the same role and priority. A value of 1.0 is an even 
+    distribution of work. This is only set for worker queues and only collected by the manager.
+    """,
+}
 
 @api_register(path="ept/queue")
 class eptQueueStats(Rest):
@@ -107,6 +115,15 @@ class eptQueueStats(Rest):
             counters are reset if process is restarted.
             """,
         },
+        "skew": {
+            "type": float,
+            "default": 1.0,
+            "description": """
+            most recent load skew for worker queue which is the ratio of messages transmitted to the
+            queue within the last collection interval relative to the average of all active worker
+            queues with the same role and priority
+            """,
+        },
         "stats_1min": {
             "type": list,
             "subtype": dict,
@@ -166,7 +183,7 @@ class eptQueueStats(Rest):
         self.save(refresh=True)
         self.db = get_db()
 
-    def collect(self, qlen=0):
+    def collect(self, qlen=0, skew=None):
         # consuming process should be incrementing total tx/rx as the queue is utilized. However,
         # when it's time to push the statistics to historical list this function is called...
    
@@ -191,8 +208,10 @@ class eptQueueStats(Rest):
                     "tx_msg_rate": 0,
                     "rx_msg_rate": 0,
                 }
-                # qlen only used by 1 minute stats collection
-                if stat_name == "stats_1min": record["qlen"] = qlen
+                # qlen and skew only used by 1 minute stats collection
+                if stat_name == "stats_1min": 
+                    record["qlen"] = qlen
+                    if skew is not None: record["skew"] = skew
                 true_delta = delta
                 if len(stats) > 0:
                     record["tx_msg"] = abs(total_tx - stats[0]["total_tx_msg"])
@@ -207,4 +226,6 @@ class eptQueueStats(Rest):
         # save db update 
         self.total_tx_msg = total_tx
         self.total_rx_msg = total_rx
+        if skew is not None:
+            self.skew = skew
         self.save(refresh=False)
@@ -0,0 +1,250 @@
+from .. tools.connection_pool import get_connection_pool
+from .. utils import clear_endpoint_ssh
+from .. utils import execute_epm_clear_ssh
+from .. utils import get_epm_clear_ip_cmd
+from .. utils import get_epm_clear_vsh_cmd
+from . common import REMEDIATE_BATCH_SIZE
+from . common import REMEDIATE_MAX_CMD_LENGTH
+from . common import REMEDIATE_MAX_WORKERS
+from . common import REMEDIATE_RATE_LIMIT
+
+import collections
+import logging
+import threading
+import time
+import traceback
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+class eptRemediateJob(object):
+    """ single endpoint clear submitted to eptRemediator. The callback is executed with the job and
+        bool success once the clear has been attempted. Any caller state required by the callback
+        can be stored in data.
+    """
+    def __init__(self, fabric, pod, node, vnid, addr, addr_type="ip", vrf_name="", callback=None,
+            data=None):
+        self.fabric = fabric
+        self.pod = pod
+        self.node = node
+        self.vnid = vnid
+        self.addr = addr
+        self.addr_type = addr_type
+        self.vrf_name = vrf_name
+        self.callback = callback
+        self.data = data
+        self.success = False
+        self.submit_ts = 0
+        self.execute_ts = 0
+
+    def __repr__(self):
+        return "%s node:%s vnid:%s addr:%s" % (self.fabric, self.node, self.vnid, self.addr)
+
+class eptRemediator(object):
+    """ in-process remediation service that clears endpoints on fabric nodes. Jobs are queued per
+        (fabric, node) and each node is served by at most one thread at a time using an ssh
+        connection from the shared ConnectionPool, so many clears on the same node require a single
+        login. The ip clears of a batch are combined into vsh commands of up to max_cmd_length 
+        characters. Up to max_workers nodes are served in parallel and clears across all nodes are
+        limited to rate per second.
+    """
+    def __init__(self, max_workers=REMEDIATE_MAX_WORKERS, batch_size=REMEDIATE_BATCH_SIZE,
+            rate=REMEDIATE_RATE_LIMIT, max_cmd_length=REMEDIATE_MAX_CMD_LENGTH, pool=None):
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.rate = rate
+        self.max_cmd_length = max_cmd_length
+        self.pool = pool
+        if self.pool is None:
+            self.pool = get_connection_pool()
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.rate_lock = threading.Lock()
+        # pending jobs indexed by (fabric, node) and order of nodes with pending jobs that are not
+        # currently being served
+        self.pending = {}
+        self.order = collections.deque()
+        self.busy = set()
+        self.threads = []
+        self.tokens = float(max(rate, 1))
+        self.token_ts = time.time()
+        self._exit = False
+        self.stats = {
+            "submitted": 0,
+            "cleared": 0,
+            "failed": 0,
+        }
+
+    def start(self):
+        """ start remediation threads """
+        with self.lock:
+            if len(self.threads) > 0:
+                return
+            self._exit = False
+            for i in range(0, self.max_workers):
+                t = threading.Thread(target=self.run, name="remediate-%s" % i)
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+        logger.debug("started %s remediation threads", self.max_workers)
+
+    def stop(self):
+        """ stop remediation threads """
+        with self.lock:
+            self._exit = True
+            self.ready.notify_all()
+            threads = self.threads
+            self.threads = []
+        for t in threads:
+            t.join(5.0)
+
+    def submit(self, job):
+        """ queue eptRemediateJob for the corresponding node """
+        key = (job.fabric, job.node)
+        job.submit_ts = time.time()
+        with self.lock:
+            self.stats["submitted"]+= 1
+            if key not in self.pending:
+                self.pending[key] = collections.deque()
+                if key not in self.busy:
+                    self.order.append(key)
+            self.pending[key].append(job)
+            self.ready.notify()
+
+    def run(self):
+        """ serve the next node with pending jobs until stop is called """
+        while True:
+            with self.lock:
+                while len(self.order) == 0 and not self._exit:
+                    self.ready.wait(1.0)
+                if self._exit:
+                    return
+                key = self.order.popleft()
+                jobs = self.pending[key]
+                batch = [jobs.popleft() for i in range(0, min(len(jobs), self.batch_size))]
+                if len(jobs) == 0:
+                    self.pending.pop(key, None)
+                self.busy.add(key)
+            try:
+                self.execute_batch(key, batch)
+            except Exception as e:
+                logger.debug("Traceback:\n%s", traceback.format_exc())
+                logger.error("failed to execute remediation batch for %s: %s", key, e)
+            finally:
+                with self.lock:
+                    self.busy.discard(key)
+                    if key in self.pending:
+                        self.order.append(key)
+                        self.ready.notify()
+
+    def execute_batch(self, key, jobs):
+        """ execute a list of jobs for a single node over one pooled ssh connection. The ip clears
+            are combined into vsh commands of up to max_cmd_length characters and the result of each
+            command applies to each of its jobs. Mac clears require a lookup on the node and are 
+            executed individually.
+        """
+        logger.debug("executing %s clears on %s", len(jobs), key)
+        (fabric, node) = key
+        ssh = None
+        try:
+            # ip clears not yet executed, list of tuples (job, clear command)
+            ip_clears = []
+            for job in jobs:
+                job.success = False
+                if job.addr_type == "ip":
+                    c = get_epm_clear_ip_cmd(fabric, job.vnid, job.addr, vrf_name=job.vrf_name)
+                    if c is None:
+                        job.execute_ts = time.time()
+                        self.complete(job)
+                        continue
+                    cmds = [ic for (j, ic) in ip_clears] + [c]
+                    if len(ip_clears) > 0 and \
+                        len(get_epm_clear_vsh_cmd(cmds)) > self.max_cmd_length:
+                        ssh = self.execute_ip_clears(key, ssh, ip_clears)
+                        ip_clears = []
+                    ip_clears.append((job, c))
+                else:
+                    self.wait_for_token()
+                    job.execute_ts = time.time()
+                    (ssh, job.success) = self.execute(key, job.pod, ssh, lambda s: 
+                            clear_endpoint_ssh(s, fabric, job.vnid, job.addr, 
+                                addr_type=job.addr_type, vrf_name=job.vrf_name), job)
+                    self.complete(job)
+            if len(ip_clears) > 0:
+                ssh = self.execute_ip_clears(key, ssh, ip_clears)
+        finally:
+            if ssh is not None:
+                self.pool.release(fabric, node, ssh)
+
+    def execute_ip_clears(self, key, ssh, ip_clears):
+        """ execute list of tuples (job, clear command) as a single vsh command on the node and
+            return the connection to use for the next clear
+        """
+        for (job, c) in ip_clears:
+            self.wait_for_token()
+        ts = time.time()
+        cmds = [c for (job, c) in ip_clears]
+        (ssh, success) = self.execute(key, ip_clears[0][0].pod, ssh, 
+                            lambda s: execute_epm_clear_ssh(s, cmds), "%s clears" % len(cmds))
+        for (job, c) in ip_clears:
+            job.execute_ts = ts
+            job.success = success
+            self.complete(job)
+        return ssh
+
+    def execute(self, key, pod, ssh, func, desc):
+        """ execute func with ssh connection to the node, acquiring a pooled connection if ssh is
+            None. If the connection is lost, it is closed and func is retried once on a new 
+            connection. A failed clear (i.e., unknown vrf or command rejected by the node) is not
+            retried and the connection is kept. Return tuple (ssh, bool success) where ssh is the
+            connection to use for the next clear or None.
+        """
+        (fabric, node) = key
+        for attempt in range(0, 2):
+            if ssh is None:
+                ssh = self.pool.acquire(fabric, pod, node)
+                if ssh is None:
+                    return (None, False)
+            try:
+                return (ssh, func(ssh) is True)
+            except Exception as e:
+                logger.debug("Traceback:\n%s", traceback.format_exc())
+                logger.warn("clear exception for %s on %s: %s", desc, key, e)
+            self.pool.release(fabric, node, ssh, healthy=False)
+            ssh = None
+        return (None, False)
+
+    def complete(self, job):
+        """ update stats and execute callback for job once the clear has been attempted """
+        with self.lock:
+            if job.success: self.stats["cleared"]+= 1
+            else: self.stats["failed"]+= 1
+        if job.callback is not None:
+            try:
+                job.callback(job, job.success)
+            except Exception as e:
+                logger.debug("Traceback:\n%s", traceback.format_exc())
+                logger.error("failed to execute remediation callback for %s: %s", job, e)
+
+    def wait_for_token(self):
+        """ token bucket rate limit of clears across all nodes """
+        if self.rate <= 0:
+            return
+        while True:
+            with self.rate_lock:
+                ts = time.time()
+                self.tokens = min(float(max(self.rate, 1)),
+                                    self.tokens + (ts - self.token_ts) * self.rate)
+                self.token_ts = ts
+                if self.tokens >= 1:
+                    self.tokens-= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def get_stats(self):
+        """ return dict of remediation stats """
+        with self.lock:
+            ret = dict(self.stats)
+            ret["pending"] = sum([len(j) for j in self.pending.values()])
+        return ret
@@ -1,14 +1,19 @@
 
 from ... rest import Rest
+from ... rest import Role
 from ... rest import api_register
 from ... rest import api_route
 from ... rest import api_callback
+from ... utils import get_redis
 from .. fabric import Fabric
+from . common import get_cache_stats_key
 from . common import subscriber_op
 from . ept_msg import MSG_TYPE
 from flask import abort
 from flask import jsonify
+import json
 import logging
+import traceback
 
 # module level logging
 logger = logging.getLogger(__name__)
@@ -252,6 +257,57 @@ class eptSettings(Rest):
             "default": 600,
             "description": "holdtime to ignore new events for endpoint marked as rapid",
         },
+        "cache_size": {
+            "type": int,
+            "default": 512,
+            "min": 64,
+            "max": 1048576,
+            "description": """ capacity of each worker cache for node, tunnel, pc, vpc, vnid, epg,
+            and subnet lookups. With cache_adaptive enabled this is the minimum capacity.
+            """,
+        },
+        "offsubnet_cache_size": {
+            "type": int,
+            "default": 1024,
+            "min": 64,
+            "max": 1048576,
+            "description": "capacity of worker cache for offsubnet results per vrf, pctag, and ip",
+        },
+        "rapid_cache_size": {
+            "type": int,
+            "default": 1024,
+            "min": 64,
+            "max": 1048576,
+            "description": "capacity of worker cache for rapid endpoint counters",
+        },
+        "state_cache_size": {
+            "type": int,
+            "default": 4096,
+            "min": 64,
+            "max": 1048576,
+            "description": "capacity of worker caches for endpoint and per node history state",
+        },
+        "cache_adaptive": {
+            "type": bool,
+            "default": False,
+            "description": """ periodically adjust the capacity of each worker cache based on its
+            hit ratio and usage. A cache that is dropping entries with a low hit ratio is grown and
+            a cache that is mostly unused is reduced, never below its configured capacity. The
+            approximate memory of the caches of each worker for the fabric is kept within
+            cache_worker_memory_budget.
+            """,
+        },
+        "cache_worker_memory_budget": {
+            "type": int,
+            "default": 128,
+            "min": 8,
+            "max": 65536,
+            "description": """ approximate memory in MB available to the caches of each worker for
+            this fabric when cache_adaptive is enabled. This budget is not shared, it applies
+            separately to every worker process and every fabric so the total memory of all caches
+            may reach this value multiplied by the number of workers and monitored fabrics
+            """,
+        },
         "tz": {
             "type": str,
             "write": False,
@@ -322,4 +378,19 @@ class eptSettings(Rest):
             return jsonify({"success": True})
         abort(500, err_str)
 
-
+    @api_route(path="cache", methods=["GET"], role=Role.USER, swag_ret=["workers"])
+    def get_cache_stats(self):
+        """ get most recent cache statistics published by each worker for this fabric. This 
+            includes the capacity, number of entries, hit ratio, and approximate bytes of each cache
+        """
+        try:
+            redis = get_redis()
+            workers = []
+            for key in sorted(redis.scan_iter(match=get_cache_stats_key(self.fabric, "*"))):
+                data = redis.get(key)
+                if data is not None:
+                    workers.append(json.loads(data))
+            return jsonify({"workers": workers})
+        except Exception as e:
+            logger.error("Traceback:\n%s", traceback.format_exc())
+            abort(500, "failed to read cache statistics from redis db")
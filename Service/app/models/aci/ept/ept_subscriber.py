@@ -6,25 +6,48 @@ from .. utils import get_apic_session
 from .. utils import get_attributes
 from .. utils import get_class
 from .. utils import get_fabric_version
+from .. utils import get_url_hostname
 from .. utils import parse_apic_version
 from .. utils import validate_session_role
 from .. subscription_ctrl import SubscriptionCtrl
 
 from . common import BG_EVENT_HANDLER_INTERVAL
+from . common import BUILD_CHUNK_SIZE
+from . common import BUILD_ENDPOINT_DB_ALL_APICS
+from . common import BUILD_ENDPOINT_DB_QUEUE_SIZE
+from . common import CACHE_PRELOAD_ENABLED
 from . common import BG_EVENT_HANDLER_ENABLED
+from . common import DELTA_RESYNC_ENABLED
+from . common import DELTA_RESYNC_MAX_AGE
+from . common import DELTA_RESYNC_MAX_NEW_NODES
+from . common import DIRECT_WORK_EPOCH_TIMEOUT
+from . common import DIRECT_WORK_RETRY_INTERVAL
 from . common import MANAGER_CTRL_CHANNEL
 from . common import MANAGER_WORK_QUEUE
 from . common import MAX_EPM_BUILD_TIME
 from . common import MAX_SEND_MSG_LENGTH
 from . common import MINIMUM_SUPPORTED_VERSION
 from . common import MO_BASE
+from . common import STD_MO_BATCH_ENABLED
+from . common import STD_MO_BATCH_WINDOW
 from . common import SUBSCRIBER_CTRL_CHANNEL
 from . common import WORKER_CTRL_CHANNEL
+from . common import WORKER_EPOCH_KEY
+from . common import WORKER_PENDING_QUEUES
+from . common import WORKER_SET_KEY
 from . common import HELLO_INTERVAL
 from . common import BackgroundThread
+from . common import EndpointPresenceSet
+from . common import HashRing
+from . common import get_msg_fabric
+from . common import get_msg_hash
+from . common import get_notify_queue
+from . common import get_sync_key
 from . common import get_vpc_domain_id
+from . common import get_work_queue
 from . common import parse_tz
 from . ept_msg import MSG_TYPE
+from . ept_msg import WIRE_FORMAT_JSON
 from . ept_msg import WORK_TYPE
 from . ept_msg import eptEpmEventParser
 from . ept_msg import eptMsg
@@ -35,6 +58,7 @@ from . ept_msg import eptMsgWorkDeleteEpt
 from . ept_msg import eptMsgWorkRaw
 from . ept_msg import eptMsgWorkStdMo
 from . ept_msg import eptMsgWorkWatchNode
+from . ept_msg import routed_encode
 from . ept_epg import eptEpg
 from . ept_history import eptHistory
 from . ept_node import eptNode
@@ -44,11 +68,15 @@ from . ept_subnet import eptSubnet
 from . ept_tunnel import eptTunnel
 from . ept_vnid import eptVnid
 from . ept_vpc import eptVpc
+from . mo_dependency import EptMapper
 from . mo_dependency_map import dependency_map
 
 from importlib import import_module
+from six.moves.queue import Full
 from six.moves.queue import Queue
 
+import hashlib
+import json
 import logging
 import re
 import threading
@@ -58,6 +86,18 @@ import traceback
 # module level logging
 logger = logging.getLogger(__name__)
 
+# push each payload (ARGV[2..n]) to corresponding queue (KEYS[2..n]) only if the current worker 
+# epoch (KEYS[1]) is equal to the expected epoch (ARGV[1]). Returns 1 on success, else 0.
+DIRECT_WORK_SCRIPT = """
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call("RPUSH", KEYS[i], ARGV[i])
+end
+return 1
+"""
+
 class eptSubscriberExitError(Exception): pass
 
 class eptSubscriber(object):
@@ -65,9 +105,21 @@ class eptSubscriber(object):
         epm events are sent to workers to analyze.
         subscriber also listens 
     """
-    def __init__(self, fabric, active_workers={}):
+    def __init__(self, fabric, active_workers={}, wire_format=WIRE_FORMAT_JSON, routed=False,
+                    direct=False):
         # receive instance of Fabric rest object along with dict of active_workers indexed by role
+        # and wire format supported by the manager for work sent on the manager work queue. If 
+        # routed is set then work is sent as routed frames with the worker placement precomputed.
+        # If direct is set then work is pushed directly to worker queues (see send_direct)
         self.fabric = fabric
+        self.wire_format = wire_format
+        self.routed = routed
+        self.direct = direct
+        self.direct_epoch = 0           # epoch of currently loaded worker set, 0 if not loaded
+        self.direct_rings = {}          # HashRing of worker_ids indexed by role
+        self.direct_workers = {}        # worker dict (id, queues, wire_format) indexed by role, id
+        self.direct_seq = {}            # last seq sent indexed by worker queue name
+        self.direct_script = None       # registered DIRECT_WORK_SCRIPT
         self.settings = eptSettings.load(fabric=self.fabric.fabric, settings="default")
         self.initializing = True    # set to queue events until fully initialized
         self.epm_initializing = True # different initializing flag for epm events
@@ -78,8 +130,13 @@ class eptSubscriber(object):
         self.bg_thread = None           # background thread used to batch epm/std_mo event messages
         self.epm_event_queue = Queue()
         self.std_mo_event_queue = Queue()
+        self.std_mo_event_ts = None     # timestamp of first std_mo event queued for next batch
+        self.std_mo_event_lock = threading.Lock()   # lock for std_mo_event_queue/std_mo_event_ts
         self.epm_parser = None  # initialized once overlay vnid is known
         self.soft_restart_ts = 0    # timestamp of last soft_restart
+        self.sync = None            # sync record of previous build if delta resync is performed
+        self.sync_state = {}        # sync record of current build, saved once processed by workers
+        self.generations = {}       # active build generation indexed by ept collection classname
         self.manager_ctrl_channel_lock = threading.Lock()
         self.manager_work_queue_lock = threading.Lock()
         self.subscription_check_interval = 5.0   # interval to check subscription health
@@ -186,6 +243,7 @@ class eptSubscriber(object):
             # allocate a unique db connection as this is running in a new process
             self.db = get_db(uniq=True, overwrite_global=True, write_concern=True)
             self.redis = get_redis()
+            self.direct_script = self.redis.register_script(DIRECT_WORK_SCRIPT)
             # start hello thread
             self.hello_thread = BackgroundThread(func=self.send_hello, name="sub-hello", count=0,
                                                 interval = HELLO_INTERVAL)
@@ -284,6 +342,7 @@ class eptSubscriber(object):
                     logger.debug("%s broadcasting resume to all watchers", msg.fabric)
                     self.send_msg(eptMsgWork(0, "watcher", {},WORK_TYPE.FABRIC_WATCH_RESUME,qnum=0))
                     self.epm_eof_tracking = None
+                    self.save_sync()
                     self.fabric.add_fabric_event("running")
             else:
                 logger.debug("%s ignoring ack as tracking is disabled", msg.fabric)
@@ -401,6 +460,11 @@ class eptSubscriber(object):
             self.fabric.add_fabric_event("failed", "unable to determine overlay-1 vnid")
             return
       
+        # load sync record of the previous build to determine if a delta resync can be performed
+        self.sync = self.load_sync(apic_version[0]["version"])
+        if self.sync is not None:
+            self.fabric.add_fabric_event(init_str, "performing delta resync from previous build")
+
         # trigger watch pause until initial build is complete
         logger.debug("broadcasting pause to all watchers")
         self.send_msg(eptMsgWork(0, "watcher", {}, WORK_TYPE.FABRIC_WATCH_PAUSE, qnum=0))
@@ -422,10 +486,11 @@ class eptSubscriber(object):
 
         # build node db and vpc db
         self.fabric.add_fabric_event(init_str, "building node db")
-        if not self.build_node_db():
+        if not self.build_db(self.build_node_db, [eptNode]):
             self.fabric.add_fabric_event("failed", "failed to build node db")
             return
-        if not self.build_vpc_db():
+        if not self.build_db(self.build_vpc_db, [eptVpc, eptPc], 
+                                ["vpcRsVpcConf", "pcAggrIf", "pcRsMbrIfs"]):
             self.fabric.add_fabric_event("failed", "failed to build node pc to vpc db")
             return
         # check if subscriptions died during previous step
@@ -433,7 +498,7 @@ class eptSubscriber(object):
 
         # build tunnel db
         self.fabric.add_fabric_event(init_str, "building tunnel db")
-        if not self.build_tunnel_db():
+        if not self.build_db(self.build_tunnel_db, [eptTunnel], ["tunnelIf"], [eptNode]):
             self.fabric.add_fabric_event("failed", "failed to build tunnel db")
             return
         # check if subscriptions died during previous step
@@ -441,7 +506,8 @@ class eptSubscriber(object):
 
         # build vnid db along with vnsLIfCtxToBD db which relies on vnid db
         self.fabric.add_fabric_event(init_str, "building vnid db")
-        if not self.build_vnid_db():
+        if not self.build_db(self.build_vnid_db, [eptVnid], ["fvCtx", "fvBD", "fvSvcBD",
+                                "l3extRsEctx", "l3extExtEncapAllocator"]):
             self.fabric.add_fabric_event("failed", "failed to build vnid db")
             return
         # check if subscriptions died during previous step
@@ -449,7 +515,9 @@ class eptSubscriber(object):
 
         # build epg db
         self.fabric.add_fabric_event(init_str, "building epg db")
-        if not self.build_epg_db():
+        if not self.build_db(self.build_epg_db, [eptEpg], ["fvAEPg", "mgmtInB", "vnsEPpInfo",
+                                "l3extInstP", "fvRsBd", "vnsRsEPpInfoToBD", "mgmtRsMgmtBD"], 
+                                [eptVnid]):
             self.fabric.add_fabric_event("failed", "failed to build epg db")
             return
         # check if subscriptions died during previous step
@@ -457,12 +525,18 @@ class eptSubscriber(object):
 
         # build subnet db
         self.fabric.add_fabric_event(init_str, "building subnet db")
-        if not self.build_subnet_db():
+        if not self.build_db(self.build_subnet_db, [eptSubnet], ["fvSubnet", "fvIpAttr",
+                                "vnsRsLIfCtxToBD"], [eptVnid, eptEpg]):
             self.fabric.add_fabric_event("failed", "failed to build subnet db")
             return
         # check if subscriptions died during previous step
         self.subscriber_is_alive() 
 
+        # workers preload caches from the completed db before the endpoint build events arrive
+        if CACHE_PRELOAD_ENABLED:
+            logger.debug("sending cache preload to all workers")
+            self.send_msg(eptMsgWork(0, "worker", {}, WORK_TYPE.CACHE_PRELOAD, qnum=0))
+
         # slow objects (including std mo objects) initialization completed
         self.initializing = False
         # safe to call resume even if never paused
@@ -560,6 +634,8 @@ class eptSubscriber(object):
             logger.debug("failed to quit subscription")
             logger.error("Traceback:\n%s", traceback.format_exc())
 
+        # state may have changed in a way that is not captured by modTs so force a full build
+        self.redis.delete(get_sync_key(self.fabric.fabric))
         reason = "restarting: %s" % reason
         data = {"fabric":self.fabric.fabric, "reason":reason}
         msg = eptMsg(MSG_TYPE.FABRIC_RESTART,data=data)
@@ -576,6 +652,9 @@ class eptSubscriber(object):
                 - eptTunnel
                 - eptVpc
                 - eptPc
+            The local mo collections are reconciled with the objects modified since they were last
+            built (when DELTA_RESYNC_ENABLED) and only the caches of the changed collections are
+            flushed on the workers.
         """
         logger.debug("soft restart requested: %s", reason)
         if ts is not None and self.soft_restart_ts > ts:
@@ -591,31 +670,42 @@ class eptSubscriber(object):
         for c in self.mo_classes:
             self.subscriber.add_interest(c, self.handle_std_mo_event, paused=True)
 
+        # fingerprint of each collection before rebuild to only flush caches that have changed
+        collections = [eptNode, eptVpc, eptPc, eptTunnel]
+        fingerprints = {}
+        for c in collections:
+            fingerprints[c._classname] = self.get_fingerprint(c)
+
         # build node db and vpc db
         self.fabric.add_fabric_event("soft-reset", reason)
         self.fabric.add_fabric_event(init_str, "building node db")
-        if not self.build_node_db():
+        if not self.build_generation(self.build_node_db, [eptNode]):
             self.fabric.add_fabric_event("failed", "failed to build node db")
             return self.hard_restart("failed to build node db")
         # need to rebuild vpc db which requires a rebuild of local mo vpcRsVpcConf mo first
-        success1 = self.mo_classes["vpcRsVpcConf"].rebuild(self.fabric, session=self.session)
-        success2 = self.mo_classes["pcAggrIf"].rebuild(self.fabric, session=self.session)
-        success3 = self.mo_classes["pcRsMbrIfs"].rebuild(self.fabric, session=self.session)
-        if not success1 or not success2 or not success3 or not self.build_vpc_db():
+        success = True
+        for c in ["vpcRsVpcConf", "pcAggrIf", "pcRsMbrIfs"]:
+            sync = None
+            if DELTA_RESYNC_ENABLED:
+                sync = self.sync_state.get("mo", {}).get(c, {})
+            if not self.mo_classes[c].rebuild(self.fabric, session=self.session, sync=sync):
+                success = False
+        if not success or not self.build_generation(self.build_vpc_db, [eptVpc, eptPc]):
             self.fabric.add_fabric_event("failed", "failed to build node pc to vpc db")
             return self.hard_restart("failed to build node pc to vpc db")
 
         # build tunnel db
         self.fabric.add_fabric_event(init_str, "building tunnel db")
-        if not self.build_tunnel_db():
+        if not self.build_generation(self.build_tunnel_db, [eptTunnel]):
             self.fabric.add_fabric_event("failed", "failed to build tunnel db")
             return self.hard_restart("failed to build tunnel db")
 
         # clear appropriate caches
-        self.send_flush(eptNode)
-        self.send_flush(eptVpc)
-        self.send_flush(eptPc)
-        self.send_flush(eptTunnel)
+        for c in collections:
+            if self.get_fingerprint(c) != fingerprints[c._classname]:
+                self.send_flush(c)
+            else:
+                logger.debug("%s unchanged, skipping flush", c._classname)
 
         self.fabric.add_fabric_event("running")
         self.initializing = False
@@ -635,12 +725,128 @@ class eptSubscriber(object):
                 bulk.msgs = [m for m in msg[i:i+MAX_SEND_MSG_LENGTH]]
                 if len(bulk.msgs)>0:
                     with self.manager_work_queue_lock:
-                        self.redis.rpush(MANAGER_WORK_QUEUE, bulk.jsonify())
+                        self.push_work(bulk.msgs, bulk)
         else:
             # validate that 'fabric' is ALWAYS set on any work
             msg.fabric = self.fabric.fabric
             with self.manager_work_queue_lock:
-                self.redis.rpush(MANAGER_WORK_QUEUE, msg.jsonify())
+                self.push_work([msg], msg)
+
+    def push_work(self, msgs, msg):
+        """ push msg (eptMsgWork or eptMsgBulk containing list of msgs) directly to worker queues if
+            direct is enabled, else (or if direct send fails) push to manager work queue.
+            this must be called with manager_work_queue_lock held
+        """
+        if self.direct and self.send_direct(msgs):
+            return
+        self.redis.rpush(MANAGER_WORK_QUEUE, self.encode_work(msgs, msg))
+
+    def encode_work(self, msgs, msg):
+        """ return encoded msg (eptMsgWork or eptMsgBulk containing list of msgs) for manager work 
+            queue. If routed is enabled, the list of msgs is encoded as a routed frame with the 
+            worker placement hash precomputed (None for broadcast) for each msg.
+        """
+        if self.routed:
+            return routed_encode([(None if m.addr == 0 else get_msg_hash(m), m) for m in msgs],
+                                    fabric=self.fabric.fabric)
+        return eptMsg.encode(msg, self.wire_format)
+
+    def send_direct(self, msgs):
+        """ push list of eptMsgWork directly to owning worker queues using the worker set of the 
+            current epoch. The push is atomic and only accepted if the epoch is unchanged, else the
+            worker set is reloaded and the push retried. Return False if no valid epoch is 
+            available within DIRECT_WORK_EPOCH_TIMEOUT and the work must be sent via the manager.
+        """
+        ts = time.time()
+        while True:
+            if self.direct_epoch == 0 and not self.load_worker_set():
+                if ts + DIRECT_WORK_EPOCH_TIMEOUT < time.time():
+                    logger.warn("no valid worker epoch after %s sec, sending work via manager", 
+                            DIRECT_WORK_EPOCH_TIMEOUT)
+                    return False
+                time.sleep(DIRECT_WORK_RETRY_INTERVAL)
+                continue
+            keys = [WORKER_EPOCH_KEY]
+            args = [self.direct_epoch]
+            for (q, data) in self.encode_direct_work(msgs):
+                keys.append(q)
+                args.append(data)
+            if WORKER_PENDING_QUEUES:
+                # wake each worker blocked waiting for work (see add_work)
+                for nq in sorted(set([get_notify_queue(q) for q in keys[1:]])):
+                    keys.append(nq)
+                    args.append(1)
+            if len(keys) == 1 or self.direct_script(keys=keys, args=args) == 1:
+                return True
+            logger.debug("worker epoch %s no longer valid", self.direct_epoch)
+            self.direct_epoch = 0
+
+    def load_worker_set(self):
+        """ load worker set published by manager and build hash ring for each role. Return False if 
+            there is no valid epoch (manager is migrating worker queues)
+        """
+        pl = self.redis.pipeline()
+        pl.get(WORKER_EPOCH_KEY)
+        pl.get(WORKER_SET_KEY)
+        (epoch, worker_set) = pl.execute()
+        if epoch is None or int(epoch) <= 0 or worker_set is None:
+            return False
+        self.direct_rings = {}
+        self.direct_workers = {}
+        for role, workers in json.loads(worker_set).items():
+            self.direct_rings[role] = HashRing()
+            self.direct_workers[role] = {}
+            for w in workers:
+                self.direct_rings[role].add_node(w["worker_id"])
+                self.direct_workers[role][w["worker_id"]] = w
+        self.direct_epoch = int(epoch)
+        logger.debug("loaded worker set epoch %s: %s", self.direct_epoch, self.direct_rings)
+        return True
+
+    def encode_direct_work(self, msgs):
+        """ return list of tuples (queue, encoded msg) for list of eptMsgWork using the current 
+            worker set. Broadcast msgs (addr of 0) are sent to each worker of the role (all roles if
+            role is None) in the same order as unicast work.
+        """
+        work = {}   # indexed by queue name with tuple (wire_format, list of eptMsgWork)
+        for m in msgs:
+            if m.addr == 0:
+                workers = []
+                for role in self.direct_workers:
+                    if m.role is None or role == m.role:
+                        workers.extend(self.direct_workers[role].values())
+            else:
+                worker_id = None
+                if m.role in self.direct_rings:
+                    worker_id = self.direct_rings[m.role].get_node(get_msg_hash(m))
+                if worker_id is None:
+                    logger.warn("no available workers for role '%s'", m.role)
+                    continue
+                workers = [self.direct_workers[m.role][worker_id]]
+            for w in workers:
+                if m.qnum >= len(w["queues"]):
+                    logger.warn("unable to enqueue work on worker %s, queue %s does not exist", 
+                        w["worker_id"], m.qnum)
+                    continue
+                q = get_work_queue(w["queues"][m.qnum], get_msg_fabric(m))
+                if q not in work:
+                    work[q] = (w["wire_format"], [])
+                work[q][1].append(m)
+        ret = []
+        for q, (wire_format, qmsgs) in work.items():
+            # seq is tracked per destination queue for this subscriber
+            for m in qmsgs:
+                self.direct_seq[q] = self.direct_seq.get(q, 0) + 1
+                m.seq = self.direct_seq[q]
+            # if there's only one message, then send that single message instead of bulk format
+            if len(qmsgs) == 1:
+                tx_msg = qmsgs[0]
+            else:
+                tx_msg = eptMsgBulk()
+                tx_msg.msgs = qmsgs
+                tx_msg.seq = qmsgs[-1].seq
+            ret.append((q, eptMsg.encode(tx_msg, wire_format)))
+        return ret
 
     def send_flush(self, collection, name=None):
         """ send flush message to workers for provided collection """
@@ -725,7 +931,10 @@ class eptSubscriber(object):
                 addr = ""
                 msg = eptMsgWorkStdMo(addr, "watcher",{classname:attr}, WORK_TYPE.STD_MO)
                 if BG_EVENT_HANDLER_ENABLED:
-                    self.std_mo_event_queue.put(msg)
+                    with self.std_mo_event_lock:
+                        self.std_mo_event_queue.put(msg)
+                        if self.std_mo_event_ts is None:
+                            self.std_mo_event_ts = time.time()
                 else:
                     self.send_msg(msg)
         except Exception as e:
@@ -768,19 +977,133 @@ class eptSubscriber(object):
 
     def handle_background_event_queue(self):
         """ pull off all current msgs in epm_event_queue/std_mo_event_queue and send as a batch.
-            The purpose of this is to create bulk eptMsg objects to improve redis performance
+            The purpose of this is to create bulk eptMsg objects to improve redis performance. If
+            STD_MO_BATCH_ENABLED is set, std_mo msgs are held until the first queued msg is older 
+            than STD_MO_BATCH_WINDOW so the watcher can coalesce a burst of events.
         """
-        for q in [self.std_mo_event_queue, self.epm_event_queue]:
-            msgs = []
-            while not q.empty():
-                msgs.append(q.get())
-            self.send_msg(msgs)
+        # batch timestamp is reset and the std_mo queue is drained under the same lock so an 
+        # event queued concurrently always starts the window for the next batch
+        msgs = []
+        with self.std_mo_event_lock:
+            if not STD_MO_BATCH_ENABLED or (self.std_mo_event_ts is not None and \
+                time.time() - self.std_mo_event_ts >= STD_MO_BATCH_WINDOW):
+                self.std_mo_event_ts = None
+                while not self.std_mo_event_queue.empty():
+                    msgs.append(self.std_mo_event_queue.get())
+        self.send_msg(msgs)
+        msgs = []
+        while not self.epm_event_queue.empty():
+            msgs.append(self.epm_event_queue.get())
+        self.send_msg(msgs)
+
+    def load_sync(self, version):
+        """ initialize sync record for current build and return the sync record of the previous
+            build if a delta resync can be performed. The previous record is only used if it was
+            saved within DELTA_RESYNC_MAX_AGE and the apic version and fabric settings used for the
+            build are unchanged, else None is returned and a full build is performed.
+        """
+        self.sync_state = {
+            "version": version,
+            "overlay_vnid": self.settings.overlay_vnid,
+            "vpc_pair_type": self.settings.vpc_pair_type,
+            "mo": {},
+            "ept": {},
+            "nodes": {},
+        }
+        if not DELTA_RESYNC_ENABLED:
+            return None
+        data = self.redis.get(get_sync_key(self.fabric.fabric))
+        if data is None:
+            logger.debug("no sync record found for %s", self.fabric.fabric)
+            return None
+        try:
+            sync = json.loads(data)
+        except ValueError as e:
+            logger.warn("invalid sync record for %s: %s", self.fabric.fabric, data)
+            return None
+        age = time.time() - sync.get("ts", 0)
+        if age > DELTA_RESYNC_MAX_AGE:
+            logger.debug("ignoring sync record with age %.3f > %.3f", age, DELTA_RESYNC_MAX_AGE)
+            return None
+        for attr in ["version", "overlay_vnid", "vpc_pair_type"]:
+            if sync.get(attr, None) != self.sync_state[attr]:
+                logger.debug("ignoring sync record, %s changed from %s to %s", attr, 
+                        sync.get(attr, None), self.sync_state[attr])
+                return None
+        logger.debug("delta resync from sync record saved %.3f seconds ago", age)
+        return sync
+
+    def save_sync(self):
+        """ save sync record of current build once it has been processed by all workers """
+        if DELTA_RESYNC_ENABLED and len(self.sync_state) > 0:
+            logger.debug("saving sync record for %s", self.fabric.fabric)
+            self.sync_state["ts"] = time.time()
+            self.redis.set(get_sync_key(self.fabric.fabric), json.dumps(self.sync_state))
+
+    def get_fingerprint(self, eptObject):
+        """ return fingerprint of all objects in ept collection for this fabric. The fingerprint
+            excludes the timestamp at which each object was written. The objects are streamed from
+            the db and the fingerprint is the sum of the sha1 of each object (mod 2^160) so it is 
+            independent of the order the objects are returned without holding them in memory.
+        """
+        projection = {"_id": 0, "_gen": 0, "ts": 0}
+        flt = {"fabric": self.fabric.fabric}
+        total = 0
+        for o in self.db[eptObject._classname].find(flt, projection):
+            h = hashlib.sha1(json.dumps(o, sort_keys=True, default=str))
+            total = (total + int(h.hexdigest(), 16)) & 0xffffffffffffffffffffffffffffffffffffffff
+        return "%040x" % total
+
+    def build_db(self, func, collections, mo_classes=None, depends=[]):
+        """ execute build function for list of ept collections and add fingerprint of each 
+            collection to sync record. On delta resync, the build is skipped if no object in the
+            provided mo classes has changed, the ept collections it depends on are unchanged, and 
+            the fingerprint of each collection matches the previous build. If mo_classes is None 
+            then the build is always performed.
+            return bool success
+        """
+        changed = self.sync is None or mo_classes is None
+        if not changed:
+            for c in mo_classes:
+                if self.sync_state["mo"].get(c, {}).get("changed", None) != 0:
+                    logger.debug("build required for %s, %s changed", collections[0]._classname,c)
+                    changed = True
+                    break
+        fingerprints = {}
+        if not changed:
+            for c in depends + collections:
+                if c in depends:
+                    fingerprints[c._classname] = self.sync_state["ept"].get(c._classname, None)
+                else:
+                    fingerprints[c._classname] = self.get_fingerprint(c)
+                if fingerprints[c._classname] != self.sync["ept"].get(c._classname, None):
+                    logger.debug("build required for %s, %s changed", collections[0]._classname,
+                            c._classname)
+                    changed = True
+                    break
+        if changed:
+            if not self.build_generation(func, collections):
+                return False
+            fingerprints = {}
+        else:
+            logger.debug("skipping build of unchanged %s", [c._classname for c in collections])
+        for c in collections:
+            if c._classname not in fingerprints:
+                fingerprints[c._classname] = self.get_fingerprint(c)
+            self.sync_state["ept"][c._classname] = fingerprints[c._classname]
+        return True
 
     def build_mo(self):
-        """ build managed objects for defined classes """
+        """ build managed objects for defined classes. On delta resync, each class is reconciled 
+            with the objects modified since the previous build.
+        """
         for mo in self.ordered_mo_classes:
-            if not self.mo_classes[mo].rebuild(self.fabric, session=self.session):
+            sync = {}
+            if self.sync is not None and mo in self.sync.get("mo", {}):
+                sync = dict(self.sync["mo"][mo])
+            if not self.mo_classes[mo].rebuild(self.fabric, session=self.session, sync=sync):
                 return False
+            self.sync_state["mo"][mo] = sync
         return True
 
     def initialize_ept_collection(self, eptObject, mo_classname, attribute_map=None, 
@@ -792,7 +1115,10 @@ class eptSubscriber(object):
                 set_ts = boolean to set modify ts within ept object. If mo_object is set, then ts
                             from mo object is written to ept object. Else, timestamp of APIC query
                             is used
-                flush = boolean to flush ept collection at initialization
+                flush = boolean to flush ept collection at initialization. If no build generation
+                        is active for the collection (see build_generation), then a new generation
+                        is started and objects from previous generations are removed once all
+                        objects have been written.
                 attribute_map = dict handling mapping of ept attribute to mo attribute. If omitted,
                         then the attribute map will use the value from the corresponding 
                         DependencyNode (if found within the dependency_map)
@@ -809,89 +1135,125 @@ class eptSubscriber(object):
                             "node": "node-(?P<value>[0-9]+)/" # extract interger value from 'node'
                         }
 
+            Objects are streamed from the local mo db or class query and upserted in chunks of 
+            BUILD_CHUNK_SIZE so the collection is never empty and memory is independent of the 
+            number of objects.
+
             return bool success
 
         """
         # iterator over data from class query returning just dict attributes
         def raw_iterator(data):
-            for attr in get_attributes(data=data):
-                yield attr
-
-        # iterator over mo objects returning just dict attributes
-        def mo_iterator(objects):
-            for o in objects:
-                yield o.to_json()
+            for obj in data:
+                if obj is None:
+                    raise Exception("failed to get data for classname %s" % mo_classname)
+                for attr in get_attributes(data=obj):
+                    yield attr
 
-        # get data from local mo db
+        # get data from local mo db, iterating over db cursor returns dict attributes
         if mo_classname in self.mo_classes:
-            data = self.mo_classes[mo_classname].find(fabric=self.fabric.fabric)
-            iterator = mo_iterator
+            iterator = self.db[self.mo_classes[mo_classname]._classname].find(
+                    {"fabric": self.fabric.fabric}, {"_id": 0})
         else:
-            data = get_class(self.session, mo_classname)
-            if data is None:
-                logger.warn("failed to get data for classname %s", mo_classname)
-                return False
-            iterator = raw_iterator
+            iterator = raw_iterator(get_class(self.session, mo_classname, stream=True))
 
-        # get attribute_map and regex_map from arguments or dependency map
+        # get compiled mapper from dependency map or compile mapper from provided arguments
         default_attribute_map = {}
         default_regex_map = {}
+        mapper = None
         if mo_classname in dependency_map:
             default_attribute_map = dependency_map[mo_classname].ept_attributes
             default_regex_map = dependency_map[mo_classname].ept_regex_map
+            if attribute_map is None and regex_map is None:
+                mapper = dependency_map[mo_classname].ept_mapper
         if attribute_map is None: 
             attribute_map = default_attribute_map
         if regex_map is None:
             regex_map = default_regex_map
+        if mapper is None:
+            mapper = EptMapper(attribute_map, regex_map)
 
         # if attribute map is empty then it wasn't provided or no corresponding entry within the 
         # dependency map
         if len(attribute_map) == 0:
             logger.error("no attribute map found/provided for %s", mo_classname)
 
+        # start a new generation for this collection if not part of an active build generation
+        generation = None
+        if flush and eptObject._classname not in self.generations:
+            generation = time.time()
+            self.generations[eptObject._classname] = generation
+
         ts = time.time()
+        count = 0
         bulk_objects = []
-        # iterate over results 
-        for attr in iterator(data):
-            db_obj = {}
-            for db_attr, o_attr in attribute_map.items():
-                # can only map 'plain' string attributes (not list referencing parent objects)
-                if isinstance(o_attr, basestring) and o_attr in attr:
-                    # check for regex_map
-                    if db_attr in regex_map:
-                        r1 = re.search(regex_map[db_attr], attr[o_attr])
-                        if r1:
-                            if "value" in r1.groupdict():
-                                db_obj[db_attr] = r1.group("value")
-                            else: 
-                                db_obj[attr] = attr[o_attr]
-                        else:
-                            logger.warn("%s value %s does not match regex %s", o_attr,attr[o_attr], 
-                                regex_map[db_attr])
-                            db_obj = {}
-                            break
-                    else:
-                        db_obj[db_attr] = attr[o_attr]
-            if len(db_obj)>0:
-                db_obj["fabric"] = self.fabric.fabric
-                if set_ts: 
-                    if "ts" in attr: db_obj["ts"] = attr["ts"]
-                    else: db_obj["ts"] = ts
-                bulk_objects.append(eptObject(**db_obj))
-            else:
-                logger.warn("%s object not added from MO (no matching attributes): %s", 
-                    eptObject._classname, attr)
+        try:
+            # iterate over results 
+            for attr in iterator:
+                db_obj = mapper.map_raw(attr)
+                if len(db_obj)>0:
+                    db_obj["fabric"] = self.fabric.fabric
+                    if set_ts: 
+                        if "ts" in attr: db_obj["ts"] = attr["ts"]
+                        else: db_obj["ts"] = ts
+                    bulk_objects.append(eptObject(**db_obj))
+                else:
+                    logger.warn("%s object not added from MO (no matching attributes): %s", 
+                        eptObject._classname, attr)
+                if len(bulk_objects) >= BUILD_CHUNK_SIZE:
+                    eptObject.bulk_save(bulk_objects, skip_validation=False, 
+                            upsert=self.get_upsert(eptObject))
+                    count+= len(bulk_objects)
+                    bulk_objects = []
+            if len(bulk_objects)>0:
+                eptObject.bulk_save(bulk_objects, skip_validation=False, 
+                        upsert=self.get_upsert(eptObject))
+                count+= len(bulk_objects)
+        except Exception as e:
+            logger.warn("failed to initialize %s: %s", eptObject._classname, e)
+            logger.debug("Traceback:\n%s", traceback.format_exc())
+            return False
+        finally:
+            if generation is not None:
+                self.generations.pop(eptObject._classname, None)
 
-        # flush right before insert to minimize time of empty table
-        if flush:
-            logger.debug("flushing %s entries for fabric %s",eptObject._classname,self.fabric.fabric)
-            eptObject.delete(_filters={"fabric":self.fabric.fabric})
-        if len(bulk_objects)>0:
-            eptObject.bulk_save(bulk_objects, skip_validation=False)
-        else:
+        if count == 0:
             logger.debug("no objects of %s to insert", mo_classname)
+        if generation is not None:
+            self.remove_generation(eptObject, generation)
         return True
-    
+
+    def get_upsert(self, eptObject):
+        """ return dict of fields written to each object upserted into ept collection """
+        return {"_gen": self.generations.get(eptObject._classname, 0)}
+
+    def remove_generation(self, eptObject, generation):
+        """ remove all objects in ept collection for this fabric not written in provided generation
+        """
+        logger.debug("removing %s objects for fabric %s not in generation %.3f", 
+                eptObject._classname, self.fabric.fabric, generation)
+        flt = {"fabric": self.fabric.fabric, "_gen": {"$ne": generation}}
+        self.db[eptObject._classname].delete_many(flt)
+
+    def build_generation(self, func, collections):
+        """ execute build function for list of ept collections within a new build generation. All
+            objects upserted into the collections during the build are tagged with the generation
+            and objects from previous generations are removed once the build is successful.
+            return bool success
+        """
+        generation = time.time()
+        for c in collections:
+            self.generations[c._classname] = generation
+        try:
+            success = func()
+        finally:
+            for c in collections:
+                self.generations.pop(c._classname, None)
+        if success:
+            for c in collections:
+                self.remove_generation(c, generation)
+        return success
+
     def build_node_db(self):
         """ initialize node collection and vpc nodes. return bool success """
         logger.debug("initializing node db")
@@ -926,6 +1288,11 @@ class eptSubscriber(object):
                 if node_id in all_nodes:
                     all_nodes[node_id].addr = attr["address"]
                     all_nodes[node_id].state = attr["state"]
+                    # current time of each node before the initial endpoint build is the watermark
+                    # for epm objects modified on the node on the next delta resync
+                    if self.epm_initializing and "currentTime" in attr:
+                        nodes = self.sync_state.setdefault("nodes", {})
+                        nodes["%s" % node_id] = attr["currentTime"]
                 else:
                     logger.warn("ignorning unknown topSystem node id '%s'", node_id)
             else:
@@ -1011,8 +1378,11 @@ class eptSubscriber(object):
                 else:
                     logger.warn("invalid %s object: %s", vpc_type, obj)
         
-        # all nodes should have been updated (TEP info, version, and vpc updates)
-        eptNode.bulk_save([all_nodes[n] for n in all_nodes], skip_validation=False)
+        # all nodes should have been updated (TEP info, version, and vpc updates). Pseudo vpc nodes
+        # are upserted as they may exist from a previous build generation
+        eptNode.bulk_save([n for n in all_nodes.values() if n.exists()], skip_validation=False)
+        eptNode.bulk_save([n for n in all_nodes.values() if not n.exists()], skip_validation=False,
+                upsert=self.get_upsert(eptNode))
         return True
 
     def build_tunnel_db(self):
@@ -1139,7 +1509,7 @@ class eptSubscriber(object):
             bulk_objects.append(new_vnid)
 
         if len(bulk_objects)>0:
-            eptVnid.bulk_save(bulk_objects, skip_validation=False)
+            eptVnid.bulk_save(bulk_objects, skip_validation=False, upsert=self.get_upsert(eptVnid))
         return True
 
     def build_epg_db(self):
@@ -1221,33 +1591,50 @@ class eptSubscriber(object):
             else:
                 logger.warn("%s tDn %s not in vnids", mo._classname, mo.tDn)
 
+        # subnets are streamed from the local mo db and upserted in chunks, objects from previous
+        # builds are removed once complete so the collection is never empty
+        generation = None
+        if eptSubnet._classname not in self.generations:
+            generation = time.time()
+            self.generations[eptSubnet._classname] = generation
         bulk_objects = []
-        # should now have all objects that would contain a subnet 
-        for classname in ["fvSubnet", "fvIpAttr"]:
-            for mo in self.mo_classes[classname].find(fabric=self.fabric.fabric):
-                # usually in bd so check vnid first and then epg
-                bd_vnid = None
-                if mo.parent in vnids:
-                    bd_vnid = vnids[mo.parent]
-                elif mo.parent in epgs:
-                    bd_vnid = epgs[mo.parent]
-                if bd_vnid is not None:
-                    # FYI - we support fvSubnet on BD and EPG for shared services so duplicate ip
-                    # can exist. unique index is disabled on eptSubnet to support this... 
-                    bulk_objects.append(eptSubnet(
-                        fabric = self.fabric.fabric,
-                        bd = bd_vnid,
-                        name = mo.dn,
-                        ip = mo.ip,
-                        ts = mo.ts
-                    ))
-                else:
-                    logger.warn("failed to map subnet '%s' (%s) to a bd", mo.ip, mo.parent)
-
-        logger.debug("flushing entries in %s for fabric %s",eptSubnet._classname,self.fabric.fabric)
-        eptSubnet.delete(_filters={"fabric":self.fabric.fabric})
-        if len(bulk_objects)>0:
-            eptSubnet.bulk_save(bulk_objects, skip_validation=False)
+        projection = {"_id": 0, "dn": 1, "ip": 1, "parent": 1, "ts": 1}
+        try:
+            # should now have all objects that would contain a subnet 
+            for classname in ["fvSubnet", "fvIpAttr"]:
+                for mo in self.db[self.mo_classes[classname]._classname].find(
+                        {"fabric": self.fabric.fabric}, projection):
+                    # usually in bd so check vnid first and then epg
+                    bd_vnid = None
+                    if mo["parent"] in vnids:
+                        bd_vnid = vnids[mo["parent"]]
+                    elif mo["parent"] in epgs:
+                        bd_vnid = epgs[mo["parent"]]
+                    if bd_vnid is not None:
+                        # FYI - we support fvSubnet on BD and EPG for shared services so duplicate
+                        # ip can exist. unique index is disabled on eptSubnet to support this... 
+                        bulk_objects.append(eptSubnet(
+                            fabric = self.fabric.fabric,
+                            bd = bd_vnid,
+                            name = mo["dn"],
+                            ip = mo["ip"],
+                            ts = mo["ts"]
+                        ))
+                    else:
+                        logger.warn("failed to map subnet '%s' (%s) to a bd", mo["ip"], 
+                                mo["parent"])
+                    if len(bulk_objects) >= BUILD_CHUNK_SIZE:
+                        eptSubnet.bulk_save(bulk_objects, skip_validation=False, 
+                                upsert=self.get_upsert(eptSubnet))
+                        bulk_objects = []
+            if len(bulk_objects)>0:
+                eptSubnet.bulk_save(bulk_objects, skip_validation=False, 
+                        upsert=self.get_upsert(eptSubnet))
+        finally:
+            if generation is not None:
+                self.generations.pop(eptSubnet._classname, None)
+        if generation is not None:
+            self.remove_generation(eptSubnet, generation)
         return True
 
     def handle_fabric_prot_pol(self, classname, attr):
@@ -1330,83 +1717,248 @@ class eptSubscriber(object):
             endpoints previously within the database but not returned on query, all other objects 
             will result in a create job.
 
+            The class queries for each epm class are fetched concurrently by background threads, 
+            the received objects are parsed in this thread, and the parsed msgs are sent by a
+            background thread. Each stage is connected by a bounded queue so the fetch, parse, and
+            send are overlapped without buffering all objects in memory on scale setups. Each class
+            query has its own fetch queue and the results are parsed and sent in the original class
+            order (epmRsMacEpToIpEpAtt events before epmIpEp events) as required by the workers.
+
+            On delta resync, create jobs are only sent for objects modified since the previous 
+            build (see get_build_endpoint_db_jobs).
+
             Return boolean success
         """
         logger.debug("initialize endpoint db")
         start_time = time.time()
 
-        # 3-level dict to track endpoints returned from class query endpoints[node][vnid][addr] = 1
-        endpoints = {}
-        # we will start epm subscription AFTER get_class (which can take a long time) but before 
-        # processing endpoints.  This minimizes amount of time we lose data without having to buffer
-        # all events that are recieved during get requests.
+        # track endpoints returned from class query to find endpoints that no longer exist
+        endpoints = EndpointPresenceSet()
+        # we will start epm subscription before get_class (which can take a long time) so no events
+        # are lost during the class queries. If queue_init_epm_events is enabled, events received 
+        # during the build are queued until the build is complete.
         paused = self.settings.queue_init_epm_events
-        total_create = 0
         for c in self.epm_subscription_classes:
-            if c == "epmRsMacEpToIpEpAtt":
-                gen = get_class(self.session, c, stream=True, orderBy="%s.dn" % c)
-            else:
-                gen = get_class(self.session, c, stream=True, orderBy="%s.addr" % c)
-            ts = time.time()
-            create_count = 0
-            create_msgs = []
             if not self.subscriber.add_interest(c, self.handle_epm_event, paused=paused):
                 logger.warn("failed to add interest %s to subscriber", c)
                 return False
-            for obj in gen:
-                if obj is None:
+
+        # per-stage counters, fetch stats are indexed by job
+        stats = {"fetch": {}, "parse": 0, "parse_time": 0.0, "send": 0, "send_time": 0.0}
+        jobs = self.get_build_endpoint_db_jobs()
+        abort = threading.Event()
+        fetch_queues = [Queue(maxsize=BUILD_ENDPOINT_DB_QUEUE_SIZE) for j in jobs]
+        send_queue = Queue(maxsize=BUILD_ENDPOINT_DB_QUEUE_SIZE)
+        sessions = self.get_build_sessions()
+        ts = time.time()
+        sender = threading.Thread(target=self.build_endpoint_db_send, name="build-send",
+                                    args=(send_queue, stats))
+        sender.daemon = True
+        sender.start()
+        for i, (c, kwargs, create, presence) in enumerate(jobs):
+            fetcher = threading.Thread(target=self.build_endpoint_db_fetch, name="build-%s" % c,
+                                    args=(sessions[i % len(sessions)], i, c, fetch_queues[i], 
+                                    abort, stats), kwargs=kwargs)
+            fetcher.daemon = True
+            fetcher.start()
+
+        success = True
+        i = 0
+        while i < len(jobs):
+            # results of each job are processed in job order, later jobs continue to fetch until
+            # their fetch queue is full
+            (job, objs) = fetch_queues[i].get()
+            (c, kwargs, create, presence) = jobs[i]
+            if objs is None:
+                # fetch for job is complete
+                logger.debug("build_endpoint_db total %s objects for %s %s", 
+                        stats["fetch"][i]["count"], c, kwargs)
+                if not stats["fetch"][i]["success"]:
                     logger.error("failed to get epm data for class %s", c)
-                    return False
+                    success = False
+                    break
+                i+= 1
+                continue
+            parse_ts = time.time()
+            create_msgs = []
+            for obj in objs:
                 if c in obj and "attributes" in obj[c]:
                     msg = self.epm_parser.parse(c, obj[c]["attributes"], ts)
                     if msg is not None:
-                        create_count+=1
-                        create_msgs.append(msg)
-                        if msg.node not in endpoints: endpoints[msg.node] = {}
-                        if msg.vnid not in endpoints[msg.node]: endpoints[msg.node][msg.vnid] = {}
-                        endpoints[msg.node][msg.vnid][msg.addr] = 1
-                        # process the data now as we can't afford buffer all msgs in memory on 
-                        # scale setups.
-                        if len(create_msgs) >= MAX_SEND_MSG_LENGTH:
-                            logger.debug("build_endpoint_db sending %s create for %s", 
-                                    len(create_msgs), c)
-                            self.send_msg(create_msgs)
-                            create_msgs = []
+                        if create:
+                            create_msgs.append(msg)
+                        # rs objects do not correspond to a db endpoint (ip is tracked by epmIpEp)
+                        if presence and msg.wt != WORK_TYPE.EPM_RS_IP_EVENT:
+                            endpoints.add(msg.node, msg.vnid, msg.type, msg.addr)
                 else:
                     logger.warn("invalid %s object: %s", c, obj)
-
-            # send remaining create messages
+            stats["parse"]+= len(create_msgs)
+            stats["parse_time"]+= time.time() - parse_ts
             if len(create_msgs) > 0:
-                logger.debug("build_endpoint_db sending %s create for %s", len(create_msgs),c)
-                self.send_msg(create_msgs)
-                create_msgs = []
-            # print total for reference
-            logger.debug("build_endpoint_db total %s create for %s", create_count, c)
-            total_create+= create_count
+                logger.debug("build_endpoint_db sending %s create for %s", len(create_msgs), c)
+                send_queue.put(create_msgs)
 
         # stream delete jobs
         delete_count = 0
         delete_msgs = []
-        for obj in self.get_epm_delete_msgs(endpoints):
-            delete_count+= 1
-            delete_msgs.append(obj)
-            if len(delete_msgs) >= MAX_SEND_MSG_LENGTH:
+        if success:
+            for obj in self.get_epm_delete_msgs(endpoints):
+                delete_count+= 1
+                delete_msgs.append(obj)
+                if len(delete_msgs) >= MAX_SEND_MSG_LENGTH:
+                    logger.debug("build_endpoint_db sending %s delete jobs", len(delete_msgs))
+                    send_queue.put(delete_msgs)
+                    delete_msgs = []
+            # send remaining delete messages
+            if len(delete_msgs) > 0:
                 logger.debug("build_endpoint_db sending %s delete jobs", len(delete_msgs))
-                self.send_msg(delete_msgs)
+                send_queue.put(delete_msgs)
                 delete_msgs = []
-        # send remaining delete messages
-        if len(delete_msgs) > 0:
-            logger.debug("build_endpoint_db sending %s delete jobs", len(delete_msgs))
-            self.send_msg(delete_msgs)
-            delete_msgs = []
+
+        # stop remaining fetch threads and wait for sender to complete
+        abort.set()
+        send_queue.put(None)
+        sender.join()
+        for session in sessions:
+            if session is not self.session:
+                session.close()
+        if not success:
+            return False
+
         # print total for reference
+        total_fetch = sum([f["count"] for f in stats["fetch"].values()])
+        total_create = stats["parse"]
         logger.debug("build_endpoint_db total %s delete jobs", delete_count)
         logger.debug("build_endpoint_db total time: %.3f", time.time()-start_time)
+        # add fabric event with throughput of each stage (fetch is measured over the elapsed time 
+        # of the concurrent queries, parse and send over the time spent in each stage)
+        fetch_time = max([f["time"] for f in stats["fetch"].values()] + [0])
+        rate = lambda count, t: count/t if t > 0 else 0
+        self.fabric.add_fabric_event("initializing", 
+            "fetched %s objects (%.1f/s), parsed %s (%.1f/s), sent %s (%.1f/s)" % (
+                total_fetch, rate(total_fetch, fetch_time), 
+                stats["parse"], rate(stats["parse"], stats["parse_time"]), 
+                stats["send"], rate(stats["send"], stats["send_time"]),
+            ))
         # add fabric event so user is aware of number of create/delete events that will be processed
         overview = "analyzing %s endpoint records" % (total_create + delete_count)
         self.fabric.add_fabric_event("initializing", overview)
         return True
 
+    def get_build_sessions(self):
+        """ return list of apic sessions for build_endpoint_db class queries. If 
+            BUILD_ENDPOINT_DB_ALL_APICS is enabled, a session is created to each other controller
+            in the cluster else all queries share the subscriber session.
+        """
+        sessions = [self.session]
+        if BUILD_ENDPOINT_DB_ALL_APICS:
+            hostnames = set([get_url_hostname(self.session.hostname)])
+            for h in self.fabric.controllers:
+                if get_url_hostname(h) in hostnames:
+                    continue
+                hostnames.add(get_url_hostname(h))
+                session = get_apic_session(self.fabric, hostname=h)
+                if session is not None:
+                    sessions.append(session)
+            logger.debug("build_endpoint_db using sessions to %s apics", len(sessions))
+        return sessions
+
+    def get_build_endpoint_db_jobs(self):
+        """ return list of tuples (classname, query kwargs, create, presence) for each class query
+            performed by build_endpoint_db. If create is set then a create msg is sent for each
+            returned object and if presence is set then each object is added to the presence set
+            used to create delete msgs.
+            On delta resync, create msgs are only sent for objects modified after the earliest 
+            current time of the nodes at the start of the previous build along with all objects on
+            nodes without a current time in the previous build. The presence set is built from a 
+            separate naming-only query of each class.
+        """
+        jobs = [(c, {}, True, True) for c in self.epm_subscription_classes]
+        if self.sync is None:
+            return jobs
+        prev = self.sync.get("nodes", {})
+        watermarks = [t for t in prev.values() if len(t) > 0]
+        new_nodes = sorted([n for n in self.sync_state.get("nodes", {}) if n not in prev])
+        if len(watermarks) == 0 or len(new_nodes) > DELTA_RESYNC_MAX_NEW_NODES:
+            logger.debug("unable to determine epm delta (%s watermarks, %s new nodes)", 
+                    len(watermarks), len(new_nodes))
+            return jobs
+        ts = min(watermarks)
+        logger.debug("epm delta since %s with new nodes: %s", ts, new_nodes)
+        jobs = []
+        for c in self.epm_subscription_classes:
+            flt = ["gt(%s.modTs,\"%s\")" % (c, ts)]
+            for n in new_nodes:
+                flt.append("wcard(%s.dn,\"/node-%s/\")" % (c, n))
+            if len(flt) > 1:
+                jobs.append((c, {"queryTargetFilter": "or(%s)" % ",".join(flt)}, True, False))
+            else:
+                jobs.append((c, {"queryTargetFilter": flt[0]}, True, False))
+        for c in self.epm_subscription_classes:
+            # rs objects do not correspond to a db endpoint
+            if c != "epmRsMacEpToIpEpAtt":
+                jobs.append((c, {"rspPropInclude": "naming-only"}, False, True))
+        return jobs
+
+    def build_endpoint_db_fetch(self, session, job, classname, fetch_queue, abort, stats, 
+                                **kwargs):
+        """ stream class query for epm classname with provided query kwargs and put tuple (job, 
+            list of objects) on fetch queue for each batch of MAX_SEND_MSG_LENGTH objects. (job, 
+            None) is put on the queue once the query is complete and the result saved in fetch 
+            stats for the job.
+        """
+        if classname == "epmRsMacEpToIpEpAtt":
+            order = "%s.dn" % classname
+        else:
+            order = "%s.addr" % classname
+        def put(item):
+            # put item on fetch queue, return False if build was aborted
+            while not abort.is_set():
+                try:
+                    fetch_queue.put(item, timeout=1.0)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        ts = time.time()
+        result = {"count": 0, "time": 0.0, "success": False}
+        objs = []
+        try:
+            for obj in get_class(session, classname, stream=True, orderBy=order, **kwargs):
+                if obj is None:
+                    break
+                objs.append(obj)
+                if len(objs) >= MAX_SEND_MSG_LENGTH:
+                    if not put((job, objs)):
+                        return
+                    result["count"]+= len(objs)
+                    objs = []
+            else:
+                if len(objs) > 0 and not put((job, objs)):
+                    return
+                result["count"]+= len(objs)
+                result["success"] = True
+        except Exception as e:
+            logger.error("Traceback:\n%s", traceback.format_exc())
+        result["time"] = time.time() - ts
+        stats["fetch"][job] = result
+        put((job, None))
+
+    def build_endpoint_db_send(self, send_queue, stats):
+        """ send each list of msgs on send queue until None is received """
+        while True:
+            msgs = send_queue.get()
+            if msgs is None:
+                return
+            ts = time.time()
+            try:
+                self.send_msg(msgs)
+                stats["send"]+= len(msgs)
+            except Exception as e:
+                logger.error("Traceback:\n%s", traceback.format_exc())
+            stats["send_time"]+= time.time() - ts
+
     def refresh_endpoint(self, vnid, addr, addr_type, qnum=1):
         """ perform endpoint refresh. This triggers an API query for epmDb filtering on provided
             addr and vnid. The results are fed through handle_epm_event which is enqueued onto 
@@ -1430,8 +1982,8 @@ class eptSubscriber(object):
             }
         objects = get_class(self.session, classname, **kwargs)
         ts = time.time()
-        # 3-level dict to track endpoints returned from class query endpoints[node][vnid][addr] = 1
-        endpoints = {}
+        # track endpoints returned from class query to find endpoints that no longer exist
+        endpoints = EndpointPresenceSet()
         # queue all the events to send at one time...
         create_msgs = []
         # queue all the events to send at one time...
@@ -1444,9 +1996,9 @@ class eptSubscriber(object):
                     msg = self.epm_parser.parse(classname, attr, attr["_ts"])
                     if msg is not None:
                         create_msgs.append(msg)
-                        if msg.node not in endpoints: endpoints[msg.node] = {}
-                        if msg.vnid not in endpoints[msg.node]: endpoints[msg.node][msg.vnid] = {}
-                        endpoints[msg.node][msg.vnid][msg.addr] = 1
+                        # rs objects do not correspond to a db endpoint (ip is tracked by epmIpEp)
+                        if msg.wt != WORK_TYPE.EPM_RS_IP_EVENT:
+                            endpoints.add(msg.node, msg.vnid, msg.type, msg.addr)
                 else:
                     logger.debug("ignoring invalid epm object %s", obj)
             # get delete jobs
@@ -1463,8 +2015,8 @@ class eptSubscriber(object):
             logger.debug("failed to get epm objects")
 
     def get_epm_delete_msgs(self, endpoints, addr=None, vnid=None):
-        """ from provided create endpoint dict and flt, stream iterators for epm delete msgs
-            endpoints must be 3-level dict in the form endpoints[node][vnid][addr]
+        """ from provided create endpoint EndpointPresenceSet and flt, stream iterators for epm
+            delete msgs
         """
         logger.debug("get epm delete messages (flt addr:%s, vnid:%s)", addr, vnid)
 
@@ -1487,9 +2039,8 @@ class eptSubscriber(object):
 
         ts = time.time()
         for obj in self.db[eptHistory._classname].find(flt, projection):
-            # if in endpoints dict, then stil exists in the fabric so do not create a delete event
-            if obj["node"] in endpoints and obj["vnid"] in endpoints[obj["node"]] and \
-                obj["addr"] in endpoints[obj["node"]][obj["vnid"]]:
+            # if in endpoints set, then stil exists in the fabric so do not create a delete event
+            if endpoints.contains(obj["node"], obj["vnid"], obj["type"], obj["addr"]):
                 continue
             if obj["type"] == "mac":
                 msg = self.epm_parser.get_delete_event("epmMacEp", obj["node"], 
@@ -1,13 +1,15 @@
 
 from ... utils import get_redis
 from ... utils import get_db
-from .. utils import execute_worker
 from .. utils import raise_interrupt
 from .. utils import register_signal_handlers
+from . common import CACHE_ADAPT_INTERVAL
 from . common import CACHE_STATS_INTERVAL
+from . common import CACHE_STATS_TIMEOUT
 from . common import HELLO_INTERVAL
 from . common import MANAGER_WORK_QUEUE
-from . common import RAPID_CALCULATE_INTERVAL
+from . common import MAX_EPM_BUILD_TIME
+from . common import RAPID_RATE_WINDOW
 from . common import TRANSITORY_DELETE
 from . common import TRANSITORY_OFFSUBNET
 from . common import TRANSITORY_RAPID
@@ -15,14 +17,32 @@ from . common import TRANSITORY_STALE
 from . common import TRANSITORY_STALE_NO_LOCAL
 from . common import SUPPRESS_WATCH_OFFSUBNET
 from . common import SUPPRESS_WATCH_STALE
+from . common import STD_MO_BATCH_ENABLED
 from . common import SUBSCRIBER_CTRL_CHANNEL
+from . common import WATCH_BATCH_SIZE
 from . common import WATCH_INTERVAL
 from . common import WORKER_CTRL_CHANNEL
+from . common import WORKER_PENDING_QUEUES
+from . common import WORK_QUEUE_QUANTUM
+from . common import WORK_QUEUE_REFRESH_INTERVAL
+from . common import WORK_DEQUEUE_SCRIPT
+from . common import WORK_REPLAY_SCRIPT
 from . common import MAX_SEND_MSG_LENGTH
 from . common import BackgroundThread
+from . common import BulkWriter
+from . common import HashRing
+from . common import WatchHeap
 from . common import db_alive
+from . common import get_address_hash
 from . common import get_addr_type
+from . common import get_cache_stats_key
+from . common import get_fabric_work_queues
+from . common import get_notify_queue
+from . common import get_pending_queue
+from . common import get_queue_length
+from . common import get_shard
 from . common import get_vpc_domain_id
+from . common import get_work_queue
 from . common import parse_vrf_name
 from . common import split_vpc_domain_id
 from . common import wait_for_db
@@ -49,10 +69,13 @@ from . ept_offsubnet import eptOffSubnet
 from . ept_offsubnet import eptOffSubnetEvent
 from . ept_rapid import eptRapid
 from . ept_remediate import eptRemediate
+from . ept_remediator import eptRemediateJob
+from . ept_remediator import eptRemediator
 from . ept_queue_stats import eptQueueStats
 from . ept_stale import eptStale
 from . ept_stale import eptStaleEvent
 from . ept_worker_fabric import eptWorkerFabric
+from . mo_dependency import sync_events
 from . mo_dependency_map import dependency_map
 
 import copy
@@ -71,12 +94,17 @@ class eptWorker(object):
         endpoint analysis for one or more fabrics.
     """
 
-    def __init__(self, worker_id, role):
+    def __init__(self, worker_id, role, pool_id=None, shard=0, shards=1):
         threading.currentThread().name = "main"
         logger.debug("init role %s id %s", role, worker_id)
         register_signal_handlers()
         self.worker_id = "%s" % worker_id
         self.role = role
+        # shard of a worker pool receives work from the pool instead of the manager. The pool is
+        # registered with the manager as a single worker on behalf of all of its shards
+        self.pool_id = pool_id
+        self.shard = shard
+        self.shards = shards
         self.db = get_db(uniq=True, overwrite_global=True, write_concern=True)
         self.redis = get_redis()
 
@@ -88,11 +116,20 @@ class eptWorker(object):
         self.stats_thread = None
         # check execute_ts for watch events at regular interval
         self.watch_thread = None
+        # auto-clear of stale/offsubnet endpoints executed by watcher
+        self.remediator = None
+        # db writes for endpoint events are batched per received msg (see flush_writes) and msgs
+        # sent while writes are pending are queued until the writes are flushed
+        self.pending_msgs = None
+        # std mo events are queued per received msg when STD_MO_BATCH_ENABLED is set and synced as
+        # a single batch (see flush_std_mo_events)
+        self.std_mo_events = None
 
         # watcher active keys where key is unique fabric+addr+vnid+node (rapid excludes node)
-        self.watch_stale = {}
-        self.watch_offsubnet = {}
-        self.watch_rapid = {}
+        # ordered by execute timestamp
+        self.watch_stale = WatchHeap()
+        self.watch_offsubnet = WatchHeap()
+        self.watch_rapid = WatchHeap()
 
         # multithreading locks
         self.queue_stats_lock = threading.Lock()
@@ -103,6 +140,16 @@ class eptWorker(object):
 
         # queues that this worker will listen on 
         self.queues = ["q0_%s" % self.worker_id, "q1_%s" % self.worker_id]
+        # each queue is partitioned per fabric. The partitions are dequeued after the base queue 
+        # of the same priority in deficit round robin order
+        self.work_fabrics = []          # fabrics with a partition in the dequeue order
+        self.fabric_order = [[] for q in self.queues]   # fabric partitions per queue, dequeue order
+        self.fabric_credit = {}         # remaining msgs before partition moves to end of order
+        self.work_queue_base = {}       # base queue indexed by fabric partition name
+        self.work_queue_refresh = 0     # timestamp of last fabric partition discovery
+        self.notify_queues = [get_notify_queue(q) for q in self.queues]
+        self.dequeue_script = self.redis.register_script(WORK_DEQUEUE_SCRIPT)
+        self.replay_script = self.redis.register_script(WORK_REPLAY_SCRIPT)
         self.queue_stats = {
             "q0_%s" % self.worker_id: eptQueueStats.load(proc=self.worker_id, 
                                                     queue="q0_%s" % self.worker_id),
@@ -116,12 +163,16 @@ class eptWorker(object):
                                                     queue=SUBSCRIBER_CTRL_CHANNEL),
             "total": eptQueueStats.load(proc=self.worker_id, queue="total"),
         }
+        # shards do not track queue stats, the pool collects stats for its registered queues
+        if self.pool_id is not None:
+            self.queue_stats = {}
         # initialize stats counters
         for k, q in self.queue_stats.items():
             q.init_queue()
 
         start_ts = time.time()
         self.cache_stats_time = start_ts
+        self.cache_adapt_time = start_ts
         self.hello_msg = eptMsgHello(self.worker_id, self.role, self.queues, start_ts)
         self.hello_msg.seq = 0
 
@@ -151,7 +202,15 @@ class eptWorker(object):
                 WORK_TYPE.DELETE_EPT: self.handle_endpoint_delete,
                 WORK_TYPE.SETTINGS_RELOAD: self.handle_settings_reload,
                 WORK_TYPE.FABRIC_EPM_EOF:  self.handle_epm_eof,
+                WORK_TYPE.CACHE_PRELOAD: self.handle_cache_preload,
             }
+        # work types where db writes are queued and flushed as bulk writes
+        self.bulk_write_work_types = [
+            WORK_TYPE.RAW,
+            WORK_TYPE.EPM_IP_EVENT,
+            WORK_TYPE.EPM_MAC_EVENT,
+            WORK_TYPE.EPM_RS_IP_EVENT,
+        ]
 
     def __repr__(self):
         return self.worker_id
@@ -161,22 +220,26 @@ class eptWorker(object):
         try:
             wait_for_redis(self.redis)
             wait_for_db(self.db)
-            # start stats thread
-            self.stats_thread = BackgroundThread(func=self.update_stats, name="worker-stats", 
+            # shards share the hello and stats threads of the pool
+            if self.pool_id is None:
+                # start stats thread
+                self.stats_thread = BackgroundThread(func=self.update_stats, name="worker-stats", 
                                                 count=0, interval= eptQueueStats.STATS_INTERVAL)
-            self.stats_thread.daemon = True
-            self.stats_thread.start()
-            # start hello thread
-            self.hello_thread = BackgroundThread(func=self.send_hello, name="worker-hello", count=0,
-                                                interval = HELLO_INTERVAL)
-            self.hello_thread.daemon = True
-            self.hello_thread.start()
+                self.stats_thread.daemon = True
+                self.stats_thread.start()
+                # start hello thread
+                self.hello_thread = BackgroundThread(func=self.send_hello, name="worker-hello", 
+                                                count=0, interval = HELLO_INTERVAL)
+                self.hello_thread.daemon = True
+                self.hello_thread.start()
             if self.role == "watcher":
                 # watcher needs to trigger execute watch at regular interval
                 self.watch_thread = BackgroundThread(func=self.execute_watch, name="watch", count=0,
                                                 interval=WATCH_INTERVAL)
                 self.watch_thread.daemon = True
                 self.watch_thread.start()
+                self.remediator = eptRemediator()
+                self.remediator.start()
 
             # start listening to redis channels/queues
             self._run()
@@ -187,6 +250,8 @@ class eptWorker(object):
                 self.hello_thread.exit()
             if self.watch_thread is not None:
                 self.watch_thread.exit()
+            if self.remediator is not None:
+                self.remediator.stop()
             if self.stats_thread is not None:
                 self.stats_thread.exit()
             if self.db is not None:
@@ -198,8 +263,9 @@ class eptWorker(object):
         """ listen for work on redis queues """
         # first check/wait on redis and mongo connection, then start hello thread
         logger.debug("[%s] listening for jobs on queues: %s", self, self.queues)
+        self.replay_work()
         while True: 
-            (q, data) = self.redis.blpop(self.queues)
+            (q, data) = self.get_work()
             # to support msg type BULK, assume an array of messages received
             msg_list = []
             try:
@@ -210,16 +276,37 @@ class eptWorker(object):
                 else:
                     msg_list = [omsg]
                 # increment rx stats for received message
-                if q in self.queue_stats:
-                    self.increment_stats(q, tx=False, count=len(msg_list))
+                if self.work_queue_base.get(q, q) in self.queue_stats:
+                    self.increment_stats(self.work_queue_base.get(q, q), tx=False, 
+                                        count=len(msg_list))
+                self.charge_work_queue(q, len(msg_list))
                 for msg in msg_list:
                     # exception on one msg must not block processing of other messages in block
                     try:
                         logger.debug("[%s] msg on q(%s): %s", self, q, msg)
+                        # endpoint events queue their writes, any other msg may read or depend on
+                        # the result of those writes so pending writes are flushed first
+                        bulk_write = self.role == "worker" and msg.msg_type == MSG_TYPE.WORK \
+                                        and msg.wt in self.bulk_write_work_types
+                        if not bulk_write:
+                            self.flush_writes()
+                        # std mo events are queued until a different msg is received or all msgs
+                        # are processed
+                        std_mo_batch = STD_MO_BATCH_ENABLED and msg.msg_type == MSG_TYPE.WORK \
+                                        and msg.wt == WORK_TYPE.STD_MO
+                        if std_mo_batch:
+                            if self.std_mo_events is None:
+                                self.std_mo_events = []
+                        else:
+                            self.flush_std_mo_events()
                         if msg.msg_type == MSG_TYPE.WORK:
                             if msg.wt in self.work_type_handlers:
                                 # set msg.wf to current fabric eptWorkerFabric object
                                 self.set_msg_worker_fabric(msg)
+                                if bulk_write:
+                                    msg.wf.writer.start()
+                                    if self.pending_msgs is None:
+                                        self.pending_msgs = []
                                 self.work_type_handlers[msg.wt](msg)
                             else:
                                 logger.warn("unsupported work type: %s", msg.wt)
@@ -227,14 +314,117 @@ class eptWorker(object):
                             self.fabric_start(fabric=msg.data["fabric"])
                         elif msg.msg_type == MSG_TYPE.FABRIC_STOP:
                             self.fabric_stop(fabric=msg.data["fabric"])
+                        elif msg.msg_type == MSG_TYPE.WORKER_HANDOFF:
+                            self.worker_handoff(msg)
                         else:
                             logger.warn("unsupported worker msg type: %s", msg.msg_type)
                     except Exception as e:
                         logger.debug("failed to execute msg %s", msg)
                         logger.error("Traceback:\n%s", traceback.format_exc())
+                self.flush_std_mo_events()
+                self.flush_writes()
+                self.update_caches()
             except Exception as e:
                 logger.debug("failed to parse message from q: %s, data: %s", q, data)
                 logger.error("Traceback:\n%s", traceback.format_exc())
+            if WORKER_PENDING_QUEUES:
+                # msg has been processed, remove from pending list
+                self.redis.lpop(get_pending_queue(q))
+
+    def replay_work(self):
+        """ replay work popped but not processed by previous instance of this worker """
+        if WORKER_PENDING_QUEUES:
+            queues = self.get_work_queues()
+            count = self.replay_script(keys=queues + [get_pending_queue(q) for q in queues])
+            if count > 0:
+                logger.info("[%s] replayed %s unacknowledged msgs", self, count)
+
+    def get_work(self):
+        """ block until work is available and return tuple (queue, data). If WORKER_PENDING_QUEUES
+            is enabled, the msg is atomically moved to the pending list for the queue and kept there
+            until processed.
+        """
+        while True:
+            queues = self.get_work_queues()
+            if WORKER_PENDING_QUEUES:
+                keys = queues + [get_pending_queue(q) for q in queues] + self.notify_queues
+                ret = self.dequeue_script(keys=keys, args=[len(queues)])
+                if ret is not None:
+                    return (queues[int(ret[0])-1], ret[1])
+                # all queues are empty, block until work is pushed onto any queue. The timeout 
+                # allows new fabric partitions to be discovered.
+                self.redis.blpop(self.notify_queues, timeout=int(WORK_QUEUE_REFRESH_INTERVAL))
+                continue
+            # block until next msg is available, the timeout allows new fabric partitions to be
+            # discovered.
+            ret = self.redis.blpop(queues, timeout=int(WORK_QUEUE_REFRESH_INTERVAL))
+            if ret is not None:
+                return ret
+
+    def get_work_queues(self):
+        """ return list of queues in dequeue order. For each priority, the base queue is followed by
+            the fabric partitions in deficit round robin order.
+        """
+        if self.work_queue_refresh + WORK_QUEUE_REFRESH_INTERVAL < time.time():
+            self.refresh_work_queues()
+        queues = []
+        for qnum, q in enumerate(self.queues):
+            queues.append(q)
+            queues.extend(self.fabric_order[qnum])
+        return queues
+
+    def refresh_work_queues(self):
+        """ discover fabric partitions of each worker queue present in redis and remove partitions
+            that no longer exist for fabrics not currently in use by this worker
+        """
+        self.work_queue_refresh = time.time()
+        fabrics = set(self.fabrics.keys())
+        for q in self.queues:
+            for (f, fq) in get_fabric_work_queues(self.redis, q):
+                fabrics.add(f)
+        for f in list(self.work_fabrics):
+            if f not in fabrics:
+                self.remove_work_fabric(f)
+        for f in sorted(fabrics):
+            self.add_work_fabric(f)
+
+    def add_work_fabric(self, fabric):
+        """ add fabric partition of each worker queue to the end of the dequeue order """
+        if fabric in self.work_fabrics:
+            return
+        logger.debug("[%s] adding work queues for fabric %s", self, fabric)
+        self.work_fabrics.append(fabric)
+        for qnum, q in enumerate(self.queues):
+            fq = get_work_queue(q, fabric)
+            self.fabric_order[qnum].append(fq)
+            self.fabric_credit[fq] = WORK_QUEUE_QUANTUM
+            self.work_queue_base[fq] = q
+
+    def remove_work_fabric(self, fabric):
+        """ remove fabric partition of each worker queue from the dequeue order """
+        if fabric not in self.work_fabrics:
+            return
+        logger.debug("[%s] removing work queues for fabric %s", self, fabric)
+        self.work_fabrics.remove(fabric)
+        for qnum, q in enumerate(self.queues):
+            fq = get_work_queue(q, fabric)
+            self.fabric_order[qnum].remove(fq)
+            self.fabric_credit.pop(fq, None)
+            self.work_queue_base.pop(fq, None)
+
+    def charge_work_queue(self, q, count):
+        """ charge count msgs received on fabric partition against its credit. Once the credit is 
+            exhausted, the partition is moved to the end of the dequeue order so other fabrics 
+            with pending work are served next.
+        """
+        if q not in self.fabric_credit:
+            return
+        self.fabric_credit[q]-= count
+        if self.fabric_credit[q] <= 0:
+            self.fabric_credit[q]+= WORK_QUEUE_QUANTUM
+            order = self.fabric_order[self.queues.index(self.work_queue_base[q])]
+            order.remove(q)
+            order.append(q)
 
     def increment_stats(self, queue, tx=False, count=1):
         # update stats queue
@@ -257,12 +447,35 @@ class eptWorker(object):
         # update stats at regular interval for all queues
         for k, q in self.queue_stats.items():
             with self.queue_stats_lock:
-                q.collect(qlen = self.redis.llen(k))
+                q.collect(qlen = get_queue_length(self.redis, k, accurate=False, 
+                            fabrics=list(self.work_fabrics) if k in self.queues else None))
+
+    def flush_writes(self):
+        """ flush queued db writes for all fabrics and then send msgs that were queued while the
+            writes were pending. This ensures that a watcher or worker receiving a msg will always
+            see the db writes that preceded it.
+        """
+        try:
+            for fabric in self.fabrics:
+                if self.fabrics[fabric].writer.enabled:
+                    self.fabrics[fabric].writer.stop()
+        finally:
+            msgs = self.pending_msgs
+            self.pending_msgs = None
+            if msgs is not None and len(msgs) > 0:
+                self.send_msg(msgs)
 
     def send_msg(self, msg):
         """ send one or more eptMsgWork objects to worker via manager work queue 
             limit the number of messages sent at a time to MAX_SEND_MSG_LENGTH
+            if db writes are currently pending, then msgs are queued until flush_writes
         """
+        if self.pending_msgs is not None:
+            if isinstance(msg, list):
+                self.pending_msgs.extend(msg)
+            else:
+                self.pending_msgs.append(msg)
+            return
         if isinstance(msg, list):
             # break up msg into multiple blocks and send as single eptMsgBulk
             for i in range(0, len(msg), MAX_SEND_MSG_LENGTH):
@@ -304,6 +517,25 @@ class eptWorker(object):
                 if f in fabrics: 
                     self.fabrics[f].cache.log_stats()
 
+    def update_caches(self):
+        """ at CACHE_ADAPT_INTERVAL, adapt the cache capacity of each fabric (if enabled within the
+            fabric settings) and publish cache statistics to redis. This is executed from the main
+            thread as resizing a cache modifies the cache
+        """
+        ts = time.time()
+        if CACHE_ADAPT_INTERVAL <= 0 or ts - self.cache_adapt_time < CACHE_ADAPT_INTERVAL:
+            return
+        self.cache_adapt_time = ts
+        for f in self.fabrics.keys():
+            cache = self.fabrics[f].cache
+            stats = cache.get_stats()
+            if len(cache.adapt(stats=stats)) > 0:
+                stats = cache.get_stats()
+            stats["worker_id"] = self.worker_id
+            stats["role"] = self.role
+            self.redis.set(get_cache_stats_key(f, self.worker_id), json.dumps(stats),
+                    ex=int(CACHE_STATS_TIMEOUT))
+
     def fabric_start(self, fabric):
         """ start fabric to init cache and for watcher process, to set a start timestamp for the 
             fabric for extending transitory timers
@@ -314,6 +546,7 @@ class eptWorker(object):
         self.fabrics[fabric] = eptWorkerFabric(fabric)
         if self.role == "watcher":
             self.fabrics[fabric].watcher_init()
+        self.add_work_fabric(fabric)
 
     def fabric_stop(self, fabric):
         """ stop only requires removing fabric from local fabrics, manager will handle removing any
@@ -324,6 +557,7 @@ class eptWorker(object):
         old_wf = self.fabrics.pop(fabric, None)
         if old_wf is not None:
             old_wf.close()
+            self.redis.delete(get_cache_stats_key(fabric, self.worker_id))
         if self.role == "watcher":
             watches = [
                 ("offsubnet", self.watch_offsubnet_lock, self.watch_offsubnet),
@@ -340,6 +574,28 @@ class eptWorker(object):
                         d.pop(k, None)
                 logger.debug("[%s] %s events removed from watch_%s", self, len(pop), name)
 
+    def worker_handoff(self, msg):
+        """ manager has updated the hash ring for this role and any pending work for keys that 
+            moved to a different worker has already been migrated.  Release cached state for keys
+            no longer owned by this worker so the counters are saved to the db before the new owner
+            starts processing events. Watch events are not released as they are independent 
+            timers that complete on the worker where they were created.
+        """
+        ring = HashRing(msg.data.get("workers", []))
+        logger.debug("[%s] worker handoff %s", self, ring)
+        # a shard owns the keys of its pool that hash to the shard
+        ring_id = self.pool_id if self.pool_id is not None else self.worker_id
+        if ring_id not in ring.nodes:
+            logger.warn("[%s] handoff received for ring without this worker: %s", self, ring)
+            return
+        def owned(addr):
+            _hash = get_address_hash(addr)
+            return ring.get_node(_hash) == ring_id and get_shard(_hash, self.shards) == self.shard
+        for f in self.fabrics.keys():
+            if f in self.fabrics:
+                count = self.fabrics[f].cache.release_endpoints(owned)
+                logger.debug("[%s] released %s rapid endpoints for fabric %s", self, count, f)
+
     def flush_cache(self, msg):
         """ receive flush cache work containing cache and optional object name """
         logger.debug("flush cache fabric: %s, data: %s", msg.fabric, msg.data)
@@ -384,42 +640,60 @@ class eptWorker(object):
         is_rs_ip_event = (msg.wt == WORK_TYPE.EPM_RS_IP_EVENT)
         addr = msg.ip if is_rs_ip_event else msg.addr
 
-        # get cached rapid eptWorkerRapidEndpoint object and ensure not currently is_rapid
-        cached_rapid = None
+        # get rapid engine slot for endpoint and ensure not currently is_rapid
+        rapid_slot = None
         if msg.wf.settings.analyze_rapid and not msg.force:
-            cached_rapid = msg.wf.cache.get_rapid_endpoint(msg.vnid, addr, msg.type)
-            if cached_rapid.rapid_count == 0:
-                # if entry was not in cache then cached_rapid.type is invalid, let's fix it here
-                # (instead on every lookup)
+            rapid = msg.wf.cache.rapid
+            rapid_slot = rapid.get_slot(msg.vnid, addr, msg.type)
+            if not rapid.is_loaded(rapid_slot):
+                # if slot is not loaded then counters are read from eptEndpoint in update_local. 
+                # msg.type is invalid for ip events, let's fix it here (instead on every lookup)
                 if is_rs_ip_event or msg.wt == WORK_TYPE.EPM_IP_EVENT:
-                    cached_rapid.type = get_addr_type(addr, "ip")
-            if self.analyze_rapid(msg, cached_rapid):
+                    rapid.keys[rapid_slot] = (msg.vnid, addr, get_addr_type(addr, "ip"))
+            elif self.analyze_rapid(msg, rapid_slot):
                 logger.debug("ignoring event, endpoint is_rapid")
                 return
 
-        flt = {
-            "fabric": msg.fabric,
-            "vnid": msg.vnid,
-            "addr": addr,
-        }
-        projection = {
-            "node": 1,
-            "watch_stale_ts":1,         # will embed value into events.0
-            "watch_stale_event":1,      # will embed value into events.0
-            "watch_offsubnet_ts": 1,    # will embed value into events.0
-            "events": {"$slice": 1}     # pull only events.0
-        }
-        per_node_history_events = {}    # one entry per node, indexed by node-id
-        for h in self.db[eptHistory._classname].find(flt, projection):
-            events = []
-            for event in h["events"]:
-                events.append(eptHistoryEvent.from_dict(event))
-            # embed watch info into events.0
-            if len(events) > 0:
-                events[0].watch_stale_ts = h["watch_stale_ts"]
-                events[0].watch_stale_event = eptStaleEvent.from_dict(h["watch_stale_event"])
-                events[0].watch_offsubnet_ts = h["watch_offsubnet_ts"]
-                per_node_history_events[h["node"]] = events
+        # per node history events are cached by this worker, only read from db on cache miss
+        per_node_history_events = msg.wf.cache.get_history_state(msg.vnid, addr)
+        if per_node_history_events is None:
+            # db read must include any queued writes for this endpoint
+            msg.wf.writer.flush(eptHistory._classname, msg.vnid, addr)
+            flt = {
+                "fabric": msg.fabric,
+                "vnid": msg.vnid,
+                "addr": addr,
+            }
+            projection = {
+                "node": 1,
+                "watch_stale_ts":1,         # will embed value into events.0
+                "watch_stale_event":1,      # will embed value into events.0
+                "watch_offsubnet_ts": 1,    # will embed value into events.0
+                "events": {"$slice": 1}     # pull only events.0
+            }
+            per_node_history_events = {}    # one entry per node, indexed by node-id
+            for h in self.db[eptHistory._classname].find(flt, projection):
+                events = []
+                for event in h["events"]:
+                    events.append(eptHistoryEvent.from_dict(event))
+                # embed watch info into events.0
+                if len(events) > 0:
+                    events[0].watch_stale_ts = h["watch_stale_ts"]
+                    events[0].watch_stale_event = eptStaleEvent.from_dict(h["watch_stale_event"])
+                    events[0].watch_offsubnet_ts = h["watch_offsubnet_ts"]
+                    per_node_history_events[h["node"]] = events
+
+        try:
+            self.analyze_endpoint_event(msg, per_node_history_events, rapid_slot)
+        except Exception as e:
+            # cached state may no longer match the db, force a db read on next event
+            msg.wf.cache.remove_endpoint_state(msg.vnid, addr)
+            raise
+        msg.wf.cache.set_history_state(msg.vnid, addr, per_node_history_events)
+
+    def analyze_endpoint_event(self, msg, per_node_history_events, rapid_slot):
+        """ update eptHistory and eptEndpoint for EPM endpoint event and perform analysis """
+        is_rs_ip_event = (msg.wt == WORK_TYPE.EPM_RS_IP_EVENT)
 
         # update endpoint history table and determine based on event if analysis is required
         # if this is a new event, the event is inserted into per_node_history_events 
@@ -434,7 +708,7 @@ class eptWorker(object):
 
         # update ept_endpoint with local event. Return last locals events for move analyze
         # note the result may be None if endpoint is_rapid
-        update_local_result = self.update_local(msg, per_node_history_events, cached_rapid) 
+        update_local_result = self.update_local(msg, per_node_history_events, rapid_slot) 
 
         # perform move/offsubnet/stale analysis
         if (analysis_required or msg.force) and update_local_result is not None:
@@ -545,11 +819,11 @@ class eptWorker(object):
                 # if this is new endpoint from rs_ip_event, ensure address is ip and rw info set
                 event.rw_mac = msg.addr
                 event.rw_bd = msg.bd
-                eptHistory(fabric=msg.fabric, node=msg.node, vnid=msg.vnid, addr=msg.ip, 
-                        type=msg.type, count=1, events=[event.to_dict()]).save(refresh=False)
+                msg.wf.writer.save(eptHistory(fabric=msg.fabric, node=msg.node, vnid=msg.vnid, 
+                        addr=msg.ip, type=msg.type, count=1, events=[event.to_dict()]))
             else:
-                eptHistory(fabric=msg.fabric, node=msg.node, vnid=msg.vnid, addr=msg.addr, 
-                        type=msg.type, count=1, events=[event.to_dict()]).save(refresh=False)
+                msg.wf.writer.save(eptHistory(fabric=msg.fabric, node=msg.node, vnid=msg.vnid, 
+                        addr=msg.addr, type=msg.type, count=1, events=[event.to_dict()]))
             per_node_history_events[msg.node] = [event]
 
             # no analysis required for new event if:
@@ -682,7 +956,7 @@ class eptWorker(object):
             logger.debug("no update detected for eptHistory")
             return False
 
-    def update_local(self, msg, per_node_history_event, cached_rapid):
+    def update_local(self, msg, per_node_history_event, rapid_slot):
         """ update/add local entries to ept_endpoint table and return list of most recent
             fabric-wide complete local events (where complete requires rewrite info for ip endpoints)
             -   calculates where endpoint is local relevant to all nodes in the fabric. Note, the
@@ -708,32 +982,37 @@ class eptWorker(object):
             "events": {"$slice": 2},
             # rapid thresholds
             "is_rapid": 1,
+            "is_rapid_ts": 1,
             "rapid_lts": 1,
             "rapid_count": 1,
             "rapid_lcount": 1,
             "rapid_icount": 1,
+            "rapid_rate": 1,
         }
         flt = {     
             "fabric": msg.fabric,
             "vnid": msg.vnid,
             "addr": msg.addr,
         }
-        endpoint = self.db[eptEndpoint._classname].find_one(flt, projection)
-        # if analyze_rapid is enabled and cached_rapid.rapid_count is 0, then no rapid calculation
-        # has been performed yet and we need to update all values and trigger analysis. Else,
-        # just update rapid_count. note cached_rapid is None if analyze_rapid is disabled
-        if not msg.force and cached_rapid is not None and endpoint is not None:
-            if cached_rapid.rapid_count == 0:
-                cached_rapid.rapid_count = endpoint["rapid_count"] + 1
-                cached_rapid.rapid_lts = endpoint["rapid_lts"]
-                cached_rapid.rapid_lcount = endpoint["rapid_lcount"]
-                cached_rapid.rapid_icount = endpoint["rapid_icount"]
-                cached_rapid.is_rapid = endpoint["is_rapid"]
-                if self.analyze_rapid(msg, cached_rapid, increment=False):
+        # endpoint state is cached by this worker, only read from db on cache miss. Any update to
+        # eptEndpoint below must also update the cached state
+        endpoint = msg.wf.cache.get_endpoint_state(msg.vnid, msg.addr)
+        if endpoint is None:
+            msg.wf.writer.flush(eptEndpoint._classname, msg.vnid, msg.addr)
+            endpoint = self.db[eptEndpoint._classname].find_one(flt, projection)
+            if endpoint is not None:
+                msg.wf.cache.set_endpoint_state(msg.vnid, msg.addr, endpoint)
+        state = endpoint
+        # if analyze_rapid is enabled and the rapid slot is not loaded, then the counters are
+        # loaded from the endpoint (or initialized for a new endpoint) and analysis is triggered.
+        # Else, analysis was already performed in handle_endpoint_event. note rapid_slot is None if
+        # analyze_rapid is disabled
+        if not msg.force and rapid_slot is not None:
+            rapid = msg.wf.cache.rapid
+            if not rapid.is_loaded(rapid_slot):
+                rapid.load(rapid_slot, endpoint)
+                if self.analyze_rapid(msg, rapid_slot):
                     return None
-            else:
-                # entry actual came from cache, analysis already performed, only need to update count
-                cached_rapid.rapid_count+= 1
 
         # set learn type based on initial node info. This is used on initial event and non-local 
         # events where learn has changed from epg to non-epg.
@@ -764,8 +1043,25 @@ class eptWorker(object):
             endpoint_type = get_addr_type(msg.addr, msg.type)
             dummy_event = eptEndpointEvent.from_dict({"vnid_name":msg.vnid_name}).to_dict()
             logger.debug("learn type set to %s", learn_type)
-            eptEndpoint(fabric=msg.fabric, vnid=msg.vnid, addr=msg.addr,type=endpoint_type,
-                    first_learn=dummy_event, learn_type=learn_type).save(refresh=False)
+            msg.wf.writer.save(eptEndpoint(fabric=msg.fabric, vnid=msg.vnid, addr=msg.addr,
+                    type=endpoint_type, first_learn=dummy_event, learn_type=learn_type))
+            state = {
+                "fabric": msg.fabric,
+                "vnid": msg.vnid,
+                "addr": msg.addr,
+                "learn_type": learn_type,
+                "is_stale": False,
+                "is_offsubnet": False,
+                "events": [],
+                "is_rapid": False,
+                "is_rapid_ts": 0.0,
+                "rapid_lts": 0.0,
+                "rapid_count": 0,
+                "rapid_lcount": 0,
+                "rapid_icount": 0,
+                "rapid_rate": 0.0,
+            }
+            msg.wf.cache.set_endpoint_state(msg.vnid, msg.addr, state)
 
         # determine current complete local event
         local_event = None
@@ -789,9 +1085,10 @@ class eptWorker(object):
             # that allows update of learn_type when local_event does not exists.
             if last_learn_type is not None and last_learn_type=="epg" and learn_type!="epg":
                 logger.debug("updating learn_type from %s to %s", last_learn_type, learn_type)
-                self.db[eptEndpoint._classname].update(flt, 
+                msg.wf.writer.update_one(eptEndpoint._classname, flt, 
                     {"$set":{"learn_type": learn_type}}
                 )
+                state["learn_type"] = learn_type
             if last_event is not None and last_event.node > 0:
                 local_event = eptEndpointEvent.from_dict({
                     "ts":msg.ts, 
@@ -801,7 +1098,9 @@ class eptWorker(object):
                     "epg_name": last_event.epg_name,
                 })
                 logger.debug("adding delete event to endpoint table: %s", local_event)
-                msg.wf.push_event(eptEndpoint._classname,flt,local_event.to_dict(),per_node=False)
+                db_event = local_event.to_dict()
+                msg.wf.push_event(eptEndpoint._classname,flt,db_event,per_node=False)
+                state["events"] = [db_event] + state["events"][0:1]
                 ret.local_events.insert(0, local_event)
             else:
                 logger.debug("ignoring local delete event for XR/deleted/non-existing endpoint")
@@ -831,11 +1130,12 @@ class eptWorker(object):
             # if this is the first event, then set first_learn, count, and events in single update
             if last_event is None:
                 logger.debug("creating new entry in endpoint table: %s", local_event)
-                self.db[eptEndpoint._classname].update_one(flt, {"$set":{
+                msg.wf.writer.update_one(eptEndpoint._classname, flt, {"$set":{
                     "first_learn": db_event,
                     "events": [db_event],
                     "count": 1,
                 }})
+                state["events"] = [db_event]
                 ret.local_events.insert(0, local_event)
                 ret.analyze_move = True
                 ret.exists = True
@@ -859,7 +1159,9 @@ class eptWorker(object):
                         "epg_name": last_event.epg_name,
                     })
                     logger.debug("adding delete event to endpoint table: %s", de)
-                    msg.wf.push_event(eptEndpoint._classname,flt,de.to_dict(),per_node=False)
+                    de_event = de.to_dict()
+                    msg.wf.push_event(eptEndpoint._classname,flt,de_event,per_node=False)
+                    state["events"] = [de_event] + state["events"][0:1]
                     ret.local_events.insert(0, de)
                 else:
                     for a in ["node", "pctag", "encap", "intf_id", "rw_mac", "rw_bd"]:
@@ -872,24 +1174,27 @@ class eptWorker(object):
                     # check if learn_type has changed for this complete event
                     if last_learn_type is not None and last_learn_type!=learn_type:
                         logger.debug("learn type updated from %s to %s",last_learn_type,learn_type)
-                        self.db[eptEndpoint._classname].update(flt, 
+                        msg.wf.writer.update_one(eptEndpoint._classname, flt, 
                             {"$set":{"learn_type": learn_type}}
                         )
+                        state["learn_type"] = learn_type
                     if updated:
                         # if the previous entry was a delete and the current entry is not a delete, 
                         # then check for possible merge.
                         if last_event.node==0 and local_event.node>0 and ts_delta<=TRANSITORY_DELETE:
                             logger.debug("overwritting eptEndpoint [ts delta(%.3f) < %.3f] with: %s",
                                 ts_delta, TRANSITORY_DELETE, local_event)
-                            self.db[eptEndpoint._classname].update(flt, 
+                            msg.wf.writer.update_one(eptEndpoint._classname, flt, 
                                     {"$set":{"events.0": db_event}}
                                 )
+                            state["events"][0] = db_event
                             ret.local_events[0] = local_event
                             ret.analyze_move = True
                         # push new event to eptEndpoint events  
                         else:
                             logger.debug("adding event to eptEndpoint: %s", local_event)
                             msg.wf.push_event(eptEndpoint._classname, flt, db_event, per_node=False)
+                            state["events"] = [db_event] + state["events"][0:1]
                             ret.local_events.insert(0, local_event)
                             ret.analyze_move = True
                     else:
@@ -902,75 +1207,48 @@ class eptWorker(object):
         # return last local endpoint events
         return ret
 
-    def analyze_rapid(self, msg, cached_rapid, increment=True):
-        """ receive eptMsgWorkEpmEvent and rapidCachedEndpointObject and perform rapid analysis.
-            if endpoint has become rapid, then add event to eptRapid table and send to watcher for
-            notification and refresh. Update eptEndpoint counters at RAPID_CALCULATE_INTERVAL
+    def analyze_rapid(self, msg, rapid_slot):
+        """ receive eptMsgWorkEpmEvent and rapid engine slot and perform rapid analysis. The event
+            is recorded for the slot and the rates of all updated endpoints are refreshed if the
+            rapid tick interval has elapsed. For each endpoint that has become rapid, add event to 
+            eptRapid table and send to watcher for notification and refresh. 
 
             return true if is_rapid
         """
-        logger.debug("analyze rapid: %s", cached_rapid)
-        if cached_rapid.rapid_count == 0:
-            # this is new cached object that has not yet been initialized, always false
-            return False
-        # should never see counter wrap but just in case...
-        if cached_rapid.rapid_count < 0: cached_rapid.rapid_count = 0
-        force = False
-        ts_delta = msg.now - cached_rapid.rapid_lts
-        if cached_rapid.is_rapid:
-            # if currently rapid, then only check to see if rapid_holdtime has expired
-            if ts_delta > msg.wf.settings.rapid_holdtime:
-                logger.debug("clearing is_rapid flag (delta %.3f > %.3f)", ts_delta, 
-                                msg.wf.settings.rapid_holdtime)
-                cached_rapid.is_rapid = False
-                # force recalculate of is_rapid
-                force = True
-            else:
-                # always increment ignored count if is_rapid is set
-                cached_rapid.rapid_icount+=1
-                if increment:
-                    # increment set to false if update_local already updated count, else if pulled
-                    # from cache then need to manually increment
-                    cached_rapid.rapid_count+=1
-                return True
-
-        if ts_delta > RAPID_CALCULATE_INTERVAL or force:
-            # calculate new rate and determine if endpoint is_rapid
-            # note that threshold is measured as events per minute
-            rate = 60.0*(cached_rapid.rapid_count - cached_rapid.rapid_lcount)/ts_delta
-            cached_rapid.is_rapid = rate > msg.wf.settings.rapid_threshold
-            cached_rapid.rapid_lts = msg.now
-            cached_rapid.rapid_lcount = cached_rapid.rapid_count
-            if cached_rapid.is_rapid:
-                cached_rapid.is_rapid_ts = msg.now
-                # add event to eptRapid table 
-                # no duplicate check and ensure all values are set so upsert works
-                vnid_name = msg.wf.cache.get_vnid_name(cached_rapid.vnid)
-                msg.wf.push_event(eptRapid._classname, {
-                        "fabric": cached_rapid.fabric,
-                        "addr": cached_rapid.addr,
-                        "vnid": cached_rapid.vnid,
-                        "type": cached_rapid.type,
-                    }, {
-                        "ts": cached_rapid.rapid_lts,
-                        "count": cached_rapid.rapid_count,
-                        "rate": rate,
-                        "vnid_name": vnid_name,
-                    })
-                # send msg for WATCH_Rapid
-                mmsg = eptMsgWorkWatchRapid(cached_rapid.addr,"watcher",{
-                        "vnid": cached_rapid.vnid,
-                        "type": cached_rapid.type,
-                        "ts": cached_rapid.rapid_lts,
-                        "count": cached_rapid.rapid_count,
-                        "rate": rate,
-                    },WORK_TYPE.WATCH_RAPID, fabric=msg.fabric)
-                logger.debug("sending rapid event to watcher")
-                self.send_msg(mmsg)
-
-            logger.debug("rapid rate:%.3f, ts:%.3f, rapid:%r",rate,ts_delta,cached_rapid.is_rapid)
-            cached_rapid.save() 
-        return cached_rapid.is_rapid
+        rapid = msg.wf.cache.rapid
+        rapid.increment(rapid_slot)
+        slots = rapid.tick(msg.now, msg.wf.settings.rapid_threshold, 
+                            msg.wf.settings.rapid_holdtime)
+        msgs = []
+        for slot in slots:
+            (vnid, addr, addr_type) = rapid.keys[slot]
+            logger.debug("rapid endpoint 0x%06x %s, rate:%.3f", vnid, addr, rapid.rate[slot])
+            # add event to eptRapid table 
+            # no duplicate check and ensure all values are set so upsert works
+            vnid_name = msg.wf.cache.get_vnid_name(vnid)
+            msg.wf.push_event(eptRapid._classname, {
+                    "fabric": msg.fabric,
+                    "addr": addr,
+                    "vnid": vnid,
+                    "type": addr_type,
+                }, {
+                    "ts": rapid.lts[slot],
+                    "count": rapid.count[slot],
+                    "rate": rapid.rate[slot],
+                    "vnid_name": vnid_name,
+                })
+            # send msg for WATCH_Rapid
+            msgs.append(eptMsgWorkWatchRapid(addr,"watcher",{
+                    "vnid": vnid,
+                    "type": addr_type,
+                    "ts": rapid.lts[slot],
+                    "count": rapid.count[slot],
+                    "rate": rapid.rate[slot],
+                },WORK_TYPE.WATCH_RAPID, fabric=msg.fabric))
+        if len(msgs) > 0:
+            logger.debug("sending %s rapid events to watcher", len(msgs))
+            self.send_msg(msgs)
+        return rapid.is_rapid(rapid_slot)
 
     def analyze_move(self, msg, last_local):
         """ analyze move event for endpoint. If last two local events are non-deleted different 
@@ -1001,12 +1279,13 @@ class eptWorker(object):
             "vnid": msg.vnid,
             "addr": msg.addr,
         }
+        msg.wf.writer.flush(eptMove._classname, msg.vnid, msg.addr)
         db_move = self.db[eptMove._classname].find_one(flt, projection)
         if db_move is None:
             logger.debug("new move detected")
             endpoint_type = get_addr_type(msg.addr, msg.type)
-            eptMove(fabric=msg.fabric, vnid=msg.vnid, addr=msg.addr, type=endpoint_type,
-                    count=1, events=[move_event]).save(refresh=False)
+            msg.wf.writer.save(eptMove(fabric=msg.fabric, vnid=msg.vnid, addr=msg.addr, 
+                    type=endpoint_type, count=1, events=[move_event]))
         else:
             db_src = eptMoveEvent.from_dict(db_move["events"][0]["src"])
             db_dst = eptMoveEvent.from_dict(db_move["events"][0]["dst"])
@@ -1074,7 +1353,7 @@ class eptWorker(object):
             "vnid": msg.vnid,
             "addr": msg.addr,
         }
-        self.db[eptHistory._classname].update_many(flt, {"$set":{"is_offsubnet":False}})
+        msg.wf.writer.update_many(eptHistory._classname, flt, {"$set":{"is_offsubnet":False}})
         if len(offsubnet_nodes)>0:
             nlist = []
             for node in offsubnet_nodes:
@@ -1084,11 +1363,12 @@ class eptWorker(object):
                 # recent event.
                 offsubnet_nodes[node].ts = msg.ts
             flt["$or"] = nlist
-            self.db[eptHistory._classname].update_many(flt, {"$set":{"is_offsubnet":True}})
+            msg.wf.writer.update_many(eptHistory._classname, flt, {"$set":{"is_offsubnet":True}})
         # clear eptEndpoint is_offsubnet flag if not currently offsubnet on any node
         elif update_local_result.is_offsubnet:
             logger.debug("clearing eptEndpoint is_offsubnet flag")
-            self.db[eptEndpoint._classname].update_one(flt, {"$set":{"is_offsubnet":False}})
+            msg.wf.writer.update_one(eptEndpoint._classname, flt, {"$set":{"is_offsubnet":False}})
+            msg.wf.cache.update_endpoint_state(msg.vnid, msg.addr, is_offsubnet=False)
 
         # suppress the event to watcher if within suppress interval
         if len(offsubnet_nodes)>0:
@@ -1122,9 +1402,11 @@ class eptWorker(object):
                     msgs.append(wmsg)
                     # mark watch ts for suppression of future events
                     flt["node"] = node
-                    self.db[eptHistory._classname].update_one(flt, {"$set":{
+                    msg.wf.writer.update_one(eptHistory._classname, flt, {"$set":{
                         "watch_offsubnet_ts":msg.ts
                     }})
+                    if node in per_node_history_events:
+                        per_node_history_events[node][0].watch_offsubnet_ts = msg.ts
                 logger.debug("sending %s offsubnet events to watcher", len(msgs))
                 self.send_msg(msgs)
 
@@ -1265,7 +1547,7 @@ class eptWorker(object):
             "vnid": msg.vnid,
             "addr": msg.addr,
         }
-        self.db[eptHistory._classname].update_many(flt, {"$set":{"is_stale":False}})
+        msg.wf.writer.update_many(eptHistory._classname, flt, {"$set":{"is_stale":False}})
         if len(stale_nodes)>0:
             nlist = []
             for node in stale_nodes:
@@ -1275,12 +1557,13 @@ class eptWorker(object):
                 stale_nodes[node].ts = msg.ts
                 nlist.append({"node":node})
             flt["$or"] = nlist
-            self.db[eptHistory._classname].update_many(flt, {"$set":{"is_stale":True}})
+            msg.wf.writer.update_many(eptHistory._classname, flt, {"$set":{"is_stale":True}})
         # clear eptEndpoint is_stale flag if not currently stale on any node
         elif update_local_result.is_stale:
             logger.debug("clearing eptEndpoint is_stale flag")
             flt.pop("node",None)
-            self.db[eptEndpoint._classname].update_one(flt, {"$set":{"is_stale":False}})
+            msg.wf.writer.update_one(eptEndpoint._classname, flt, {"$set":{"is_stale":False}})
+            msg.wf.cache.update_endpoint_state(msg.vnid, msg.addr, is_stale=False)
 
         # suppress the event to watcher if within suppress interval
         if len(stale_nodes)>0:
@@ -1321,10 +1604,13 @@ class eptWorker(object):
                     msgs.append(wmsg)
                     # mark watch ts for suppression of future events
                     flt["node"] = node
-                    self.db[eptHistory._classname].update_one(flt, {"$set":{
+                    msg.wf.writer.update_one(eptHistory._classname, flt, {"$set":{
                         "watch_stale_ts": msg.ts,
                         "watch_stale_event": stale_nodes[node].to_dict()
                     }})
+                    if node in per_node_history_events:
+                        per_node_history_events[node][0].watch_stale_ts = msg.ts
+                        per_node_history_events[node][0].watch_stale_event = stale_nodes[node]
                 logger.debug("sending %s stale events to watcher", len(msgs))
                 self.send_msg(msgs)
 
@@ -1384,7 +1670,7 @@ class eptWorker(object):
 
     def handle_watch_rapid(self, msg):
         """ receive an eptMsgWorkRapid message and immediately performs notification action. If
-            refresh_rapid is enabled, then adds the object to watch_rapid dict with execute
+            refresh_rapid is enabled, then adds the object to watch_rapid heap with execute
             timestamp (xts) of msg.ts + eptSettings.rapid_holdtime + TRANSITORY_RAPID timer. If 
             object already exists it is overwritten with new watch event. This allows suppression
             of refresh events for endpoints that are continuously 'rapid' and waits until they 
@@ -1407,8 +1693,8 @@ class eptWorker(object):
             logger.debug("watch rapid added with xts: %.03f, delta: %.03f", msg.xts, msg.xts-msg.now)
 
     def handle_watch_offsubnet(self, msg):
-        """ recieves an eptMsgWorkWatchOffSubnet message and adds object to watch_offsubnet dict with 
-            execute timestamp (xts) of msg.ts + TRANSITORY_OFFSUBNET timer. If object already
+        """ recieves an eptMsgWorkWatchOffSubnet message and adds object to watch_offsubnet heap
+            with execute timestamp (xts) of msg.ts + TRANSITORY_OFFSUBNET timer. If object already
             exists it is overwritten with the new watch event.
         """
         key = "%s,%s,%s,%s" % (msg.fabric, msg.vnid, msg.addr, msg.node)
@@ -1418,7 +1704,7 @@ class eptWorker(object):
         logger.debug("watch offsubnet added with xts: %.03f, delta: %.03f", msg.xts, msg.xts-msg.now)
 
     def handle_watch_stale(self, msg):
-        """ recevie an eptMsgWorkWatchStale message and adds object to watch_stale dict with execute
+        """ recevie an eptMsgWorkWatchStale message and adds object to watch_stale heap with execute
             timestamp (xts) of msg.ts + TRANSITORY_STALE or TRANSITORY_STALE_NO_LOCAL timer.
             If object already exists it is overwritten with the new watch event.
         """
@@ -1440,23 +1726,24 @@ class eptWorker(object):
         self.execute_watch_rapid()
 
     def watcher_get_xts_ready(self, lock, msgs):
-        """ receive a lock and dict 'msgs' and pop off msgs that are ready to execute.
+        """ receive a lock and WatchHeap 'msgs' and pop off msgs that are ready to execute. Ready 
+            msgs for a paused fabric are added back to msgs and executed once the fabric resumes.
             return tuple (key, msg) of ready msgs
         """
         ts = time.time()
         work = []               # tuple of (key, msg) of watch event that is ready
         paused = {}             # count of work per fabric for accounting only
         with lock:
-            # get msg events that are ready, remove key from corresponding dict
-            for k, msg in msgs.items():
+            held = []
+            for (k, msg) in msgs.pop_ready(ts):
                 if msg.wf.watcher_paused:
                     if msg.fabric not in paused:
                         paused[msg.fabric] = 0
                     paused[msg.fabric]+=1
+                    held.append((k, msg))
                 else:
-                    if msg.xts <= ts: 
-                        work.append((k, msg))
-            for (k, msg) in work: msgs.pop(k, None)
+                    work.append((k, msg))
+            for (k, msg) in held: msgs[k] = msg
         if len(paused) > 0:
             for fab in paused:
                 logger.debug("paused %s watch events for fabric %s", paused[fab], fab)
@@ -1482,11 +1769,12 @@ class eptWorker(object):
                 if endpoint is not None:
                     is_rapid = endpoint["is_rapid"]
                     if is_rapid:
-                        ts_delta = time.time() - endpoint["rapid_lts"]
-                        rate = 0
-                        if ts_delta > 0:
-                            rate = 60.0*(endpoint["rapid_count"]-endpoint["rapid_lcount"])/ts_delta
-                            is_rapid = rate > msg.wf.settings.rapid_threshold
+                        # events within the window of the last saved rate expire as the window 
+                        # slides, use the share of the window still remaining
+                        ts_delta = max(0, time.time() - endpoint["rapid_lts"])
+                        rate = endpoint.get("rapid_rate", 0.0) * \
+                                max(0.0, 1.0 - ts_delta/RAPID_RATE_WINDOW)
+                        is_rapid = rate > msg.wf.settings.rapid_threshold
                         logger.debug("updating is_rapid to %r from current rate %.3f",is_rapid,rate)
                     if not is_rapid: 
                         logger.debug("is_rapid is False, requesting refresh")
@@ -1504,11 +1792,12 @@ class eptWorker(object):
                     logger.debug("endpoint not found in db")
 
     def execute_generic_watch(self, watch_type):
-        """ loop through all events in watch_type dict. for each event with xts ready check if 
+        """ loop through all events in watch_type heap. for each event with xts ready check if 
             watch_type (is_offsubnet/is_stale) value within corresponding eptHistory object is set.
             If true, update eptEndpoint (is_offsubnet/is_stale) attribute and then perform 
             configured notify and remediate actions.  Add object ept collection with dup check, 
             but perform remediation action unconditionally.
+            Ready events are verified in batches of WATCH_BATCH_SIZE (execute_generic_watch_batch)
         """
         if watch_type == "offsubnet":
             lock = self.watch_offsubnet_lock
@@ -1531,8 +1820,9 @@ class eptWorker(object):
             return
 
         if len(work) > 0:
-            clear_events = []   # list of clear tuples (cmd, key, reason, event)
+            clear_jobs = []     # list of eptRemediateJob
             logger.debug("execute %s ready watch %s events", len(work), watch_type)
+            batch = []
             for (key, msg) in work:
                 logger.debug("checking: %s", msg)
                 # check if key is in watch_rapid, if so ignore this event
@@ -1540,102 +1830,159 @@ class eptWorker(object):
                 if rapid_key in self.watch_rapid:
                     logger.debug("skipping execute event as endpoint is flagged as rapid")
                     continue
-                flt = {
-                    "fabric": msg.fabric,
-                    "vnid": msg.vnid,
-                    "addr": msg.addr,
-                    "node": msg.node,
-                }
-                projection = {
-                    ept_db_attr: 1,
-                    "events": {"$slice": 4},
-                }
-                h = self.db[eptHistory._classname].find_one(flt, projection)
-                if h is None or not h[ept_db_attr]:
-                    logger.debug("%s is false", ept_db_attr)
+                batch.append(msg)
+            for i in range(0, len(batch), WATCH_BATCH_SIZE):
+                clear_jobs.extend(self.execute_generic_watch_batch(watch_type,
+                    batch[i:i+WATCH_BATCH_SIZE], ept_db, ept_db_attr, event_class, remediate_attr))
+            # submit clear jobs to remediator, result is handled by remediate_complete
+            if len(clear_jobs) > 0:
+                logger.debug("submitting %s clear endpoint jobs", len(clear_jobs))
+                if self.remediator is None:
+                    self.remediator = eptRemediator()
+                    self.remediator.start()
+                for job in clear_jobs:
+                    self.remediator.submit(job)
+
+    def remediate_complete(self, job, success):
+        """ callback for eptRemediateJob submitted by execute_generic_watch. On successful clear,
+            add event to eptRemediate and send notification if enabled
+        """
+        if not success:
+            logger.debug("failed to clear endpoint: %s", job)
+            return
+        (key, ept_db_attr, event, wf) = job.data
+        reason = "stale" if ept_db_attr == "is_stale" else "offsubnet"
+        # executed on remediator thread, write immediately instead of using the fabric writer
+        wf.push_event(eptRemediate._classname, key, {
+            "ts": job.execute_ts,
+            "vnid_name": event.vnid_name,
+            "action": "clear",
+            "reason": reason,
+        }, immediate=True)
+        # send notification if enabled
+        subject = "auto-clear %s endpoint" % reason
+        txt = "auto-clear %s endpoint [fabric: %s, %s, addr: %s]" % (
+            reason,
+            key["fabric"],
+            event.vnid_name if len(event.vnid_name)>0 else "vnid:%d" % key["vnid"],
+            key["addr"],
+        )
+        wf.queue_notification("clear", subject, txt)
+
+    def execute_generic_watch_batch(self, watch_type, msgs, ept_db, ept_db_attr, event_class,
+            remediate_attr):
+        """ verify a batch of ready watch msgs for execute_generic_watch. The eptHistory objects 
+            and the last ept_db event of the batch are each read with a single query. The 
+            eptEndpoint updates and the new ept_db events are written with a single bulk write per
+            collection, after which the eptEndpoint cache flush is sent to the owning workers.
+            return list of eptRemediateJob for endpoints with remediation enabled
+        """
+        def get_flt(msg):
+            return {"fabric": msg.fabric, "vnid": msg.vnid, "addr": msg.addr, "node": msg.node}
+        def get_index(obj):
+            return (obj["fabric"], obj["vnid"], obj["addr"], obj["node"])
+
+        index_projection = {"fabric": 1, "vnid": 1, "addr": 1, "node": 1}
+        projection = {
+            ept_db_attr: 1,
+            "events": {"$slice": 4},
+        }
+        projection.update(index_projection)
+        history = {}
+        for h in self.db[eptHistory._classname].find({"$or": [get_flt(m) for m in msgs]}, 
+                                                        projection):
+            history[get_index(h)] = h
+        ready = []
+        for msg in msgs:
+            h = history.get(get_index(get_flt(msg)), None)
+            if h is None or not h.get(ept_db_attr, False):
+                logger.debug("%s is false for %s", ept_db_attr, msg.addr)
+            else:
+                ready.append(msg)
+        if len(ready) == 0:
+            return []
+
+        # last ept_db event for each endpoint used for dup check
+        projection = {"events": {"$slice": 1}}
+        projection.update(index_projection)
+        last_events = {}
+        for db_obj in self.db[ept_db._classname].find({"$or": [get_flt(m) for m in ready]},
+                                                        projection):
+            if "events" in db_obj and len(db_obj["events"]) > 0:
+                last_events[get_index(db_obj)] = event_class.from_dict(db_obj["events"][0])
+
+        clear_jobs = []
+        flush_msgs = []
+        writer = BulkWriter(self.db)
+        writer.start()
+        try:
+            for msg in ready:
+                flt = get_flt(msg)
+                h = history[get_index(flt)]
+                logger.debug("%s is true, updating eptEndpoint", ept_db_attr)
+                # update eptEndpoint object 
+                flt2 = copy.copy(flt)
+                flt2.pop("node",None)
+                writer.update_one(eptEndpoint._classname, flt2, {"$set":{ept_db_attr:True}})
+                # eptEndpoint state is cached by the worker that owns this address. Send the flush
+                # with the endpoint addr so it is delivered only to the owning worker
+                flush_msgs.append(eptMsgWork(msg.addr, "worker", {
+                    "cache": eptEndpoint._classname,
+                    "name": msg.wf.cache.get_key_str(vnid=msg.vnid, addr=msg.addr),
+                }, WORK_TYPE.FLUSH_CACHE, qnum=0, fabric=msg.fabric))
+
+                # for db push, the only non-key value not present is 'type' which we will set as a
+                # key to allow proper upsert functionality if object does not exists (upsert)
+                key = copy.copy(flt)
+                key["type"] = msg.type
+                event = event_class.from_dict(msg.event)
+
+                # dup check is two parts. dup flag is initialized to false and set to true if last 
+                # event is_duplicate of current event. dup flag can then be cleared if a delete has 
+                # occurred in eptHistory since the last event_class event. this is useful because
+                # watch events that are still offsubnet/stale are less frequently than analyze_stale
+                # or anaylze_offsubnet events. The hope is reads in the watch reduce reads in the
+                # worker nodes
+                is_duplicate = False
+                db_event = last_events.get(get_index(flt), None)
+                if db_event is not None and event.is_duplicate(db_event):
+                    is_duplicate = True
+                    # check if there was a delete since db_event
+                    for h_event in h["events"]:
+                        if h_event["ts"] > db_event.ts and h_event["status"] == "deleted":
+                            is_duplicate = False
+                            break
+                if is_duplicate:
+                    logger.debug("suppressing notification and db update for duplicate event")
                 else:
-                    logger.debug("%s is true, updating eptEndpoint", ept_db_attr)
-                    # update eptEndpoint object 
-                    flt2 = copy.copy(flt)
-                    flt2.pop("node",None)
-                    self.db[eptEndpoint._classname].update_one(flt2, {"$set":{ept_db_attr:True}})
-                    
-                    # for db push, the only non-key value not present is 'type' which we will set as
-                    # a key to allow proper upsert functionality if object does not exists (upsert)
-                    key = copy.copy(flt)
-                    key["type"] = msg.type
-                    event = event_class.from_dict(msg.event)
-
-                    # dup check is two parts. dup flag is initialized to false and set to true if
-                    # last event is_duplicate of current event. dup flag can then be cleared if 
-                    # a delete has occurred in eptHistory since the last event_class event. either 
-                    # ways we need to do a read of event_class.  this is useful because watch events
-                    # that are still offsubnet/stale are less frequently than analyze_stale or 
-                    # anaylze_offsubnet events. The hope is reads in the watch reduce reads in the 
-                    # worker nodes
-                    is_duplicate = False
-                    db_obj = self.db[ept_db._classname].find_one(flt,{"events":{"$slice":1}})
-                    if db_obj is not None and "events" in db_obj and len(db_obj["events"])>0:
-                        db_event = event_class.from_dict(db_obj["events"][0])
-                        if event.is_duplicate(db_event):
-                            is_duplicate = True
-                            # check if there was a delete since db_event
-                            for h_event in h["events"]:
-                                if h_event["ts"] > db_event.ts and h_event["status"] == "deleted":
-                                    is_duplicate = False
-                                    break
-                    if is_duplicate:
-                        logger.debug("suppressing notification and db update for duplicate event")
+                    msg.wf.push_event(ept_db._classname, key, event.to_dict(), writer=writer)
+                    # send notification if enabled
+                    subject = "%s event for %s" % (watch_type, msg.addr)
+                    txt = "%s event [fabric: %s, %s, addr: %s] %s" % (
+                        watch_type,
+                        msg.fabric,
+                        event.vnid_name if len(event.vnid_name)>0 else "vnid:%d" % msg.vnid,
+                        msg.addr,
+                        event.notify_string()
+                    )
+                    msg.wf.queue_notification(watch_type, subject, txt)
+
+                # even if duplicate, add to clear list if remediation is enabled
+                if getattr(msg.wf.settings, remediate_attr):
+                    logger.debug("%s enabled, adding endpoint to clear list", remediate_attr)
+                    if msg.type == "mac":
+                        (addr_type, vrf_name) = ("mac", "")
                     else:
-                        msg.wf.push_event(ept_db._classname, key, event.to_dict())
-                        # send notification if enabled
-                        subject = "%s event for %s" % (watch_type, msg.addr)
-                        txt = "%s event [fabric: %s, %s, addr: %s] %s" % (
-                            watch_type,
-                            msg.fabric,
-                            event.vnid_name if len(event.vnid_name)>0 else "vnid:%d" % msg.vnid,
-                            msg.addr,
-                            event.notify_string()
-                        )
-                        msg.wf.queue_notification(watch_type, subject, txt)
-
-                    # even if duplicate, add to clear list if remediation is enabled
-                    if getattr(msg.wf.settings, remediate_attr):
-                        logger.debug("%s enabled, adding endpoint to clear list", remediate_attr)
-                        cmd = "clear --fabric %s --pod %s --node %s --addr %s --vnid %s " % (
-                                msg.fabric,
-                                msg.wf.cache.get_pod_id(msg.node),
-                                msg.node,
-                                msg.addr,
-                                msg.vnid)
-                        if msg.type == "mac":
-                            cmd+= "--addr_type mac"
-                        else:
-                            cmd+= "--addr_type ip --vrf_name \"%s\""%parse_vrf_name(event.vnid_name)
-                        clear_events.append((cmd,key,ept_db_attr,event)) 
-            # perform clear action for all clear cmds
-            if len(clear_events) > 0:
-                logger.debug("executing %s clear endpoint commands", len(clear_events))
-                ts = time.time()
-                for (cmd, key, ept_db_attr, event) in clear_events:
-                    if execute_worker(cmd):
-                        # add event to eptRemediate and send notification if enabled
-                        reason = "stale" if ept_db_attr == "is_stale" else "offsubnet"
-                        msg.wf.push_event(eptRemediate._classname, key, {
-                            "ts": ts,
-                            "vnid_name": event.vnid_name,
-                            "action": "clear",
-                            "reason": reason,
-                        })
-                        # send notification if enabled
-                        subject = "auto-clear %s endpoint" % reason
-                        txt = "auto-clear %s endpoint [fabric: %s, %s, addr: %s]" % (
-                            reason,
-                            key["fabric"],
-                            event.vnid_name if len(event.vnid_name)>0 else "vnid:%d" % key["vnid"],
-                            key["addr"],
-                        )
-                        msg.wf.queue_notification("clear", subject, txt)
+                        (addr_type, vrf_name) = ("ip", parse_vrf_name(event.vnid_name) or "")
+                    clear_jobs.append(eptRemediateJob(msg.fabric, msg.wf.cache.get_pod_id(msg.node),
+                        msg.node, msg.vnid, msg.addr, addr_type=addr_type, vrf_name=vrf_name,
+                        callback=self.remediate_complete, data=(key, ept_db_attr, event, msg.wf)))
+        finally:
+            writer.stop()
+        logger.debug("watch %s batch of %s events, %s verified", watch_type, len(msgs), len(ready))
+        if len(flush_msgs) > 0:
+            self.send_msg(flush_msgs)
+        return clear_jobs
 
     def handle_endpoint_delete(self, msg):
         """ handle endpoint delete requests.  This needs to flush the local cache and delete all
@@ -1643,12 +1990,14 @@ class eptWorker(object):
             dependencies)
             caches:
                 rapid_cache
+                history_cache
+                endpoint_cache
         """
         logger.debug("deleting %s [0x%06x %s]", msg.fabric, msg.vnid, msg.addr)
-        # remove from local caches
+        # remove from local caches (rapid counters are not saved as the endpoint is deleted)
         cache = msg.wf.cache
-        key = cache.get_key_str(addr=msg.addr, vnid=msg.vnid)
-        cache.rapid_cache.remove(key)
+        cache.rapid.remove(msg.vnid, msg.addr, save=False)
+        cache.remove_endpoint_state(msg.vnid, msg.addr)
         # delete from db
         endpoint = eptEndpoint.load(fabric=msg.fabric, vnid=msg.vnid, addr=msg.addr)
         if endpoint.exists():
@@ -1672,14 +2021,33 @@ class eptWorker(object):
         """ receive eptMsgWork with WORK_TYPE.SETTINGS_RELOAD to reload local wf settings """
         logger.debug("reloading settings for fabric %s", msg.fabric)
         msg.wf.settings_reload()
+        # cached endpoint state depends on analysis settings (i.e., rapid counters), force db read
+        msg.wf.cache.handle_flush(eptEndpoint._classname)
+
+    def handle_cache_preload(self, msg):
+        """ receive eptMsgWork with WORK_TYPE.CACHE_PRELOAD and bulk load wf caches from db """
+        (count, duration) = msg.wf.cache.preload()
+        logger.info("preloaded %s cache entries for fabric %s in %.3f seconds", count, msg.fabric,
+                duration)
 
     def handle_epm_eof(self, msg):
-        """ receive eptMsgWork with WORK_TYPE.FABRIC_EPM_EOF and send ack back to subscriber """
+        """ receive eptMsgWork with WORK_TYPE.FABRIC_EPM_EOF and send ack back to subscriber. The 
+            eof is broadcast to each shard of a worker pool and the last shard to receive it sends
+            the ack on behalf of the pool.
+        """
         logger.debug("received epm eof for fabric %s", msg.fabric)
+        if self.pool_id is not None:
+            key = "%s#eof|%s" % (self.pool_id, msg.fabric)
+            pl = self.redis.pipeline()
+            pl.incr(key)
+            pl.expire(key, int(MAX_EPM_BUILD_TIME))
+            if pl.execute()[0] < self.shards:
+                return
+            self.redis.delete(key)
         self.redis.publish(SUBSCRIBER_CTRL_CHANNEL, 
             eptMsgSubOp(MSG_TYPE.FABRIC_EPM_EOF_ACK,data={
                 "fabric": msg.fabric,
-                "addr": self.worker_id,
+                "addr": self.worker_id if self.pool_id is None else self.pool_id,
                 }
             ).jsonify()
         )
@@ -1696,10 +2064,15 @@ class eptWorker(object):
         msg.wf.watcher_paused = False
 
     def handle_std_mo_event(self, msg):
-        """ receive eptMsgWork with WORK_TYPE.STD_MO and """
+        """ receive eptMsgWork with WORK_TYPE.STD_MO and sync corresponding dependency node. If std
+            mo events are being batched then the msg is queued until flush_std_mo_events
+        """
         classname = msg.data.keys()[0]
         attr = msg.data[classname]
         if classname in dependency_map:
+            if self.std_mo_events is not None:
+                self.std_mo_events.append(msg)
+                return
             logger.debug("triggering sync_event for dependency %s", classname)
             updates = dependency_map[classname].sync_event(msg.wf.fabric, attr, msg.wf.session)
             logger.debug("updated objects: %s", len(updates))
@@ -1709,6 +2082,37 @@ class eptWorker(object):
         else:
             logger.warn("%s not defined in dependency_map", classname)
 
+    def flush_std_mo_events(self):
+        """ sync all queued std mo events as a single batch per fabric and send one flush per 
+            updated ept collection and name
+        """
+        msgs = self.std_mo_events
+        self.std_mo_events = None
+        if msgs is None or len(msgs) == 0:
+            return
+        # list of (DependencyNode, attr) events per fabric in the order received
+        fabrics = {}
+        for msg in msgs:
+            if msg.fabric not in fabrics:
+                fabrics[msg.fabric] = (msg.wf, [])
+            classname = msg.data.keys()[0]
+            fabrics[msg.fabric][1].append((dependency_map[classname], msg.data[classname]))
+        for fabric in fabrics:
+            (wf, events) = fabrics[fabric]
+            try:
+                logger.debug("triggering sync_events for %s std mo events", len(events))
+                updates = sync_events(wf.fabric, events, wf.session)
+                logger.debug("updated objects: %s", len(updates))
+                flushed = set()
+                for u in updates:
+                    name = u.name if hasattr(u, "name") else None
+                    if (u._classname, name) not in flushed:
+                        flushed.add((u._classname, name))
+                        self.send_flush(u, name)
+            except Exception as e:
+                logger.debug("failed to sync std mo events for fabric %s", fabric)
+                logger.error("Traceback:\n%s", traceback.format_exc())
+
 
 class eptWorkerUpdateLocalResult(object):
     """ return object for eptWorker.update_loal method """
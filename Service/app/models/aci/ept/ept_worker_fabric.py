@@ -7,6 +7,8 @@ from .. utils import syslog
 from . common import NOTIFY_INTERVAL
 from . common import NOTIFY_QUEUE_MAX_SIZE
 from . common import BackgroundThread
+from . common import BulkWriter
+from . common import get_push_event_update
 from . common import push_event
 from . ept_cache import eptCache
 from . dns_cache import DNSCache
@@ -30,9 +32,13 @@ class eptWorkerFabric(object):
         self.fabric = fabric
         self.start_ts = time.time()
         self.settings = eptSettings.load(fabric=fabric, settings="default")
-        self.cache = eptCache(fabric)
+        self.cache = eptCache(fabric, settings=self.settings)
         self.dns_cache = DNSCache()
         self.db = get_db()
+        # unit of work for worker db writes, enabled by worker while processing a bulk of events.
+        # If a write fails then the cached endpoint state is no longer consistent with the db
+        self.writer = BulkWriter(self.db, error_callback=self.cache.remove_endpoint_state)
+        self.cache.writer = self.writer
         self.watcher_paused = False
         self.session = None
         self.notify_queue = None
@@ -91,6 +97,7 @@ class eptWorkerFabric(object):
         """ reload settings from db """
         logger.debug("reloading settings for %s", self.fabric)
         self.settings.reload()
+        self.cache.apply_settings(self.settings)
         self.init()
 
     def get_uptime_delta_offset(self, delta=None):
@@ -103,14 +110,23 @@ class eptWorkerFabric(object):
         if uptime_delta > 0: return uptime_delta
         return 0
 
-    def push_event(self, table, key, event, per_node=True):
+    def push_event(self, table, key, event, per_node=True, writer=None, immediate=False):
         # wrapper to push an event to eptHistory events list.  set per_node to false to use 
         # max_endpoint_event rotate length, else max_per_node_endpoint_events value is used
+        # if writer (default fabric writer) is enabled then the push is queued until the next flush
+        # set immediate to always write the push to the db (i.e., executed outside of the thread 
+        # using the fabric writer)
         if per_node:
-            return push_event(self.db[table], key, event, 
-                    rotate=self.settings.max_per_node_endpoint_events)
+            rotate = self.settings.max_per_node_endpoint_events
         else:
-            return push_event(self.db[table], key, event, rotate=self.settings.max_endpoint_events)
+            rotate = self.settings.max_endpoint_events
+        if not immediate:
+            if writer is None:
+                writer = self.writer
+            if writer.enabled:
+                return writer.update_one(table, key, get_push_event_update(event, rotate=rotate),
+                                            upsert=True)
+        return push_event(self.db[table], key, event, rotate=rotate)
 
     def get_learn_type(self, vnid, flags=[]):
         # based on provide vnid and flags return learn type for endpoint:
@@ -0,0 +1,113 @@
+from . common import MAX_SEND_MSG_LENGTH
+from . common import WORKER_PENDING_QUEUES
+from . common import add_work
+from . common import get_msg_fabric
+from . common import get_msg_hash
+from . common import get_pending_queue
+from . common import get_shard
+from . common import get_shard_id
+from . common import get_work_queue
+from . ept_msg import MSG_TYPE
+from . ept_msg import WIRE_FORMAT_COMPACT
+from . ept_msg import eptMsg
+from . ept_msg import eptMsgBulk
+from . ept_worker import eptWorker
+
+import logging
+import traceback
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+class eptWorkerPool(eptWorker):
+    """ worker pool registers with the manager as a single worker and splits the work received on
+        its queues across shard processes by address hash. Each shard is an eptWorker listening on
+        its own queues so a single container can use multiple cores without adding workers to the
+        manager hash ring. Msgs without an address (fabric start/stop, handoff, flush, eof, etc)
+        are sent to all shards.
+    """
+
+    def __init__(self, worker_id, shards=1):
+        super(eptWorkerPool, self).__init__(worker_id, "worker")
+        self.shards = shards
+        # queues for each shard, sorted by priority same as the registered queues
+        self.shard_queues = []
+        for s in xrange(0, self.shards):
+            shard_id = get_shard_id(self.worker_id, s)
+            self.shard_queues.append(["q%s_%s" % (qnum, shard_id) for qnum in range(0, 
+                                        len(self.queues))])
+
+    def _run(self):
+        """ listen for work on redis queues and dispatch to shard queues """
+        logger.debug("[%s] dispatching jobs on queues %s to %s shards", self, self.queues,
+                self.shards)
+        self.replay_work()
+        while True:
+            (q, data) = self.get_work()
+            self.dispatch_work(q, data)
+
+    def dispatch_work(self, q, data):
+        """ split msgs received on queue q across the shard queues of the same priority. The push
+            to the shard queues and the removal from the pending list are a single transaction.
+        """
+        pl = self.redis.pipeline()
+        try:
+            omsg = eptMsg.parse(data)
+            if omsg.msg_type == MSG_TYPE.BULK:
+                msg_list = omsg.msgs
+            else:
+                msg_list = [omsg]
+            base = self.work_queue_base.get(q, q)
+            if base in self.queue_stats:
+                self.increment_stats(base, tx=False, count=len(msg_list))
+            self.charge_work_queue(q, len(msg_list))
+            self.dispatch(pl, self.queues.index(base), msg_list)
+        except Exception as e:
+            logger.debug("failed to dispatch message from q: %s, data: %s", q, data)
+            logger.error("Traceback:\n%s", traceback.format_exc())
+        if WORKER_PENDING_QUEUES:
+            pl.lpop(get_pending_queue(q))
+        pl.execute()
+
+    def dispatch(self, pl, qnum, msgs):
+        """ add push of each msg to the shard queue owning its address to provided pipeline. The
+            order of msgs is maintained within each shard queue.
+        """
+        # dict indexed by shard queue with list of msgs
+        work = {}
+        for msg in msgs:
+            if msg.msg_type == MSG_TYPE.FABRIC_START:
+                self.add_work_fabric(msg.data["fabric"])
+            elif msg.msg_type == MSG_TYPE.FABRIC_STOP:
+                self.flush_shard_fabric(pl, msg.data["fabric"])
+            if msg.msg_type == MSG_TYPE.WORK and msg.addr != 0:
+                shards = [get_shard(get_msg_hash(msg), self.shards)]
+            else:
+                shards = range(0, self.shards)
+            fabric = get_msg_fabric(msg)
+            for s in shards:
+                sq = get_work_queue(self.shard_queues[s][qnum], fabric)
+                if sq not in work:
+                    work[sq] = []
+                work[sq].append(msg)
+        for sq in work:
+            for i in xrange(0, len(work[sq]), MAX_SEND_MSG_LENGTH):
+                bulk = eptMsgBulk()
+                bulk.msgs = work[sq][i:i+MAX_SEND_MSG_LENGTH]
+                if len(bulk.msgs) == 1:
+                    tx_msg = bulk.msgs[0]
+                else:
+                    bulk.seq = bulk.msgs[-1].seq
+                    tx_msg = bulk
+                add_work(pl, sq, eptMsg.encode(tx_msg, WIRE_FORMAT_COMPACT))
+
+    def flush_shard_fabric(self, pl, fabric):
+        """ add delete of fabric partition and pending list of each shard queue to pipeline. The
+            manager flushes the registered queues of the pool on fabric stop, the work already
+            dispatched to the shards is flushed by the pool.
+        """
+        logger.debug("[%s] flush fabric %s from shard queues", self, fabric)
+        for queues in self.shard_queues:
+            for q in queues:
+                fq = get_work_queue(q, fabric)
+                pl.delete(fq, get_pending_queue(fq))
@@ -2,7 +2,9 @@
 from .... import create_app
 from ... utils import setup_logger
 from .. utils import terminate_process
+from . common import get_shard_id
 from . ept_worker import eptWorker
+from . ept_worker_pool import eptWorkerPool
 from . ept_manager import eptManager
 from multiprocessing import Process
 
@@ -18,17 +20,26 @@ logger = logging.getLogger(__name__)
 
 def execute(role="aio", count=1, worker_id=None, restart=False, unique_log=True, debug_modules=[]):
     # execute a manager/worker/watcher or within all-in-one mode with process monitor capability 
-    # to restart on failure.
+    # to restart on failure. For role pool, a single worker is registered with count shard 
+    # processes and each process is restarted independently on failure.
   
-    def wrapper(wid, role):
+    def wrapper(wid, role, shard=None):
         # wrapper to start a manager/worker sub process with separate logfile if enabled
         if unique_log:
-            fname = "%s_%s.log" % (role, wid)
+            if shard is not None:
+                fname = "%s_%s.log" % (role, get_shard_id(wid, shard))
+            else:
+                fname = "%s_%s.log" % (role, wid)
             setup_logger(logger, fname=fname)
             for l in debug_modules:
                 setup_logger(logging.getLogger(l), fname=fname, thread=True)
         if role == "manager":
             ept = eptManager(wid)
+        elif role == "pool":
+            ept = eptWorkerPool(wid, shards=count)
+        elif role == "shard":
+            ept = eptWorker(get_shard_id(wid, shard), "worker", pool_id=wid, shard=shard, 
+                            shards=count)
         else:
             ept = eptWorker(wid, role=role)
         ept.run()
@@ -45,6 +56,11 @@ def execute(role="aio", count=1, worker_id=None, restart=False, unique_log=True,
                 ]
         elif role == "manager":
             return [ Process(target=wrapper, args=("m%s" % worker_id,"manager",)) ]
+        elif role == "pool":
+            return [ Process(target=wrapper, args=("w%s" % worker_id, "pool",)) ] + [
+                    Process(target=wrapper, args=("w%s" % worker_id, "shard", s,)) \
+                    for s in xrange(0, count)
+                ]
         else:
             base = "x" if role == "watcher" else "w"
             base_id = worker_id
@@ -71,7 +87,17 @@ def execute(role="aio", count=1, worker_id=None, restart=False, unique_log=True,
                 if not p.is_alive():
                     logger.error("process %s, pid(%s) not longer alive", i, p.pid)
                     all_alive = False
-            if not all_alive:
+            if not all_alive and role == "pool" and restart:
+                # restart only the failed pool processes, the pool registration is unchanged as
+                # long as the pool restarts within the hello timeout
+                new_processes = get_processes()
+                for i, p in enumerate(processes):
+                    if not p.is_alive():
+                        terminate_process(p)
+                        processes[i] = new_processes[i]
+                        processes[i].start()
+                        logger.info("restarted process %s with pid: %s", i, processes[i].pid)
+            elif not all_alive:
                 for p in processes: 
                     terminate_process(p)
                 # get new process objects and start them
@@ -96,10 +122,11 @@ if __name__ == "__main__":
     parser.add_argument("--all-in-one", dest="aio", action="store_true", 
             help="run AIO(all-in-one) mode")
     parser.add_argument("--count", dest="count", type=int, default=1,
-            help="worker count in AIO or role 'worker' where multiple workers per container")
+            help="worker count in AIO or role 'worker' where multiple workers per container, or"
+            " shard count for role 'pool'")
     parser.add_argument("--id", dest="worker_id", type=int, help="unique id for this worker")
     parser.add_argument("--role", dest="role", help="worker role", default="worker",
-        choices=["manager", "watcher", "worker"])
+        choices=["manager", "watcher", "worker", "pool"])
     parser.add_argument("--restart", dest="restart", type=bool, default=None,
             help="auto restart on failure")
     parser.add_argument("--stdout", dest="stdout", action="store_true", help="send logs to stdout")
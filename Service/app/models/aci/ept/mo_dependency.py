@@ -29,6 +29,7 @@ class DependencyNode(object):
         self.ept_attributes = {}
         self.ept_regex_map = {}
         self.ept_key = None
+        self.ept_mapper = EptMapper({})
         self.callback = None
 
     def __repr__(self):
@@ -83,6 +84,7 @@ class DependencyNode(object):
                 self.ept_key = key
             if self.ept_key not in self.ept_attributes:
                 self.ept_attributes[self.ept_key] = self.ept_key
+            self.ept_mapper = EptMapper(self.ept_attributes, self.ept_regex_map)
         else:
             logger.debug("received map for %s without db or attributes", self.classname)
         if callback is not None:
@@ -97,11 +99,7 @@ class DependencyNode(object):
             setattr(mo, "ept", None)
         else:
             key = {"fabric": mo.fabric}
-            if isinstance(self.ept_attributes[self.ept_key], moAttrHandler):
-                val = self.ept_attributes[self.ept_key].get_value(self.ept_key, mo, [])
-            else:
-                val = getattr(mo, self.ept_attributes[self.ept_key])
-            key[self.ept_key] = val
+            key[self.ept_key] = self.ept_mapper.get_key(self.ept_key, mo)
             logger.debug("setting keys: %s", key)
             setattr(mo, "ept", self.ept_db.load(**key))
 
@@ -128,54 +126,17 @@ class DependencyNode(object):
                 # force updated to true if ept object does not exist
                 if not ept.exists(): updated = True
                 try:
-                    for a, mo_attr in self.ept_attributes.items():
+                    for a, val in self.ept_mapper.map_mo(mo, mo_parents):
                         if not hasattr(ept, a):
                             logger.warn("skipping unknown attribute %s in ept %s",a,ept._classname)
                             continue
-                        # mo_attribute in one of the following formats:
-                        #   attribute               - indicating string name of mo attribute
-                        #   classname.attribute     - indicating parent class and parent attribute
-                        #   moAttrHandler           - moAttrHandler for custom handler
-                        #   list[ ... ]             - list of options
-                        val = None
-                        if isinstance(mo_attr, moAttrHandler):
-                            val = mo_attr.get_value(a, mo, mo_parents)
-                        else:
-                            if type(mo_attr) is not list: mo_attr = [mo_attr]
-                            for mo_a in mo_attr:
-                                mo_a_split = mo_a.split(".")
-                                if len(mo_a_split) == 1:
-                                    if hasattr(mo, mo_a_split[0]):
-                                        val = getattr(mo, mo_a_split[0])
-                                    else:
-                                        logger.warn("cannot map mo attr: %s, %s",mo._classname,mo_a)
-                                    break
-                                elif len(mo_a_split) == 2:
-                                    pclass = mo_a_split[0]
-                                    pattr = mo_a_split[1]
-                                    if pclass in mo_parents:
-                                        parent = mo_parents[pclass]
-                                        if hasattr(parent, mo_a_split[1]):
-                                            val = getattr(parent, mo_a_split[1])
-                                        else:
-                                            logger.warn("cannot map parent mo attr: %s", mo_a)
-                                        break
-                                else:
-                                    logger.error("unexpected/unsupported mo attribute: %s", mo_a)
-                        if val is not None:
-                            if a in self.ept_regex_map:
-                                r1 = re.search(self.ept_regex_map[a], val)
-                                if r1 is not None and "value" in r1.groupdict():
-                                    val = r1.group("value")
-                                else:
-                                    logger.warn("failed to extract value for %s, regex: %s, from %s", 
-                                        a, self.ept_regex_map[a], val)
-                        else:
+                        if val is None:
                             # val of none implies an unmapped attribute. This implies that a 
                             # dependency was not resolved which is common when objects are deleted.  
                             # Will force a value of '0' for all unmapped depenency
                             logger.debug("%s(%s) '%s' from %s not found, setting to 0", 
-                                ept._classname, getattr(ept, self.ept_key), a, mo_attr)
+                                ept._classname, getattr(ept, self.ept_key), a, 
+                                self.ept_attributes[a])
                             val = 0
 
                         # need to cast mo value to expected value in ept object. If cast fails then
@@ -232,15 +193,37 @@ class DependencyNode(object):
         #logger.debug("full event: %s", attr)
         updates = []
         mo = self.cls_mo.load(fabric=fabric, dn=attr["dn"])
+        if not self.sync_mo(mo, attr, session=session):
+            return updates
+
+        # get ept object along with parent and child dependencies 
+        self.set_ept_object(mo)
+        logger.debug("getting mo dependents for %s(%s)", mo._classname, mo.dn)
+        ts1 = time.time()
+        parents = self.get_parent_objects(mo)
+        ts2 = time.time()
+        setattr(mo, "children", self.get_child_objects(mo))
+        ts3 = time.time()
+        logger.debug("mo timing total: %.3f, parent(%s): %.3f, child(%s): %0.3f", ts3-ts1, 
+                len(parents), ts2-ts1, len(mo.children), ts3-ts2) 
+
+        # update local ept object
+        return self.sync_mo_to_ept(mo, parents)
+
+    def sync_mo(self, mo, attr, session=None):
+        """ update local mo object from subscription event attributes. Return True if the mo was
+            created, modified, or deleted and dependent ept objects need to be synced.
+        """
         if mo.exists() and mo.ts > attr["_ts"]:
             logger.debug("ignoring old %s event (%.3f > %.3f)", self.classname, mo.ts, attr["_ts"])
-            return updates
+            return False
 
         # perform manual refresh for non-trusting mo or non-existing mo with modify event
         if not mo.TRUST_SUBSCRIPTION or attr["status"] == "modified" and not mo.exists():
             logger.debug("mo dependency sync performing api refresh for dn: %s", attr["dn"])
             if session is None:
-                raise Exception("no session object provided for sync event: %s, %s" %(fabric, attr))
+                raise Exception("no session object provided for sync event: %s, %s" % (
+                    mo.fabric, attr))
             full_attr = get_attributes(session=session, dn=attr["dn"])
             if full_attr is None:
                 logger.debug("failed to refresh dn, assuming deleted: %s", attr["dn"])
@@ -254,7 +237,7 @@ class DependencyNode(object):
             if not mo.exists():
                 logger.debug("ignoring delete event for non-existing mo: %s, %s", mo._classname, 
                         attr["dn"])
-                return updates
+                return False
             logger.debug("delete event removing mo object(%s): %s", mo._classname, mo.dn)
             mo.remove()
         else:
@@ -271,21 +254,8 @@ class DependencyNode(object):
 
             if not mo_update:
                 # no local mo update so no ept object change or child dependencies can change
-                return updates
-
-        # get ept object along with parent and child dependencies 
-        self.set_ept_object(mo)
-        logger.debug("getting mo dependents for %s(%s)", mo._classname, mo.dn)
-        ts1 = time.time()
-        parents = self.get_parent_objects(mo)
-        ts2 = time.time()
-        setattr(mo, "children", self.get_child_objects(mo))
-        ts3 = time.time()
-        logger.debug("mo timing total: %.3f, parent(%s): %.3f, child(%s): %0.3f", ts3-ts1, 
-                len(parents), ts2-ts1, len(mo.children), ts3-ts2) 
-
-        # update local ept object
-        return self.sync_mo_to_ept(mo, parents)
+                return False
+        return True
 
     def get_parent_objects(self, mo):
         # return dict indexed by classname of each parent.  Note, each classname can only be one
@@ -363,8 +333,294 @@ class DependencyNode(object):
         #    logger.debug("no children for %s", mo.dn)
         return ret
 
+    def get_parent_objects_batch(self, mos):
+        # return list with parent dict for each mo in provided list of mo objects of this node (see
+        # get_parent_objects). A single $in query is performed per connector and dependency level
+        # for all mo objects. All mo objects must belong to the same fabric.
+        ret = [{} for mo in mos]
+        if len(mos) == 0:
+            return ret
+        fabric = mos[0].fabric
+        try:
+            # index of mo objects with no matched parent
+            pending = range(0, len(mos))
+            for connector in self.parents:
+                if len(pending) == 0:
+                    break
+                classname = connector.remote_node.classname
+                values = set([getattr(mos[i], connector.local_attr) for i in pending])
+                key = {
+                    "fabric": fabric,
+                    connector.remote_attr: {"$in": list(values)},
+                }
+                # an instance of an object will only ever have one parent, so first match is
+                # sufficient
+                matched = {}
+                for p_mo in connector.remote_node.cls_mo.find(**key):
+                    value = getattr(p_mo, connector.remote_attr)
+                    if value not in matched:
+                        setattr(p_mo, "dependency", connector.remote_node)
+                        matched[value] = p_mo
+                if len(matched) == 0:
+                    continue
+                p_mos = matched.values()
+                p_rets = dict(zip([getattr(p, connector.remote_attr) for p in p_mos], 
+                            connector.remote_node.get_parent_objects_batch(p_mos)))
+                unmatched = []
+                for i in pending:
+                    value = getattr(mos[i], connector.local_attr)
+                    if value in matched:
+                        ret[i].update(p_rets[value])
+                        ret[i][classname] = matched[value]
+                    else:
+                        unmatched.append(i)
+                pending = unmatched
+        except Exception as e:
+            logger.error("Traceback:\n%s", traceback.format_exc())
+        return ret
+
+    def get_child_objects_batch(self, mos):
+        # return list with children list for each mo in provided list of mo objects of this node
+        # (see get_child_objects). A single $in query is performed per connector and dependency 
+        # level for all mo objects. All mo objects must belong to the same fabric.
+        ret = [[] for mo in mos]
+        if len(mos) == 0:
+            return ret
+        fabric = mos[0].fabric
+        try:
+            for connector in self.children:
+                values = set([getattr(mo, connector.local_attr) for mo in mos])
+                key = {
+                    "fabric": fabric,
+                    connector.remote_attr: {"$in": list(values)},
+                }
+                c_mos = connector.remote_node.cls_mo.find(**key)
+                if len(c_mos) == 0:
+                    continue
+                # children indexed by connector remote attribute value
+                matched = {}
+                for c in c_mos:
+                    setattr(c, "dependency", connector.remote_node)
+                    connector.remote_node.set_ept_object(c)
+                    value = getattr(c, connector.remote_attr)
+                    if value not in matched:
+                        matched[value] = []
+                    matched[value].append(c)
+                c_children = connector.remote_node.get_child_objects_batch(c_mos)
+                for c, children in zip(c_mos, c_children):
+                    setattr(c, "children", children)
+                for i, mo in enumerate(mos):
+                    ret[i].extend(matched.get(getattr(mo, connector.local_attr), []))
+        except Exception as e:
+            logger.error("Traceback:\n%s", traceback.format_exc())
+        return ret
+
+def coalesce_events(events):
+    """ coalesce list of (DependencyNode, attr) subscription events into a single event per dn in
+        the order the dn was first seen. Attributes of created/modified events are merged with the
+        latest value, a delete replaces all previous events, and a created event following a 
+        delete replaces the delete.
+    """
+    ret = {}
+    order = []
+    for node, attr in events:
+        key = (node.classname, attr["dn"])
+        if key not in ret:
+            order.append(key)
+            ret[key] = (node, dict(attr))
+            continue
+        prev = ret[key][1]
+        if attr["status"] == "deleted" or prev["status"] == "deleted":
+            ret[key] = (node, dict(attr))
+        else:
+            merged = dict(prev)
+            merged.update(attr)
+            if prev["status"] == "created":
+                merged["status"] = "created"
+            ret[key] = (node, merged)
+    return [ret[key] for key in order]
+
+def sync_events(fabric, events, session=None):
+    """ batch version of DependencyNode.sync_event for a list of (DependencyNode, attr) events. 
+        Events are coalesced per dn and the mo objects of each class are loaded with a single query.
+        Once all mo objects are updated, the parents and children of all updated mo objects of each
+        class are resolved with $in queries per dependency level.
+        return list of ept objects that were updated (an ept object may be included more than once)
+    """
+    events = coalesce_events(events)
+    logger.debug("sync %s coalesced events (fabric:%s)", len(events), fabric)
+    # events grouped by DependencyNode in the order the class was first seen
+    nodes = []
+    node_events = {}
+    for node, attr in events:
+        if node.classname not in node_events:
+            nodes.append(node)
+            node_events[node.classname] = []
+        node_events[node.classname].append(attr)
+
+    # sync all mo objects to local db before resolving any dependencies
+    ts1 = time.time()
+    node_mos = {}
+    for node in nodes:
+        node_mos[node.classname] = []
+        dns = [attr["dn"] for attr in node_events[node.classname]]
+        mos = {}
+        for mo in node.cls_mo.find(fabric=fabric, dn={"$in": dns}):
+            mos[mo.dn] = mo
+        for attr in node_events[node.classname]:
+            mo = mos.get(attr["dn"], None)
+            if mo is None:
+                mo = node.cls_mo(fabric=fabric, dn=attr["dn"])
+            try:
+                if node.sync_mo(mo, attr, session=session):
+                    node.set_ept_object(mo)
+                    node_mos[node.classname].append(mo)
+            except Exception as e:
+                logger.error("Traceback:\n%s", traceback.format_exc())
+
+    # resolve dependencies for all updated mo objects and sync to ept objects
+    ts2 = time.time()
+    updates = []
+    count = 0
+    for node in nodes:
+        mos = node_mos[node.classname]
+        count+= len(mos)
+        parents = node.get_parent_objects_batch(mos)
+        for mo, children in zip(mos, node.get_child_objects_batch(mos)):
+            setattr(mo, "children", children)
+        for mo, mo_parents in zip(mos, parents):
+            updates+= node.sync_mo_to_ept(mo, mo_parents)
+    ts3 = time.time()
+    logger.debug("mo batch timing total: %.3f, mo(%s): %.3f, dependents(%s): %.3f", ts3-ts1, 
+            len(events), ts2-ts1, count, ts3-ts2)
+    return updates
+
 
        
+class EptMapper(object):
+    """ mapping of mo attributes to ept object attributes compiled once per class mapping. Each
+        ept attribute is compiled into a getter function with its regex precompiled so that
+        mapping an object does not need to parse the attribute map or regex strings. 
+            attributes is dict mapping ept db attribute to mo db attribute (see set_ept_map)
+            regex_map is dict mapping ept db attribute to regex with named group 'value'
+    """
+    def __init__(self, attributes, regex_map=None):
+        if regex_map is None:
+            regex_map = {}
+        self.attributes = attributes
+        self.regex = {}
+        for a in regex_map:
+            self.regex[a] = re.compile(regex_map[a])
+            if "value" not in self.regex[a].groupindex:
+                logger.warn("regex for %s does not contain 'value' group: %s", a, regex_map[a])
+        # list of (ept attribute, getter, regex) for mapping mo objects
+        mo_map = []
+        # lists of (ept attribute, mo attribute) and (ept attribute, mo attribute, regex) for 
+        # mapping raw dict attributes. Only 'plain' string attributes can be mapped from raw dict
+        raw_map = []
+        raw_regex_map = []
+        for a, mo_attr in attributes.items():
+            regex = self.regex.get(a, None)
+            mo_map.append((a, EptMapper.compile_getter(a, mo_attr), regex))
+            if isinstance(mo_attr, basestring):
+                if regex is None:
+                    raw_map.append((a, mo_attr))
+                else:
+                    raw_regex_map.append((a, mo_attr, regex))
+        self.mo_map = tuple(mo_map)
+        self.raw_map = tuple(raw_map)
+        self.raw_regex_map = tuple(raw_regex_map)
+
+    @staticmethod
+    def compile_getter(a, mo_attr):
+        """ return getter function for ept attribute a that accepts mo object and mo_parents dict
+            and returns the mapped value or None if the value could not be resolved. mo_attr is in
+            one of the following formats:
+                attribute               - indicating string name of mo attribute
+                classname.attribute     - indicating parent class and parent attribute
+                moAttrHandler           - moAttrHandler for custom handler
+                list[ ... ]             - list of options, first resolved option is used
+        """
+        if isinstance(mo_attr, moAttrHandler):
+            def handler_getter(mo, mo_parents):
+                return mo_attr.get_value(a, mo, mo_parents)
+            return handler_getter
+        if type(mo_attr) is not list:
+            mo_attr = [mo_attr]
+        # list of (parent classname or None for local attribute, attribute name)
+        options = []
+        for mo_a in mo_attr:
+            mo_a_split = mo_a.split(".")
+            if len(mo_a_split) == 1:
+                # local attribute is always resolved so remaining options are never checked
+                options.append((None, mo_a_split[0]))
+                break
+            elif len(mo_a_split) == 2:
+                options.append((mo_a_split[0], mo_a_split[1]))
+            else:
+                logger.error("unexpected/unsupported mo attribute: %s", mo_a)
+        options = tuple(options)
+        def getter(mo, mo_parents):
+            for pclass, pattr in options:
+                if pclass is None:
+                    if hasattr(mo, pattr):
+                        return getattr(mo, pattr)
+                    logger.warn("cannot map mo attr: %s, %s", mo._classname, pattr)
+                    return None
+                elif pclass in mo_parents:
+                    if hasattr(mo_parents[pclass], pattr):
+                        return getattr(mo_parents[pclass], pattr)
+                    logger.warn("cannot map parent mo attr: %s.%s", pclass, pattr)
+                    return None
+            return None
+        return getter
+
+    def get_key(self, a, mo):
+        """ return value of ept attribute a from mo object without parents or regex """
+        for ept_a, getter, regex in self.mo_map:
+            if ept_a == a:
+                return getter(mo, {})
+        return None
+
+    def map_mo(self, mo, mo_parents):
+        """ return list of (ept attribute, value) tuples from mo object and mo_parents dict. The
+            value is None if it could not be resolved. If the regex for the attribute does not
+            match then the unmodified value is returned.
+        """
+        ret = []
+        for a, getter, regex in self.mo_map:
+            val = getter(mo, mo_parents)
+            if val is not None and regex is not None:
+                r1 = regex.search(val)
+                if r1 is not None and "value" in regex.groupindex:
+                    val = r1.group("value")
+                else:
+                    logger.warn("failed to extract value for %s, regex: %s, from %s", a, 
+                        regex.pattern, val)
+            ret.append((a, val))
+        return ret
+
+    def map_raw(self, attr):
+        """ return dict of ept attributes mapped from raw dict of mo attributes. Only attributes
+            present in attr are mapped. An empty dict is returned if any regex does not match.
+        """
+        db_obj = {}
+        for a, o_attr in self.raw_map:
+            if o_attr in attr:
+                db_obj[a] = attr[o_attr]
+        for a, o_attr, regex in self.raw_regex_map:
+            if o_attr in attr:
+                r1 = regex.search(attr[o_attr])
+                if r1 is None:
+                    logger.warn("%s value %s does not match regex %s", o_attr, attr[o_attr], 
+                        regex.pattern)
+                    return {}
+                if "value" in regex.groupindex:
+                    db_obj[a] = r1.group("value")
+                else:
+                    db_obj[a] = attr[o_attr]
+        return db_obj
+
 class moAttrHandler(object):
     """ custom attribute handler that supports a get_value function with attribute name, mo object,
         and mo_parents list and returns value for the attribute
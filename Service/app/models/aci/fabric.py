@@ -12,6 +12,7 @@ from . import utils as aci_utils
 from . ept.ept_msg import eptMsg
 from . ept.ept_msg import MSG_TYPE
 from . ept.common import MANAGER_CTRL_CHANNEL 
+from . ept.common import get_sync_key
 
 from flask import abort
 from flask import jsonify
@@ -216,6 +217,8 @@ class Fabric(Rest):
         try:
             if len(reason) == 0: reason = "API requested stop"
             redis = get_redis()
+            # force full build on next start
+            redis.delete(get_sync_key(self.fabric))
             data={"fabric":self.fabric, "reason":reason}
             msg = eptMsg(MSG_TYPE.FABRIC_STOP,data=data)
             redis.publish(MANAGER_CTRL_CHANNEL, msg.jsonify())
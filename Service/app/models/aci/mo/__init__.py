@@ -1,4 +1,5 @@
 from ... rest import Rest
+from .. ept.common import BUILD_CHUNK_SIZE
 from .. utils import get_class
 from .. utils import get_apic_session
 
@@ -55,26 +56,120 @@ class ManagedObject(Rest):
         return ret
 
     @classmethod
-    def rebuild(cls, fabric, session=None):
+    def rebuild(cls, fabric, session=None, sync=None):
         """ rebuild collection 
             requires instance of Fabric object and optional session object for queries
+            sync is an optional dict with the sync record from the previous rebuild. If the record
+            contains a modTs watermark then a delta rebuild is attempted (see delta_rebuild) and a
+            full rebuild is only performed if the delta cannot be determined. On success, the sync
+            record is updated with the current watermark, object count, and number of changed 
+            objects (None after a full rebuild).
             return bool success
         """
         classname = cls.__name__
-        logger.debug("db rebuild of '%s'", classname)
-        cls.delete(_filters={"fabric":fabric.fabric})
-
         if session is None:
             session = get_apic_session(fabric)
             if session is None:
                 logger.warn("failed to get apic session for fabric %s", fabric.fabric)
                 return False
 
-        data = get_class(session, classname)
+        if sync is not None and sync.get("modTs", None) is not None:
+            ret = cls.delta_rebuild(fabric, session, sync)
+            if ret is not None:
+                return ret
+            logger.debug("unable to determine delta for '%s', performing full rebuild", classname)
+
+        # objects are streamed from the MIT and upserted in chunks tagged with a build generation.
+        # Objects from previous generations are removed after all chunks are saved so the
+        # collection is never empty during the rebuild.
+        logger.debug("db rebuild of '%s'", classname)
+        upsert = {"_gen": time.time()}
+        bulk_objects = []
+        count = 0
+        modTs = ""
+        for obj in get_class(session, classname, stream=True):
+            if obj is None:
+                logger.warn("failed to get data for classname %s", classname)
+                return False
+            bulk_objects.extend(cls.get_db_objects(fabric, [obj]))
+            if len(bulk_objects) >= BUILD_CHUNK_SIZE:
+                cls.bulk_save(bulk_objects, skip_validation=not cls.VALIDATE, upsert=upsert)
+                modTs = max(modTs, get_max_modTs(bulk_objects))
+                count+= len(bulk_objects)
+                bulk_objects = []
+        if len(bulk_objects)>0:
+            cls.bulk_save(bulk_objects, skip_validation=not cls.VALIDATE, upsert=upsert)
+            modTs = max(modTs, get_max_modTs(bulk_objects))
+            count+= len(bulk_objects)
+        elif count == 0:
+            logger.debug("no objects of %s to insert", classname)
+        cls.delete(_filters={"fabric":fabric.fabric, "_gen": {"$ne": upsert["_gen"]}})
+        if sync is not None:
+            sync["modTs"] = modTs
+            sync["count"] = count
+            sync["changed"] = None
+        return True
+
+    @classmethod
+    def delta_rebuild(cls, fabric, session, sync):
+        """ reconcile collection with the objects modified in the MIT since the modTs watermark of
+            the provided sync record. The count of objects in the MIT is compared with the local
+            collection to determine if any objects were deleted, and only when the counts do not
+            match are the dns of all objects (naming-only) queried to find the deleted objects.
+            return bool success or None if the delta cannot be determined
+        """
+        classname = cls.__name__
+        if len(sync["modTs"]) == 0:
+            return None
+        logger.debug("db delta rebuild of '%s' since %s", classname, sync["modTs"])
+        local = set([o.dn for o in cls.find(fabric=fabric.fabric, _projection={"dn":1})])
+        data = get_class(session, classname, queryTargetFilter="gt(%s.modTs,\"%s\")" % (
+                    classname, sync["modTs"]))
         if data is None:
-            logger.warn("failed to get data for classname %s", classname)
+            logger.warn("failed to get modified data for classname %s", classname)
+            return False
+        modified = cls.get_db_objects(fabric, data)
+        count = get_count(session, classname)
+        if count is None:
+            logger.warn("failed to get count for classname %s", classname)
             return False
 
+        # all objects created since the previous sync are returned as modified, so a count mismatch
+        # indicates one or more local objects were deleted from the MIT
+        created = [o.dn for o in modified if o.dn not in local]
+        deleted = []
+        if len(local) + len(created) != count:
+            data = get_class(session, classname, rspPropInclude="naming-only")
+            if data is None:
+                logger.warn("failed to get naming-only data for classname %s", classname)
+                return False
+            remote = set()
+            for obj in data:
+                if type(obj) is dict and len(obj)>0:
+                    attr = obj.values()[0].get("attributes", {})
+                    if "dn" in attr:
+                        remote.add(attr["dn"])
+            # an object created in the MIT that was not returned as modified cannot be reconciled
+            if len(remote - local - set(created)) > 0:
+                return None
+            deleted = list(local - remote)
+
+        logger.debug("delta rebuild of '%s', modified: %s, created: %s, deleted: %s", classname,
+                len(modified), len(created), len(deleted))
+        stale = deleted + [o.dn for o in modified if o.dn in local]
+        if len(stale) > 0:
+            cls.delete(_filters={"fabric":fabric.fabric, "dn": {"$in": stale}})
+        if len(modified) > 0:
+            cls.bulk_save(modified, skip_validation=not cls.VALIDATE)
+        sync["modTs"] = max(sync["modTs"], get_max_modTs(modified))
+        sync["count"] = count
+        sync["changed"] = len(modified) + len(deleted)
+        return True
+
+    @classmethod
+    def get_db_objects(cls, fabric, data):
+        """ return list of instances of this class from class query result """
+        classname = cls.__name__
         ts = time.time()
         bulk_objects = []
         for obj in data:
@@ -90,11 +185,30 @@ class ManagedObject(Rest):
                             if a in attr:
                                 db_obj[a] = attr[a]
                         bulk_objects.append(cls(**db_obj))
-        if len(bulk_objects)>0:
-            cls.bulk_save(bulk_objects, skip_validation=not cls.VALIDATE)
-        else:
-            logger.debug("no objects of %s to insert", classname)
-        return True
+        return bulk_objects
+
+def get_count(session, classname):
+    """ return number of objects of classname within the MIT or None on error """
+    data = get_class(session, classname, rspSubtreeInclude="count")
+    if data is not None:
+        for obj in data:
+            if type(obj) is dict and "moCount" in obj:
+                try:
+                    return int(obj["moCount"]["attributes"]["count"])
+                except (KeyError, ValueError) as e:
+                    logger.warn("invalid count for classname %s: %s", classname, obj)
+    return None
+
+def get_max_modTs(objects):
+    """ return the latest modTs from a list of mo objects or empty string if none are set. APIC 
+        returns 'never' for objects that have not been modified which is ignored.
+    """
+    ret = ""
+    for o in objects:
+        ts = getattr(o, "modTs", "")
+        if ts != "never" and ts > ret:
+            ret = ts
+    return ret
 
 
 
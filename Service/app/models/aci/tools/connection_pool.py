@@ -0,0 +1,301 @@
+"""
+    shared pool of apic sessions and ssh connections to fabric nodes
+"""
+
+from ... utils import get_app_config
+
+import logging
+import re
+import threading
+import time
+import traceback
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+# shared pool for the current process, see get_connection_pool
+_g_pool = None
+_g_pool_lock = threading.Lock()
+
+class ConnectionPool(object):
+    """ shared pool of apic sessions indexed by fabric and ssh connections (Connection objects)
+        indexed by (fabric, node). A connection is used by a single caller at a time between
+        acquire and release, and at most max_concurrency connections are in use across all nodes.
+        Pooled sessions idle for longer than health_interval are health checked before reuse. The
+        prompt of the node is recorded when a connection is created and a pooled connection is only
+        reused if it still returns the same prompt, since the ssh session to the node runs within an
+        ssh session to the apic and returns the apic prompt if the node session is lost. Sessions
+        and connections are closed after idle_timeout.
+
+        Example
+            ssh = pool.acquire("fab1", 1, 101)
+            if ssh is not None:
+                try:
+                    ssh.cmd("show version")
+                finally:
+                    pool.release("fab1", 101, ssh)
+    """
+    MAX_CONCURRENCY = 16
+    IDLE_TIMEOUT = 300.0
+    HEALTH_INTERVAL = 30.0
+    HEALTH_TIMEOUT = 5
+    ACQUIRE_TIMEOUT = 120.0
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, idle_timeout=IDLE_TIMEOUT,
+            health_interval=HEALTH_INTERVAL):
+        self.max_concurrency = max_concurrency
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        # session and last used timestamp indexed by fabric
+        self.sessions = {}
+        # idle connection and last used timestamp indexed by (fabric, node)
+        self.connections = {}
+        # node prompt recorded at login indexed by (fabric, node)
+        self.prompts = {}
+        # (fabric, node) of connections currently acquired
+        self.in_use = set()
+        self.cleanup_thread = None
+        self.stats = {
+            "acquired": 0,
+            "reused": 0,
+            "logins": 0,
+            "sessions": 0,
+            "health_failed": 0,
+            "idle_closed": 0,
+        }
+
+    def acquire(self, fabric, pod, node, timeout=ACQUIRE_TIMEOUT):
+        """ return logged in ssh connection to node, creating a new one if there is no healthy
+            pooled connection. Blocks while the node connection is in use by another caller or
+            max_concurrency is reached. Return None on timeout or connection failure.
+        """
+        key = (fabric, node)
+        end_ts = time.time() + timeout
+        with self.lock:
+            while key in self.in_use or len(self.in_use) >= self.max_concurrency:
+                remaining = end_ts - time.time()
+                if remaining <= 0:
+                    logger.warn("timeout waiting for connection to %s", key)
+                    return None
+                self.available.wait(remaining)
+            self.in_use.add(key)
+            self.stats["acquired"]+= 1
+            (ssh, ts) = self.connections.pop(key, (None, 0))
+            prompt = self.prompts.get(key, None)
+            self.start_cleanup()
+        try:
+            if ssh is not None:
+                if self.check_connection(ssh, prompt):
+                    with self.lock:
+                        self.stats["reused"]+= 1
+                    return ssh
+                logger.debug("pooled connection to %s failed health check", key)
+                with self.lock:
+                    self.stats["health_failed"]+= 1
+                self.close_object(ssh)
+            ssh = self.create_connection(fabric, pod, node)
+        except Exception as e:
+            logger.debug("Traceback:\n%s", traceback.format_exc())
+            logger.warn("failed to acquire connection to %s: %s", key, e)
+            ssh = None
+        if ssh is None:
+            self.release(fabric, node, None)
+        return ssh
+
+    def release(self, fabric, node, ssh, healthy=True):
+        """ return acquired connection to the pool. Set healthy to False if an error occurred on the
+            connection so it is closed instead of reused.
+        """
+        key = (fabric, node)
+        with self.lock:
+            self.in_use.discard(key)
+            if ssh is not None and healthy:
+                self.connections[key] = (ssh, time.time())
+            self.available.notify_all()
+        if ssh is not None and not healthy:
+            self.close_object(ssh)
+
+    def create_connection(self, fabric, pod, node):
+        """ create ssh connection to node using pooled apic session and record the node prompt. If
+            the connection fails, the session is replaced and the connection retried once
+        """
+        from .. utils import get_ssh_connection
+        for attempt in range(0, 2):
+            session = self.get_session(fabric)
+            if session is None:
+                return None
+            ssh = get_ssh_connection(fabric, pod, node, session=session)
+            if ssh is not None:
+                with self.lock:
+                    self.stats["logins"]+= 1
+                prompt = self.get_prompt(ssh)
+                if prompt is None:
+                    logger.warn("failed to determine prompt for %s node-%s", fabric, node)
+                    self.close_object(ssh)
+                    return None
+                with self.lock:
+                    self.prompts[(fabric, node)] = prompt
+                return ssh
+            self.close_session(fabric)
+        return None
+
+    def get_session(self, fabric):
+        """ return pooled apic session for fabric, creating a new one if required """
+        from .. utils import get_apic_session
+        with self.lock:
+            (session, ts) = self.sessions.get(fabric, (None, 0))
+            if session is not None:
+                self.sessions[fabric] = (session, time.time())
+        if session is not None:
+            if time.time() - ts < self.health_interval or self.check_session(session):
+                return session
+            logger.debug("pooled session for %s failed health check", fabric)
+            with self.lock:
+                self.stats["health_failed"]+= 1
+            self.close_session(fabric)
+        session = get_apic_session(fabric)
+        if session is None:
+            logger.warn("failed to get apic session for fabric: %s", fabric)
+            return None
+        with self.lock:
+            self.stats["sessions"]+= 1
+            (existing, ts) = self.sessions.get(fabric, (None, 0))
+            if existing is None:
+                self.sessions[fabric] = (session, time.time())
+        if existing is not None:
+            # session created by another caller at the same time
+            self.close_object(session)
+            return existing
+        return session
+
+    def close_session(self, fabric):
+        """ close pooled apic session for fabric """
+        with self.lock:
+            (session, ts) = self.sessions.pop(fabric, (None, 0))
+        if session is not None:
+            self.close_object(session)
+
+    def check_session(self, session):
+        """ return True if apic session is able to query apic """
+        from .. utils import get_attributes
+        try:
+            return get_attributes(session, "info") is not None
+        except Exception as e:
+            logger.debug("session health check failed: %s", e)
+        return False
+
+    def get_prompt(self, ssh):
+        """ return prompt returned by ssh connection for an empty command or None on error """
+        if ssh.cmd("", timeout=self.HEALTH_TIMEOUT) != "prompt":
+            return None
+        output = re.sub("\x1b[\x5b-\x5f][\x40-\x7e]", "", ssh.output)
+        lines = [l.strip() for l in output.splitlines() if len(l.strip()) > 0]
+        if len(lines) > 0:
+            return lines[-1]
+        return None
+
+    def check_connection(self, ssh, prompt):
+        """ return True if ssh connection is alive and returns the prompt recorded at login. The
+            process is checked first since Connection.cmd performs a new login to the apic if the
+            connection was closed
+        """
+        try:
+            if ssh.child is None or not ssh.child.isalive():
+                return False
+            current = self.get_prompt(ssh)
+            if prompt is not None and current == prompt:
+                return True
+            logger.debug("connection prompt changed from '%s' to '%s'", prompt, current)
+        except Exception as e:
+            logger.debug("connection health check failed: %s", e)
+        return False
+
+    def close_object(self, obj):
+        """ close session or connection ignoring errors """
+        try:
+            obj.close()
+        except Exception as e:
+            logger.debug("failed to close %s: %s", obj, e)
+
+    def close_idle(self):
+        """ close sessions and connections idle longer than idle_timeout. A session is kept while
+            its fabric has pooled or acquired connections.
+        """
+        ts = time.time()
+        close = []
+        with self.lock:
+            for key, (ssh, last_ts) in list(self.connections.items()):
+                if ts - last_ts > self.idle_timeout:
+                    close.append(self.connections.pop(key)[0])
+                    self.prompts.pop(key, None)
+            fabrics = set([k[0] for k in self.connections]) | set([k[0] for k in self.in_use])
+            for fabric, (session, last_ts) in list(self.sessions.items()):
+                if fabric not in fabrics and ts - last_ts > self.idle_timeout:
+                    close.append(self.sessions.pop(fabric)[0])
+            self.stats["idle_closed"]+= len(close)
+        for obj in close:
+            self.close_object(obj)
+        if len(close) > 0:
+            logger.debug("closed %s idle sessions/connections", len(close))
+
+    def close(self, fabric=None):
+        """ close all idle pooled sessions and connections, optionally limited to a fabric """
+        close = []
+        with self.lock:
+            for key in list(self.connections.keys()):
+                if fabric is None or key[0] == fabric:
+                    close.append(self.connections.pop(key)[0])
+                    self.prompts.pop(key, None)
+            for f in list(self.sessions.keys()):
+                if fabric is None or f == fabric:
+                    close.append(self.sessions.pop(f)[0])
+        for obj in close:
+            self.close_object(obj)
+
+    def start_cleanup(self):
+        """ start idle cleanup thread if not running. Must be called with lock held """
+        if self.cleanup_thread is None or not self.cleanup_thread.is_alive():
+            self.cleanup_thread = threading.Thread(target=self.cleanup, name="connection-pool")
+            self.cleanup_thread.daemon = True
+            self.cleanup_thread.start()
+
+    def cleanup(self):
+        """ close idle sessions and connections at regular interval until pool is empty """
+        while True:
+            time.sleep(min(self.idle_timeout, self.health_interval))
+            try:
+                self.close_idle()
+            except Exception as e:
+                logger.debug("Traceback:\n%s", traceback.format_exc())
+                logger.error("failed to close idle connections: %s", e)
+            with self.lock:
+                if len(self.sessions) + len(self.connections) + len(self.in_use) == 0:
+                    self.cleanup_thread = None
+                    return
+
+    def get_stats(self):
+        """ return dict of pool stats """
+        with self.lock:
+            ret = dict(self.stats)
+            ret["in_use"] = len(self.in_use)
+            ret["idle"] = len(self.connections)
+            ret["fabrics"] = len(self.sessions)
+        return ret
+
+def get_connection_pool():
+    """ return shared ConnectionPool for the current process. The max concurrency and idle timeout
+        are set from SSH_POOL_MAX_CONCURRENCY and SSH_POOL_IDLE_TIMEOUT within app config
+    """
+    global _g_pool
+    with _g_pool_lock:
+        if _g_pool is None:
+            config = get_app_config()
+            _g_pool = ConnectionPool(
+                max_concurrency=int(config.get("SSH_POOL_MAX_CONCURRENCY",
+                                    ConnectionPool.MAX_CONCURRENCY)),
+                idle_timeout=float(config.get("SSH_POOL_IDLE_TIMEOUT",
+                                    ConnectionPool.IDLE_TIMEOUT)),
+            )
+    return _g_pool
@@ -243,7 +243,7 @@ def validate_session_role(session):
         err_msg+= "missing required read role 'admin' for security domain 'all'"
         return (False, err_msg)
 
-def get_apic_session(fabric, resubscribe=False):
+def get_apic_session(fabric, resubscribe=False, hostname=None):
     """ get_apic_session 
         based on current aci.settings for provided fabric name, connect to
         apic and return valid session object. If fail to connect to apic 
@@ -254,6 +254,8 @@ def get_apic_session(fabric, resubscribe=False):
 
         set resubscribe to true to auto restart subscriptions (disabled by default)
 
+        set hostname to only attempt a session to the provided apic
+
         Returns None on failure
     """
     from . fabric import Fabric
@@ -270,7 +272,9 @@ def get_apic_session(fabric, resubscribe=False):
     # build list of apics for session attempt
     app = get_app()
     hostnames = [aci.apic_hostname]
-    if not app.config["ACI_APP_MODE"]:
+    if hostname is not None:
+        hostnames = [hostname]
+    elif not app.config["ACI_APP_MODE"]:
         for h in aci.controllers:
             if h not in hostnames: hostnames.append(h)
 
@@ -314,6 +318,17 @@ def get_apic_session(fabric, resubscribe=False):
     logger.warn("failed to connect to any known apic")
     return None   
 
+def get_url_hostname(url):
+    """ return lowercase hostname of an apic url or hostname without the scheme, path, and port. 
+        For example, 'https://APIC1:8443/' returns 'apic1'
+    """
+    h = re.sub("^https?://", "", url.strip().lower())
+    h = re.sub("/.*$", "", h)
+    # port is only removed from a hostname or ipv4 address, an ipv6 address has multiple ':'
+    if h.count(":") == 1:
+        h = h.split(":")[0]
+    return h
+
 def get_ssh_connection(fabric, pod_id, node_id, session=None):
     """ create active/logged in ssh connection object for provided fabric name 
         and node-id.  At this time, all ssh connections are via APIC tep of
@@ -833,14 +848,12 @@ def send_emails(settings=None, dns_cache=None, emails=None):
 
 def clear_endpoint(fabric, pod, node, vnid, addr, addr_type="ip", vrf_name=""):
     """ ssh to node id and clear endpoint. fabric can be fabric name or Fabric object. If addr_type
-        is a mac, then vnid is remapped to FD vlan before clear is executed.
+        is a mac, then vnid is remapped to FD vlan before clear is executed. The apic session and
+        ssh connection are reused from the shared connection pool.
         return bool success
     """
     from . fabric import Fabric
-    from . ept.common import parse_vrf_name
-    from . ept.common import get_mac_string
-    from . ept.common import get_mac_value
-    from . ept.ept_vnid import eptVnid
+    from . tools.connection_pool import get_connection_pool
     if isinstance(fabric, Fabric): f = fabric
     else: f = Fabric.load(fabric=fabric)
 
@@ -848,35 +861,85 @@ def clear_endpoint(fabric, pod, node, vnid, addr, addr_type="ip", vrf_name=""):
     if not f.exists():
         logger.warn("unknown fabric: %s", f.fabric)
         return False
-    session = get_apic_session(f)
-    if session is None:
-        logger.warn("failed to get apic session for fabric: %s", f.fabric)
-        return False
-    ssh = get_ssh_connection(f, pod, node, session=session)
+    pool = get_connection_pool()
+    ssh = pool.acquire(f.fabric, pod, node)
     if ssh is None:
         logger.warn("failed to ssh to pod:%s node:%s", pod, node)
         return False
+    try:
+        ret = clear_endpoint_ssh(ssh, f.fabric, vnid, addr, addr_type=addr_type, vrf_name=vrf_name)
+    except Exception as e:
+        # connection is not reused once lost
+        logger.debug("Traceback:\n%s", traceback.format_exc())
+        logger.warn("failed to clear endpoint on pod:%s node:%s: %s", pod, node, e)
+        pool.release(f.fabric, node, ssh, healthy=False)
+        return False
+    pool.release(f.fabric, node, ssh)
+    return ret
 
-    if addr_type == "ip":
-        ctype = "ipv6" if ":" in addr else "ip"
-        if len(vrf_name) == 0:
-            # try to determine vrf name from eptVnid table
-            v = eptVnid.find(fabric=f.fabric, vnid=vnid)
-            if len(v) > 0:
-                vrf_name = parse_vrf_name(v[0].name)
-                if vrf_name is None:
-                    logger.warn("failed to parse vrf name from ept vnid_name: %s", v.name)
-                    return False
-            else:
-                logger.warn("failed to determine vnid_name for fabric: %s, vnid: %s",f.fabric,vnid)
-                return False
-        cmd = "vsh -c 'clear system internal epm endpoint key vrf %s %s %s'" % (vrf_name,ctype,addr)
-        if ssh.cmd(cmd) == "prompt":
-            logger.debug("successfully cleared endpoint: %s", cmd)
-            return True
+def get_epm_clear_ip_cmd(fabric, vnid, addr, vrf_name=""):
+    """ return epm clear command for ip endpoint to be executed with vsh (see 
+        execute_epm_clear_ssh). If vrf_name is not provided, it is determined from the eptVnid 
+        table for the vnid. return None if the vrf name cannot be determined.
+    """
+    from . ept.common import parse_vrf_name
+    from . ept.ept_vnid import eptVnid
+
+    ctype = "ipv6" if ":" in addr else "ip"
+    if len(vrf_name) == 0:
+        # try to determine vrf name from eptVnid table
+        v = eptVnid.find(fabric=fabric, vnid=vnid)
+        if len(v) > 0:
+            vrf_name = parse_vrf_name(v[0].name)
+            if vrf_name is None:
+                logger.warn("failed to parse vrf name from ept vnid_name: %s", v[0].name)
+                return None
         else:
-            logger.warn("failed to execute clear cmd: %s", cmd)
+            logger.warn("failed to determine vnid_name for fabric: %s, vnid: %s",fabric,vnid)
+            return None
+    return "clear system internal epm endpoint key vrf %s %s %s" % (vrf_name, ctype, addr)
+
+def get_epm_clear_vsh_cmd(commands):
+    """ return single vsh command executing the provided list of epm clear commands in order """
+    return "vsh -c '%s'" % " ; ".join(commands)
+
+def execute_epm_clear_ssh(ssh, commands):
+    """ execute list of epm clear commands (see get_epm_clear_ip_cmd) on the node as a single vsh
+        command using an active ssh connection. return bool success for all commands. An exception
+        is raised if the connection to the node is lost (eof or timeout waiting for prompt).
+    """
+    c = get_epm_clear_vsh_cmd(commands)
+    result = ssh.cmd(c)
+    if result == "eof" or result == "timeout":
+        raise Exception("connection lost (%s) executing: %s" % (result, c))
+    if result == "prompt":
+        logger.debug("successfully cleared endpoint: %s", c)
+        return True
+    logger.warn("failed to execute clear cmd: %s", c)
+    return False
+
+def clear_endpoint_ssh(ssh, fabric, vnid, addr, addr_type="ip", vrf_name=""):
+    """ clear endpoint using an active ssh connection to the node (see get_ssh_connection). This
+        allows several endpoints to be cleared on the same node with a single login.
+        return bool success. An exception is raised if the connection to the node is lost (eof or
+        timeout waiting for prompt) and the connection must not be reused.
+    """
+    from . ept.common import get_mac_string
+    from . ept.common import get_mac_value
+
+    def cmd(command):
+        # execute command and return True if prompt was returned
+        result = ssh.cmd(command)
+        if result == "eof" or result == "timeout":
+            raise Exception("connection lost (%s) executing: %s" % (result, command))
+        return result == "prompt"
+
+    logger.debug("clear endpoint [%s, vnid:%s, addr:%s]", fabric, vnid, addr)
+    if addr_type == "ip":
+        c = get_epm_clear_ip_cmd(fabric, vnid, addr, vrf_name=vrf_name)
+        if c is None:
             return False
+        return execute_epm_clear_ssh(ssh, [c])
     else:
         # first cast mac into correct format
         addr = get_mac_string(get_mac_value(addr),fmt="std")
@@ -887,29 +950,29 @@ def clear_endpoint(fabric, pod, node, vnid, addr, addr_type="ip", vrf_name=""):
         # here we have two choices, first is APIC epmMacEp query which hits all nodes or, since ssh
         # session is already up, we can execute directly on the leaf. For that latter case, it will
         # be easier to use moquery with grep then parsing json with extra terminal characters...
-        cmd = "moquery -c epmMacEp -f 'epm.MacEp.addr==\"%s\"' | egrep '^dn' | egrep 'vxlan-%s'"%(
+        c = "moquery -c epmMacEp -f 'epm.MacEp.addr==\"%s\"' | egrep '^dn' | egrep 'vxlan-%s'" % (
                 addr, vnid)
-        if ssh.cmd(cmd) == "prompt":
+        if cmd(c):
             r1 = re.search("dn[ ]*:[ ]*(?P<dn>sys/.+)/db-ep", ssh.output)
             if r1 is not None:
-                cmd = "moquery -d '%s' | egrep '^id'" % r1.group("dn")
-                if ssh.cmd(cmd) == "prompt":
+                c = "moquery -d '%s' | egrep '^id'" % r1.group("dn")
+                if cmd(c):
                     r2 = re.search("id[ ]*:[ ]*(?P<pi>[0-9]+)", ssh.output)
                     if r2 is not None:
-                        cmd = "vsh -c 'clear system internal epm endpoint key vlan %s mac %s'" % (
+                        c = "vsh -c 'clear system internal epm endpoint key vlan %s mac %s'" % (
                             r2.group("pi"), addr)
-                        if ssh.cmd(cmd) == "prompt":
-                            logger.debug("successfully cleared endpoint: %s", cmd)
+                        if cmd(c):
+                            logger.debug("successfully cleared endpoint: %s", c)
                             return True
                         else:
-                            logger.warn("failed to execute clear cmd: %s", cmd)
+                            logger.warn("failed to execute clear cmd: %s", c)
                             return False
                     else:
                         logger.warn("failed to extract pi-vlan id from %s: %s", r1.group("dn"), 
                             ssh.output)
                         return False
                 else:
-                    logger.warn("failed to execute command: %s", cmd)
+                    logger.warn("failed to execute command: %s", c)
             else:
                 logger.debug("failed to parse bd/cktEp from dn or endpoint not found: %s",ssh.output)
                 # assume parsing was fine and that endpoint is no longer present (so cleared!)
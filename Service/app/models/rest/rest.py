@@ -18,6 +18,7 @@ from flask import jsonify
 from pymongo import ASCENDING
 from pymongo import DESCENDING
 from pymongo import InsertOne
+from pymongo import ReplaceOne
 from pymongo import UpdateOne
 from pymongo import UpdateMany
 from pymongo.errors import BulkWriteError
@@ -497,7 +498,7 @@ class Rest(object):
         """
         return (self._save(skip_validation=skip_validation, refresh=refresh) is not None)
 
-    def _save(self, bulk_prep=False, skip_validation=False, refresh=True):
+    def _save(self, bulk_prep=False, skip_validation=False, refresh=True, upsert=None):
         """ save current instance of object to database.  If does not exists,
             then will attempt a create.  If already exists, then will perform
             an update.  
@@ -509,6 +510,9 @@ class Rest(object):
 
             skip_validation sent forwarded to create/update methods
 
+            upsert is forwarded to create on bulk_prep (see bulk_save) and forces a create 
+            independent of whether the object exists
+
             None is returned on error
         """
         reload_required = False
@@ -516,7 +520,7 @@ class Rest(object):
         obj = {}
         try:
             # perform create if this object does not currently exists
-            if not self.exists():
+            if not self.exists() or (bulk_prep and upsert is not None):
                 for attr in self._attributes:
                     if hasattr(self, attr): 
                         obj[attr] = getattr(self,attr)
@@ -525,7 +529,7 @@ class Rest(object):
                             obj[attr] = self.secure_attribute(attr, obj[attr])
 
                 ret = self.create(_data=obj, _bulk_prep=bulk_prep, _skip_validation=skip_validation, 
-                                    _write_all=True)
+                                    _write_all=True, _upsert=upsert)
                 if bulk_prep: result = ret
                 else:
                     if self._access["expose_id"] and "_id" in ret: 
@@ -582,7 +586,7 @@ class Rest(object):
         return result
 
     @classmethod
-    def bulk_save(cls, rest_objects, skip_validation=True):
+    def bulk_save(cls, rest_objects, skip_validation=True, upsert=None):
         """ perform save on list of rest objects. Note, all rest_objects must be instance of the 
             same class as bulk_write occurrs on a single collection.
 
@@ -590,6 +594,10 @@ class Rest(object):
             this is disabled by default on bulk_save but can be enabled if source data is untrusted
             or if dataset is incomplete and requires validation to prepopulate with proper defaults.
 
+            upsert is an optional dict of additional fields (not attributes of the object) written
+            to each document. When set, each object replaces the document with the same keys or is 
+            inserted if not present, allowing a collection to be refreshed without a flush.
+
             Return bool success
         """
         cls.init()
@@ -599,7 +607,7 @@ class Rest(object):
         ts = time.time()
         bulk = []
         for r in rest_objects:
-            save_obj = r._save(bulk_prep=True, skip_validation=skip_validation)
+            save_obj = r._save(bulk_prep=True, skip_validation=skip_validation, upsert=upsert)
             if save_obj is not None: bulk.append(save_obj)
         try:
             if len(bulk)>0:
@@ -1182,6 +1190,9 @@ class Rest(object):
             _bulk_prep (bool) perform initial obj prep and before_create callbacks only.  When set
             this overrides normal return behavior and returns an InsertOne object. 
 
+            _upsert (dict) when set along with _bulk_prep, a ReplaceOne object with upsert enabled
+            is returned that matches on the object keys and includes the provided fields
+
             _skip_validation (bool) skip attribute validation. This improves performance and is 
             useful on non-api calls where data is trusted
 
@@ -1281,7 +1292,15 @@ class Rest(object):
                 cls.logger.warn("%s before create callback failed: %s", classname, e)
  
         # if _bulk_prep then we are not doing insertion, only creating InsertOne object 
-        if _bulk_prep: return InsertOne(obj)
+        if _bulk_prep: 
+            _upsert = kwargs.get("_upsert", None)
+            if _upsert is not None:
+                keys = {}
+                for k in cls._keys: keys[k] = obj.get(k, None)
+                doc = copy.copy(obj)
+                doc.update(_upsert)
+                return ReplaceOne(keys, doc, upsert=True)
+            return InsertOne(obj)
 
         # insert the update into the collection
         try:
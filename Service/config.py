@@ -148,6 +148,10 @@ REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
 REDIS_DB = int(os.environ.get("REDIS_DB", 0))
 
+# shared apic session and ssh connection pool used to clear endpoints (see ConnectionPool)
+SSH_POOL_MAX_CONCURRENCY = int(os.environ.get("SSH_POOL_MAX_CONCURRENCY", 16))
+SSH_POOL_IDLE_TIMEOUT = int(os.environ.get("SSH_POOL_IDLE_TIMEOUT", 300))
+
 # email options
 EMAIL_SENDER = os.environ.get("EMAIL_SENDER", "noreply@aci.app")
 
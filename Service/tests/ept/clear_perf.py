@@ -0,0 +1,144 @@
+"""
+measure latency of endpoint clears against a local fake ssh endpoint
+
+    Each node is emulated by a local fake ssh endpoint (fake_ssh_node.py) spawned through
+    tools.connection.Connection (custom protocol) that prompts for username and password, waits the
+    provided login delay, and then returns the prompt for each command after the provided command
+    delay. The apic session login and queries are emulated with the provided session delay. The
+    provided number of clears are executed on each node in parallel (one thread per node) using a
+    new apic session and ssh connection per clear (previous clear_endpoint) and using the shared
+    ConnectionPool. The number of logins and the average, p50, p99, and max latency of a single
+    clear are reported.
+
+    python clear_perf.py [--nodes 4] [--count 50] [--login-delay 0.5] [--cmd-delay 0.01]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+# update sys path for importing test classes for app registration
+sys.path.append(os.path.realpath("%s/../../" % os.path.dirname(os.path.realpath(__file__))))
+
+# set logger to base app logger
+logger = logging.getLogger("app")
+
+from app.models.utils import setup_logger
+from app.models.aci import utils as aci_utils
+from app.models.aci.tools.connection import Connection
+from app.models.aci.tools.connection_pool import ConnectionPool
+
+fabric = "fab1"
+vrf_name = "tn:v1"
+
+class FakeSession(object):
+    # apic session
+    def close(self):
+        pass
+
+def setup_fake_fabric(args, logins):
+    # replace apic session and ssh connection with local fake endpoint
+    def get_apic_session(fabric):
+        time.sleep(args.session_delay)
+        return FakeSession()
+    def get_attributes(session, dn):
+        time.sleep(args.session_delay)
+        return {"id": "1", "podId": "1"}
+    def get_ssh_connection(fabric, pod, node, session=None):
+        # apic id, apic tep, and node tep queries
+        for dn in ["info", "apic", "node"]:
+            get_attributes(session, dn)
+        c = Connection("leaf-%s" % node)
+        c.protocol = "%s %s/fake_ssh_node.py --node %s --login-delay %s --cmd-delay %s" % (
+                sys.executable, os.path.dirname(os.path.realpath(__file__)), node,
+                args.login_delay, args.cmd_delay)
+        if not c.login():
+            logger.warn("failed to login to fake node %s", node)
+            return None
+        logins.append(node)
+        return c
+    aci_utils.get_apic_session = get_apic_session
+    aci_utils.get_attributes = get_attributes
+    aci_utils.get_ssh_connection = get_ssh_connection
+
+def legacy_clear(node, addr):
+    # previous clear_endpoint with new apic session and ssh connection per clear
+    session = aci_utils.get_apic_session(fabric)
+    ssh = aci_utils.get_ssh_connection(fabric, 1, node, session=session)
+    if ssh is None:
+        return False
+    try:
+        return aci_utils.clear_endpoint_ssh(ssh, fabric, 1, addr, vrf_name=vrf_name)
+    finally:
+        ssh.close()
+        session.close()
+
+def pool_clear(pool, node, addr):
+    # clear_endpoint using shared connection pool
+    ssh = pool.acquire(fabric, 1, node)
+    if ssh is None:
+        return False
+    try:
+        ret = aci_utils.clear_endpoint_ssh(ssh, fabric, 1, addr, vrf_name=vrf_name)
+    except Exception as e:
+        pool.release(fabric, node, ssh, healthy=False)
+        return False
+    pool.release(fabric, node, ssh)
+    return ret
+
+def measure(name, args, func, logins):
+    # execute count clears per node with one thread per node, log latency per clear
+    latency = []
+    failed = []
+    def per_node(node):
+        for i in xrange(0, args.count):
+            ts = time.time()
+            if not func(node, "10.%s.%s.%s" % (node % 256, i / 256, i % 256)):
+                failed.append((node, i))
+            latency.append(time.time() - ts)
+    del logins[:]
+    ts = time.time()
+    threads = []
+    for node in xrange(101, 101 + args.nodes):
+        t = threading.Thread(target=per_node, args=(node,))
+        t.start()
+        threads.append(t)
+    for t in threads: t.join()
+    total = time.time() - ts
+    latency.sort()
+    logger.debug("%-8s clears: %s, failed: %s, logins: %s, total: %.3f s, avg: %8.3f ms, "
+        "p50: %8.3f ms, p99: %8.3f ms, max: %8.3f ms", name, len(latency), len(failed),
+        len(logins), total, 1000*sum(latency)/len(latency), 1000*latency[len(latency)/2],
+        1000*latency[int(len(latency)*0.99)], 1000*latency[-1])
+
+if __name__ == "__main__":
+
+    desc = """ measure endpoint clear latency """
+    parser = argparse.ArgumentParser(description=desc,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--nodes", dest="nodes", type=int, default=4, help="nodes")
+    parser.add_argument("--count", dest="count", type=int, default=50, help="clears per node")
+    parser.add_argument("--login-delay", dest="login_delay", type=float, default=0.5,
+        help="seconds for ssh login to node")
+    parser.add_argument("--session-delay", dest="session_delay", type=float, default=0.1,
+        help="seconds for apic session login and each apic query")
+    parser.add_argument("--cmd-delay", dest="cmd_delay", type=float, default=0.01,
+        help="seconds for each command on node")
+    parser.add_argument("--max-concurrency", dest="max_concurrency", type=int,
+        default=ConnectionPool.MAX_CONCURRENCY, help="pool max concurrency")
+    args = parser.parse_args()
+
+    # force logging to stdout
+    setup_logger(logger, stdout=True)
+    logging.getLogger("app.models.aci").setLevel(logging.WARN)
+
+    logins = []
+    setup_fake_fabric(args, logins)
+    logger.debug("nodes: %s, clears per node: %s", args.nodes, args.count)
+    measure("legacy", args, legacy_clear, logins)
+    pool = ConnectionPool(max_concurrency=args.max_concurrency)
+    measure("pool", args, lambda node, addr: pool_clear(pool, node, addr), logins)
+    pool.close()
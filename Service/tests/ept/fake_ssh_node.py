@@ -0,0 +1,42 @@
+"""
+local fake ssh endpoint used by clear_perf.py
+
+    Spawned through tools.connection.Connection (custom protocol). Prompts for username and
+    password, waits the provided login delay, and then returns the prompt for each command after
+    the provided command delay until exit or eof is received.
+
+    python fake_ssh_node.py [--node 101] [--login-delay 0.5] [--cmd-delay 0.01]
+"""
+
+import argparse
+import sys
+import time
+
+if __name__ == "__main__":
+
+    desc = """ fake ssh endpoint """
+    parser = argparse.ArgumentParser(description=desc,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--node", dest="node", type=int, default=101, help="node id for prompt")
+    parser.add_argument("--login-delay", dest="login_delay", type=float, default=0.5,
+        help="seconds for login")
+    parser.add_argument("--cmd-delay", dest="cmd_delay", type=float, default=0.01,
+        help="seconds for each command")
+    args = parser.parse_args()
+
+    out = sys.stdout
+    out.write("login: ")
+    out.flush()
+    sys.stdin.readline()
+    out.write("Password: ")
+    out.flush()
+    sys.stdin.readline()
+    time.sleep(args.login_delay)
+    while True:
+        out.write("leaf-%s# " % args.node)
+        out.flush()
+        line = sys.stdin.readline()
+        if len(line) == 0 or line.strip() == "exit":
+            break
+        if len(line.strip()) > 0:
+            time.sleep(args.cmd_delay)
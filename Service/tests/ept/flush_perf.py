@@ -0,0 +1,106 @@
+"""
+measure time to flush a fabric from worker queues against queue depth
+
+    For each queue depth, work is queued as bulks of epm events alternating between two fabrics.
+    The shared queue flush (lrange of the full queue, parse each msg to check the fabric, delete,
+    and re-push the msgs of the other fabric) is compared with the per-fabric queue partitions
+    where the flush is a single delete of the fabric partition. The shared queue is unavailable to
+    the worker for the full duration of the flush, stalling work for all other fabrics.
+
+    python flush_perf.py [--depth 1000,10000,100000] [--bulk 100] [--format 1]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+# update sys path for importing test classes for app registration
+sys.path.append(os.path.realpath("%s/../../" % os.path.dirname(os.path.realpath(__file__))))
+
+# set logger to base app logger
+logger = logging.getLogger("app")
+
+from app.models.utils import get_redis
+from app.models.utils import setup_logger
+from app.models.aci.ept.common import get_pending_queue
+from app.models.aci.ept.common import get_work_queue
+from app.models.aci.ept.ept_msg import MSG_TYPE
+from app.models.aci.ept.ept_msg import WIRE_FORMAT_COMPACT
+from app.models.aci.ept.ept_msg import eptMsg
+from app.models.aci.ept.ept_msg import eptMsgBulk
+from msg_perf import get_events
+
+fabrics = ["fab1", "fab2"]
+perf_queue = "q1_flush_perf"
+
+def get_encoded_bulks(depth, bulk_size, wire_format):
+    # return list of tuples (fabric, encoded eptMsgBulk) with a total of depth events
+    ret = []
+    events = get_events(depth)
+    for i in xrange(0, len(events), bulk_size):
+        fabric = fabrics[(i/bulk_size) % len(fabrics)]
+        bulk = eptMsgBulk()
+        bulk.msgs = events[i:i+bulk_size]
+        for m in bulk.msgs:
+            m.fabric = fabric
+        ret.append((fabric, eptMsg.encode(bulk, wire_format)))
+    return ret
+
+def shared_flush(redis, q, fabric):
+    # same operation as WorkerTracker.flush_queue on a queue shared by all fabrics
+    pl = redis.pipeline()
+    pl.lrange(q, 0, -1)
+    pl.delete(q)
+    ret = pl.execute()
+    repush = []
+    for data in ret[0]:
+        msg = eptMsg.parse(data)
+        if msg.msg_type == MSG_TYPE.BULK and len(msg.msgs)>0 and msg.msgs[0].fabric == fabric:
+            continue
+        repush.append(data)
+    if len(repush) > 0:
+        redis.rpush(q, *repush)
+
+def measure(redis, depth, bulk_size, wire_format):
+    # return tuple (shared flush time, partitioned flush time) for provided queue depth
+    bulks = get_encoded_bulks(depth, bulk_size, wire_format)
+
+    redis.delete(perf_queue)
+    redis.rpush(perf_queue, *[data for (fabric, data) in bulks])
+    ts = time.time()
+    shared_flush(redis, perf_queue, fabrics[0])
+    shared_time = time.time() - ts
+    redis.delete(perf_queue)
+
+    for fabric in fabrics:
+        redis.rpush(get_work_queue(perf_queue, fabric), *[d for (f, d) in bulks if f == fabric])
+    ts = time.time()
+    q = get_work_queue(perf_queue, fabrics[0])
+    redis.delete(q, get_pending_queue(q))
+    partition_time = time.time() - ts
+    for fabric in fabrics:
+        redis.delete(get_work_queue(perf_queue, fabric))
+    return (shared_time, partition_time)
+
+if __name__ == "__main__":
+
+    desc = """ measure fabric flush time against worker queue depth """
+    parser = argparse.ArgumentParser(description=desc,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--depth", dest="depth", type=str, default="1000,10000,100000",
+        help="comma separated list of events queued per measurement")
+    parser.add_argument("--bulk", dest="bulk", type=int, default=100, help="events per eptMsgBulk")
+    parser.add_argument("--format", dest="wire_format", type=int, default=WIRE_FORMAT_COMPACT,
+        help="wire format of queued msgs")
+    args = parser.parse_args()
+
+    # force logging to stdout
+    setup_logger(logger, stdout=True)
+
+    redis = get_redis()
+    for depth in [int(d) for d in args.depth.split(",")]:
+        (shared_time, partition_time) = measure(redis, depth, args.bulk, args.wire_format)
+        logger.debug("depth: %8s, shared flush: %10.3f ms, partitioned flush: %8.3f ms", depth,
+            shared_time*1000, partition_time*1000)
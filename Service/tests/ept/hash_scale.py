@@ -0,0 +1,113 @@
+"""
+measure distribution of endpoint addresses across workers
+
+    Compares the original character-sum hash with modulo worker index, the character-sum hash
+    placed on the consistent hash ring, and get_address_hash on the consistent hash ring used by 
+    the manager.  The endpoint population follows the same allocators as scale.py (sequential 
+    macs, ipv4 /24 subnets, and ipv6 /112 subnets). For each worker count the number of addresses
+    assigned to each worker is reported along with the skew (max worker load / average worker 
+    load) and the coefficient of variation.
+
+    python hash_scale.py [--workers 3,5,8,16] [--mac 100000] [--ipv4 150000] [--ipv6 150000]
+"""
+
+import argparse
+import logging
+import math
+import os
+import sys
+import time
+
+# update sys path for importing test classes for app registration
+sys.path.append(os.path.realpath("%s/../../" % os.path.dirname(os.path.realpath(__file__))))
+
+# set logger to base app logger
+logger = logging.getLogger("app")
+
+from app.models.utils import setup_logger
+from app.models.aci.ept.common import HashRing
+from app.models.aci.ept.common import get_address_hash
+from app.models.aci.ept.common import get_ipv4_string
+from app.models.aci.ept.common import get_ipv6_string
+from app.models.aci.ept.common import get_mac_string
+
+# allocators (same as scale.py)
+v4_subnet_base                  = 0xa000100
+v4_subnet_length                = 24
+v6_subnet_base                  = 0x20010000000000000000000000000000
+v6_subnet_length                = 112
+mac_base                        = 0x0242ac000000
+per_subnet_ips                  = 200
+
+def get_population(mac_count, ipv4_count, ipv6_count):
+    # return list of address strings with sequential allocation across subnets
+    addrs = []
+    for i in xrange(0, mac_count):
+        addrs.append(get_mac_string(mac_base + i))
+    for i in xrange(0, ipv4_count):
+        subnet = v4_subnet_base + ((i / per_subnet_ips) << (32 - v4_subnet_length))
+        addrs.append(get_ipv4_string(subnet + 1 + i % per_subnet_ips))
+    for i in xrange(0, ipv6_count):
+        subnet = v6_subnet_base + ((i / per_subnet_ips) << (128 - v6_subnet_length))
+        addrs.append(get_ipv6_string(subnet + 1 + i % per_subnet_ips))
+    return addrs
+
+def char_sum_placement(addrs, workers):
+    # original placement: sum of characters modulo number of workers
+    counts = [0]*len(workers)
+    for addr in addrs:
+        counts[sum(ord(i) for i in addr) % len(workers)]+= 1
+    return counts
+
+def ring_placement(addrs, workers, hash_func=get_address_hash):
+    # current placement: address hash on consistent hash ring
+    ring = HashRing(workers)
+    index = dict([(w, i) for i, w in enumerate(workers)])
+    counts = [0]*len(workers)
+    for addr in addrs:
+        counts[index[ring.get_node(hash_func(addr))]]+= 1
+    return counts
+
+def report(name, counts):
+    avg = float(sum(counts)) / len(counts)
+    stddev = math.sqrt(sum([(c - avg)**2 for c in counts]) / len(counts))
+    logger.debug("%-9s skew(max/avg): %.3f, min/avg: %.3f, cv: %.3f, counts: %s", name,
+        max(counts)/avg, min(counts)/avg, stddev/avg, counts)
+
+if __name__ == "__main__":
+
+    desc = """ measure worker load distribution for address hash """
+    parser = argparse.ArgumentParser(description=desc,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--workers", dest="workers", default="3,5,8,16",
+        help="comma separated list of worker counts to test")
+    parser.add_argument("--mac", dest="mac", type=int, default=100000, help="mac endpoints")
+    parser.add_argument("--ipv4", dest="ipv4", type=int, default=150000, help="ipv4 endpoints")
+    parser.add_argument("--ipv6", dest="ipv6", type=int, default=150000, help="ipv6 endpoints")
+    args = parser.parse_args()
+
+    # force logging to stdout
+    setup_logger(logger, stdout=True)
+
+    addrs = get_population(args.mac, args.ipv4, args.ipv6)
+    logger.debug("endpoint population: %s", len(addrs))
+    logger.debug("distinct char-sum hash values: %s", 
+        len(set([sum(ord(i) for i in addr) for addr in addrs])))
+    logger.debug("distinct address hash values: %s", 
+        len(set([get_address_hash(addr) for addr in addrs])))
+
+    ts = time.time()
+    for addr in addrs: sum(ord(i) for i in addr)
+    total_time = time.time() - ts
+    logger.debug("char-sum hash time: %.3f, avg: %0.9f", total_time, total_time/len(addrs))
+    ts = time.time()
+    for addr in addrs: get_address_hash(addr)
+    total_time = time.time() - ts
+    logger.debug("address hash time: %.3f, avg: %0.9f", total_time, total_time/len(addrs))
+
+    for count in [int(c) for c in args.workers.split(",")]:
+        workers = ["w%s" % i for i in xrange(0, count)]
+        logger.debug("workers: %s", count)
+        report("char-sum", char_sum_placement(addrs, workers))
+        report("sum-ring", ring_placement(addrs, workers, lambda a: sum(ord(i) for i in a)))
+        report("hash-ring", ring_placement(addrs, workers))
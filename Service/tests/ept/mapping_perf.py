@@ -0,0 +1,146 @@
+"""
+measure rate of mo to ept object mapping used for initialize_ept_collection and sync_mo_to_ept
+
+    Synthetic fvSubnet and fvAEPg payloads are mapped with the previous per-object walk of the
+    attribute map (re.search with uncompiled patterns) and with the compiled EptMapper from the
+    dependency map. Raw dict attributes from a class query are mapped with map_raw and mo objects
+    with parent dependencies are mapped with map_mo.
+
+    python mapping_perf.py [--count 100000]
+"""
+
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+
+# update sys path for importing test classes for app registration
+sys.path.append(os.path.realpath("%s/../../" % os.path.dirname(os.path.realpath(__file__))))
+
+# set logger to base app logger
+logger = logging.getLogger("app")
+
+from app.models.utils import setup_logger
+from app.models.aci.ept.mo_dependency import EptMapper
+from app.models.aci.ept.mo_dependency import moAttrHandler
+from app.models.aci.ept.mo_dependency_map import dependency_map
+
+class FakeMo(object):
+    # mo object with plain attributes
+    _classname = "fake"
+    def __init__(self, **kwargs):
+        for a in kwargs:
+            setattr(self, a, kwargs[a])
+
+def get_payloads(classname, count):
+    # list of raw dict attributes for synthetic objects of provided classname
+    ret = []
+    for i in xrange(0, count):
+        epg = "uni/tn-tn%s/ap-app/epg-epg%s" % (i % 100, i)
+        if classname == "fvSubnet":
+            ret.append({
+                "dn": "%s/subnet-[10.%s.%s.1/24]" % (epg, (i >> 8) & 0xff, i & 0xff),
+                "ip": "10.%s.%s.1/24" % ((i >> 8) & 0xff, i & 0xff),
+                "parent": epg,
+                "scope": "private",
+            })
+        else:
+            ret.append({
+                "dn": epg,
+                "scope": "%s" % (2654208 + i % 100),
+                "pcTag": "%s" % (16386 + i),
+                "isAttrBasedEPg": "no",
+                "prio": "unspecified",
+            })
+    return ret
+
+def legacy_map_raw(attribute_map, regex_map, attr):
+    # previous per-object mapping within initialize_ept_collection
+    db_obj = {}
+    for db_attr, o_attr in attribute_map.items():
+        if isinstance(o_attr, basestring) and o_attr in attr:
+            if db_attr in regex_map:
+                r1 = re.search(regex_map[db_attr], attr[o_attr])
+                if r1:
+                    db_obj[db_attr] = r1.group("value")
+                else:
+                    return {}
+            else:
+                db_obj[db_attr] = attr[o_attr]
+    return db_obj
+
+def legacy_map_mo(attribute_map, regex_map, mo, mo_parents):
+    # previous per-object mapping within DependencyNode.sync_mo_to_ept
+    ret = []
+    for a, mo_attr in attribute_map.items():
+        val = None
+        if isinstance(mo_attr, moAttrHandler):
+            val = mo_attr.get_value(a, mo, mo_parents)
+        else:
+            if type(mo_attr) is not list: mo_attr = [mo_attr]
+            for mo_a in mo_attr:
+                mo_a_split = mo_a.split(".")
+                if len(mo_a_split) == 1:
+                    if hasattr(mo, mo_a_split[0]):
+                        val = getattr(mo, mo_a_split[0])
+                    break
+                elif len(mo_a_split) == 2:
+                    if mo_a_split[0] in mo_parents:
+                        parent = mo_parents[mo_a_split[0]]
+                        if hasattr(parent, mo_a_split[1]):
+                            val = getattr(parent, mo_a_split[1])
+                        break
+        if val is not None and a in regex_map:
+            r1 = re.search(regex_map[a], val)
+            if r1 is not None and "value" in r1.groupdict():
+                val = r1.group("value")
+        ret.append((a, val))
+    return ret
+
+def measure(name, count, func):
+    # execute func count times and log rate
+    ts = time.time()
+    func()
+    logger.debug("%-30s %10.1f obj/s", name, count/(time.time() - ts))
+
+if __name__ == "__main__":
+
+    desc = """ measure mo to ept mapping rate """
+    parser = argparse.ArgumentParser(description=desc,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--count", dest="count", type=int, default=100000, help="objects")
+    args = parser.parse_args()
+
+    # force logging to stdout
+    setup_logger(logger, stdout=True)
+
+    for classname in ["fvSubnet", "fvAEPg"]:
+        node = dependency_map[classname]
+        attribute_map = node.ept_attributes
+        regex_map = node.ept_regex_map
+        mapper = EptMapper(attribute_map, regex_map)
+        payloads = get_payloads(classname, args.count)
+        mos = [FakeMo(**p) for p in payloads]
+        parents = {"fvBD": FakeMo(seg="15302583")}
+        logger.debug("%s objects: %s", classname, args.count)
+        measure("%s legacy raw" % classname, args.count,
+            lambda: [legacy_map_raw(attribute_map, regex_map, p) for p in payloads])
+        measure("%s compiled raw" % classname, args.count,
+            lambda: [mapper.map_raw(p) for p in payloads])
+        measure("%s legacy mo" % classname, args.count,
+            lambda: [legacy_map_mo(attribute_map, regex_map, mo, parents) for mo in mos])
+        measure("%s compiled mo" % classname, args.count,
+            lambda: [mapper.map_mo(mo, parents) for mo in mos])
+
+    # regex heavy mapping for node extraction from dn
+    attribute_map = {"node": "dn", "name": "dn", "addr": "address"}
+    regex_map = {"node": "topology/pod-[0-9]+/node-(?P<value>[0-9]+)"}
+    mapper = EptMapper(attribute_map, regex_map)
+    payloads = [{"dn": "topology/pod-1/node-%s" % (101 + i), "address": "10.0.0.%s" % (i % 250)}
+                    for i in xrange(0, args.count)]
+    logger.debug("fabricNode objects: %s", args.count)
+    measure("fabricNode legacy raw", args.count,
+        lambda: [legacy_map_raw(attribute_map, regex_map, p) for p in payloads])
+    measure("fabricNode compiled raw", args.count, lambda: [mapper.map_raw(p) for p in payloads])
@@ -0,0 +1,169 @@
+"""
+measure encode/decode throughput and size of eptMsg wire formats
+
+    Builds a population of epm events in the same form as build_endpoint_db (epmMacEp, epmIpEp,
+    and epmRsMacEpToIpEpAtt) and reports for each wire format the encode and decode rate for
+    single events and eptMsgBulk messages, along with the average number of bytes per event. The
+    manager dispatch rate is reported for each format (decode, hash, and re-encode of each bulk)
+    and for routed frames (forward of encoded records using the precomputed routing header). If
+    --redis is set then each bulk is also pushed to a temporary redis list and the redis memory
+    usage per queued event is reported.
+
+    python msg_perf.py [--count 100000] [--bulk 10240] [--redis]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+# update sys path for importing test classes for app registration
+sys.path.append(os.path.realpath("%s/../../" % os.path.dirname(os.path.realpath(__file__))))
+
+# set logger to base app logger
+logger = logging.getLogger("app")
+
+from app.models.utils import get_redis
+from app.models.utils import setup_logger
+from app.models.aci.ept.common import MAX_SEND_MSG_LENGTH
+from app.models.aci.ept.common import get_ipv4_string
+from app.models.aci.ept.common import get_mac_string
+from app.models.aci.ept.common import get_msg_hash
+from app.models.aci.ept.ept_msg import WIRE_FORMATS
+from app.models.aci.ept.ept_msg import eptEpmEventParser
+from app.models.aci.ept.ept_msg import eptMsg
+from app.models.aci.ept.ept_msg import eptMsgBulk
+from app.models.aci.ept.ept_msg import compact_bulk_encode
+from app.models.aci.ept.ept_msg import routed_decode
+from app.models.aci.ept.ept_msg import routed_encode
+
+fabric = "fab1"
+overlay_vnid = 0x1000000
+mac_base = 0x0242ac000000
+ipv4_base = 0xa000100
+vrf_vnid = 2654208
+bd_vnid = 15302583
+perf_queue = "msg_perf"
+
+def get_events(count):
+    # return list of eptMsgWorkEpmEvent with equal number of mac, ip, and rs_ip events
+    parser = eptEpmEventParser(fabric, overlay_vnid)
+    events = []
+    for i in xrange(0, count):
+        node = 101 + i % 4
+        mac = get_mac_string(mac_base + i/3, fmt="std")
+        ip = get_ipv4_string(ipv4_base + i/3)
+        base = "topology/pod-1/node-%s/sys" % node
+        if i % 3 == 0:
+            classname = "epmMacEp"
+            dn = "%s/ctx-[vxlan-%s]/bd-[vxlan-%s]/vlan-[vlan-101]/db-ep/mac-%s" % (base, vrf_vnid,
+                    bd_vnid, mac)
+        elif i % 3 == 1:
+            classname = "epmIpEp"
+            dn = "%s/ctx-[vxlan-%s]/bd-[vxlan-%s]/vlan-[vlan-101]/db-ep/ip-[%s]" % (base, vrf_vnid,
+                    bd_vnid, ip)
+        else:
+            classname = "epmRsMacEpToIpEpAtt"
+            dn = "%s/ctx-[vxlan-%s]/bd-[vxlan-%s]/vlan-[vlan-101]/db-ep/mac-%s/" % (base, vrf_vnid,
+                    bd_vnid, mac)
+            dn+= "rsmacEpToIpEpAtt-[sys/ctx-[vxlan-%s]/bd-[vxlan-%s]/vlan-[vlan-101]/" % (
+                    vrf_vnid, bd_vnid)
+            dn+= "db-ep/ip-[%s]]" % ip
+        attr = {
+            "dn": dn,
+            "status": "created",
+            "flags": "ip,local,mac" if classname != "epmIpEp" else "ip,local",
+            "ifId": "eth1/%s" % (i % 48 + 1),
+            "pcTag": "49153",
+        }
+        events.append(parser.parse(classname, attr, time.time()))
+    return events
+
+def get_bulks(events, bulk_size):
+    bulks = []
+    for i in xrange(0, len(events), bulk_size):
+        bulk = eptMsgBulk()
+        bulk.msgs = events[i:i+bulk_size]
+        bulks.append(bulk)
+    return bulks
+
+def measure(name, wire_format, msgs, event_count):
+    # encode and decode all msgs and log rate (events per second) and bytes per event
+    ts = time.time()
+    encoded = [eptMsg.encode(m, wire_format) for m in msgs]
+    encode_time = time.time() - ts
+    ts = time.time()
+    for data in encoded: eptMsg.parse(data)
+    decode_time = time.time() - ts
+    total_bytes = sum([len(data) for data in encoded])
+    logger.debug("%-6s format:%s encode: %10.1f ev/s, decode: %10.1f ev/s, bytes/ev: %6.1f", name,
+        wire_format, event_count/encode_time, event_count/decode_time,
+        float(total_bytes)/event_count)
+    return encoded
+
+def measure_manager(wire_format, encoded, event_count):
+    # decode each bulk, calculate hash for each msg, and re-encode as the manager does for each
+    # bulk received on the manager work queue
+    ts = time.time()
+    for data in encoded:
+        bulk = eptMsg.parse(data)
+        for m in bulk.msgs: get_msg_hash(m)
+        eptMsg.encode(bulk, wire_format)
+    logger.debug("manager format:%s dispatch: %10.1f ev/s", wire_format, 
+        event_count/(time.time() - ts))
+
+def measure_manager_routed(bulks, event_count):
+    # encode routed frames (subscriber) and forward records with routing header (manager)
+    ts = time.time()
+    encoded = [routed_encode([(get_msg_hash(m), m) for m in b.msgs]) for b in bulks]
+    encode_time = time.time() - ts
+    ts = time.time()
+    for data in encoded:
+        compact_bulk_encode(1, [r[3] for r in routed_decode(data)[1]])
+    logger.debug("manager routed encode: %10.1f ev/s, dispatch: %10.1f ev/s, bytes/ev: %6.1f", 
+        event_count/encode_time, event_count/(time.time() - ts), 
+        float(sum([len(data) for data in encoded]))/event_count)
+
+def measure_redis(wire_format, encoded, event_count):
+    # push encoded msgs to temporary redis queue and report memory usage per event
+    redis = get_redis()
+    redis.delete(perf_queue)
+    start = redis.info("memory")["used_memory"]
+    for data in encoded:
+        redis.rpush(perf_queue, data)
+    used = redis.info("memory")["used_memory"] - start
+    try:
+        usage = redis.execute_command("MEMORY", "USAGE", perf_queue, "SAMPLES", "0")
+    except Exception as e:
+        usage = None
+    redis.delete(perf_queue)
+    logger.debug("redis  format:%s used_memory/ev: %6.1f, memory usage/ev: %s", wire_format,
+        float(used)/event_count,
+        "%6.1f" % (float(usage)/event_count) if usage is not None else "n/a")
+
+if __name__ == "__main__":
+
+    desc = """ measure eptMsg wire format encode/decode throughput """
+    parser = argparse.ArgumentParser(description=desc,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--count", dest="count", type=int, default=100000, help="epm events")
+    parser.add_argument("--bulk", dest="bulk", type=int, default=MAX_SEND_MSG_LENGTH,
+        help="events per eptMsgBulk")
+    parser.add_argument("--redis", dest="redis", action="store_true",
+        help="measure redis memory per queued event")
+    args = parser.parse_args()
+
+    # force logging to stdout
+    setup_logger(logger, stdout=True)
+
+    events = get_events(args.count)
+    bulks = get_bulks(events, args.bulk)
+    logger.debug("events: %s, bulks: %s", len(events), len(bulks))
+    for wire_format in WIRE_FORMATS:
+        measure("single", wire_format, events, len(events))
+        encoded = measure("bulk", wire_format, bulks, len(events))
+        measure_manager(wire_format, encoded, len(events))
+        if args.redis:
+            measure_redis(wire_format, encoded, len(events))
+    measure_manager_routed(bulks, len(events))
@@ -0,0 +1,115 @@
+"""
+measure memory and lookup rate of endpoint presence tracking used for build_endpoint_db delete
+reconciliation
+
+    Endpoints are added to the previous 3-level dict (endpoints[node][vnid][addr]) and to the
+    EndpointPresenceSet, each within a separate process. The resident memory of the process is
+    measured before and after adding all endpoints and reported per endpoint, along with the rate
+    of lookups for every endpoint. Half of the endpoints are mac and the remainder are ipv4 or ipv6
+    based on the provided ratio, spread across the provided number of nodes and vnids.
+
+    python presence_perf.py [--count 1000000] [--nodes 4] [--vnids 16] [--ipv6 0.05]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+# update sys path for importing test classes for app registration
+sys.path.append(os.path.realpath("%s/../../" % os.path.dirname(os.path.realpath(__file__))))
+
+# set logger to base app logger
+logger = logging.getLogger("app")
+
+from app.models.utils import setup_logger
+from app.models.aci.ept.common import EndpointPresenceSet
+from app.models.aci.ept.common import get_ipv4_string
+from app.models.aci.ept.common import get_ipv6_string
+from app.models.aci.ept.common import get_mac_string
+from multiprocessing import Pipe
+from multiprocessing import Process
+
+mac_base = 0x0242ac000000
+ipv4_base = 0xa000000
+ipv6_base = 0x20010000000000000000000000000000
+
+def get_endpoints(count, nodes, vnids, ipv6):
+    # generator of (node, vnid, type, addr) tuples
+    for i in xrange(0, count):
+        node = 101 + i % nodes
+        vnid = 0x800000 + (i / nodes) % vnids
+        if i % 2 == 0:
+            yield (node, vnid, "mac", get_mac_string(mac_base + i, fmt="std"))
+        elif ((i / 2) % 100) < ipv6 * 100:
+            yield (node, vnid, "ip", get_ipv6_string(ipv6_base + i))
+        else:
+            yield (node, vnid, "ip", get_ipv4_string(ipv4_base + i))
+
+def get_rss():
+    # return current resident memory of this process in bytes
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def measure_dict(args, conn):
+    start = get_rss()
+    endpoints = {}
+    ts = time.time()
+    for (node, vnid, addr_type, addr) in get_endpoints(args.count, args.nodes, args.vnids,
+                                                        args.ipv6):
+        if node not in endpoints: endpoints[node] = {}
+        if vnid not in endpoints[node]: endpoints[node][vnid] = {}
+        endpoints[node][vnid][addr] = 1
+    add_time = time.time() - ts
+    used = get_rss() - start
+    ts = time.time()
+    for (node, vnid, addr_type, addr) in get_endpoints(args.count, args.nodes, args.vnids,
+                                                        args.ipv6):
+        assert node in endpoints and vnid in endpoints[node] and addr in endpoints[node][vnid]
+    conn.send((used, add_time, time.time() - ts))
+
+def measure_presence(args, conn):
+    start = get_rss()
+    endpoints = EndpointPresenceSet()
+    ts = time.time()
+    for (node, vnid, addr_type, addr) in get_endpoints(args.count, args.nodes, args.vnids,
+                                                        args.ipv6):
+        endpoints.add(node, vnid, addr_type, addr)
+    add_time = time.time() - ts
+    ts = time.time()
+    for (node, vnid, addr_type, addr) in get_endpoints(args.count, args.nodes, args.vnids,
+                                                        args.ipv6):
+        assert endpoints.contains(node, vnid, addr_type, addr)
+    lookup_time = time.time() - ts
+    # measured after lookups as each array is sorted on first lookup
+    conn.send((get_rss() - start, add_time, lookup_time))
+
+def measure(name, func, args):
+    # execute measurement in a separate process and log results
+    (parent_conn, child_conn) = Pipe()
+    p = Process(target=func, args=(args, child_conn,))
+    p.start()
+    (used, add_time, lookup_time) = parent_conn.recv()
+    p.join()
+    logger.debug("%-8s bytes/ep: %6.1f, add: %10.1f ep/s, lookup: %10.1f ep/s", name,
+        float(used)/args.count, args.count/add_time, args.count/lookup_time)
+
+if __name__ == "__main__":
+
+    desc = """ measure endpoint presence tracking memory """
+    parser = argparse.ArgumentParser(description=desc,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--count", dest="count", type=int, default=1000000, help="endpoints")
+    parser.add_argument("--nodes", dest="nodes", type=int, default=4, help="nodes")
+    parser.add_argument("--vnids", dest="vnids", type=int, default=16, help="vnids per node")
+    parser.add_argument("--ipv6", dest="ipv6", type=float, default=0.05,
+        help="ratio of ip endpoints that are ipv6")
+    args = parser.parse_args()
+
+    # force logging to stdout
+    setup_logger(logger, stdout=True)
+
+    logger.debug("endpoints: %s, nodes: %s, vnids: %s", args.count, args.nodes, args.vnids)
+    measure("dict", measure_dict, args)
+    measure("presence", measure_presence, args)
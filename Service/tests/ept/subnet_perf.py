@@ -0,0 +1,102 @@
+"""
+measure rate of offsubnet check against the subnets of a single bd
+
+    A bd is created with the provided number of ipv4 subnets (and ipv6 subnets based on the
+    provided ratio). Addresses within and outside of the subnets are checked using the previous
+    linear walk of the bd subnets (parsing each subnet ip for every check) and using the subnetIndex
+    built once for the bd. The build time of the index is also reported.
+
+    python subnet_perf.py [--subnets 500] [--count 100000] [--ipv6 0.1]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+# update sys path for importing test classes for app registration
+sys.path.append(os.path.realpath("%s/../../" % os.path.dirname(os.path.realpath(__file__))))
+
+# set logger to base app logger
+logger = logging.getLogger("app")
+
+from app.models.utils import setup_logger
+from app.models.aci.ept.common import get_ip_prefix
+from app.models.aci.ept.common import get_ipv4_string
+from app.models.aci.ept.common import get_ipv6_string
+from app.models.aci.ept.ept_cache import subnetIndex
+
+ipv4_base = 0xa000000
+ipv6_base = 0x20010000000000000000000000000000
+
+class subnetObject(object):
+    # eptSubnet with name and ip attributes
+    def __init__(self, name, ip):
+        self.name = name
+        self.ip = ip
+
+def get_subnets(count, ipv6):
+    # list of /24 ipv4 and /112 ipv6 subnets
+    ret = []
+    for i in xrange(0, count):
+        if (i % 100) < ipv6 * 100:
+            ip = "%s/112" % get_ipv6_string(ipv6_base + (i << 16) + 1)
+        else:
+            ip = "%s/24" % get_ipv4_string(ipv4_base + (i << 8) + 1)
+        ret.append(subnetObject("subnet%s" % i, ip))
+    return ret
+
+def get_addresses(count, subnets, ipv6):
+    # list of ip strings where every other address is outside of the subnets
+    ret = []
+    for i in xrange(0, count):
+        s = (i / 2) % subnets
+        if (s % 100) < ipv6 * 100:
+            ret.append(get_ipv6_string(ipv6_base + (s << 16) + 5 + (i % 2) * 0x10000000))
+        else:
+            ret.append(get_ipv4_string(ipv4_base + (s << 8) + 5 + (i % 2) * 0x10000000))
+    return ret
+
+def legacy_is_offsubnet(subnets, addr):
+    # previous linear walk of bd subnets in eptCache.ip_is_offsubnet
+    for s in subnets:
+        (saddr, smask) = get_ip_prefix(s.ip)
+        if saddr is None or smask is None:
+            continue
+        if addr & smask == saddr:
+            return False
+    return True
+
+if __name__ == "__main__":
+
+    desc = """ measure offsubnet check rate """
+    parser = argparse.ArgumentParser(description=desc,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--subnets", dest="subnets", type=int, default=500, help="subnets in bd")
+    parser.add_argument("--count", dest="count", type=int, default=100000, help="checks")
+    parser.add_argument("--ipv6", dest="ipv6", type=float, default=0.1,
+        help="ratio of subnets that are ipv6")
+    args = parser.parse_args()
+
+    # force logging to stdout
+    setup_logger(logger, stdout=True)
+
+    subnets = get_subnets(args.subnets, args.ipv6)
+    addresses = [(ip, get_ip_prefix(ip)[0]) for ip in get_addresses(args.count, args.subnets,
+                    args.ipv6)]
+    logger.debug("subnets: %s, checks: %s", args.subnets, args.count)
+
+    ts = time.time()
+    index = subnetIndex(subnets)
+    logger.debug("%-8s %10.3f ms", "build", (time.time() - ts)*1000)
+
+    ts = time.time()
+    legacy = [legacy_is_offsubnet(subnets, addr) for (ip, addr) in addresses]
+    logger.debug("%-8s %10.1f checks/s", "legacy", args.count/(time.time() - ts))
+
+    ts = time.time()
+    indexed = [index.search(addr, ipv6=":" in ip) is None for (ip, addr) in addresses]
+    logger.debug("%-8s %10.1f checks/s", "index", args.count/(time.time() - ts))
+
+    assert legacy == indexed
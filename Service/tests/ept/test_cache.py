@@ -9,8 +9,11 @@ from app.models.aci.ept.ept_cache import eptCache
 from app.models.aci.ept.ept_cache import hitCache
 from app.models.aci.ept.ept_cache import hitCacheNotFound
 from app.models.aci.ept.ept_cache import offsubnetCachedObject
+from app.models.aci.ept.ept_cache import subnetIndex
+from app.models.aci.ept.ept_endpoint import eptEndpoint
 from app.models.aci.ept.ept_epg import eptEpg
 from app.models.aci.ept.ept_node import eptNode
+from app.models.aci.ept.ept_settings import eptSettings
 from app.models.aci.ept.ept_subnet import eptSubnet
 from app.models.aci.ept.ept_tunnel import eptTunnel
 from app.models.aci.ept.ept_vnid import eptVnid
@@ -50,6 +53,7 @@ def func_prep(request, app):
         eptNode.delete(_filters={})
         eptVpc.delete(_filters={})
         eptTunnel.delete(_filters={})
+        eptEndpoint.delete(_filters={})
         
     request.addfinalizer(teardown)
     return
@@ -178,6 +182,132 @@ def test_hit_cache_general_name_and_none_lookup(app, func_prep):
     assert h_cache.get_size() == 1
 
 
+def test_hit_cache_evict_callback(app, func_prep):
+    # evict callback (used by rapid_cache to save counters) is triggered with the val of the least
+    # recently used node only when max size is exceeded, never on remove or flush, and a failed
+    # callback does not prevent the eviction
+    evicted = []
+    def callback(val):
+        if val == "fail":
+            raise Exception("callback failure")
+        evicted.append(val)
+    h_cache = hitCache(3, callback=callback)
+    h_cache.push("key1", "val1")
+    h_cache.push("key2", "val2")
+    h_cache.push("key3", "val3")
+    assert len(evicted) == 0
+    # hit on key1 moves it to the head so key2 is the next evicted
+    assert h_cache.search("key1") == "val1"
+    h_cache.push("key4", "val4")
+    assert evicted == ["val2"]
+    assert isinstance(h_cache.search("key2"), hitCacheNotFound)
+    # push of existing key updates val without eviction
+    h_cache.push("key3", "val3-update")
+    assert evicted == ["val2"] and h_cache.get_size() == 3
+    assert h_cache.head.key == "key3" and h_cache.head.val == "val3-update"
+    # remove and flush do not trigger callback
+    h_cache.remove("key1")
+    h_cache.flush()
+    assert evicted == ["val2"] and h_cache.get_size() == 0
+    # failed callback still evicts the node
+    h_cache.push("key1", "fail")
+    h_cache.push("key2", "val2")
+    h_cache.push("key3", "val3")
+    h_cache.push("key4", "val4")
+    assert h_cache.get_size() == 3 and h_cache.tail.key == "key2"
+    assert isinstance(h_cache.search("key1"), hitCacheNotFound)
+
+def test_hit_cache_set_max_size_and_stats(app, func_prep):
+    # reducing max size drops least recently used nodes with evict callback, stats report the
+    # counters and approximate bytes which grows with the number of nodes
+    evicted = []
+    h_cache = hitCache(10, callback=lambda val: evicted.append(val))
+    empty_bytes = h_cache.get_bytes()
+    for i in range(0, 10):
+        h_cache.push("key%s" % i, "val%s" % i)
+    assert h_cache.get_bytes() > empty_bytes
+    h_cache.set_max_size(4)
+    assert h_cache.get_size() == 4 and h_cache.max_size == 4
+    assert evicted == ["val0", "val1", "val2", "val3", "val4", "val5"]
+    assert h_cache.tail.key == "key6"
+    h_cache.set_max_size(8)
+    h_cache.push("key10", "val10")
+    assert h_cache.get_size() == 5 and len(evicted) == 6
+    h_cache.search("key10")
+    h_cache.search("key0")
+    h_cache.remove("key10")
+    stats = h_cache.get_stats()
+    assert stats["size"] == 4 and stats["max_size"] == 8
+    assert stats["hit"] == 1 and stats["miss"] == 1 and stats["hit_ratio"] == 0.5
+    assert stats["drop"] == 6 and stats["evict"] == 7
+    assert stats["bytes"] > 0
+
+def test_cache_adapt(app, func_prep):
+    # cache capacity is set from settings, grows when dropping entries with low hit ratio within
+    # the memory budget, and is reduced when mostly unused but never below configured capacity
+    settings = eptSettings(fabric=tfabric, cache_size=64, cache_adaptive=True, 
+                            cache_worker_memory_budget=8)
+    cache = eptCache(tfabric, settings=settings)
+    assert cache.node_cache.max_size == 64
+    assert cache.endpoint_cache.max_size == settings.state_cache_size
+    def fill(count):
+        for i in range(0, count):
+            if isinstance(cache.node_cache.search(i), hitCacheNotFound):
+                cache.node_cache.push(i, eptNode(fabric=tfabric, node=i))
+    fill(200)
+    assert cache.adapt() == [("node_cache", 64, 128)]
+    assert cache.node_cache.max_size == 128
+    # no activity, no change
+    assert cache.adapt() == []
+    # mostly unused cache is halved but not below configured capacity
+    cache.node_cache.flush()
+    assert cache.adapt() == [("node_cache", 128, 64)]
+    assert cache.adapt() == []
+    # growth is limited by memory budget
+    cache.worker_memory_budget = 1
+    fill(200)
+    assert cache.adapt() == []
+    assert cache.node_cache.max_size == 64
+    # adapt disabled via settings
+    settings.cache_adaptive = False
+    settings.cache_size = 128
+    cache.apply_settings(settings)
+    assert cache.node_cache.max_size == 128
+    fill(400)
+    assert cache.adapt() == []
+    stats = cache.get_stats()
+    assert stats["caches"]["node_cache"]["size"] == 128 and stats["bytes"] > 0
+
+def test_hit_cache_tags(app, func_prep):
+    # remove by tag value removes only the nodes with the tag value and maintains head/tail
+    h_cache = hitCache(10, tags={
+        "bd": lambda val: getattr(val, "bd", None),
+        "node": lambda val: getattr(val, "node", None),
+    })
+    class taggedObject(object):
+        def __init__(self, bd, node):
+            self.bd = bd
+            self.node = node
+    for i in range(0, 6):
+        h_cache.push("key%s" % i, taggedObject(i % 2, 100 + i % 3))
+    h_cache.push("none", None)
+    assert h_cache.remove_tag("bd", 1) == 3
+    assert sorted(h_cache.key_hash.keys()) == ["key0", "key2", "key4", "none"]
+    assert 1 not in h_cache.tag_hash["bd"]
+    assert h_cache.head.key == "none" and h_cache.tail.key == "key0"
+    # node tag index updated for nodes removed by bd tag
+    assert sorted(h_cache.tag_hash["node"][101].keys()) == ["key4"]
+    assert h_cache.remove_tag("node", 101, preserve_none=False) == 1
+    assert sorted(h_cache.key_hash.keys()) == ["key0", "key2"]
+    assert h_cache.remove_tag("node", 999) == 0
+    # replacing a val updates its tags
+    h_cache.push("key0", taggedObject(5, 100))
+    assert "key0" not in h_cache.tag_hash["bd"].get(0, {})
+    assert h_cache.remove_tag("bd", 5) == 1
+    assert h_cache.key_hash.keys() == ["key2"]
+    h_cache.flush()
+    assert len(h_cache.tag_hash["bd"]) == 0 and len(h_cache.tag_hash["node"]) == 0
+
 def test_get_peer_node_lookup(app, func_prep):
     # add eptNode object and ensure cache returns peer value if found, and 0 if not present
     # trigger flush and ensure value is no longer found within cache
@@ -195,6 +325,39 @@ def test_get_peer_node_lookup(app, func_prep):
     assert cache.get_peer_node(node) == peer
     assert isinstance(cache.node_cache.search(keystr), eptNode)
 
+def test_cache_preload(app, func_prep):
+    # preload adds objects from each collection to the corresponding cache up to the cache size 
+    # and groups subnets per bd
+    cache = get_test_cache()
+    cache.node_cache.set_max_size(4)
+    for i in range(0, 8):
+        assert eptNode(fabric=tfabric, node=101+i, pod_id=1).save()
+    assert eptNode(fabric="fab2", node=201, pod_id=1).save()
+    assert eptTunnel(fabric=tfabric, node=101, intf="tunnel1", remote=102).save()
+    assert eptVnid(fabric=tfabric, name="uni/tn-t1/ctx-v1", vnid=1).save()
+    assert eptEpg(fabric=tfabric, name="epg1", vrf=1, pctag=0x1001, bd=2).save()
+    assert eptSubnet(fabric=tfabric, name="subnet1", bd=2, ip="10.1.1.1/24").save()
+    assert eptSubnet(fabric=tfabric, name="subnet2", bd=2, ip="20.1.1.1/24").save()
+    assert eptSubnet(fabric=tfabric, name="subnet3", bd=3, ip="30.1.1.1/24").save()
+    (count, duration) = cache.preload()
+    assert count == 4 + 1 + 1 + 1 + 2
+    assert cache.preload_count == count and cache.preload_time == duration
+    assert cache.node_cache.get_size() == 4
+    assert isinstance(cache.node_cache.search(cache.get_key_str(node=201)), hitCacheNotFound)
+    assert cache.tunnel_cache.search(cache.get_key_str(node=101, intf="tunnel1")).remote == 102
+    assert cache.vnid_cache.search(cache.get_key_str(vnid=1)).name == "uni/tn-t1/ctx-v1"
+    assert cache.epg_cache.search(cache.get_key_str(vrf=1, pctag=0x1001)).bd == 2
+    subnets = cache.subnet_cache.search(cache.get_key_str(bd=2))
+    assert sorted([s.name for s in subnets]) == ["subnet1", "subnet2"]
+    # lookups are served from cache
+    miss_count = cache.tunnel_cache.miss_count
+    assert cache.get_tunnel_remote(101, "tunnel1") == 102
+    assert cache.tunnel_cache.miss_count == miss_count
+    assert not cache.ip_is_offsubnet(1, 0x1001, "20.1.1.5")
+    # flush by name still supported for preloaded objects
+    cache.handle_flush(eptSubnet._classname, name="subnet3")
+    assert isinstance(cache.subnet_cache.search(cache.get_key_str(bd=3)), hitCacheNotFound)
+
 def test_get_tunnel_remote_lookup(app, func_prep):
     # add eptTunnel object and ensure cache returns remote node if found, else 0
     # trigger flush and ensure value is no longer found within cache but next lookup adds it
@@ -419,4 +582,99 @@ def test_ip_is_offsubnet_full(app, func_prep):
     assert isinstance(cache.offsubnet_cache.search(cache.get_key_str(vrf=vrf,pctag=0x1004,ip="30.1.2.5")),
             offsubnetCachedObject)
 
-
+def test_subnet_index_nested_and_disjoint_prefixes(app, func_prep):
+    # subnet index merges nested prefixes into the enclosing prefix, keeps ipv4 and ipv6 ranges
+    # separate, and ignores subnets that cannot be parsed
+    subnets = [
+        eptSubnet(fabric=tfabric, name="subnet1", bd=1, ip="10.1.1.1/24"),
+        eptSubnet(fabric=tfabric, name="subnet2", bd=1, ip="10.0.0.1/8"),
+        eptSubnet(fabric=tfabric, name="subnet3", bd=1, ip="20.1.1.1/24"),
+        eptSubnet(fabric=tfabric, name="subnet4", bd=1, ip="2001:1:2:3:4:5:6:7/112"),
+        eptSubnet(fabric=tfabric, name="subnet5", bd=1, ip="invalid"),
+    ]
+    index = subnetIndex(subnets)
+    def search(ip):
+        (addr, mask) = get_ip_prefix(ip)
+        return index.search(addr, ipv6=":" in ip)
+    assert index.count == 5
+    assert search("10.1.1.5") == "subnet2"
+    assert search("10.255.255.255") == "subnet2"
+    assert search("11.0.0.0") is None
+    assert search("9.255.255.255") is None
+    assert search("20.1.1.0") == "subnet3"
+    assert search("20.1.1.255") == "subnet3"
+    assert search("20.1.2.0") is None
+    assert search("2001:1:2:3:4:5:6:abcd") == "subnet4"
+    assert search("2001:1:2:3:4:5:5:abcd") is None
+    assert subnetIndex([]).search(1) is None
+
+def test_subnet_index_flush(app, func_prep):
+    # subnet index for a bd is rebuilt after a flush of any subnet within the bd
+    cache = get_test_cache()
+    vrf = 1
+    assert eptEpg.load(fabric=tfabric, name="epg1", vrf=vrf, pctag=0x1001, bd=1).save()
+    assert eptSubnet.load(fabric=tfabric, name="subnet1", bd=1, ip="10.1.1.1/24").save()
+    assert cache.ip_is_offsubnet(vrf, 0x1001, "20.1.1.5")
+    index = cache.get_subnet_index(1)
+    assert cache.get_subnet_index(1) is index
+    assert eptSubnet.load(fabric=tfabric, name="subnet2", bd=1, ip="20.1.1.1/24").save()
+    cache.handle_flush(eptSubnet._classname, name="subnet2")
+    assert cache.get_subnet_index(1) is not index
+    assert not cache.ip_is_offsubnet(vrf, 0x1001, "20.1.1.5")
+
+def test_rapid_rate_engine(app, func_prep):
+    # rates are refreshed at most once per tick from the events within the sliding window scaled to
+    # events per minute, endpoints above the threshold are flagged rapid until holdtime expires, 
+    # and counters are saved to eptEndpoint at flush interval and when the slot is evicted
+    cache = get_test_cache()
+    rapid = cache.rapid
+    assert rapid.buckets == 15 and rapid.window == 15.0
+    for addr in ["10.1.1.1", "10.1.1.2"]:
+        assert eptEndpoint.load(fabric=tfabric, vnid=1, addr=addr, type="ipv4").save()
+    slot = rapid.get_slot(1, "10.1.1.1", "ipv4")
+    assert rapid.get_slot(1, "10.1.1.1", "ipv4") == slot
+    assert not rapid.is_loaded(slot)
+    rapid.load(slot, None)
+    assert rapid.is_loaded(slot) and not rapid.is_rapid(slot)
+    ts = 1000.0
+    rapid.last_flush = ts
+    for i in range(0, 30): rapid.increment(slot)
+    assert rapid.tick(ts, 500, 600) == []
+    assert abs(rapid.rate[slot] - 120) < 0.001
+    # within tick interval, no refresh
+    for i in range(0, 120): rapid.increment(slot)
+    assert rapid.tick(ts + 0.5, 500, 600) == []
+    assert rapid.pending[slot] == 120
+    assert rapid.tick(ts + 1, 500, 600) == [slot]
+    assert abs(rapid.rate[slot] - 600) < 0.001
+    assert rapid.is_rapid(slot) and rapid.rapid_ts[slot] == ts + 1
+    assert rapid.count[slot] == 150 and rapid.lcount[slot] == 150 and rapid.pending[slot] == 0
+    # ignored events while rapid
+    for i in range(0, 10): rapid.increment(slot)
+    assert rapid.icount[slot] == 10
+    # events of the first tick are no longer within the window
+    assert rapid.tick(ts + 15, 500, 600) == []
+    assert abs(rapid.rate[slot] - 520) < 0.001
+    # counters saved at flush interval
+    e = eptEndpoint.find(fabric=tfabric, vnid=1, addr="10.1.1.1")[0]
+    assert e.is_rapid and e.is_rapid_ts == ts + 1 and e.rapid_lts == ts + 15
+    assert e.rapid_count == 160 and e.rapid_icount == 10 and e.rapid_rate == rapid.rate[slot]
+    assert len(rapid.dirty) == 0
+    # rapid endpoint rate drops without events but remains rapid until holdtime expires
+    assert rapid.tick(ts + 16, 500, 600) == []
+    assert rapid.is_rapid(slot) and abs(rapid.rate[slot] - 40) < 0.001
+    assert rapid.tick(ts + 700, 500, 600) == []
+    assert not rapid.is_rapid(slot) and rapid.rate[slot] == 0
+    # evicted slot is saved and reused
+    cache.rapid_cache.set_max_size(1)
+    slot2 = rapid.get_slot(1, "10.1.1.2", "ipv4")
+    assert slot2 == len(rapid.keys) - 1 and rapid.keys[slot] is None and rapid.free == [slot]
+    e = eptEndpoint.find(fabric=tfabric, vnid=1, addr="10.1.1.1")[0]
+    assert not e.is_rapid and e.rapid_lts == ts + 700
+    assert rapid.get_slot(1, "10.1.1.1", "ipv4") == slot
+    assert not rapid.is_loaded(slot) and rapid.keys[slot2] is None
+    # load from endpoint state
+    rapid.load(slot, e.to_dict())
+    assert rapid.count[slot] == 160 and rapid.lts[slot] == ts + 700 and not rapid.is_rapid(slot)
+    assert rapid.remove(1, "10.1.1.1", save=False)
+    assert not rapid.remove(1, "10.1.1.1")
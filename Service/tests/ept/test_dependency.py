@@ -11,6 +11,8 @@ from app.models.aci.ept.ept_pc import eptPc
 from app.models.aci.ept.ept_subnet import eptSubnet
 from app.models.aci.ept.ept_tunnel import eptTunnel
 from app.models.aci.ept.ept_vnid import eptVnid
+from app.models.aci.ept.mo_dependency import EptMapper
+from app.models.aci.ept.mo_dependency import sync_events
 from app.models.aci.ept.mo_dependency_map import dependency_map as dmap
 
 from app.models.aci.mo.fvCtx import fvCtx
@@ -560,3 +562,67 @@ def test_dependency_pc_member_callback(app, func_prep):
     assert len(pc)==1
     assert len(pc[0].members)==2 and mbr1 in pc[0].members and mbr3 in pc[0].members
 
+def test_dependency_ept_mapper(app, func_prep):
+    # compiled mapper extracts regex values from raw attributes, drops objects that do not match
+    # the regex, and resolves mo attributes from the first available parent
+    mapper = dmap["tunnelIf"].ept_mapper
+    db_obj = mapper.map_raw({
+        "dn": "topology/pod-1/node-101/sys/tunnel-[tunnel1]",
+        "id": "tunnel1",
+        "dest": "10.0.0.2",
+    })
+    assert db_obj["node"] == "101" and db_obj["dst"] == "10.0.0.2"
+    assert db_obj["name"] == "topology/pod-1/node-101/sys/tunnel-[tunnel1]"
+    assert "status" not in db_obj
+    assert mapper.map_raw({"dn": "uni/tn-ag", "id": "tunnel1"}) == {}
+
+    dn = "uni/tn-ag/ap-app/epg-e1"
+    epg = fvAEPg(fabric=tfabric, dn=dn, scope="1", pcTag="32770", isAttrBasedEPg="no")
+    vals = dict(dmap["fvAEPg"].ept_mapper.map_mo(epg, {"fvSvcBD": fvSvcBD(seg="3")}))
+    assert vals["name"] == dn and vals["pctag"] == "32770" and vals["bd"] == "3"
+    vals = dict(dmap["fvAEPg"].ept_mapper.map_mo(epg, {}))
+    assert vals["bd"] is None
+
+    # attribute map provided without dependency node
+    mapper = EptMapper({"node": "dn"}, {"node": "node-(?P<value>[0-9]+)"})
+    assert mapper.map_raw({"dn": "topology/pod-1/node-201"}) == {"node": "201"}
+    assert mapper.map_raw({"name": "node-201"}) == {}
+
+def test_dependency_sync_events_batch(app, func_prep):
+    # burst of events in arbitrary order is coalesced per dn and all dependencies are resolved as
+    # a single batch with the same result as individual sync_event calls
+    vrf = 1
+    bd_dn = "uni/tn-ag/BD-bd1"
+    epg_dn = "uni/tn-ag/ap-ap1/epg-e1"
+    events = [
+        (dmap["fvAEPg"], get_create_event({"dn":epg_dn,"pcTag":3,"scope":vrf,
+                                            "isAttrBasedEPg":"no"})),
+        (dmap["fvSubnet"], get_create_event({"dn":"%s/subnet-[10.1.1.1/24]" % bd_dn,
+                                            "ip":"10.1.1.1/24"})),
+        (dmap["fvSubnet"], get_create_event({"dn":"%s/subnet-[10.2.1.1/24]" % epg_dn,
+                                            "ip":"10.2.1.1/24"})),
+        (dmap["fvRsBd"], get_create_event({"dn":"%s/rsbd" % epg_dn, "tDn": bd_dn})),
+        (dmap["fvBD"], get_create_event({"dn":bd_dn,"pcTag":4,"scope":vrf,"seg":2})),
+        (dmap["fvBD"], get_update_event({"dn":bd_dn,"seg":5}, ts=0xf0000002)),
+    ]
+    updates = sync_events(tfabric, events)
+    names = set([(u._classname, u.name) for u in updates])
+    assert (eptVnid._classname, bd_dn) in names
+    assert (eptEpg._classname, epg_dn) in names
+    assert len([n for n in names if n[0] == eptSubnet._classname]) == 2
+
+    bd = fvBD.load(fabric=tfabric, dn=bd_dn)
+    assert bd.exists()
+    assert eptVnid.load(fabric=tfabric, name=bd_dn).vnid == 5
+    assert eptEpg.load(fabric=tfabric, name=epg_dn).bd == 5
+    for s in eptSubnet.find(fabric=tfabric):
+        assert s.bd == 5
+
+    # delete following update in same batch removes bd and resets dependents
+    updates = sync_events(tfabric, [
+        (dmap["fvBD"], get_update_event({"dn":bd_dn,"seg":6}, ts=0xf0000003)),
+        (dmap["fvBD"], get_delete_event({"dn":bd_dn}, ts=0xf0000004)),
+    ])
+    assert not fvBD.load(fabric=tfabric, dn=bd_dn).exists()
+    assert not eptVnid.load(fabric=tfabric, name=bd_dn).exists()
+    assert eptEpg.load(fabric=tfabric, name=epg_dn).bd == 0
@@ -69,14 +69,38 @@ tenant ag, vrf v1, bd bd1/bd2/bd3, app a1, epg e1/e2/e3
 
 
 """
+import json
 import logging
 import pytest
+import threading
 import time
 
+from app.models.aci import utils as aci_utils
 from app.models.aci.fabric import Fabric
+from app.models.aci.tools.connection_pool import ConnectionPool
 from app.models.aci.ept.common import MANAGER_WORK_QUEUE
+from app.models.aci.ept.common import WORKER_EPOCH_KEY
+from app.models.aci.ept.common import WORKER_SET_KEY
+from app.models.aci.ept.common import WORK_QUEUE_QUANTUM
+from app.models.aci.ept.common import EndpointPresenceSet
+from app.models.aci.ept.common import HashRing
+from app.models.aci.ept.common import WatchHeap
+from app.models.aci.ept.common import add_work
+from app.models.aci.ept.common import get_fabric_work_queues
+from app.models.aci.ept.common import get_ip_prefix
+from app.models.aci.ept.common import get_mac_value
+from app.models.aci.ept.common import get_msg_hash
+from app.models.aci.ept.common import get_notify_queue
+from app.models.aci.ept.common import get_pending_queue
+from app.models.aci.ept.common import get_queue_length
+from app.models.aci.ept.common import get_work_queue
 from app.models.aci.ept.ept_msg import *
+from app.models.aci.ept import ept_worker
 from app.models.aci.ept.ept_worker import eptWorker
+from app.models.aci.ept.ept_worker_pool import eptWorkerPool
+from app.models.aci.ept import ept_subscriber
+from app.models.aci.ept.ept_subscriber import DIRECT_WORK_SCRIPT
+from app.models.aci.ept.ept_subscriber import eptSubscriber
 from app.models.aci.ept.ept_queue_stats import eptQueueStats
 from app.models.aci.ept.ept_epg import eptEpg
 from app.models.aci.ept.ept_subnet import eptSubnet
@@ -88,6 +112,7 @@ from app.models.aci.ept.ept_tunnel import eptTunnel
 from app.models.aci.ept.ept_history import eptHistory
 from app.models.aci.ept.ept_history import eptHistoryEvent
 from app.models.aci.ept.ept_stale import eptStale
+from app.models.aci.ept.ept_stale import eptStaleEvent
 from app.models.aci.ept.ept_move import eptMove
 from app.models.aci.ept.ept_move import eptMoveEvent
 from app.models.aci.ept.ept_offsubnet import eptOffSubnet
@@ -95,6 +120,8 @@ from app.models.aci.ept.ept_endpoint import eptEndpoint
 from app.models.aci.ept.ept_endpoint import eptEndpointEvent
 from app.models.aci.ept.ept_rapid import eptRapid
 from app.models.aci.ept.ept_remediate import eptRemediate
+from app.models.aci.ept.ept_remediator import eptRemediateJob
+from app.models.aci.ept.ept_remediator import eptRemediator
 from app.models.aci.ept.ept_settings import eptSettings
 
 from app.models.rest.db import db_setup
@@ -1946,6 +1973,303 @@ def test_handle_endpoint_ignore_suppress_for_new_stale_event(app, func_prep):
     assert msgs[1].event["expected_remote"] == 0
 
 
+def test_watcher_execute_watch_stale_batch(app, func_prep):
+    # stale watch events for multiple endpoints are verified as a single batch. eptEndpoint is 
+    # updated and stale event added for each endpoint, and a repeated watch event for the same
+    # stale endpoint is suppressed as a duplicate
+
+    dut = get_worker()
+    ips = ["10.1.1.101", "10.1.1.102", "10.1.1.103"]
+    for ip in ips:
+        msg = get_epm_event(101, ip, wt=WORK_TYPE.EPM_IP_EVENT, remote_node=103, ts=1000000001.0)
+        dut.set_msg_worker_fabric(msg)
+        dut.handle_endpoint_event(msg)
+    msgs = get_queue_msgs(pop=True)
+    assert len(msgs) == len(ips)
+
+    watcher = get_worker(role="watcher")
+    def execute(msgs):
+        for msg in msgs:
+            watcher.set_msg_worker_fabric(msg)
+            # set received time in the past so the watch is immediately ready
+            msg.now = 0
+            watcher.handle_watch_stale(msg)
+        watcher.execute_generic_watch("stale")
+    execute(msgs)
+    assert len(watcher.watch_stale) == 0
+    for ip in ips:
+        e = eptEndpoint.find(fabric=tfabric, addr=ip)
+        assert len(e) == 1 and e[0].is_stale
+        s = eptStale.find(fabric=tfabric, addr=ip, node=101)
+        assert len(s) == 1 and len(s[0].events) == 1
+    # eptEndpoint cache flush sent to owning worker for each endpoint
+    flush = [m for m in get_queue_msgs(pop=True) if m.wt == WORK_TYPE.FLUSH_CACHE]
+    assert len(flush) == len(ips)
+    # duplicate event is not added
+    execute(msgs)
+    for ip in ips:
+        s = eptStale.find(fabric=tfabric, addr=ip, node=101)
+        assert len(s) == 1 and len(s[0].events) == 1
+
+class FakeChild(object):
+    # pexpect child of Connection
+    def __init__(self):
+        self.alive = True
+
+    def isalive(self):
+        return self.alive
+
+class FakeConnection(object):
+    # tools.connection.Connection with the command echoed and the prompt in the output. Returns
+    # result (prompt by default) for each command other than the empty command used to check the
+    # prompt
+    def __init__(self):
+        self.output = ""
+        self.cmds = []
+        self.closed = False
+        self.child = FakeChild()
+        self.result = "prompt"
+        self.prompt = "leaf101#"
+
+    def cmd(self, command, **kwargs):
+        self.cmds.append(command)
+        self.output = "%s\r\n%s " % (command, self.prompt)
+        if len(command) == 0:
+            return "prompt"
+        return self.result
+
+    def close(self):
+        self.closed = True
+
+class FakeSession(object):
+    # apic session
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def get_fake_pool(monkeypatch, logins, **kwargs):
+    # connection pool with apic session and ssh connection replaced with fake objects. Each new
+    # connection is added to logins as a tuple (fabric, node, connection)
+    def get_ssh_connection(fabric, pod, node, session=None):
+        c = FakeConnection()
+        logins.append((fabric, node, c))
+        return c
+    monkeypatch.setattr(aci_utils, "get_apic_session", lambda fabric: FakeSession())
+    monkeypatch.setattr(aci_utils, "get_attributes", lambda session, dn: {"id": 1})
+    monkeypatch.setattr(aci_utils, "get_ssh_connection", get_ssh_connection)
+    return ConnectionPool(**kwargs)
+
+def test_connection_pool_reuse_and_health_check(app, func_prep, monkeypatch):
+    # released connection is reused for the same node and replaced if the health check fails
+    logins = []
+    pool = get_fake_pool(monkeypatch, logins, health_interval=0)
+    ssh = pool.acquire(tfabric, 1, 101)
+    pool.release(tfabric, 101, ssh)
+    assert pool.acquire(tfabric, 1, 101) is ssh
+    assert ssh.cmds == ["", ""]
+    ssh.child.alive = False
+    pool.release(tfabric, 101, ssh)
+    ssh2 = pool.acquire(tfabric, 1, 101)
+    assert ssh2 is not ssh and ssh.closed
+    pool.release(tfabric, 101, ssh2, healthy=False)
+    assert ssh2.closed
+    stats = pool.get_stats()
+    assert stats["logins"] == 2 and stats["reused"] == 1 and stats["health_failed"] == 1
+    assert stats["sessions"] == 1 and stats["in_use"] == 0 and stats["idle"] == 0
+
+def test_connection_pool_node_session_lost(app, func_prep, monkeypatch):
+    # pooled connection returning the apic prompt lost the ssh session to the node and is replaced
+    # with a new connection
+    logins = []
+    pool = get_fake_pool(monkeypatch, logins)
+    ssh = pool.acquire(tfabric, 1, 101)
+    pool.release(tfabric, 101, ssh)
+    ssh.prompt = "apic1#"
+    ssh2 = pool.acquire(tfabric, 1, 101)
+    assert ssh2 is not ssh and ssh.closed and len(logins) == 2
+    pool.release(tfabric, 101, ssh2)
+    assert pool.acquire(tfabric, 1, 101) is ssh2
+    pool.release(tfabric, 101, ssh2)
+    stats = pool.get_stats()
+    assert stats["logins"] == 2 and stats["reused"] == 1 and stats["health_failed"] == 1
+    pool.close()
+
+def test_connection_pool_max_concurrency_and_idle_timeout(app, func_prep, monkeypatch):
+    # acquire blocks while max concurrency connections are in use and idle connections and
+    # sessions are closed after idle timeout
+    logins = []
+    pool = get_fake_pool(monkeypatch, logins, max_concurrency=1, idle_timeout=0.1)
+    ssh = pool.acquire(tfabric, 1, 101)
+    assert pool.acquire(tfabric, 1, 102, timeout=0.1) is None
+    assert pool.acquire(tfabric, 1, 101, timeout=0.1) is None
+    pool.release(tfabric, 101, ssh)
+    ssh2 = pool.acquire(tfabric, 1, 102, timeout=0.1)
+    assert ssh2 is not None
+    pool.release(tfabric, 102, ssh2)
+    session = pool.sessions[tfabric][0]
+    time.sleep(0.2)
+    pool.close_idle()
+    assert ssh.closed and ssh2.closed and session.closed
+    assert pool.get_stats()["idle"] == 0 and pool.get_stats()["fabrics"] == 0
+
+def test_remediator_single_login_per_node(app, func_prep, monkeypatch):
+    # many clears on the same node are executed over a single pooled ssh connection, nodes are
+    # served in parallel, and the callback receives the result of each clear
+    logins = []
+    pool = get_fake_pool(monkeypatch, logins)
+    results = []
+    def callback(job, success):
+        results.append((job, success))
+    dut = eptRemediator(max_workers=2, batch_size=8, rate=0, pool=pool)
+    for node in [101, 102]:
+        for i in range(0, 20):
+            dut.submit(eptRemediateJob(tfabric, 1, node, 1, "10.1.1.%s" % i, vrf_name="ag:v1",
+                                        callback=callback))
+    dut.start()
+    for i in range(0, 50):
+        if len(results) == 40: break
+        time.sleep(0.1)
+    dut.stop()
+    pool.close()
+    assert len(results) == 40
+    assert all([success for (job, success) in results])
+    assert sorted([(f, n) for (f, n, c) in logins]) == [(tfabric, 101), (tfabric, 102)]
+    # each batch of 8 clears is executed as a single vsh command
+    clear = "clear system internal epm endpoint key vrf ag:v1 ip 10.1.1.%s"
+    for (fabric, node, c) in logins:
+        clears = [cmd for cmd in c.cmds if len(cmd) > 0]
+        assert len(clears) == 3 and c.closed
+        assert clears[0] == "vsh -c '%s'" % " ; ".join([clear % i for i in range(0, 8)])
+        assert clears[2] == "vsh -c '%s'" % " ; ".join([clear % i for i in range(16, 20)])
+    assert dut.get_stats()["cleared"] == 40
+
+def test_remediator_batch_max_cmd_length(app, func_prep, monkeypatch):
+    # ip clears of a batch are split into vsh commands of up to max_cmd_length characters, a clear
+    # without a known vrf fails on its own and mac clears are executed individually
+    logins = []
+    pool = get_fake_pool(monkeypatch, logins)
+    dut = eptRemediator(rate=0, max_cmd_length=200, pool=pool)
+    jobs = [eptRemediateJob(tfabric, 1, 101, 1, "10.1.1.%s" % i, vrf_name="ag:v1")
+                for i in range(0, 10)]
+    jobs.insert(3, eptRemediateJob(tfabric, 1, 101, 1, "10.1.1.100"))
+    jobs.insert(5, eptRemediateJob(tfabric, 1, 101, 1, "00:00:01:02:03:04", addr_type="mac"))
+    dut.execute_batch((tfabric, 101), jobs)
+    assert len(logins) == 1
+    clears = [cmd for cmd in logins[0][2].cmds if cmd.startswith("vsh")]
+    assert len(clears) == 4 and all([len(c) <= 200 for c in clears])
+    assert sum([c.count("clear system") for c in clears]) == 10
+    assert [j.success for j in jobs].count(False) == 1 and not jobs[3].success
+    assert dut.get_stats()["cleared"] == 11 and dut.get_stats()["failed"] == 1
+    pool.close()
+
+def test_remediator_retry_on_connection_loss(app, func_prep, monkeypatch):
+    # failed clear keeps the pooled connection and is not retried, a lost connection is closed and
+    # the clear is retried once on a new connection
+    logins = []
+    pool = get_fake_pool(monkeypatch, logins)
+    dut = eptRemediator(rate=0, pool=pool)
+    # vrf cannot be determined for vnid without eptVnid
+    jobs = [eptRemediateJob(tfabric, 1, 101, 1, "10.1.1.1"),
+            eptRemediateJob(tfabric, 1, 101, 1, "10.1.1.2", vrf_name="ag:v1")]
+    dut.execute_batch((tfabric, 101), jobs)
+    assert not jobs[0].success and jobs[1].success
+    assert len(logins) == 1 and not logins[0][2].closed
+    # clear rejected by node
+    logins[0][2].result = "error"
+    job = eptRemediateJob(tfabric, 1, 101, 1, "10.1.1.1", vrf_name="ag:v1")
+    dut.execute_batch((tfabric, 101), [job])
+    assert not job.success and len(logins) == 1 and not logins[0][2].closed
+    # connection lost during clear
+    logins[0][2].result = "timeout"
+    job = eptRemediateJob(tfabric, 1, 101, 1, "10.1.1.1", vrf_name="ag:v1")
+    dut.execute_batch((tfabric, 101), [job])
+    assert job.success and len(logins) == 2 and logins[0][2].closed
+    # connection lost on every attempt
+    monkeypatch.setattr(FakeConnection, "cmd", lambda self, command, **kwargs: "eof")
+    job = eptRemediateJob(tfabric, 1, 101, 1, "10.1.1.1", vrf_name="ag:v1")
+    dut.execute_batch((tfabric, 101), [job])
+    assert not job.success and len(logins) == 3 and logins[1][2].closed and logins[2][2].closed
+    assert dut.get_stats()["failed"] == 3 and dut.get_stats()["cleared"] == 2
+    pool.close()
+
+def test_remediator_rate_limit(app, func_prep, monkeypatch):
+    # clears are limited to the configured rate
+    pool = get_fake_pool(monkeypatch, [])
+    results = []
+    dut = eptRemediator(max_workers=4, rate=10, pool=pool)
+    for i in range(0, 15):
+        dut.submit(eptRemediateJob(tfabric, 1, 101 + i % 4, 1, "10.1.1.%s" % i, vrf_name="ag:v1",
+                                    callback=lambda job, success: results.append(job)))
+    dut.start()
+    for i in range(0, 50):
+        if len(results) == 15: break
+        time.sleep(0.1)
+    dut.stop()
+    assert len(results) == 15
+    # first 10 clears use the initial burst, remaining 5 at 10 per second
+    ts = sorted([job.execute_ts for job in results])
+    assert ts[-1] - ts[0] >= 0.4
+
+def test_watcher_remediate_complete(app, func_prep):
+    # successful clear from remediator is recorded in eptRemediate, failed clear is not. The event
+    # is written immediately even if the fabric writer is enabled
+    watcher = get_worker(role="watcher")
+    msg = get_epm_event(101, "10.1.1.101", wt=WORK_TYPE.EPM_IP_EVENT)
+    watcher.set_msg_worker_fabric(msg)
+    msg.wf.writer.start()
+    event = eptStaleEvent()
+    for (addr, success) in [("10.1.1.101", True), ("10.1.1.102", False)]:
+        key = {"fabric": tfabric, "vnid": msg.vnid, "addr": addr, "node": 101, "type": "ipv4"}
+        job = eptRemediateJob(tfabric, 1, 101, msg.vnid, addr,
+                                data=(key, "is_stale", event, msg.wf))
+        job.execute_ts = 1.0
+        watcher.remediate_complete(job, success)
+    r = eptRemediate.find(fabric=tfabric, node=101)
+    assert len(r) == 1 and r[0].addr == "10.1.1.101"
+    assert r[0].events[0]["reason"] == "stale" and r[0].events[0]["action"] == "clear"
+    assert msg.wf.writer.count == 0
+    msg.wf.writer.stop()
+
+def test_handle_endpoint_event_rapid(app, func_prep):
+    # endpoint with a steady event rate of 1.5x rapid_threshold is marked as rapid once the events
+    # within the sliding rate window exceed the threshold (2/3 of the window), an eptRapid entry is
+    # added and a WATCH_RAPID msg is sent to the watcher. Further events are ignored while rapid
+
+    dut = get_worker()
+    ip = "10.1.1.101"
+    get_queue_msgs(pop=True)
+    ts = time.time()
+    rapid = None
+    interval = None
+    for i in range(0, 2000):
+        msg = get_epm_event(101, ip, wt=WORK_TYPE.EPM_IP_EVENT, epg=1, intf="eth1/1", ts=1.0)
+        dut.set_msg_worker_fabric(msg)
+        if rapid is None:
+            rapid = msg.wf.cache.rapid
+            interval = 60.0 / (1.5 * msg.wf.settings.rapid_threshold)
+        msg.now = ts + i * interval
+        dut.handle_endpoint_event(msg)
+        slot = rapid.get_slot(msg.vnid, ip, "ipv4")
+        if rapid.is_rapid(slot):
+            break
+    elapsed = msg.now - ts
+    assert rapid.is_rapid(slot)
+    assert rapid.window * 2 / 3 - 1 <= elapsed <= rapid.window * 2 / 3 + 1
+    r = eptRapid.find(fabric=tfabric, vnid=msg.vnid, addr=ip)
+    assert len(r) == 1 and r[0].rate > msg.wf.settings.rapid_threshold
+    watch = [m for m in get_queue_msgs(pop=True) if m.wt == WORK_TYPE.WATCH_RAPID]
+    assert len(watch) == 1 and watch[0].addr == ip and watch[0].vnid == msg.vnid
+    icount = rapid.icount[slot]
+    msg = get_epm_event(101, ip, wt=WORK_TYPE.EPM_IP_EVENT, epg=1, intf="eth1/2", ts=2.0)
+    dut.set_msg_worker_fabric(msg)
+    msg.now = ts + elapsed + interval
+    dut.handle_endpoint_event(msg)
+    assert rapid.icount[slot] == icount + 1
+    e = eptEndpoint.find(fabric=tfabric, vnid=msg.vnid, addr=ip)
+    assert len(e) == 1 and e[0].events[0]["intf_id"] == "eth1/1"
+
 def test_handle_endpoint_set_pod_id(app, func_prep):
     # ensure create and update event for eptEndpoint includes pod-id.  for this case we will create
     # and ip endpoint on node-101 and then trigger a move to new intf and ensure pod-id is maintained
@@ -2103,6 +2427,540 @@ def test_create_ept_msg_bulk(app, func_prep):
         assert m.wt == WORK_TYPE.EPM_IP_EVENT
         assert m.addr == ip
 
+def test_create_ept_msg_bulk_compact(app, func_prep):
+    # encode eptMsgBulk with compact wire format and ensure all msgs are the same as json encoding
+    # including msgs that fallback to json and flags that are not interned
+
+    ip = "10.1.1.101"
+    msg1 = get_epm_event(101, ip, wt=WORK_TYPE.EPM_IP_EVENT, epg=1, intf="eth1/1", ts=1.0,
+                flags=["ip", "local", "unknown-flag"])
+    msg2 = get_epm_event(101, "00:00:01:02:03:04", ip=ip, wt=WORK_TYPE.EPM_RS_IP_EVENT, epg=1,
+                ts=1.0)
+    msg3 = eptMsgWork(0, "worker", {"cache":"x", "name":""}, WORK_TYPE.FLUSH_CACHE, fabric=tfabric)
+    bulk = eptMsgBulk()
+    bulk.msgs = [msg1, msg2, msg3]
+
+    data = eptMsg.encode(bulk, WIRE_FORMAT_COMPACT)
+    assert data[0:1] == COMPACT_MAGIC
+    assert len(data) < len(bulk.jsonify())
+    p = eptMsg.parse(data)
+    assert p.msg_type == MSG_TYPE.BULK
+    assert len(p.msgs) == 3
+    for i, m in enumerate(p.msgs):
+        assert m.jsonify() == bulk.msgs[i].jsonify()
+    assert p.msgs[0].flags == ["ip", "local", "unknown-flag"]
+    assert eptMsg.parse(data, brief=True).msg_count == 3
+
+    # non-epm msgs are always json encoded
+    assert eptMsg.encode(msg3, WIRE_FORMAT_COMPACT) == msg3.jsonify()
+
+def test_routed_frame_forward(app, func_prep):
+    # routed frame from subscriber must provide routing header for each msg without decoding the 
+    # msg and records forwarded within a compact bulk must decode to the original msgs
+
+    mac = "00:00:01:02:03:04"
+    ip = "10.1.1.101"
+    msg1 = get_epm_event(101, ip, wt=WORK_TYPE.EPM_IP_EVENT, epg=1, intf="eth1/1", ts=1.0)
+    msg2 = get_epm_event(101, mac, ip=ip, wt=WORK_TYPE.EPM_RS_IP_EVENT, epg=1, ts=1.0)
+    msg3 = eptMsgWork(0, None, {"cache":"x", "name":""}, WORK_TYPE.FLUSH_CACHE, qnum=0, 
+                fabric=tfabric)
+    msgs = [msg1, msg2, msg3]
+
+    data = routed_encode([(get_msg_hash(msg1), msg1), (get_msg_hash(msg2), msg2), (None, msg3)])
+    assert is_routed(data)
+    assert not is_routed(eptMsg.encode(eptMsgBulk(), WIRE_FORMAT_COMPACT))
+    (fabric, routes) = routed_decode(data)
+    assert fabric is None
+    assert len(routes) == 3
+    # rs_ip event is hashed on ip so it is placed with the ip event
+    assert routes[0][0] == routes[1][0]
+    assert routes[0][1] == "worker"
+    assert routes[2][0] is None and routes[2][1] is None and routes[2][2] == 0
+
+    bulk = eptMsg.parse(compact_bulk_encode(5, [r[3] for r in routes]))
+    assert bulk.seq == 5
+    assert len(bulk.msgs) == 3
+    for i, m in enumerate(bulk.msgs):
+        assert m.jsonify() == msgs[i].jsonify()
+
+    # routed frame can still be fully parsed (i.e., flush of manager work queue)
+    assert len(eptMsg.parse(data).msgs) == 3
+    assert eptMsg.parse(data, brief=True).msg_count == 3
+
+def test_subscriber_direct_work(app, func_prep):
+    # subscriber in direct mode pushes work to the owning worker queue using the published worker
+    # set, broadcasts are sent to all workers of the role, and a new epoch reloads the worker set
+
+    ip = "10.1.1.101"
+    workers = {"worker": [
+        {"worker_id": "w1", "queues": ["q0_w1", "q1_w1"], "wire_format": WIRE_FORMAT_COMPACT},
+        {"worker_id": "w2", "queues": ["q0_w2", "q1_w2"], "wire_format": WIRE_FORMAT_JSON},
+    ]}
+    redis.set(WORKER_SET_KEY, json.dumps(workers))
+    redis.set(WORKER_EPOCH_KEY, 1)
+    sub = eptSubscriber(Fabric.load(fabric=tfabric), direct=True)
+    sub.redis = redis
+    sub.direct_script = redis.register_script(DIRECT_WORK_SCRIPT)
+
+    msg1 = get_epm_event(101, ip, wt=WORK_TYPE.EPM_IP_EVENT, epg=1, intf="eth1/1", ts=1.0)
+    msg2 = eptMsgWork(0, "worker", {}, WORK_TYPE.FABRIC_EPM_EOF, qnum=1)
+    sub.send_msg([msg1, msg2])
+    assert sub.direct_epoch == 1
+    assert redis.llen(MANAGER_WORK_QUEUE) == 0
+    owner = HashRing(nodes=["w1", "w2"]).get_node(get_msg_hash(msg1))
+    other = "w2" if owner == "w1" else "w1"
+    assert redis.llen(get_notify_queue("q1_%s" % owner)) == 1
+    p = eptMsg.parse(redis.lpop(get_work_queue("q1_%s" % owner, tfabric)))
+    assert p.msg_type == MSG_TYPE.BULK
+    assert len(p.msgs) == 2
+    assert p.msgs[0].addr == ip
+    assert p.msgs[1].wt == WORK_TYPE.FABRIC_EPM_EOF
+    assert eptMsg.parse(redis.lpop(get_work_queue("q1_%s" % other, tfabric))).wt == \
+            WORK_TYPE.FABRIC_EPM_EOF
+
+    # push with stale epoch is rejected
+    assert sub.direct_script(keys=[WORKER_EPOCH_KEY, "q1_w1"], args=[0, "x"]) == 0
+    assert redis.llen("q1_w1") == 0
+
+    redis.set(WORKER_SET_KEY, json.dumps({"worker": workers["worker"][0:1]}))
+    redis.set(WORKER_EPOCH_KEY, 2)
+    sub.send_msg(msg1)
+    assert sub.direct_epoch == 2
+    assert eptMsg.parse(redis.lpop(get_work_queue("q1_w1", tfabric))).addr == ip
+
+def test_worker_pending_queue_replay(app, func_prep):
+    # work popped by a worker is held on the pending list until processed and unacknowledged work
+    # is replayed onto the head of the work queue in the original order
+
+    dut = get_worker()
+    redis.rpush(dut.queues[1], "m1", "m2")
+    redis.rpush(dut.queues[0], "m0")
+    # highest priority queue is always dequeued first
+    assert dut.get_work() == (dut.queues[0], "m0")
+    assert redis.lrange(get_pending_queue(dut.queues[0]), 0, -1) == ["m0"]
+    redis.lpop(get_pending_queue(dut.queues[0]))
+    assert dut.get_work() == (dut.queues[1], "m1")
+    assert redis.lrange(dut.queues[1], 0, -1) == ["m2"]
+    # worker restart before m1 is processed replays m1 ahead of m2
+    pending = [get_pending_queue(q) for q in dut.queues]
+    assert dut.replay_script(keys=dut.queues + pending) == 1
+    assert redis.lrange(dut.queues[1], 0, -1) == ["m1", "m2"]
+    assert redis.llen(pending[1]) == 0
+
+def test_worker_pending_queue_replay_empty_partition(app, func_prep):
+    # fabric partition that was fully drained only exists in redis as a pending list. It is still
+    # discovered so unacknowledged work is replayed on worker restart
+
+    dut = get_worker()
+    fab1 = get_work_queue(dut.queues[1], "fab1")
+    redis.delete(fab1)
+    redis.rpush(get_pending_queue(fab1), "a1")
+    assert redis.exists(fab1) == 0
+    assert get_fabric_work_queues(redis, dut.queues[1]) == [("fab1", fab1)]
+    redis.rpush(fab1, "a2")
+    assert get_fabric_work_queues(redis, dut.queues[1]) == [("fab1", fab1)]
+    redis.delete(fab1)
+    dut.replay_work()
+    assert dut.work_fabrics == ["fab1"]
+    assert redis.lrange(fab1, 0, -1) == ["a1"]
+    assert redis.llen(get_pending_queue(fab1)) == 0
+
+def test_worker_get_work_empty_queue(app, func_prep):
+    # when all queues are empty the worker blocks on its notify lists without polling and a msg 
+    # pushed while waiting is moved atomically to the pending list
+
+    dut = get_worker()
+    for q in dut.queues: redis.delete(q, get_pending_queue(q), get_notify_queue(q))
+    calls = []
+    dequeue_script = dut.dequeue_script
+    def dequeue(*args, **kwargs):
+        calls.append(time.time())
+        return dequeue_script(*args, **kwargs)
+    dut.dequeue_script = dequeue
+    def push():
+        time.sleep(0.5)
+        pl = redis.pipeline()
+        add_work(pl, dut.queues[1], "m1")
+        pl.execute()
+    threading.Thread(target=push).start()
+    assert dut.get_work() == (dut.queues[1], "m1")
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.4
+    assert redis.lrange(get_pending_queue(dut.queues[1]), 0, -1) == ["m1"]
+    assert redis.llen(get_notify_queue(dut.queues[1])) == 0
+
+def test_worker_fabric_queue_round_robin(app, func_prep):
+    # work for each fabric is on a separate partition of the worker queue, dequeued after the base 
+    # queue of the same priority and in deficit round robin order across fabrics
+
+    dut = get_worker()
+    fab1 = get_work_queue(dut.queues[1], "fab1")
+    fab2 = get_work_queue(dut.queues[1], "fab2")
+    redis.rpush(fab1, "a1", "a2")
+    redis.rpush(fab2, "b1")
+    redis.rpush(dut.queues[1], "c1")
+    dut.refresh_work_queues()
+    assert dut.work_fabrics == ["fab1", "fab2"]
+    assert dut.get_work_queues()[-3:] == [dut.queues[1], fab1, fab2]
+    assert dut.get_work() == (dut.queues[1], "c1")
+    assert dut.get_work() == (fab1, "a1")
+    # fab1 has used its full quantum so fab2 is served next
+    dut.charge_work_queue(fab1, WORK_QUEUE_QUANTUM)
+    assert dut.get_work() == (fab2, "b1")
+    assert dut.get_work() == (fab1, "a2")
+    # queue length includes each fabric partition
+    assert get_queue_length(redis, dut.queues[1], fabrics=dut.work_fabrics) == 0
+    redis.rpush(fab2, "b2")
+    assert get_queue_length(redis, dut.queues[1], fabrics=dut.work_fabrics) == 1
+
+def test_watcher_watch_heap(app, func_prep):
+    # watch events are returned in xts order once ready, setting an existing key overwrites the 
+    # previous event, and ready events for a paused fabric are held until the fabric is resumed
+
+    class wfObject(object):
+        def __init__(self):
+            self.watcher_paused = False
+    class watchMsg(object):
+        def __init__(self, fabric, wf, xts):
+            self.fabric = fabric
+            self.wf = wf
+            self.xts = xts
+
+    dut = get_worker(role="watcher")
+    msgs = dut.watch_stale
+    wf1 = wfObject()
+    wf2 = wfObject()
+    now = time.time()
+    msgs["k1"] = watchMsg("fab1", wf1, now - 2)
+    msgs["k2"] = watchMsg("fab1", wf1, now - 3)
+    msgs["k3"] = watchMsg("fab2", wf2, now - 1)
+    msgs["k4"] = watchMsg("fab1", wf1, now + 60)
+    msgs["k1"] = watchMsg("fab1", wf1, now + 60)
+    msgs["k4"] = watchMsg("fab1", wf1, now - 1)
+    assert len(msgs) == 4 and msgs["k1"].xts == now + 60
+    wf2.watcher_paused = True
+    work = dut.watcher_get_xts_ready(dut.watch_stale_lock, msgs)
+    assert [k for (k, msg) in work] == ["k2", "k4"]
+    assert sorted(msgs.keys()) == ["k1", "k3"]
+    wf2.watcher_paused = False
+    work = dut.watcher_get_xts_ready(dut.watch_stale_lock, msgs)
+    assert [k for (k, msg) in work] == ["k3"]
+    assert msgs.keys() == ["k1"]
+    assert msgs.pop("k1").xts == now + 60
+    assert len(msgs) == 0 and msgs.pop("k1") is None
+    assert dut.watcher_get_xts_ready(dut.watch_stale_lock, msgs) == []
+    # heap of overwritten events is rebuilt from the current events
+    for i in range(0, 5000):
+        msgs["k1"] = watchMsg("fab1", wf1, now + i)
+    assert len(msgs) == 1 and len(msgs.heap) <= WatchHeap.COMPACT_MIN_SIZE + 1
+    assert msgs.pop_ready(now + 5000)[0][1].xts == now + 4999
+
+def test_worker_pool_dispatch(app, func_prep):
+    # pool splits each bulk across shard queues by address hash and sends msgs without an address
+    # to all shards. The dispatched msg is removed from the pending list of the pool queue.
+
+    dut = eptWorkerPool("w1", shards=2)
+    dut.db = get_db()
+    dut.redis = get_redis()
+    assert dut.shard_queues == [["q0_w1.0", "q1_w1.0"], ["q0_w1.1", "q1_w1.1"]]
+    bulk = eptMsgBulk()
+    bulk.msgs = [get_epm_event(101, "10.1.1.%s" % i) for i in range(0, 10)]
+    bulk.msgs.append(eptMsgWork(0, "worker", {}, WORK_TYPE.FABRIC_EPM_EOF, qnum=1, fabric=tfabric))
+    redis.rpush(get_work_queue(dut.queues[1], tfabric), bulk.jsonify())
+    redis.rpush(dut.queues[0], eptMsg(MSG_TYPE.FABRIC_STOP, data={"fabric": tfabric}).jsonify())
+    (q, data) = dut.get_work()
+    assert q == dut.queues[0]
+    redis.rpush(get_work_queue(dut.shard_queues[0][1], tfabric), "stale")
+    dut.dispatch_work(q, data)
+    (q, data) = dut.get_work()
+    dut.dispatch_work(q, data)
+    assert redis.llen(get_pending_queue(q)) == 0
+    total = 0
+    for s, queues in enumerate(dut.shard_queues):
+        assert get_queue_msgs(queues[0])[0].msg_type == MSG_TYPE.FABRIC_STOP
+        msgs = get_queue_msgs(get_work_queue(queues[1], tfabric))
+        assert msgs[-1].wt == WORK_TYPE.FABRIC_EPM_EOF
+        for m in msgs[:-1]:
+            assert get_msg_hash(m) % 2 == s
+        total+= len(msgs) - 1
+    assert total == 10
+
+def test_subscriber_build_endpoint_db_pipeline(app, func_prep, monkeypatch):
+    # epm classes are fetched concurrently and each parsed create msg is sent to the manager work 
+    # queue in class order (rs before ip events even if the rs query is slowest) followed by 
+    # delete msgs for endpoints in the db not returned. A failed query for any class fails the 
+    # build.
+
+    base = "topology/pod-1/node-101/sys/ctx-[vxlan-2654208]/bd-[vxlan-15302583]/vlan-[vlan-101]"
+    def get_class(session, classname, stream=False, **kwargs):
+        if classname == "epmRsMacEpToIpEpAtt":
+            time.sleep(0.2)
+        for i in range(1, 4):
+            mac = "00:00:01:02:03:0%s" % i
+            ip = "10.1.1.%s" % i
+            if classname == "epmMacEp":
+                dn = "%s/db-ep/mac-%s" % (base, mac)
+            elif classname == "epmIpEp":
+                if fail: 
+                    yield None
+                    return
+                dn = "%s/db-ep/ip-[%s]" % (base, ip)
+            else:
+                dn = "%s/db-ep/mac-%s/rsmacEpToIpEpAtt-[sys/ctx-[vxlan-2654208]/" % (base, mac)
+                dn+= "bd-[vxlan-15302583]/vlan-[vlan-101]/db-ep/ip-[%s]]" % ip
+            yield {classname: {"attributes": {"dn": dn, "status": "created", "ifId": "eth1/1", 
+                    "flags": "ip,local,mac", "pcTag": "49153"}}}
+
+    class Subscription(object):
+        def add_interest(self, classname, callback, paused=False):
+            return True
+
+    monkeypatch.setattr(ept_subscriber, "get_class", get_class)
+    sub = eptSubscriber(Fabric.load(fabric=tfabric))
+    sub.redis = redis
+    sub.subscriber = Subscription()
+    sub.epm_parser = eptEpmEventParser(tfabric, overlay_vnid)
+    for ip in ["10.1.1.1", "10.1.1.9"]:
+        assert eptHistory.load(fabric=tfabric, node=101, vnid=2654208, addr=ip, type="ip").save()
+    fail = False
+    assert sub.build_endpoint_db()
+    msgs = get_queue_msgs(pop=True)
+    assert len(msgs) == 11
+    assert set([m.addr for m in msgs[:9]]) == set(["00:00:01:02:03:0%s" % i for i in range(1, 4)] +
+                                                ["10.1.1.%s" % i for i in range(1, 4)])
+    assert [m.wt for m in msgs[:9]] == [WORK_TYPE.EPM_RS_IP_EVENT]*3 + \
+                                        [WORK_TYPE.EPM_IP_EVENT]*3 + [WORK_TYPE.EPM_MAC_EVENT]*3
+    for m in msgs[9:]:
+        assert m.status == "deleted" and m.addr == "10.1.1.9"
+    fail = True
+    assert not sub.build_endpoint_db()
+
+def test_subscriber_get_build_sessions(app, func_prep, monkeypatch):
+    # a build session is created to each other controller. Controllers are compared with the
+    # subscriber session by hostname so 10.1.1.1 does not match 10.1.1.10
+    class Session(object):
+        def __init__(self, hostname):
+            self.hostname = hostname
+    hostnames = []
+    def get_apic_session(fabric, hostname=None):
+        hostnames.append(hostname)
+        return Session("https://%s" % hostname)
+
+    monkeypatch.setattr(ept_subscriber, "BUILD_ENDPOINT_DB_ALL_APICS", True)
+    monkeypatch.setattr(ept_subscriber, "get_apic_session", get_apic_session)
+    sub = eptSubscriber(Fabric.load(fabric=tfabric))
+    sub.session = Session("https://10.1.1.1:443")
+    sub.fabric.controllers = ["10.1.1.1", "10.1.1.10", "10.1.1.10", "APIC1", "apic10"]
+    sessions = sub.get_build_sessions()
+    assert hostnames == ["10.1.1.10", "APIC1", "apic10"]
+    assert len(sessions) == 4 and sessions[0] is sub.session
+
+def test_endpoint_presence_set(app, func_prep):
+    # presence set values match get_mac_value/get_ip_prefix for all supported address formats
+    # so the same endpoint is found regardless of format
+
+    value = EndpointPresenceSet.get_value
+    mac = get_mac_value("00:AA:01:02:03:0F")
+    for addr in ["00:AA:01:02:03:0F", "00:aa:01:02:03:0f", "00-AA-01-02-03-0F", "00aa.0102.030f"]:
+        assert value("mac", addr) == (True, mac)
+    ipv4 = get_ip_prefix("10.1.2.3")[0] | EndpointPresenceSet.IPV4_FLAG
+    for addr in ["10.1.2.3", "10.1.2.3/32"]:
+        assert value("ipv4", addr) == (True, ipv4)
+    ipv6 = get_ip_prefix("2001:1::a")[0]
+    for addr in ["2001:1::a", "2001:1:0:0:0:0:0:A", "2001:1::a/128"]:
+        assert value("ipv6", addr) == (False, ipv6)
+    assert value("ipv4", "10.1.2.300") == (False, "10.1.2.300")
+    endpoints = EndpointPresenceSet()
+    endpoints.add(101, 1, "mac", "00-AA-01-02-03-0F")
+    endpoints.add(101, 1, "ipv4", "10.1.2.3")
+    endpoints.add(101, 1, "ipv6", "2001:1::a")
+    assert len(endpoints) == 3
+    assert endpoints.contains(101, 1, "mac", "00:AA:01:02:03:0F")
+    assert endpoints.contains(101, 1, "ipv6", "2001:1:0:0:0:0:0:a")
+    assert not endpoints.contains(102, 1, "ipv4", "10.1.2.3")
+
+def test_subscriber_get_fingerprint(app, func_prep):
+    # fingerprint of an ept collection is independent of the order of the objects and the write
+    # timestamp and changes when any object changes
+
+    sub = eptSubscriber(Fabric.load(fabric=tfabric))
+    eptNode.delete(_filters={})
+    for n in [101, 102, 103]:
+        assert eptNode.load(fabric=tfabric, node=n, name="leaf-%s" % n).save()
+    fp = sub.get_fingerprint(eptNode)
+    eptNode.delete(_filters={})
+    for n in [103, 101, 102]:
+        assert eptNode.load(fabric=tfabric, node=n, name="leaf-%s" % n).save()
+    assert sub.get_fingerprint(eptNode) == fp
+    assert eptNode.load(fabric=tfabric, node=102, name="leaf-x").save()
+    assert sub.get_fingerprint(eptNode) != fp
+    eptNode.delete(_filters={})
+    assert sub.get_fingerprint(eptNode) != fp
+
+def test_mo_delta_rebuild(app, func_prep, monkeypatch):
+    # delta rebuild reconciles modified, created, and deleted objects since the sync watermark and
+    # falls back to a full rebuild when a created object is not returned as modified
+    from app.models.aci import mo as mo_module
+    from app.models.aci.mo.fvBD import fvBD
+
+    remote = {}
+    queries = []
+    def get_class(session, classname, **kwargs):
+        queries.append(kwargs)
+        if "rspSubtreeInclude" in kwargs:
+            return [{"moCount": {"attributes": {"count": "%s" % len(remote)}}}]
+        if "rspPropInclude" in kwargs:
+            return [{classname: {"attributes": {"dn": dn}}} for dn in remote]
+        ts = ""
+        if "queryTargetFilter" in kwargs:
+            ts = kwargs["queryTargetFilter"].split("\"")[1]
+        return [{classname: {"attributes": remote[dn]}} for dn in remote if 
+                    remote[dn]["modTs"] > ts]
+
+    def set_bd(name, seg, modTs):
+        dn = "uni/tn-ag/BD-%s" % name
+        remote[dn] = {"dn": dn, "seg": "%s" % seg, "modTs": modTs}
+
+    monkeypatch.setattr(mo_module, "get_class", get_class)
+    fabric = Fabric.load(fabric=tfabric)
+    fvBD.delete(_filters={"fabric": tfabric})
+    for i in range(1, 4):
+        set_bd("bd%s" % i, i, "2019-01-01T00:00:0%s.000+00:00" % i)
+    sync = {}
+    assert fvBD.rebuild(fabric, session=True, sync=sync)
+    assert sync["modTs"] == "2019-01-01T00:00:03.000+00:00" and sync["count"] == 3
+    assert sync["changed"] is None
+
+    # modify bd1, create bd4, delete bd2
+    set_bd("bd1", 11, "2019-01-01T00:00:04.000+00:00")
+    set_bd("bd4", 4, "2019-01-01T00:00:05.000+00:00")
+    remote.pop("uni/tn-ag/BD-bd2")
+    queries = []
+    assert fvBD.rebuild(fabric, session=True, sync=sync)
+    assert sync["changed"] == 3 and sync["count"] == 3
+    assert sync["modTs"] == "2019-01-01T00:00:05.000+00:00"
+    bds = dict([(b.dn, b) for b in fvBD.find(fabric=tfabric)])
+    assert set(bds.keys()) == set(["uni/tn-ag/BD-bd1", "uni/tn-ag/BD-bd3", "uni/tn-ag/BD-bd4"])
+    assert bds["uni/tn-ag/BD-bd1"].seg == "11"
+    assert len([q for q in queries if "rspPropInclude" in q]) == 1
+
+    # no change requires only modified and count queries
+    queries = []
+    assert fvBD.rebuild(fabric, session=True, sync=sync)
+    assert sync["changed"] == 0 and len(queries) == 2
+
+    # object created with a modTs before the watermark cannot be reconciled
+    set_bd("bd5", 5, "2019-01-01T00:00:00.000+00:00")
+    assert fvBD.rebuild(fabric, session=True, sync=sync)
+    assert sync["changed"] is None and sync["count"] == 4
+    assert len(fvBD.find(fabric=tfabric)) == 4
+    fvBD.delete(_filters={"fabric": tfabric})
+
+def test_subscriber_build_endpoint_db_delta(app, func_prep, monkeypatch):
+    # on delta resync, create msgs are only sent for epm objects modified since the previous build
+    # or on new nodes while deletes are based on naming-only queries of all objects
+
+    base = "topology/pod-1/node-101/sys/ctx-[vxlan-2654208]/bd-[vxlan-15302583]/vlan-[vlan-101]"
+    def get_class(session, classname, stream=False, **kwargs):
+        for i in range(1, 4):
+            # only first object of each class was modified since the previous build
+            if "queryTargetFilter" in kwargs and i > 1:
+                return
+            mac = "00:00:01:02:03:0%s" % i
+            ip = "10.1.1.%s" % i
+            if classname == "epmMacEp":
+                dn = "%s/db-ep/mac-%s" % (base, mac)
+            elif classname == "epmIpEp":
+                dn = "%s/db-ep/ip-[%s]" % (base, ip)
+            else:
+                dn = "%s/db-ep/mac-%s/rsmacEpToIpEpAtt-[sys/ctx-[vxlan-2654208]/" % (base, mac)
+                dn+= "bd-[vxlan-15302583]/vlan-[vlan-101]/db-ep/ip-[%s]]" % ip
+            yield {classname: {"attributes": {"dn": dn}}}
+
+    class Subscription(object):
+        def add_interest(self, classname, callback, paused=False):
+            return True
+
+    monkeypatch.setattr(ept_subscriber, "get_class", get_class)
+    sub = eptSubscriber(Fabric.load(fabric=tfabric))
+    sub.redis = redis
+    sub.subscriber = Subscription()
+    sub.epm_parser = eptEpmEventParser(tfabric, overlay_vnid)
+    ts1 = "2019-01-01T00:00:01.000+00:00"
+    ts2 = "2019-01-01T00:00:02.000+00:00"
+    sub.sync = {"nodes": {"101": ts2, "102": ts1}}
+    sub.sync_state = {"nodes": {"101": ts2, "102": ts2, "103": ts2}}
+    jobs = sub.get_build_endpoint_db_jobs()
+    assert len(jobs) == 5
+    for (c, kwargs, create, presence) in jobs[0:3]:
+        assert create and not presence
+        flt = "or(gt(%s.modTs,\"%s\"),wcard(%s.dn,\"/node-103/\"))" % (c, ts1, c)
+        assert kwargs["queryTargetFilter"] == flt
+    for (c, kwargs, create, presence) in jobs[3:]:
+        assert presence and not create and kwargs["rspPropInclude"] == "naming-only"
+
+    for ip in ["10.1.1.1", "10.1.1.9"]:
+        assert eptHistory.load(fabric=tfabric, node=101, vnid=2654208, addr=ip, type="ip").save()
+    assert sub.build_endpoint_db()
+    msgs = get_queue_msgs(pop=True)
+    assert len(msgs) == 5
+    assert set([m.addr for m in msgs[:3]]) == set(["00:00:01:02:03:01", "10.1.1.1"])
+    for m in msgs[3:]:
+        assert m.status == "deleted" and m.addr == "10.1.1.9"
+
+    # no previous node watermark requires full build
+    sub.sync = {"nodes": {}}
+    assert all([create and presence for (c, k, create, presence) in 
+                    sub.get_build_endpoint_db_jobs()])
+
+def test_subscriber_initialize_ept_collection_streaming(app, func_prep, monkeypatch):
+    # objects are upserted in chunks without flushing the collection, stale objects from previous
+    # builds are only removed once all objects are written and kept if the build fails
+
+    seen = []
+    def get_class(session, classname, stream=False, **kwargs):
+        for i in range(1, 4):
+            # all previous objects remain present during the build
+            seen.append(set([n.node for n in eptNode.find(fabric=tfabric)]))
+            if fail and i == 3:
+                yield None
+                return
+            yield {classname: {"attributes": {"dn": "topology/pod-1/node-%s" % (200+i), 
+                    "id": "%s" % (200+i), "address": "10.0.0.%s" % i, "name": "leaf-%s" % i, 
+                    "role": "leaf"}}}
+
+    monkeypatch.setattr(ept_subscriber, "get_class", get_class)
+    monkeypatch.setattr(ept_subscriber, "BUILD_CHUNK_SIZE", 2)
+    sub = eptSubscriber(Fabric.load(fabric=tfabric))
+    sub.db = get_db()
+    attribute_map = {"addr": "address", "name": "name", "node": "id", "pod_id": "dn", 
+                    "role": "role"}
+    regex_map = {"pod_id": "topology/pod-(?P<value>[0-9]+)/node-[0-9]+"}
+    assert eptNode.load(fabric=tfabric, node=999, name="stale").save()
+
+    fail = True
+    assert not sub.initialize_ept_collection(eptNode, "fabricNode", attribute_map=attribute_map,
+            regex_map=regex_map, flush=True)
+    nodes = set([n.node for n in eptNode.find(fabric=tfabric)])
+    assert 999 in nodes and 201 in nodes and 202 in nodes
+
+    fail = False
+    seen = []
+    assert sub.initialize_ept_collection(eptNode, "fabricNode", attribute_map=attribute_map,
+            regex_map=regex_map, flush=True)
+    assert all([999 in s for s in seen])
+    assert set([n.node for n in eptNode.find(fabric=tfabric)]) == set([201, 202, 203])
+    assert eptNode.load(fabric=tfabric, node=203).name == "leaf-3"
+
+def test_hello_wire_format_negotiation(app, func_prep):
+    # hello from a process that does not advertise encodings must negotiate json
+    hello = eptMsgHello("w1", "worker", ["q0_w1", "q1_w1"], time.time())
+    assert get_wire_format(eptMsg.parse(hello.jsonify()).encodings) == WIRE_FORMAT_COMPACT
+    hello.encodings = [WIRE_FORMAT_JSON]
+    assert get_wire_format(eptMsg.parse(hello.jsonify()).encodings) == WIRE_FORMAT_JSON
+    js = json.loads(hello.jsonify())
+    js["data"].pop("encodings")
+    assert eptMsg.parse(json.dumps(js)).encodings == [WIRE_FORMAT_JSON]
+
 def test_flush_offsubnet_cache(app, func_prep):
     # when adding a new subnet to a running client, ensure that the offsubnet_cache is properly 
     # flushed such that new learns are correctly detected as on subnet.  Similarly, if the subnet
@@ -2179,3 +3037,28 @@ def test_flush_offsubnet_cache(app, func_prep):
     assert h[0].is_offsubnet 
 
 
+
+def test_handle_endpoint_event_bulk_write_mac_move(app, func_prep):
+    # same sequence as basic mac move with db writes queued in the worker fabric writer and only
+    # flushed at the end of the bulk. The state caches are cleared before each event to force a db
+    # read which must first flush pending writes for the endpoint
+    dut = get_worker()
+    mac = "00:00:01:02:03:04"
+    msgs = [
+        get_epm_event(103, mac, wt=WORK_TYPE.EPM_MAC_EVENT, epg=1, intf="eth1/1", ts=1.0),
+        get_epm_event(104, mac, wt=WORK_TYPE.EPM_MAC_EVENT, epg=1, intf="eth1/1", ts=2.0),
+        get_epm_event(103, mac, wt=WORK_TYPE.EPM_MAC_EVENT, status="deleted", ts=2.1),
+        get_epm_event(103, mac, wt=WORK_TYPE.EPM_MAC_EVENT, status="created", ts=2.2, 
+            remote_node=104, flags=["bounce","mac"]),
+    ]
+    for i, msg in enumerate(msgs):
+        dut.set_msg_worker_fabric(msg)
+        msg.wf.writer.start()
+        if i % 2 == 1:
+            msg.wf.cache.remove_endpoint_state(msg.vnid, msg.addr)
+        dut.handle_endpoint_event(msg)
+    assert len(eptEndpoint.find(fabric=tfabric, addr=mac)) == 1
+    dut.flush_writes()
+    assert not msgs[0].wf.writer.enabled
+
+    validate_mac_state_1()
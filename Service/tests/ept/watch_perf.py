@@ -0,0 +1,111 @@
+"""
+measure cost of scheduling and expiring watch events in the watcher
+
+    The provided number of watch events are scheduled with an execute timestamp (xts) spread over
+    the provided window. A ratio of the events are scheduled again for an existing key which
+    overwrites the previous event. The events are then expired over the window with one check per
+    WATCH_INTERVAL using the previous full scan of the watch dict and using the WatchHeap. The
+    average and max duration of a single check are reported, which is the time the lock is held
+    and the handlers that insert new watch events are blocked.
+
+    python watch_perf.py [--count 500000] [--window 60] [--overwrite 0.2]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+# update sys path for importing test classes for app registration
+sys.path.append(os.path.realpath("%s/../../" % os.path.dirname(os.path.realpath(__file__))))
+
+# set logger to base app logger
+logger = logging.getLogger("app")
+
+from app.models.utils import setup_logger
+from app.models.aci.ept.common import WATCH_INTERVAL
+from app.models.aci.ept.common import WatchHeap
+
+class FabricObject(object):
+    # eptWorkerFabric with watcher_paused flag
+    def __init__(self):
+        self.watcher_paused = False
+
+class WatchObject(object):
+    # eptMsgWorkWatchStale with fabric, wf, and xts attributes
+    def __init__(self, wf, xts):
+        self.fabric = "fab1"
+        self.wf = wf
+        self.xts = xts
+
+def get_events(count, window, overwrite):
+    # list of (key, msg) where a ratio of keys are repeated with a later xts
+    wf = FabricObject()
+    ret = []
+    keys = int(count * (1 - overwrite))
+    for i in xrange(0, count):
+        key = "fab1,%s,10.%s.%s.%s,%s" % (i % 4096, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff,
+                101 + i % 2)
+        if i >= keys:
+            key = ret[random.randint(0, keys - 1)][0]
+        ret.append((key, WatchObject(wf, window * float(i) / count)))
+    return ret
+
+def legacy_get_xts_ready(msgs, ts):
+    # previous full scan of watch dict in eptWorker.watcher_get_xts_ready
+    work = []
+    for k, msg in msgs.items():
+        if not msg.wf.watcher_paused and msg.xts <= ts:
+            work.append((k, msg))
+    for (k, msg) in work: msgs.pop(k, None)
+    return work
+
+def heap_get_xts_ready(msgs, ts):
+    # eptWorker.watcher_get_xts_ready with WatchHeap
+    work = []
+    for (k, msg) in msgs.pop_ready(ts):
+        if not msg.wf.watcher_paused:
+            work.append((k, msg))
+    return work
+
+def measure(name, msgs, events, window, func):
+    # schedule all events and then expire them at each WATCH_INTERVAL, log rate and check time
+    ts = time.time()
+    for (key, msg) in events:
+        msgs[key] = msg
+    schedule = time.time() - ts
+    checks = []
+    ready = 0
+    tick = 0.0
+    while tick <= window + WATCH_INTERVAL:
+        ts = time.time()
+        ready+= len(func(msgs, tick))
+        checks.append(time.time() - ts)
+        tick+= WATCH_INTERVAL
+    logger.debug("%-8s schedule %10.1f events/s, checks: %s, avg: %8.3f ms, max: %8.3f ms, "
+        "ready: %s", name, len(events)/schedule, len(checks), 1000*sum(checks)/len(checks),
+        1000*max(checks), ready)
+    return ready
+
+if __name__ == "__main__":
+
+    desc = """ measure watch scheduling and expiry cost """
+    parser = argparse.ArgumentParser(description=desc,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--count", dest="count", type=int, default=500000, help="watch events")
+    parser.add_argument("--window", dest="window", type=int, default=60,
+        help="seconds over which events are ready")
+    parser.add_argument("--overwrite", dest="overwrite", type=float, default=0.2,
+        help="ratio of events that overwrite an existing key")
+    args = parser.parse_args()
+
+    # force logging to stdout
+    setup_logger(logger, stdout=True)
+
+    events = get_events(args.count, args.window, args.overwrite)
+    logger.debug("events: %s, keys: %s", args.count, len(set([k for (k, msg) in events])))
+    legacy = measure("legacy", {}, events, args.window, legacy_get_xts_ready)
+    heap = measure("heap", WatchHeap(), events, args.window, heap_get_xts_ready)
+    assert legacy == heap